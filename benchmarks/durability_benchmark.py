@@ -0,0 +1,130 @@
+"""
+Benchmark for the throughput of the FileStoreManager under each of the
+supported durability modes.
+
+Each thread stores a series of files, one segment at a time, against a
+shared store manager. The throughput, in megabytes and segments per second,
+is reported for each durability mode, from the fastest of several passes.
+With the "segment" mode, every segment waits for a sync of its own file; with
+the "group" mode, the segments written while one sync is in progress are
+batched together and covered by a single sync of the file system.
+
+Usage:
+
+    python benchmarks/durability_benchmark.py [--threads 32] [--repeat 3] \
+        [--dir /tmp]
+
+The ``--dir`` argument should point at the file system to be measured, since
+the cost of a sync varies greatly between devices.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from tempfile import mkdtemp
+
+from dxlclient.message import Request
+from dxlfiletransferclient.constants import FileStoreResultProp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+# pylint: disable=wrong-import-position
+from dxlfiletransferservice.constants import FileStoreProp
+from dxlfiletransferservice.durability import DurabilityMode
+from dxlfiletransferservice.settings import FileStoreSettings
+from dxlfiletransferservice.store import FileStoreManager
+
+
+def store_files(store_manager, file_count, segment_count, segment):
+    """
+    Store a series of files, each made up of repeated copies of a segment.
+    """
+    file_hash = hashlib.sha256(segment * segment_count).hexdigest()
+    for _ in range(file_count):
+        file_id = str(uuid.uuid4())
+        for segment_number in range(1, segment_count + 1):
+            req = Request("/benchmark/file/store")
+            other_fields = {
+                FileStoreProp.ID: file_id,
+                FileStoreProp.SEGMENT_NUMBER: str(segment_number)
+            }
+            if segment_number == segment_count:
+                other_fields[FileStoreProp.RESULT] = FileStoreResultProp.STORE
+                other_fields[FileStoreProp.NAME] = file_id
+                other_fields[FileStoreProp.SIZE] = str(
+                    segment_count * len(segment))
+                other_fields[FileStoreProp.HASH_SHA256] = file_hash
+            req.other_fields = other_fields
+            req.payload = segment
+            store_manager.store_segment(req)
+
+
+def run(durability, args):
+    """
+    Store files from concurrent threads with the supplied durability mode and
+    return the elapsed time.
+    """
+    storage_dir = mkdtemp(dir=args.dir)
+    store_manager = FileStoreManager(
+        storage_dir,
+        settings=FileStoreSettings(
+            durability=durability,
+            group_commit_interval=args.group_commit_interval / 1000.0))
+    segment = os.urandom(args.segment_size)
+    try:
+        threads = [threading.Thread(target=store_files,
+                                    args=(store_manager, args.files,
+                                          args.segments, segment))
+                   for _ in range(args.threads)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+    finally:
+        store_manager.close()
+        shutil.rmtree(storage_dir)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=32,
+                        help="Concurrent uploading threads")
+    parser.add_argument("--files", type=int, default=2,
+                        help="Files stored per thread")
+    parser.add_argument("--segments", type=int, default=32,
+                        help="Segments per file")
+    parser.add_argument("--segment-size", type=int, default=50 * 2 ** 10,
+                        help="Segment size in bytes")
+    parser.add_argument("--group-commit-interval", type=float, default=0,
+                        help="Group commit interval in milliseconds")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Passes for each mode, of which the fastest is "
+                             "reported")
+    parser.add_argument("--dir", default=None,
+                        help="Directory in which to store the files")
+    args = parser.parse_args()
+
+    total_segments = args.threads * args.files * args.segments
+    total_mb = total_segments * args.segment_size / float(2 ** 20)
+    print("{:>10} {:>10} {:>12} {:>12}".format(
+        "mode", "time (s)", "MB/s", "segments/s"))
+    for durability in DurabilityMode.ALL:
+        elapsed = min(run(durability, args) for _ in range(args.repeat))
+        print("{:>10} {:>10.3f} {:>12.1f} {:>12.0f}".format(
+            durability, elapsed, total_mb / elapsed,
+            total_segments / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,656 @@
+"""
+Load generator which simulates a fleet of agents uploading files to the file
+store service at the same time, in order to find the load at which the
+service saturates.
+
+Each simulated agent repeatedly uploads a file using the store protocol of
+``sample/basic/basic_store_example.py``: the file is sent one segment at a
+time, each segment after the response to the previous one, and a request
+rejected because the service is busy is sent again after a backoff. After
+each file, the agent waits for a think time before starting the next. The
+agents are event-driven and send their requests asynchronously, so
+thousands of agents are simulated with a handful of threads.
+
+The number of agents is raised in steps. Each step runs for a fixed
+duration, after which the throughput, request latency percentiles, error,
+busy, and timeout rates, and the depth of the service's queue of pending
+requests (from its stats topic) are reported. The saturation point is the
+last step after which adding agents no longer raised the throughput by the
+saturation threshold.
+
+The load is sent either to a real service through a DXL broker (when a DXL
+client configuration file is given with ``--config``) or to a service
+running in-process behind the stand-in for the DXL fabric from
+``service_benchmark.py``.
+
+File sizes are drawn from a distribution given as one of:
+
+* ``fixed:SIZE``
+* ``uniform:MIN:MAX``
+* ``lognormal:MEDIAN:SIGMA`` (capped at ``--max-file-size``)
+* ``choice:SIZE,SIZE,...``
+
+Usage:
+
+    python benchmarks/load_generator.py [--agents 100,500,1000,2000]
+        [--file-size lognormal:1048576:1] [--segment-size 51200]
+        [--think-time 1] [--duration 30] [--config dxlclient.config]
+        [--output results.json]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import argparse
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import threading
+import time
+import uuid
+from tempfile import mkdtemp
+
+try:
+    from queue import Queue
+except ImportError:  # Python 2
+    from Queue import Queue
+
+from dxlclient.callbacks import ResponseCallback
+from dxlclient.message import Message, Request
+from dxlbootstrap.util import MessageUtils
+from dxlfiletransferclient.constants import FileStoreResultProp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+# pylint: disable=wrong-import-position
+from dxlfiletransferservice._version import __version__
+from dxlfiletransferservice.constants import FileStoreErrorCode, \
+    FileStoreProp
+from dxlfiletransferservice.metrics import monotonic
+from dxlfiletransferservice.requesthandlers import FileStoreRequestCallback
+from dxlfiletransferservice.settings import FileStoreSettings
+from service_benchmark import FakeDxlClient, percentile
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+#: Default topics registered by the service
+STORE_TOPIC = "/opendxl-file-transfer/service/file-transfer/file/store"
+STATS_TOPIC = "/opendxl-file-transfer/service/file-transfer/file/stats"
+
+#: Number of times to send a request rejected as busy again, and the initial
+#: and maximum number of seconds to wait before sending it again, as in the
+#: store sample
+MAX_BUSY_RETRIES = 8
+INITIAL_BUSY_BACKOFF = 0.1
+MAX_BUSY_BACKOFF = 5
+
+#: Names of the service metrics reported for each step
+PENDING_REQUESTS_METRIC = "dxlfiletransfer_store_pending_requests"
+REJECTED_REQUESTS_METRIC = "dxlfiletransfer_store_requests_rejected_total"
+
+
+def parse_file_size_distribution(value, max_file_size):
+    """
+    Parse a file size distribution.
+
+    :return: A function which draws a file size from the distribution, and
+        the largest size which it may return.
+    """
+    kind, _, params = value.partition(":")
+    params = params.split(":") if params else []
+    if kind == "fixed" and len(params) == 1:
+        size = int(params[0])
+        return lambda: size, size
+    if kind == "uniform" and len(params) == 2:
+        min_size, max_size = int(params[0]), int(params[1])
+        return lambda: random.randint(min_size, max_size), max_size
+    if kind == "lognormal" and len(params) == 2:
+        mu, sigma = math.log(int(params[0])), float(params[1])
+        return lambda: min(max_file_size,
+                           int(random.lognormvariate(mu, sigma))), \
+            max_file_size
+    if kind == "choice" and len(params) == 1:
+        sizes = [int(size) for size in params[0].split(",")]
+        return lambda: random.choice(sizes), max(sizes)
+    raise argparse.ArgumentTypeError(
+        "Invalid file size distribution: '{}'".format(value))
+
+
+class Scheduler(object):
+    """
+    Runs functions, immediately or after a delay, on a small pool of worker
+    threads.
+    """
+
+    def __init__(self, worker_count):
+        self._timers = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._tasks = Queue()
+        self._running = True
+        self._threads = [threading.Thread(target=self._run_timers,
+                                          name="LoadSchedulerTimers")]
+        self._threads.extend(
+            threading.Thread(target=self._run_tasks,
+                             name="LoadSchedulerWorker-{}".format(number))
+            for number in range(worker_count))
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def call_soon(self, function, *args):
+        """
+        Run a function on a worker thread as soon as possible.
+        """
+        self._tasks.put((function, args))
+
+    def call_later(self, delay, function, *args):
+        """
+        Run a function on a worker thread after a delay, in seconds.
+        """
+        if delay <= 0:
+            self.call_soon(function, *args)
+            return
+        with self._condition:
+            heapq.heappush(self._timers, (monotonic() + delay,
+                                          next(self._sequence), function,
+                                          args))
+            self._condition.notify()
+
+    def _run_timers(self):
+        """
+        Move functions whose delay has elapsed to the worker threads.
+        """
+        with self._condition:
+            while self._running:
+                now = monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    _, _, function, args = heapq.heappop(self._timers)
+                    self._tasks.put((function, args))
+                self._condition.wait(
+                    self._timers[0][0] - now if self._timers else None)
+
+    def _run_tasks(self):
+        """
+        Run functions until stopped.
+        """
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            function, args = task
+            try:
+                function(*args)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error running load generator task")
+
+    def stop(self):
+        """
+        Stop the timer and worker threads, dropping any pending functions.
+        """
+        with self._condition:
+            self._running = False
+            self._timers = []
+            self._condition.notify()
+        for _ in self._threads[1:]:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+class LoadStats(object):
+    """
+    Counts and latencies recorded by the agents over a step.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start_time = None
+        self._latencies = []
+        self._counts = {}
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the recorded values and restart the step clock.
+        """
+        with self._lock:
+            self._start_time = monotonic()
+            self._latencies = []
+            self._counts = dict.fromkeys(
+                ("requests", "segments", "bytes", "files", "busy", "errors",
+                 "timeouts"), 0)
+
+    def record(self, latency=None, **counts):
+        """
+        Record the latency of a request and add to the named counts.
+        """
+        with self._lock:
+            if latency is not None:
+                self._latencies.append(latency)
+            for name, count in counts.items():
+                self._counts[name] += count
+
+    def snapshot(self):
+        """
+        Get the rates and latency percentiles since the last reset.
+        """
+        with self._lock:
+            elapsed = monotonic() - self._start_time
+            latencies = sorted(self._latencies)
+            counts = dict(self._counts)
+        requests = counts["requests"] or 1
+        return {
+            "elapsed": elapsed,
+            "requests": counts["requests"],
+            "files_per_sec": counts["files"] / elapsed,
+            "mb_per_sec": counts["bytes"] / float(2 ** 20) / elapsed,
+            "segments_per_sec": counts["segments"] / elapsed,
+            "latency_p50_ms": percentile(latencies, 50) * 1000,
+            "latency_p99_ms": percentile(latencies, 99) * 1000,
+            "error_rate": counts["errors"] / requests,
+            "busy_rate": counts["busy"] / requests,
+            "timeouts": counts["timeouts"]
+        }
+
+
+class UploadAgent(ResponseCallback):
+    """
+    Simulated agent which uploads files, one after another, one segment at a
+    time. Responses are received on a client thread, which only records them
+    and schedules the next action on the scheduler.
+    """
+
+    def __init__(self, generator):
+        super(UploadAgent, self).__init__()
+        self._generator = generator
+        self._lock = threading.Lock()
+        self._running = True
+        self._file_id = None
+        self._file_size = 0
+        self._segment_count = 0
+        self._segment_number = 0
+        self._segment_length = 0
+        self._busy_retries = 0
+        self._request_id = None
+        self._sent_time = None
+
+    def start(self):
+        """
+        Start uploading files.
+        """
+        self._generator.scheduler.call_soon(self._start_file)
+
+    def stop(self):
+        """
+        Stop uploading files once the request in flight completes.
+        """
+        with self._lock:
+            self._running = False
+
+    def _start_file(self):
+        """
+        Start uploading a new file.
+        """
+        generator = self._generator
+        self._file_id = str(uuid.uuid4())
+        self._file_size = generator.draw_file_size()
+        self._segment_count = max(
+            1, int(math.ceil(self._file_size / generator.segment_size)))
+        self._segment_number = 1
+        self._send_segment()
+
+    def _finish_file(self):
+        """
+        Start the next file after the think time.
+        """
+        think_time = self._generator.think_time
+        self._generator.scheduler.call_later(
+            random.expovariate(1.0 / think_time) if think_time else 0,
+            self._start_file)
+
+    def _send_segment(self):
+        """
+        Send the request for the current segment.
+        """
+        generator = self._generator
+        segment_size = generator.segment_size
+        offset = (self._segment_number - 1) * segment_size
+        self._segment_length = min(segment_size, self._file_size - offset)
+        req = Request(generator.store_topic)
+        other_fields = {
+            FileStoreProp.ID: self._file_id,
+            FileStoreProp.SEGMENT_NUMBER: str(self._segment_number)
+        }
+        if self._segment_number == self._segment_count:
+            other_fields[FileStoreProp.RESULT] = FileStoreResultProp.STORE
+            other_fields[FileStoreProp.NAME] = "load/{}".format(self._file_id)
+            other_fields[FileStoreProp.SIZE] = str(self._file_size)
+            other_fields[FileStoreProp.HASH_SHA256] = generator.get_file_hash(
+                self._file_size)
+        req.other_fields = other_fields
+        req.payload = generator.get_content(offset, self._segment_length)
+        with self._lock:
+            if not self._running:
+                return
+            self._request_id = req.message_id
+            self._sent_time = monotonic()
+        try:
+            generator.client.async_request(req, self)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Error sending request")
+            with self._lock:
+                self._request_id = None
+            generator.stats.record(requests=1, errors=1)
+            self._finish_file()
+
+    def on_response(self, response):
+        """
+        Invoked when the response to a request is received.
+        """
+        with self._lock:
+            if response.request_message_id != self._request_id:
+                # Response to a request which has already timed out
+                return
+            self._request_id = None
+            latency = monotonic() - self._sent_time
+        generator = self._generator
+        scheduler = generator.scheduler
+        if response.message_type != Message.MESSAGE_TYPE_ERROR:
+            generator.stats.record(
+                latency, requests=1, segments=1, bytes=self._segment_length,
+                files=int(self._segment_number == self._segment_count))
+            self._busy_retries = 0
+            if self._segment_number == self._segment_count:
+                self._finish_file()
+            else:
+                self._segment_number += 1
+                scheduler.call_soon(self._send_segment)
+        elif response.error_code == FileStoreErrorCode.BUSY and \
+                self._busy_retries < MAX_BUSY_RETRIES:
+            generator.stats.record(latency, requests=1, busy=1)
+            backoff = min(INITIAL_BUSY_BACKOFF * 2 ** self._busy_retries,
+                          MAX_BUSY_BACKOFF)
+            self._busy_retries += 1
+            scheduler.call_later(backoff * random.uniform(0.5, 1.5),
+                                 self._send_segment)
+        else:
+            logger.debug("Error response: %s (%s)", response.error_message,
+                         response.error_code)
+            generator.stats.record(latency, requests=1, errors=1)
+            self._busy_retries = 0
+            self._finish_file()
+
+    def check_timeout(self, now, timeout):
+        """
+        Abandon the current file if the request in flight has not been
+        answered within the timeout.
+        """
+        with self._lock:
+            if self._request_id is None or now - self._sent_time < timeout:
+                return
+            self._request_id = None
+        self._generator.stats.record(requests=1, timeouts=1)
+        self._busy_retries = 0
+        self._finish_file()
+
+
+class LoadGenerator(object):
+    """
+    Shared state for the simulated agents: the client through which they
+    send requests, the contents of the files they upload, and the recorded
+    statistics.
+    """
+
+    def __init__(self, client, args):
+        self.client = client
+        self.store_topic = args.store_topic
+        self.segment_size = args.segment_size
+        self.think_time = args.think_time
+        self.draw_file_size, max_file_size = args.file_size
+        self.scheduler = Scheduler(args.sender_threads)
+        self.stats = LoadStats()
+        # Every file is a prefix of the same random contents. The hash state
+        # at each segment boundary is kept so that the hash of a file of any
+        # size only needs the bytes of its last segment to be hashed.
+        self._content = os.urandom(max_file_size)
+        self._hash_states = []
+        file_hash = hashlib.sha256()
+        for offset in range(0, max_file_size + 1, self.segment_size):
+            self._hash_states.append(file_hash.copy())
+            file_hash.update(self._content[offset:offset + self.segment_size])
+
+    def get_content(self, offset, length):
+        """
+        Get bytes of the contents of the uploaded files.
+        """
+        return self._content[offset:offset + length]
+
+    def get_file_hash(self, file_size):
+        """
+        Get the SHA-256 hash of a file of the supplied size.
+        """
+        boundary = file_size // self.segment_size
+        file_hash = self._hash_states[boundary].copy()
+        file_hash.update(self._content[boundary * self.segment_size:
+                                       file_size])
+        return file_hash.hexdigest()
+
+
+class _StatsResponse(object):
+    """
+    Response callback used to wait on the response to a stats request.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+
+    def on_response(self, response):
+        self.response = response
+        self.done.set()
+
+
+def get_service_stats(client, args, store_callback):
+    """
+    Get the metrics of the service, or `None` if they cannot be retrieved.
+    """
+    if store_callback:
+        return store_callback.metrics_registry.to_dict()
+    try:
+        res = client.sync_request(Request(args.stats_topic), timeout=5)
+        if res.message_type != Message.MESSAGE_TYPE_ERROR:
+            return MessageUtils.json_payload_to_dict(res)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Error requesting service stats")
+    return None
+
+
+def find_saturation(results, threshold):
+    """
+    Find the last step after which adding agents no longer raised the
+    throughput by the threshold.
+    """
+    best = None
+    for result in results:
+        if best and result["mb_per_sec"] < best["mb_per_sec"] * (
+                1 + threshold):
+            return best
+        if not best or result["mb_per_sec"] > best["mb_per_sec"]:
+            best = result
+    return None
+
+
+def create_client(args, storage_dir):
+    """
+    Create the client through which to send requests, and, for the local
+    stand-in, the store callback for the in-process service.
+    """
+    if args.config:
+        from dxlclient.client import DxlClient
+        from dxlclient.client_config import DxlClientConfig
+        client = DxlClient(DxlClientConfig.create_dxl_config_from_file(
+            args.config))
+        client.connect()
+        return client, None
+    client = FakeDxlClient(args.callback_threads)
+    store_callback = FileStoreRequestCallback(
+        client, storage_dir,
+        settings=FileStoreSettings(io_thread_count=args.io_threads))
+    client.set_callback(store_callback)
+    return client, store_callback
+
+
+def run_steps(generator, args, store_callback):
+    """
+    Raise the number of agents in steps, measuring each step.
+    """
+    agents = []
+    results = []
+    try:
+        for agent_count in args.agents:
+            while len(agents) < agent_count:
+                agent = UploadAgent(generator)
+                agents.append(agent)
+                agent.start()
+            time.sleep(args.warmup)
+            service_stats = get_service_stats(generator.client, args,
+                                              store_callback) or {}
+            generator.stats.reset()
+            end_time = monotonic() + args.duration
+            while monotonic() < end_time:
+                time.sleep(min(1, max(0, end_time - monotonic())))
+                now = monotonic()
+                for agent in agents:
+                    agent.check_timeout(now, args.timeout)
+            result = generator.stats.snapshot()
+            result["agents"] = agent_count
+            end_service_stats = get_service_stats(generator.client, args,
+                                                  store_callback) or {}
+            result["service_pending_requests"] = end_service_stats.get(
+                PENDING_REQUESTS_METRIC)
+            if REJECTED_REQUESTS_METRIC in end_service_stats:
+                result["service_rejected_requests"] = \
+                    end_service_stats[REJECTED_REQUESTS_METRIC] - \
+                    service_stats.get(REJECTED_REQUESTS_METRIC, 0)
+            results.append(result)
+            print("{:>7} {:>9.1f} {:>10.0f} {:>8.1f} {:>9.2f} {:>9.2f} "
+                  "{:>7.2%} {:>7.2%} {:>8} {:>8}".format(
+                      agent_count, result["mb_per_sec"],
+                      result["segments_per_sec"], result["files_per_sec"],
+                      result["latency_p50_ms"], result["latency_p99_ms"],
+                      result["error_rate"], result["busy_rate"],
+                      result["timeouts"],
+                      "-" if result["service_pending_requests"] is None
+                      else result["service_pending_requests"]))
+            sys.stdout.flush()
+    finally:
+        for agent in agents:
+            agent.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--agents", default="100,500,1000,2000",
+                        type=lambda value: [int(count) for count in
+                                            value.split(",")],
+                        help="Comma-separated numbers of agents per step")
+    parser.add_argument("--file-size", default="lognormal:1048576:1",
+                        help="File size distribution")
+    parser.add_argument("--max-file-size", type=int, default=64 * 2 ** 20,
+                        help="Largest file size for unbounded distributions")
+    parser.add_argument("--segment-size", type=int, default=50 * 2 ** 10,
+                        help="Segment size in bytes")
+    parser.add_argument("--think-time", type=float, default=1,
+                        help="Mean seconds an agent waits between files")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="Seconds to measure each step for")
+    parser.add_argument("--warmup", type=float, default=5,
+                        help="Seconds to wait after adding agents")
+    parser.add_argument("--timeout", type=float, default=30,
+                        help="Seconds to wait for each response")
+    parser.add_argument("--saturation-threshold", type=float, default=0.05,
+                        help="Smallest relative gain in throughput for "
+                             "more agents to count as not saturated")
+    parser.add_argument("--sender-threads", type=int, default=4,
+                        help="Threads used to send requests")
+    parser.add_argument("--config", default=None,
+                        help="DXL client configuration file. If not set, "
+                             "load is sent to an in-process service")
+    parser.add_argument("--store-topic", default=STORE_TOPIC,
+                        help="Topic of the service's store requests")
+    parser.add_argument("--stats-topic", default=STATS_TOPIC,
+                        help="Topic of the service's stats requests")
+    parser.add_argument("--callback-threads", type=int, default=10,
+                        help="DXL message callback threads for the "
+                             "in-process service")
+    parser.add_argument("--io-threads", type=int, default=10,
+                        help="I/O threads for the in-process service")
+    parser.add_argument("--dir", default=None,
+                        help="Directory in which the in-process service "
+                             "stores files")
+    parser.add_argument("--output", default=None,
+                        help="File to which to write the results as JSON")
+    args = parser.parse_args()
+    try:
+        args.file_size = parse_file_size_distribution(args.file_size,
+                                                      args.max_file_size)
+    except argparse.ArgumentTypeError as ex:
+        parser.error(str(ex))
+    logging.basicConfig(level=logging.WARNING)
+
+    storage_dir = None if args.config else mkdtemp(dir=args.dir)
+    client, store_callback = create_client(args, storage_dir)
+    generator = LoadGenerator(client, args)
+    print("{:>7} {:>9} {:>10} {:>8} {:>9} {:>9} {:>7} {:>7} {:>8} "
+          "{:>8}".format("agents", "MB/s", "segments/s", "files/s",
+                         "p50 (ms)", "p99 (ms)", "errors", "busy",
+                         "timeouts", "pending"))
+    try:
+        results = run_steps(generator, args, store_callback)
+    finally:
+        generator.scheduler.stop()
+        if store_callback:
+            client.shutdown()
+            store_callback.shutdown()
+            shutil.rmtree(storage_dir)
+        else:
+            client.destroy()
+
+    saturation = find_saturation(results, args.saturation_threshold)
+    if saturation:
+        print("Throughput saturated at {} agents ({:.1f} MB/s, p99 "
+              "latency {:.2f} ms)".format(saturation["agents"],
+                                         saturation["mb_per_sec"],
+                                         saturation["latency_p99_ms"]))
+    else:
+        print("Throughput did not saturate within {} agents".format(
+            args.agents[-1]))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({
+                "version": __version__,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                           time.gmtime()),
+                "target": "broker" if args.config else "local",
+                "saturation_agents": saturation["agents"]
+                                     if saturation else None,
+                "results": results
+            }, output_file, indent=4, sort_keys=True)
+        print("Wrote results to: {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
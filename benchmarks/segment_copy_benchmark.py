@@ -0,0 +1,161 @@
+"""
+Micro-benchmark for the memory traffic of the FileStoreManager segment
+write path.
+
+For each segment, the benchmark records the peak amount of memory which is
+allocated (and then released) while the segment is stored. Each copy of the
+segment payload made on the way from the request to the hash and working
+file shows up as an allocation of roughly the segment size. The number of
+garbage collections triggered across the run is also reported.
+
+Two variants of the write path are measured:
+
+* before - the payload is handled as `bytes` and segments which arrive ahead
+  of a gap are read back from the working file into newly allocated `bytes`
+  objects before being hashed.
+* after - the current path, where the payload is handled through a
+  `memoryview` and segments are read back into a reusable per-thread buffer.
+
+Both in-order and reordered (pairs of segments swapped) traffic are measured.
+
+Usage:
+
+    python benchmarks/segment_copy_benchmark.py [--segment-size 1048576]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import argparse
+import gc
+import hashlib
+import os
+import shutil
+import sys
+import time
+import tracemalloc
+import uuid
+from tempfile import mkdtemp
+
+from dxlclient.message import Request
+from dxlfiletransferclient.constants import FileStoreResultProp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+# pylint: disable=wrong-import-position, protected-access
+from dxlfiletransferservice import store, util
+from dxlfiletransferservice.constants import FileStoreProp
+
+
+class BeforeFileStoreManager(store.FileStoreManager):
+    """
+    Store manager which handles segments as `bytes` objects, as the write
+    path did before segments were handled through views.
+    """
+    def parse_segment(self, message):
+        segment_params = super(BeforeFileStoreManager, self).parse_segment(
+            message)
+        segment_params[self._SEGMENT_PAYLOAD] = message.payload
+        return segment_params
+
+    def _hash_file_range(self, file_handle, file_hasher, offset, length):
+        file_hasher.update(util.read_at(file_handle, length, offset))
+
+
+def create_requests(segment_count, segment_size, reorder):
+    """
+    Create the requests for a single file.
+    """
+    file_id = str(uuid.uuid4())
+    segments = [os.urandom(segment_size) for _ in range(segment_count)]
+    order = list(range(segment_count))
+    if reorder:
+        # Swap each pair of segments, keeping the last segment last
+        for index in range(0, segment_count - 2, 2):
+            order[index], order[index + 1] = order[index + 1], order[index]
+
+    requests = []
+    for index in order:
+        req = Request("/benchmark/file/store")
+        other_fields = {
+            FileStoreProp.ID: file_id,
+            FileStoreProp.SEGMENT_NUMBER: str(index + 1),
+            FileStoreProp.SEGMENT_OFFSET: str(index * segment_size)
+        }
+        if index == segment_count - 1:
+            other_fields[FileStoreProp.RESULT] = FileStoreResultProp.STORE
+            other_fields[FileStoreProp.NAME] = file_id
+            other_fields[FileStoreProp.SIZE] = str(segment_count *
+                                                   segment_size)
+            other_fields[FileStoreProp.HASH_SHA256] = hashlib.sha256(
+                b"".join(segments)).hexdigest()
+        req.other_fields = other_fields
+        req.payload = segments[index]
+        requests.append(req)
+    return requests
+
+
+def reset_peak():
+    """
+    Reset the peak memory traced by tracemalloc.
+    """
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.stop()
+        tracemalloc.start()
+
+
+def run(manager_class, segment_count, segment_size, reorder):
+    """
+    Store a file with the supplied store manager class and return the average
+    peak bytes allocated per segment, the number of garbage collections, and
+    the elapsed time.
+    """
+    storage_dir = mkdtemp()
+    try:
+        store_manager = manager_class(storage_dir)
+        requests = create_requests(segment_count, segment_size, reorder)
+        # Warm up the per-thread read buffer and any lazily created state
+        store_manager.store_segment(create_requests(3, 16, True)[0])
+
+        gc_collections = sum(stat["collections"] for stat in gc.get_stats())
+        peak_bytes = 0
+        start = time.time()
+        tracemalloc.start()
+        for req in requests:
+            reset_peak()
+            current_bytes = tracemalloc.get_traced_memory()[0]
+            store_manager.store_segment(req)
+            peak_bytes += tracemalloc.get_traced_memory()[1] - current_bytes
+        tracemalloc.stop()
+        elapsed = time.time() - start
+        gc_collections = sum(stat["collections"]
+                             for stat in gc.get_stats()) - gc_collections
+    finally:
+        shutil.rmtree(storage_dir)
+    return peak_bytes / segment_count, gc_collections, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--segments", type=int, default=64,
+                        help="Segments per file")
+    parser.add_argument("--segment-size", type=int, default=2 ** 20,
+                        help="Segment size in bytes")
+    args = parser.parse_args()
+
+    print("{:>10} {:>8} {:>22} {:>8} {:>10}".format(
+        "traffic", "path", "peak bytes/segment", "gc runs", "time (s)"))
+    for reorder in (False, True):
+        for name, manager_class in (("before", BeforeFileStoreManager),
+                                    ("after", store.FileStoreManager)):
+            peak_bytes, gc_collections, elapsed = run(
+                manager_class, args.segments, args.segment_size, reorder)
+            print("{:>10} {:>8} {:>22.0f} {:>8} {:>10.3f}".format(
+                "reordered" if reorder else "in-order", name, peak_bytes,
+                gc_collections, elapsed))
+
+
+if __name__ == "__main__":
+    main()
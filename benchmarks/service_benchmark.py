@@ -0,0 +1,382 @@
+"""
+Offline benchmark for the throughput and latency of the file store service,
+using an in-process stand-in for the DXL fabric.
+
+Requests are processed by the FileStoreRequestCallback exactly as when the
+service is running, but no broker is needed. A fake DXL client serializes
+each request to the DXL wire format, dispatches it to the callback on a pool
+of message callback threads, and routes each response (also serialized)
+back to the client thread waiting on it. Each client thread uploads its
+files one segment at a time, waiting for the response to each segment
+before sending the next, as the store sample does.
+
+Every combination of file size, segment size, client concurrency, and I/O
+thread count is measured. With ``--workers``, each pass runs in several
+processes at once, each with its own callback and clients, to measure how
+the throughput of the service scales with its ``workerCount`` setting. With
+``--topic-shards``, requests are dispatched by file id across that many
+callbacks, each with its own store manager, as for the ``topicShardCount``
+setting. With ``--batch-files``, each client uploads its files in batch
+requests of that many files rather than in segments, to measure the
+throughput for small files. For each, the throughput in megabytes and
+requests (segments or batches) per second and the p50/p99 latency of the
+requests are reported.
+The results, along with the version of the service and the platform, can
+also be written as JSON so that runs against different releases can be
+compared.
+
+Usage:
+
+    python benchmarks/service_benchmark.py [--file-sizes 1048576,16777216]
+        [--segment-sizes 65536,524288] [--concurrency 1,8]
+        [--io-threads 0,10] [--io-engine threads] [--workers 1]
+        [--topic-shards 1] [--batch-files 1] [--output results.json]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import threading
+import time
+import uuid
+from tempfile import mkdtemp
+
+from dxlclient._thread_pool import ThreadPool
+from dxlclient.message import Message, Request
+from dxlfiletransferclient.constants import FileStoreResultProp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+# pylint: disable=wrong-import-position, protected-access
+from dxlfiletransferservice._version import __version__
+from dxlfiletransferservice.constants import FileStoreProp
+from dxlfiletransferservice.ioengine import IoEngine
+from dxlfiletransferservice.metrics import monotonic
+from dxlfiletransferservice.requesthandlers import \
+    FileShardRequestCallback, FileStoreRequestCallback
+from dxlfiletransferservice.settings import FileStoreSettings
+
+
+class _PendingRequest(object):
+    """
+    Request sent through the fake DXL client which is waiting on a response.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+
+    def on_response(self, response):
+        """
+        Invoked when the response to the request is received.
+        """
+        self.response = response
+        self.done.set()
+
+
+class FakeDxlClient(object):
+    """
+    In-process stand-in for a DXL client connected to a broker. Requests
+    sent with :meth:`sync_request` or :meth:`async_request` are delivered to
+    a single request callback on a pool of message callback threads, and
+    responses sent with :meth:`send_response` are routed back to the
+    waiting sender or response callback.
+    Messages are serialized to and from the DXL wire format in both
+    directions, so the cost of encoding and decoding is included in the
+    measurements.
+    """
+
+    def __init__(self, callback_thread_count):
+        self._callback = None
+        self._callback_pool = ThreadPool(1000, callback_thread_count,
+                                         "FakeDxlCallbackPool")
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    def set_callback(self, callback):
+        """
+        Set the request callback to which requests are delivered.
+        """
+        self._callback = callback
+
+    def sync_request(self, request):
+        """
+        Send a request and wait for its response.
+        """
+        pending = _PendingRequest()
+        self.async_request(request, pending)
+        pending.done.wait()
+        return pending.response
+
+    def async_request(self, request, response_callback):
+        """
+        Send a request without waiting for its response. The `on_response`
+        method of the response callback is invoked with the response.
+        """
+        with self._pending_lock:
+            self._pending[request.message_id] = response_callback
+        self._callback_pool.add_task(self._deliver, request._to_bytes())
+
+    def _deliver(self, raw_request):
+        """
+        Deliver a serialized request to the request callback.
+        """
+        self._callback.on_request(Message._from_bytes(raw_request))
+
+    def send_response(self, response):
+        """
+        Route a response back to the sender of its request.
+        """
+        response = Message._from_bytes(response._to_bytes())
+        with self._pending_lock:
+            response_callback = self._pending.pop(response.request_message_id)
+        response_callback.on_response(response)
+
+    def shutdown(self):
+        """
+        Stop the message callback threads.
+        """
+        self._callback_pool.shutdown()
+
+
+def upload_files(client, file_count, file_content, segment_size, latencies,
+                 errors, batch_files=1):
+    """
+    Upload files through the fake DXL client, one segment at a time,
+    recording the latency of each request. If `batch_files` is greater than
+    1, the files are instead uploaded in batches of that many files, one
+    request per batch.
+    """
+    file_size = len(file_content)
+    file_hash = hashlib.sha256(file_content).hexdigest()
+    if batch_files > 1:
+        for batch_start in range(0, file_count, batch_files):
+            batch_count = min(batch_files, file_count - batch_start)
+            req = Request("/benchmark/file/store")
+            req.other_fields = {
+                FileStoreProp.FILES: json.dumps([{
+                    FileStoreProp.NAME: str(uuid.uuid4()),
+                    FileStoreProp.SIZE: file_size,
+                    FileStoreProp.HASH_SHA256: file_hash
+                } for _ in range(batch_count)])
+            }
+            req.payload = file_content * batch_count
+            start = monotonic()
+            res = client.sync_request(req)
+            latencies.append(monotonic() - start)
+            if res.message_type == Message.MESSAGE_TYPE_ERROR:
+                errors.append(res.error_message)
+                break
+        return
+    content_view = memoryview(file_content)
+    segment_count = max(1, int(math.ceil(file_size / segment_size)))
+    for _ in range(file_count):
+        file_id = str(uuid.uuid4())
+        for segment_number in range(1, segment_count + 1):
+            req = Request("/benchmark/file/store")
+            other_fields = {
+                FileStoreProp.ID: file_id,
+                FileStoreProp.SEGMENT_NUMBER: str(segment_number)
+            }
+            if segment_number == segment_count:
+                other_fields[FileStoreProp.RESULT] = FileStoreResultProp.STORE
+                other_fields[FileStoreProp.NAME] = file_id
+                other_fields[FileStoreProp.SIZE] = str(file_size)
+                other_fields[FileStoreProp.HASH_SHA256] = file_hash
+            req.other_fields = other_fields
+            offset = (segment_number - 1) * segment_size
+            req.payload = content_view[offset:offset + segment_size].tobytes()
+            start = monotonic()
+            res = client.sync_request(req)
+            latencies.append(monotonic() - start)
+            if res.message_type == Message.MESSAGE_TYPE_ERROR:
+                errors.append(res.error_message)
+                break
+
+
+def percentile(sorted_values, percent):
+    """
+    Get a percentile of sorted values, using the nearest-rank method.
+    """
+    if not sorted_values:
+        return 0
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def run_pass(file_size, segment_size, concurrency, io_thread_count, args):
+    """
+    Run one benchmark pass in the current process and return the latencies
+    of the requests, the elapsed time, and the number of errors.
+    """
+    storage_dir = mkdtemp(dir=args.dir)
+    client = FakeDxlClient(args.callback_threads)
+    callbacks = []
+    sharded = args.topic_shards > 1
+    for shard in range(args.topic_shards):
+        callbacks.append(FileStoreRequestCallback(
+            client, storage_dir,
+            settings=FileStoreSettings(io_thread_count=io_thread_count,
+                                       io_engine=args.io_engine),
+            file_id_shard=shard if sharded else None,
+            file_id_shard_count=args.topic_shards if sharded else None,
+            working_subdir=str(shard) if sharded else None))
+    if sharded:
+        client.set_callback(FileShardRequestCallback(
+            dict(enumerate(callbacks)), args.topic_shards))
+    else:
+        client.set_callback(callbacks[0])
+    file_content = os.urandom(file_size)
+    thread_latencies = [[] for _ in range(concurrency)]
+    errors = []
+    try:
+        threads = [threading.Thread(target=upload_files,
+                                    args=(client, args.files, file_content,
+                                          segment_size, latencies, errors,
+                                          args.batch_files))
+                   for latencies in thread_latencies]
+        start = monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = monotonic() - start
+    finally:
+        client.shutdown()
+        for callback in callbacks:
+            callback.shutdown()
+        shutil.rmtree(storage_dir)
+
+    return list(itertools.chain.from_iterable(thread_latencies)), elapsed, \
+        len(errors)
+
+
+def run(file_size, segment_size, concurrency, io_thread_count, args):
+    """
+    Run one benchmark pass, in each of the worker processes, and return its
+    results.
+    """
+    pass_args = (file_size, segment_size, concurrency, io_thread_count, args)
+    if args.workers == 1:
+        passes = [run_pass(*pass_args)]
+    else:
+        pool = multiprocessing.Pool(args.workers)
+        try:
+            passes = [result.get() for result in
+                      [pool.apply_async(run_pass, pass_args)
+                       for _ in range(args.workers)]]
+        finally:
+            pool.close()
+            pool.join()
+
+    latencies = sorted(itertools.chain.from_iterable(
+        pass_latencies for pass_latencies, _, _ in passes))
+    # The passes start together, so the slowest determines the throughput
+    elapsed = max(pass_elapsed for _, pass_elapsed, _ in passes)
+    total_bytes = args.workers * concurrency * args.files * file_size
+    return {
+        "file_size": file_size,
+        "segment_size": segment_size,
+        "concurrency": concurrency,
+        "io_threads": io_thread_count,
+        "workers": args.workers,
+        "topic_shards": args.topic_shards,
+        "batch_files": args.batch_files,
+        "files": args.workers * concurrency * args.files,
+        "segments": len(latencies),
+        "errors": sum(pass_errors for _, _, pass_errors in passes),
+        "elapsed": elapsed,
+        "mb_per_sec": total_bytes / float(2 ** 20) / elapsed,
+        "segments_per_sec": len(latencies) / elapsed,
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000
+    }
+
+
+def parse_int_list(value):
+    """
+    Parse a comma-separated list of integers.
+    """
+    return [int(item) for item in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--file-sizes", type=parse_int_list,
+                        default=[2 ** 20, 16 * 2 ** 20],
+                        help="Comma-separated file sizes in bytes")
+    parser.add_argument("--segment-sizes", type=parse_int_list,
+                        default=[64 * 2 ** 10, 512 * 2 ** 10],
+                        help="Comma-separated segment sizes in bytes")
+    parser.add_argument("--concurrency", type=parse_int_list,
+                        default=[1, 8],
+                        help="Comma-separated numbers of concurrent clients")
+    parser.add_argument("--io-threads", type=parse_int_list,
+                        default=[0, 10],
+                        help="Comma-separated I/O thread counts")
+    parser.add_argument("--io-engine", choices=IoEngine.ALL,
+                        default=IoEngine.THREADS,
+                        help="Engine dispatching requests to the I/O threads")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes, each with its own callback and "
+                             "clients, across which each pass is run")
+    parser.add_argument("--topic-shards", type=int, default=1,
+                        help="Store callbacks across which requests are "
+                             "dispatched by file id")
+    parser.add_argument("--batch-files", type=int, default=1,
+                        help="Files uploaded per batch request, or 1 to "
+                             "upload each file in segments")
+    parser.add_argument("--files", type=int, default=2,
+                        help="Files uploaded per client")
+    parser.add_argument("--callback-threads", type=int, default=10,
+                        help="DXL message callback threads")
+    parser.add_argument("--dir", default=None,
+                        help="Directory in which to store the files")
+    parser.add_argument("--output", default=None,
+                        help="File to which to write the results as JSON")
+    args = parser.parse_args()
+
+    print("{:>10} {:>10} {:>6} {:>6} {:>10} {:>12} {:>10} {:>10} {:>7}".format(
+        "file size", "seg size", "conc", "io", "MB/s", "segments/s",
+        "p50 (ms)", "p99 (ms)", "errors"))
+    results = []
+    for file_size, segment_size, concurrency, io_thread_count in \
+            itertools.product(args.file_sizes, args.segment_sizes,
+                              args.concurrency, args.io_threads):
+        result = run(file_size, segment_size, concurrency, io_thread_count,
+                     args)
+        results.append(result)
+        print("{:>10} {:>10} {:>6} {:>6} {:>10.1f} {:>12.0f} {:>10.2f} "
+              "{:>10.2f} {:>7}".format(
+                  file_size, segment_size, concurrency, io_thread_count,
+                  result["mb_per_sec"], result["segments_per_sec"],
+                  result["latency_p50_ms"], result["latency_p99_ms"],
+                  result["errors"]))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({
+                "version": __version__,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": multiprocessing.cpu_count(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                           time.gmtime()),
+                "callback_threads": args.callback_threads,
+                "io_engine": args.io_engine,
+                "results": results
+            }, output_file, indent=4, sort_keys=True)
+        print("Wrote results to: {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
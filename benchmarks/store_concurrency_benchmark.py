@@ -0,0 +1,119 @@
+"""
+Measures the aggregate number of file segments per second which the
+FileStoreManager can store as the number of concurrent callback threads
+increases, comparing the default sharded file locks against a baseline
+manager which guards every file with a single shard lock.
+
+Each thread uploads its own files so that segments for different transfers
+are stored in parallel, mirroring concurrent uploads from many clients
+dispatched by the DXL message callback pool.
+
+Usage:
+
+    python benchmarks/store_concurrency_benchmark.py [--threads 1,2,4,8,16]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import time
+from tempfile import mkdtemp
+
+from dxlclient.message import Request
+from dxlfiletransferclient.constants import FileStoreProp, FileStoreResultProp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from dxlfiletransferservice.settings import FileStoreSettings # pylint: disable=wrong-import-position
+from dxlfiletransferservice.store import FileStoreManager # pylint: disable=wrong-import-position
+
+
+def upload_files(store_manager, thread_number, file_count, segment_count,
+                 segment):
+    """
+    Upload files through the store manager, one segment at a time.
+    """
+    file_hash = hashlib.sha256()
+    for _ in range(segment_count):
+        file_hash.update(segment)
+    file_size = len(segment) * segment_count
+
+    for file_number in range(file_count):
+        file_id = None
+        for segment_number in range(1, segment_count + 1):
+            req = Request("/benchmark/file/store")
+            other_fields = {
+                FileStoreProp.SEGMENT_NUMBER: str(segment_number)
+            }
+            if file_id:
+                other_fields[FileStoreProp.ID] = file_id
+            if segment_number == segment_count:
+                other_fields[FileStoreProp.RESULT] = FileStoreResultProp.STORE
+                other_fields[FileStoreProp.NAME] = "t{}/f{}".format(
+                    thread_number, file_number)
+                other_fields[FileStoreProp.SIZE] = str(file_size)
+                other_fields[FileStoreProp.HASH_SHA256] = \
+                    file_hash.hexdigest()
+            req.other_fields = other_fields
+            req.payload = segment
+            file_id = store_manager.store_segment(req).file_id
+
+
+def run(settings, thread_count, file_count, segment_count, segment_size):
+    """
+    Run one benchmark pass and return the aggregate segments per second.
+    """
+    storage_dir = mkdtemp()
+    segment = os.urandom(segment_size)
+    try:
+        store_manager = FileStoreManager(storage_dir, settings=settings)
+        threads = [threading.Thread(target=upload_files,
+                                    args=(store_manager, thread_number,
+                                          file_count, segment_count, segment))
+                   for thread_number in range(thread_count)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(storage_dir)
+    return (thread_count * file_count * segment_count) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", default="1,2,4,8,16",
+                        help="Comma-separated callback thread counts")
+    parser.add_argument("--files", type=int, default=4,
+                        help="Files uploaded per thread")
+    parser.add_argument("--segments", type=int, default=50,
+                        help="Segments per file")
+    parser.add_argument("--segment-size", type=int, default=50 * (2 ** 10),
+                        help="Segment size in bytes")
+    args = parser.parse_args()
+
+    single_lock_settings = FileStoreSettings(lock_shard_count=1)
+    sharded_settings = FileStoreSettings()
+
+    print("{:>8} {:>14} {:>14} {:>8}".format(
+        "threads", "single lock/s", "sharded/s", "speedup"))
+    for thread_count in [int(count) for count in args.threads.split(",")]:
+        single_lock_rate = run(single_lock_settings, thread_count, args.files,
+                               args.segments, args.segment_size)
+        sharded_rate = run(sharded_settings, thread_count, args.files,
+                           args.segments, args.segment_size)
+        print("{:>8} {:>14.1f} {:>14.1f} {:>7.2f}x".format(
+            thread_count, single_lock_rate, sharded_rate,
+            sharded_rate / single_lock_rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,13 @@
 from __future__ import absolute_import
 from __future__ import print_function
 import logging
-from logging.config import fileConfig
 
 import sys
-import os
 import signal
 import threading
 
 from .app import FileTransferService
+from .workers import WorkerSupervisor, configure_logging
 
 # Whether the application is running
 running = False
@@ -16,6 +15,9 @@ running = False
 # Condition used to notify that the application should exit
 run_condition = threading.Condition()
 
+# The exit code when running several worker processes
+exit_code = 0
+
 
 def signal_handler(signum, frame):
     """
@@ -48,21 +50,35 @@ if len(sys.argv) != 2:
 #
 
 config_dir = sys.argv[1]
-logging_config_path = os.path.join(config_dir, FileTransferService.LOGGING_CONFIG_FILE)
-if os.access(logging_config_path, os.R_OK):
-    # Log configuration via configuration file
-    fileConfig(logging_config_path, disable_existing_loggers=False)
-    logger = logging.getLogger()
-else:
-    # Default log configuration (no configuration file)
-    log_formatter = logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
-
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(log_formatter)
-
-    logger = logging.getLogger()
-    logger.addHandler(console_handler)
-    logger.setLevel(logging.INFO)
+configure_logging(config_dir)
+logger = logging.getLogger()
+
+try:
+    worker_count = FileTransferService.get_worker_count(config_dir)
+except ValueError:
+    logger.exception("Error occurred, exiting")
+    sys.exit(1)
+
+if worker_count > 1:
+    # Run the application in several worker processes
+    supervisor = WorkerSupervisor(config_dir, worker_count)
+    try:
+        supervisor.start()
+        running = True
+
+        with run_condition:
+            # Wait until notified to exit or until a worker exits
+            while running:
+                run_condition.wait(1)
+                exited_worker = supervisor.get_exited_worker()
+                if exited_worker is not None:
+                    logger.error("Worker %d exited, exiting",
+                                 exited_worker + 1)
+                    running = False
+                    exit_code = 1
+    finally:
+        supervisor.stop()
+    sys.exit(exit_code)
 
 # Create the application
 with FileTransferService(sys.argv[1]) as app:
@@ -0,0 +1,100 @@
+from __future__ import absolute_import
+import threading
+
+
+class ServiceBusyError(Exception):
+    """
+    Raised when a request is not processed because the service has reached a
+    limit on the transfers or requests that it accepts at a time. The request
+    may be sent again later.
+    """
+    pass
+
+
+class AdmissionController(object):
+    """
+    Tracks the requests admitted for processing and rejects new requests
+    while either the number of admitted requests which have not yet been
+    processed, or the number of bytes of payload held by those requests,
+    is at its limit. Every admitted request must be released once it has
+    been processed.
+    """
+
+    def __init__(self, max_pending_requests=None, max_bytes_in_flight=None):
+        """
+        Constructor parameters:
+
+        :param int max_pending_requests: Maximum number of requests admitted
+            but not yet released. If not specified, the number of requests is
+            not limited.
+        :param int max_bytes_in_flight: Maximum number of bytes of payload for
+            the requests admitted but not yet released. A single request is
+            always admitted when no other requests are pending, however large
+            its payload. If not specified, the number of bytes is not limited.
+        :raises ValueError: If either limit is less than 1.
+        """
+        for name, value in (("pending requests", max_pending_requests),
+                            ("bytes in flight", max_bytes_in_flight)):
+            if value is not None and value < 1:
+                raise ValueError(
+                    "Maximum {} must be at least 1: '{}'".format(name, value))
+        self._max_pending_requests = max_pending_requests
+        self._max_bytes_in_flight = max_bytes_in_flight
+        self._pending_requests = 0
+        self._bytes_in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending_requests(self):
+        """
+        Number of requests admitted but not yet released
+
+        :rtype: int
+        """
+        return self._pending_requests
+
+    @property
+    def bytes_in_flight(self):
+        """
+        Number of bytes of payload for the requests admitted but not yet
+        released
+
+        :rtype: int
+        """
+        return self._bytes_in_flight
+
+    def admit(self, request_size):
+        """
+        Admit a request for processing.
+
+        :param int request_size: Number of bytes of payload in the request.
+        :raises ServiceBusyError: If a limit has been reached. The request is
+            not admitted and must not be released.
+        """
+        with self._lock:
+            if self._max_pending_requests is not None and \
+                    self._pending_requests >= self._max_pending_requests:
+                raise ServiceBusyError(
+                    "Service busy: '{}' requests pending".format(
+                        self._pending_requests))
+            if self._max_bytes_in_flight is not None and \
+                    self._pending_requests and \
+                    self._bytes_in_flight + request_size > \
+                    self._max_bytes_in_flight:
+                raise ServiceBusyError(
+                    "Service busy: '{}' bytes in flight".format(
+                        self._bytes_in_flight))
+            self._pending_requests += 1
+            self._bytes_in_flight += request_size
+
+    def release(self, request_size):
+        """
+        Release a request admitted by :meth:`admit` once it has been
+        processed.
+
+        :param int request_size: Number of bytes of payload in the request,
+            as passed to :meth:`admit`.
+        """
+        with self._lock:
+            self._pending_requests -= 1
+            self._bytes_in_flight -= request_size
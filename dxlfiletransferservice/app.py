@@ -1,9 +1,26 @@
 from __future__ import absolute_import
 import logging
+import os
+
+try:
+    from configparser import ConfigParser
+except ImportError:  # Python 2
+    from ConfigParser import ConfigParser
 
 from dxlbootstrap.app import Application
 from dxlclient.service import ServiceRegistrationInfo
-from .requesthandlers import FileStoreRequestCallback
+from .durability import DurabilityMode
+from .ioengine import IoEngine
+from .metrics import MetricsHttpEndpoint, MetricsRegistry
+from .profiler import SamplingProfiler
+from .requesthandlers import FilePrecheckRequestCallback, \
+    FileProfileRequestCallback, FileResumeRequestCallback, \
+    FileRetrieveRequestCallback, FileShardRequestCallback, \
+    FileStatsRequestCallback, FileStoreRequestCallback
+from .retrieve import FileRetrieveManager
+from .settings import FileStoreSettings
+from .sharding import get_shard_topic
+from .storage import StorageMode
 
 # Configure local logger
 logger = logging.getLogger(__name__)
@@ -21,6 +38,9 @@ class FileTransferService(Application):
     #: file
     _GENERAL_CONFIG_SECTION = "General"
 
+    #: The name of the application-specific configuration file
+    _APP_CONFIG_FILE = "dxlfiletransferservice.config"
+
     #: The property used to specify the root directory under which files
     #: are stored
     _GENERAL_STORAGE_DIR_PROP = "storageDir"
@@ -33,23 +53,214 @@ class FileTransferService(Application):
     #: registered with the DXL fabric.
     _GENERAL_STORE_TOPIC_PROP = "storeTopic"
 
+    #: The property used to specify a custom name for the pre-check topic
+    #: registered with the DXL fabric.
+    _GENERAL_PRECHECK_TOPIC_PROP = "precheckTopic"
+
+    #: The property used to specify a custom name for the resume topic
+    #: registered with the DXL fabric.
+    _GENERAL_RESUME_TOPIC_PROP = "resumeTopic"
+
+    #: The property used to specify a custom name for the retrieve topic
+    #: registered with the DXL fabric.
+    _GENERAL_RETRIEVE_TOPIC_PROP = "retrieveTopic"
+
+    #: The property used to specify a custom name for the stats topic
+    #: registered with the DXL fabric.
+    _GENERAL_STATS_TOPIC_PROP = "statsTopic"
+
+    #: The property used to specify the port of the local HTTP endpoint from
+    #: which metrics are served in the Prometheus text format
+    _GENERAL_METRICS_PORT_PROP = "metricsPort"
+
+    #: The property used to specify the address of the interface on which
+    #: the local HTTP endpoint for metrics listens
+    _GENERAL_METRICS_ADDRESS_PROP = "metricsAddress"
+
+    #: The property used to specify the directory in which profile files are
+    #: written. The profile topic is only registered if this is set.
+    _GENERAL_PROFILE_DIR_PROP = "profileDir"
+
+    #: The property used to specify a custom name for the profile topic
+    #: registered with the DXL fabric.
+    _GENERAL_PROFILE_TOPIC_PROP = "profileTopic"
+
+    #: The property used to specify the number of milliseconds between
+    #: samples taken by the profiler
+    _GENERAL_PROFILE_SAMPLE_INTERVAL_PROP = "profileSampleInterval"
+
+    #: The property used to specify the maximum number of bytes returned in
+    #: the response to a single retrieve request
+    _GENERAL_RETRIEVE_SEGMENT_SIZE_PROP = "retrieveSegmentSize"
+
+    #: The property used to specify the maximum number of bytes of retrieved
+    #: segments held in memory for serving repeated retrieve requests
+    _GENERAL_RETRIEVE_CACHE_SIZE_PROP = "retrieveCacheSize"
+
+    #: The property used to specify the number of seconds after the last
+    #: request for a file at which its transfer is evicted from the working
+    #: directory
+    _GENERAL_WORKING_DIR_IDLE_TIMEOUT_PROP = "workingDirIdleTimeout"
+
+    #: The property used to specify the maximum total number of bytes of
+    #: files in the working directory
+    _GENERAL_WORKING_DIR_MAX_SIZE_PROP = "workingDirMaxSize"
+
+    #: The property used to specify the number of seconds between passes to
+    #: evict transfers from the working directory
+    _GENERAL_WORKING_DIR_REAP_INTERVAL_PROP = "workingDirReapInterval"
+
+    #: The property used to specify the maximum size which may be declared
+    #: for a file stored in parallel
+    _GENERAL_MAX_PARALLEL_FILE_SIZE_PROP = "maxParallelFileSize"
+
+    #: The property used to specify the maximum number of files which may be
+    #: in the process of being stored at a time
+    _GENERAL_MAX_ACTIVE_TRANSFERS_PROP = "maxActiveTransfers"
+
+    #: The property used to specify the maximum number of store requests
+    #: which have been received but not yet processed
+    _GENERAL_MAX_PENDING_REQUESTS_PROP = "maxPendingRequests"
+
+    #: The property used to specify the maximum number of bytes of segments
+    #: in the store requests which have been received but not yet processed
+    _GENERAL_MAX_BYTES_IN_FLIGHT_PROP = "maxBytesInFlight"
+
+    #: The property used to specify the number of segments past the last
+    #: contiguous segment received for a file which may be accepted out of
+    #: order
+    _GENERAL_REORDER_WINDOW_PROP = "reorderWindow"
+
+    #: The property used to specify when data written for stored files is
+    #: forced to stable storage
+    _GENERAL_DURABILITY_PROP = "durability"
+
+    #: The property used to specify the number of milliseconds over which to
+    #: batch syncs for the "group" durability mode
+    _GENERAL_GROUP_COMMIT_INTERVAL_PROP = "groupCommitInterval"
+
+    #: The property used to specify how committed files are laid out under
+    #: the storage directory
+    _GENERAL_STORAGE_MODE_PROP = "storageMode"
+
+    #: The property used to specify the maximum size of a file whose contents
+    #: are appended to a pack for the "pack" storage mode
+    _GENERAL_MAX_PACKED_FILE_SIZE_PROP = "maxPackedFileSize"
+
+    #: The property used to specify the size at which a pack is closed and a
+    #: new pack started for the "pack" storage mode
+    _GENERAL_MAX_PACK_SIZE_PROP = "maxPackSize"
+
+    #: The property used to specify the number of seconds between passes to
+    #: compact packs for the "pack" storage mode
+    _GENERAL_PACK_COMPACT_INTERVAL_PROP = "packCompactInterval"
+
+    #: The property used to specify the number of worker processes started
+    #: for the service
+    _GENERAL_WORKER_COUNT_PROP = "workerCount"
+
+    #: The property used to specify the number of shards of the store,
+    #: pre-check, and resume topics across which files are routed
+    _GENERAL_TOPIC_SHARD_COUNT_PROP = "topicShardCount"
+
+    #: The property used to specify the shards of the topics registered by
+    #: the service
+    _GENERAL_TOPIC_SHARDS_PROP = "topicShards"
+
+    #: The name of the "IoPool" section within the application configuration
+    #: file
+    _IO_POOL_CONFIG_SECTION = "IoPool"
+
+    #: The property used to specify how file store requests are dispatched
+    #: to the threads of the "IoPool"
+    _IO_ENGINE_CONFIG_PROP = "engine"
+
+    #: The default number of threads in the pool used to write file segments
+    #: and send responses
+    _DEFAULT_IO_THREAD_COUNT = 10
+
     #: The default subtopic to register with the DXL fabric if the store topic
     #: is not overridden in the configuration file
     _DEFAULT_STORE_SUBTOPIC = "file/store"
 
-    def __init__(self, config_dir):
+    #: The default subtopic to register with the DXL fabric if the pre-check
+    #: topic is not overridden in the configuration file
+    _DEFAULT_PRECHECK_SUBTOPIC = "file/precheck"
+
+    #: The default subtopic to register with the DXL fabric if the resume
+    #: topic is not overridden in the configuration file
+    _DEFAULT_RESUME_SUBTOPIC = "file/resume"
+
+    #: The default subtopic to register with the DXL fabric if the retrieve
+    #: topic is not overridden in the configuration file
+    _DEFAULT_RETRIEVE_SUBTOPIC = "file/retrieve"
+
+    #: The default subtopic to register with the DXL fabric if the stats
+    #: topic is not overridden in the configuration file
+    _DEFAULT_STATS_SUBTOPIC = "file/stats"
+
+    #: The default address of the interface on which the local HTTP endpoint
+    #: for metrics listens
+    _DEFAULT_METRICS_ADDRESS = "127.0.0.1"
+
+    #: The default subtopic to register with the DXL fabric if the profile
+    #: topic is not overridden in the configuration file
+    _DEFAULT_PROFILE_SUBTOPIC = "admin/profile"
+
+    def __init__(self, config_dir, worker_index=0, worker_count=1):
         """
         Constructor parameters:
 
         :param str config_dir: The location of the configuration files for the
             application
+        :param int worker_index: Index of the worker process, from 0 to one
+            less than the `worker_count`, in which the application runs.
+        :param int worker_count: Number of worker processes sharing the
+            storage directory. The shards of the store, pre-check, and resume
+            topics (see :mod:`dxlfiletransferservice.sharding`) registered by
+            the service are divided among the workers, each handling the
+            files whose ids are routed to its shards. If the number of
+            shards is not set in the configuration file, there is one shard
+            for each worker.
+        :raises ValueError: If the `worker_index` is not between 0 and one
+            less than the `worker_count`.
         """
         super(FileTransferService, self).__init__(
-            config_dir, "dxlfiletransferservice.config")
+            config_dir, self._APP_CONFIG_FILE)
+        self._worker_index = worker_index
+        self._worker_count = worker_count
         self._storage_dir = None
         self._working_dir = None
+        self._store_settings = FileStoreSettings(
+            io_thread_count=self._DEFAULT_IO_THREAD_COUNT)
+        self._topic_shard_count = worker_count
+        self._topic_shards = None
+        self._store_callbacks = []
         self._store_topic = "{}/{}".format(self._SERVICE_TYPE,
                                            self._DEFAULT_STORE_SUBTOPIC)
+        self._precheck_topic = "{}/{}".format(self._SERVICE_TYPE,
+                                              self._DEFAULT_PRECHECK_SUBTOPIC)
+        self._resume_topic = "{}/{}".format(self._SERVICE_TYPE,
+                                            self._DEFAULT_RESUME_SUBTOPIC)
+        self._retrieve_topic = "{}/{}".format(self._SERVICE_TYPE,
+                                              self._DEFAULT_RETRIEVE_SUBTOPIC)
+        self._retrieve_segment_size = None
+        self._retrieve_cache_size = None
+        self._stats_topic = "{}/{}".format(self._SERVICE_TYPE,
+                                           self._DEFAULT_STATS_SUBTOPIC)
+        self._metrics_port = None
+        self._metrics_address = self._DEFAULT_METRICS_ADDRESS
+        self._metrics_registry = MetricsRegistry()
+        self._metrics_endpoint = None
+        self._profile_dir = None
+        self._profile_topic = "{}/{}".format(self._SERVICE_TYPE,
+                                             self._DEFAULT_PROFILE_SUBTOPIC)
+        self._profile_sample_interval = None
+        self._profiler = None
+        if not 0 <= worker_index < worker_count:
+            raise ValueError(
+                "Worker index must be from 0 to {}: '{}'".format(
+                    worker_count - 1, worker_index))
 
     @property
     def client(self):
@@ -59,6 +270,54 @@ class FileTransferService(Application):
         """
         return self._dxl_client
 
+    @property
+    def worker_index(self):
+        """
+        Index of the worker process in which the application runs
+        """
+        return self._worker_index
+
+    @property
+    def worker_count(self):
+        """
+        Number of worker processes sharing the storage directory
+        """
+        return self._worker_count
+
+    @classmethod
+    def get_worker_count(cls, config_dir):
+        """
+        Get the number of worker processes to start for the service, as set
+        in the application configuration file.
+
+        :param str config_dir: The location of the configuration files for the
+            application
+        :return: The number of worker processes. If the configuration file
+            does not exist or does not set the number, this is 1.
+        :rtype: int
+        :raises ValueError: If the number set is not an integer greater than
+            0.
+        """
+        config = ConfigParser()
+        config.read(os.path.join(config_dir, cls._APP_CONFIG_FILE))
+        worker_count = 1
+        if config.has_option(cls._GENERAL_CONFIG_SECTION,
+                             cls._GENERAL_WORKER_COUNT_PROP):
+            value = config.get(cls._GENERAL_CONFIG_SECTION,
+                               cls._GENERAL_WORKER_COUNT_PROP).strip()
+            if value:
+                try:
+                    worker_count = int(value)
+                except ValueError:
+                    worker_count = 0
+                if worker_count < 1:
+                    raise ValueError(
+                        "Setting {} in section {} must be an integer greater "
+                        "than 0: {}".format(cls._GENERAL_WORKER_COUNT_PROP,
+                                            cls._GENERAL_CONFIG_SECTION,
+                                            value))
+        return worker_count
+
     @property
     def config(self):
         """
@@ -67,6 +326,23 @@ class FileTransferService(Application):
         """
         return self._config
 
+    def destroy(self):
+        """
+        Destroys the application (waits for queued file store requests to
+        complete, disconnects from fabric, frees resources, etc.)
+        """
+        with self._lock:
+            if self._metrics_endpoint:
+                self._metrics_endpoint.stop()
+                self._metrics_endpoint = None
+            if self._profiler:
+                self._profiler.stop()
+                self._profiler = None
+            for store_callback in self._store_callbacks:
+                store_callback.shutdown()
+            self._store_callbacks = []
+        super(FileTransferService, self).destroy()
+
     def on_run(self):
         """
         Invoked when the application has started running.
@@ -75,7 +351,8 @@ class FileTransferService(Application):
 
     def _get_setting_from_config(self, config, setting,
                                  default_value=None,
-                                 raise_exception_if_missing=False):
+                                 raise_exception_if_missing=False,
+                                 section=_GENERAL_CONFIG_SECTION):
         """
         Get the value for a setting in the application configuration file.
 
@@ -86,11 +363,11 @@ class FileTransferService(Application):
             to False.
         :param bool raise_exception_if_missing: Whether or not to raise an
             exception if the setting is missing from the configuration file.
+        :param str section: Name of the section containing the setting.
         :return: Value for the setting.
         :raises ValueError: If the setting cannot be found in the configuration
             file and 'raise_exception_if_missing' is set to 'True'.
         """
-        section = self._GENERAL_CONFIG_SECTION
         if config.has_option(section, setting):
             try:
                 return_value = config.get(section, setting)
@@ -112,6 +389,36 @@ class FileTransferService(Application):
 
         return return_value
 
+    def _get_int_setting_from_config(self, config, setting,
+                                     default_value=None,
+                                     section=_GENERAL_CONFIG_SECTION):
+        """
+        Get the value for an integer setting in the application configuration
+        file.
+
+        :param RawConfigParser config: Config parser to get setting from.
+        :param str setting: Name of the setting.
+        :param int default_value: Value to return if the setting is not found
+            in the configuration file.
+        :param str section: Name of the section containing the setting.
+        :return: Value for the setting.
+        :rtype: int
+        :raises ValueError: If the value for the setting cannot be converted
+            to an int.
+        """
+        return_value = self._get_setting_from_config(config, setting,
+                                                     section=section)
+        if return_value:
+            try:
+                return_value = int(return_value)
+            except ValueError:
+                raise ValueError(
+                    "Setting {} in section {} must be an integer: {}".format(
+                        setting, section, return_value))
+        else:
+            return_value = default_value
+        return return_value
+
     def on_load_configuration(self, config):
         """
         Invoked after the application-specific configuration has been loaded
@@ -128,9 +435,157 @@ class FileTransferService(Application):
             raise_exception_if_missing=True)
         self._working_dir = self._get_setting_from_config(
             config, self._GENERAL_WORKING_DIR_PROP)
+        store_settings = self._store_settings
+        store_settings.idle_file_timeout = self._get_int_setting_from_config(
+            config, self._GENERAL_WORKING_DIR_IDLE_TIMEOUT_PROP)
+        store_settings.max_working_size = self._get_int_setting_from_config(
+            config, self._GENERAL_WORKING_DIR_MAX_SIZE_PROP)
+        store_settings.reap_interval = self._get_int_setting_from_config(
+            config, self._GENERAL_WORKING_DIR_REAP_INTERVAL_PROP)
+        store_settings.max_parallel_file_size = \
+            self._get_int_setting_from_config(
+                config, self._GENERAL_MAX_PARALLEL_FILE_SIZE_PROP)
+        store_settings.max_active_files = self._get_int_setting_from_config(
+            config, self._GENERAL_MAX_ACTIVE_TRANSFERS_PROP)
+        store_settings.max_pending_requests = \
+            self._get_int_setting_from_config(
+                config, self._GENERAL_MAX_PENDING_REQUESTS_PROP)
+        store_settings.max_bytes_in_flight = \
+            self._get_int_setting_from_config(
+                config, self._GENERAL_MAX_BYTES_IN_FLIGHT_PROP)
         self._store_topic = self._get_setting_from_config(
             config, self._GENERAL_STORE_TOPIC_PROP,
             default_value=self._store_topic)
+        self._precheck_topic = self._get_setting_from_config(
+            config, self._GENERAL_PRECHECK_TOPIC_PROP,
+            default_value=self._precheck_topic)
+        self._resume_topic = self._get_setting_from_config(
+            config, self._GENERAL_RESUME_TOPIC_PROP,
+            default_value=self._resume_topic)
+        self._retrieve_topic = self._get_setting_from_config(
+            config, self._GENERAL_RETRIEVE_TOPIC_PROP,
+            default_value=self._retrieve_topic)
+        self._retrieve_segment_size = self._get_int_setting_from_config(
+            config, self._GENERAL_RETRIEVE_SEGMENT_SIZE_PROP)
+        self._retrieve_cache_size = self._get_int_setting_from_config(
+            config, self._GENERAL_RETRIEVE_CACHE_SIZE_PROP)
+        self._stats_topic = self._get_setting_from_config(
+            config, self._GENERAL_STATS_TOPIC_PROP,
+            default_value=self._stats_topic)
+        self._metrics_port = self._get_int_setting_from_config(
+            config, self._GENERAL_METRICS_PORT_PROP)
+        self._metrics_address = self._get_setting_from_config(
+            config, self._GENERAL_METRICS_ADDRESS_PROP,
+            default_value=self._metrics_address)
+        self._profile_dir = self._get_setting_from_config(
+            config, self._GENERAL_PROFILE_DIR_PROP)
+        self._profile_topic = self._get_setting_from_config(
+            config, self._GENERAL_PROFILE_TOPIC_PROP,
+            default_value=self._profile_topic)
+        profile_sample_interval = self._get_int_setting_from_config(
+            config, self._GENERAL_PROFILE_SAMPLE_INTERVAL_PROP)
+        if profile_sample_interval is not None:
+            self._profile_sample_interval = profile_sample_interval / 1000.0
+        store_settings.reorder_window = self._get_int_setting_from_config(
+            config, self._GENERAL_REORDER_WINDOW_PROP)
+        store_settings.durability = self._get_setting_from_config(
+            config, self._GENERAL_DURABILITY_PROP,
+            default_value=store_settings.durability).lower()
+        if store_settings.durability not in DurabilityMode.ALL:
+            raise ValueError(
+                "Setting {} in section {} must be one of {}: {}".format(
+                    self._GENERAL_DURABILITY_PROP,
+                    self._GENERAL_CONFIG_SECTION,
+                    ", ".join(DurabilityMode.ALL),
+                    store_settings.durability))
+        group_commit_interval = self._get_int_setting_from_config(
+            config, self._GENERAL_GROUP_COMMIT_INTERVAL_PROP)
+        if group_commit_interval is not None:
+            store_settings.group_commit_interval = \
+                group_commit_interval / 1000.0
+        store_settings.storage_mode = self._get_setting_from_config(
+            config, self._GENERAL_STORAGE_MODE_PROP,
+            default_value=store_settings.storage_mode).lower()
+        if store_settings.storage_mode not in StorageMode.ALL:
+            raise ValueError(
+                "Setting {} in section {} must be one of {}: {}".format(
+                    self._GENERAL_STORAGE_MODE_PROP,
+                    self._GENERAL_CONFIG_SECTION,
+                    ", ".join(StorageMode.ALL), store_settings.storage_mode))
+        store_settings.max_packed_file_size = \
+            self._get_int_setting_from_config(
+                config, self._GENERAL_MAX_PACKED_FILE_SIZE_PROP)
+        store_settings.max_pack_size = self._get_int_setting_from_config(
+            config, self._GENERAL_MAX_PACK_SIZE_PROP)
+        store_settings.pack_compact_interval = \
+            self._get_int_setting_from_config(
+                config, self._GENERAL_PACK_COMPACT_INTERVAL_PROP)
+        self._topic_shard_count = self._get_int_setting_from_config(
+            config, self._GENERAL_TOPIC_SHARD_COUNT_PROP,
+            default_value=self._topic_shard_count)
+        if self._topic_shard_count < 1:
+            raise ValueError(
+                "Setting {} in section {} must be greater than 0: {}".format(
+                    self._GENERAL_TOPIC_SHARD_COUNT_PROP,
+                    self._GENERAL_CONFIG_SECTION, self._topic_shard_count))
+        topic_shards = self._get_setting_from_config(
+            config, self._GENERAL_TOPIC_SHARDS_PROP)
+        if topic_shards:
+            try:
+                topic_shards = sorted(set(
+                    int(shard) for shard in topic_shards.split(",")))
+            except ValueError:
+                topic_shards = None
+            if not topic_shards or topic_shards[0] < 0 or \
+                    topic_shards[-1] >= self._topic_shard_count:
+                raise ValueError(
+                    "Setting {} in section {} must be a comma-separated list "
+                    "of shards from 0 to {}: {}".format(
+                        self._GENERAL_TOPIC_SHARDS_PROP,
+                        self._GENERAL_CONFIG_SECTION,
+                        self._topic_shard_count - 1,
+                        self._get_setting_from_config(
+                            config, self._GENERAL_TOPIC_SHARDS_PROP)))
+        else:
+            topic_shards = list(range(self._topic_shard_count))
+        # The index of the packs is held in memory by a single store manager
+        if store_settings.storage_mode == StorageMode.PACK and \
+                self._topic_shard_count > 1:
+            raise ValueError(
+                "Setting {} in section {} cannot be {} when there is more "
+                "than one topic shard: {}".format(
+                    self._GENERAL_STORAGE_MODE_PROP,
+                    self._GENERAL_CONFIG_SECTION, StorageMode.PACK,
+                    self._topic_shard_count))
+        if len(topic_shards) < self._worker_count:
+            raise ValueError(
+                "The {} worker processes require at least as many topic "
+                "shards: {}".format(self._worker_count, len(topic_shards)))
+        # Each worker registers every worker_count-th shard
+        self._topic_shards = \
+            topic_shards[self._worker_index::self._worker_count]
+
+        store_settings.io_queue_size = self._get_int_setting_from_config(
+            config, self.QUEUE_SIZE_CONFIG_PROP,
+            default_value=store_settings.io_queue_size,
+            section=self._IO_POOL_CONFIG_SECTION)
+        store_settings.io_thread_count = self._get_int_setting_from_config(
+            config, self.THREAD_COUNT_CONFIG_PROP,
+            default_value=store_settings.io_thread_count,
+            section=self._IO_POOL_CONFIG_SECTION)
+        store_settings.io_engine = self._get_setting_from_config(
+            config, self._IO_ENGINE_CONFIG_PROP,
+            default_value=store_settings.io_engine,
+            section=self._IO_POOL_CONFIG_SECTION).lower()
+        if store_settings.io_engine not in IoEngine.ALL:
+            raise ValueError(
+                "Setting {} in section {} must be one of {}: {}".format(
+                    self._IO_ENGINE_CONFIG_PROP,
+                    self._IO_POOL_CONFIG_SECTION,
+                    ", ".join(IoEngine.ALL), store_settings.io_engine))
+        logger.info("I/O pool configuration: queueSize=%d, threadCount=%d, "
+                    "engine=%s", store_settings.io_queue_size,
+                    store_settings.io_thread_count, store_settings.io_engine)
 
     def on_dxl_connect(self):
         """
@@ -149,14 +604,117 @@ class FileTransferService(Application):
         service = ServiceRegistrationInfo(self._dxl_client,
                                           self._SERVICE_TYPE)
 
+        if self._worker_count > 1:
+            logger.info("Running as worker %d of %d",
+                        self._worker_index + 1, self._worker_count)
+        sharded = self._topic_shard_count > 1
+        if sharded:
+            logger.info("Handling topic shards %s of %d",
+                        ", ".join(str(shard) for shard in self._topic_shards),
+                        self._topic_shard_count)
+
+        # Each shard has its own store manager, I/O threads, and
+        # subdirectory of the working directory
+        for shard in self._topic_shards:
+            self._store_callbacks.append(FileStoreRequestCallback(
+                self.client,
+                self._storage_dir,
+                self._working_dir,
+                self._store_settings,
+                metrics_registry=self._metrics_registry,
+                file_id_shard=shard if sharded else None,
+                file_id_shard_count=self._topic_shard_count
+                if sharded else None,
+                working_subdir=str(shard) if sharded else None))
+        store_managers = [store_callback.store_manager
+                          for store_callback in self._store_callbacks]
+
+        self._add_file_request_callbacks(
+            service, "file_transfer_service_file_store", self._store_topic,
+            self._store_callbacks)
+
+        self._add_file_request_callbacks(
+            service, "file_transfer_service_file_precheck",
+            self._precheck_topic,
+            [FilePrecheckRequestCallback(self.client, store_manager)
+             for store_manager in store_managers])
+
+        self._add_file_request_callbacks(
+            service, "file_transfer_service_file_resume", self._resume_topic,
+            [FileResumeRequestCallback(self.client, store_manager)
+             for store_manager in store_managers])
+
+        logger.info("Registering request callback: %s. Topic: %s.",
+                    "file_transfer_service_file_retrieve",
+                    self._retrieve_topic)
+        self.add_request_callback(
+            service, self._retrieve_topic,
+            FileRetrieveRequestCallback(
+                self.client,
+                FileRetrieveManager(store_managers[0],
+                                    self._retrieve_segment_size,
+                                    self._retrieve_cache_size),
+                self._store_callbacks[0].io_engine),
+            False)
+
         logger.info("Registering request callback: %s. Topic: %s.",
-                    "file_transfer_service_file_store",
-                    self._store_topic)
+                    "file_transfer_service_file_stats",
+                    self._stats_topic)
         self.add_request_callback(
-            service, self._store_topic,
-            FileStoreRequestCallback(self.client,
-                                     self._storage_dir,
-                                     self._working_dir),
+            service, self._stats_topic,
+            FileStatsRequestCallback(self.client, self._metrics_registry),
             False)
 
+        if self._profile_dir:
+            logger.info("Registering request callback: %s. Topic: %s.",
+                        "file_transfer_service_profile",
+                        self._profile_topic)
+            self._profiler = SamplingProfiler(self._profile_dir,
+                                              self._profile_sample_interval)
+            self.add_request_callback(
+                service, self._profile_topic,
+                FileProfileRequestCallback(self.client, self._profiler),
+                False)
+
         self.register_service(service)
+
+        if self._metrics_port is not None:
+            self._metrics_endpoint = MetricsHttpEndpoint(
+                self._metrics_registry,
+                self._metrics_port + self._worker_index,
+                self._metrics_address)
+
+    def _add_file_request_callbacks(self, service, name, topic, callbacks):
+        """
+        Add the request callbacks for requests which may refer to a file
+        being stored, one callback for each of the topic shards handled by
+        the service. When the topic is sharded, each callback is registered
+        on the shard of the topic for its shard, to which clients route the
+        requests for the files in the shard. The topic itself, on which
+        requests which do not yet refer to a file are load balanced across
+        the service processes, is registered with a callback which dispatches
+        each request to the callback for one of the shards.
+
+        :param dxlclient.service.ServiceRegistrationInfo service: The service
+            with which to register the callbacks.
+        :param str name: Name of the callbacks, for logging.
+        :param str topic: The topic.
+        :param list callbacks: The callbacks, in the same order as the topic
+            shards handled by the service.
+        """
+        topic_callbacks = []
+        if self._topic_shard_count > 1:
+            callbacks_by_shard = dict(zip(self._topic_shards, callbacks))
+            topic_callbacks.append((topic, FileShardRequestCallback(
+                self.client, topic, callbacks_by_shard,
+                self._topic_shard_count)))
+            for shard in self._topic_shards:
+                topic_callbacks.append((get_shard_topic(topic, shard),
+                                        callbacks_by_shard[shard]))
+        else:
+            topic_callbacks.append((topic, callbacks[0]))
+        for callback_topic, callback in topic_callbacks:
+            logger.info("Registering request callback: %s. Topic: %s.",
+                        name, callback_topic)
+            self.add_request_callback(service, callback_topic, callback,
+                                      False)
@@ -0,0 +1,256 @@
+from __future__ import absolute_import
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from dxlfiletransferclient.constants import FileStoreResultProp
+from .compression import check_compression_type, decompress
+from .constants import FileStoreProp, HashType
+from .durability import DurabilityMode, sync_file_data
+from .hashing import DEFAULT_HASH_TYPES, MultiHasher, parse_hash_types
+from .metrics import monotonic
+from .storeresult import FileStoreBatchResult
+from .util import get_buffer_view, get_value_as_int, write_at
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class BatchStoreMixin(object):
+    """
+    Mixin for the :class:`dxlfiletransferservice.store.FileStoreManager`
+    which stores a batch of small files, received in a single request along
+    with a manifest listing the name, size, and hashes of each file.
+    """
+
+    #: Prefix for the name of the temporary directory, in the working
+    #: directory, in which the files in a batch are written before they are
+    #: committed. The name cannot be mistaken for a file id, which may not
+    #: contain a period.
+    _BATCH_WORKING_DIR_PREFIX = ".batch-"
+
+    def parse_batch(self, message):
+        """
+        Extract and validate the parameters for a batch of files from a
+        message. Like
+        :meth:`dxlfiletransferservice.store.FileStoreManager.parse_segment`,
+        this does not access any state for files or write anything to disk.
+
+        The contents of all of the files in the batch are concatenated in the
+        message payload, which may be compressed as a whole. The
+        :const:`dxlfiletransferservice.constants.FileStoreProp.FILES`
+        parameter is a JSON list with an entry for each of the files, in the
+        order in which their contents appear in the payload. Each entry is an
+        object with the ``name`` and ``size`` of the file and one or more
+        expected hashes for the file, for example, ``hash_sha256``.
+
+        :param dxlclient.message.Message message: The message containing the
+            batch of files to process.
+        :return: The parameters for the batch, for use with the
+            :meth:`store_parsed_batch` method.
+        :rtype: dict
+        :raises ValueError: If the manifest for the batch is not a non-empty
+            list of entries which each have a name, size, and hash.
+        """
+        params = message.other_fields
+        try:
+            manifest = json.loads(params.get(FileStoreProp.FILES))
+        except (TypeError, ValueError):
+            raise ValueError(
+                "'{}' is not a valid JSON list: '{}'".format(
+                    FileStoreProp.FILES, params.get(FileStoreProp.FILES)))
+        if not isinstance(manifest, list) or not manifest:
+            raise ValueError(
+                "'{}' must be a non-empty list of files".format(
+                    FileStoreProp.FILES))
+
+        batch_files = []
+        for entry in manifest:
+            if not isinstance(entry, dict):
+                raise ValueError(
+                    "Unexpected entry in '{}': '{}'".format(
+                        FileStoreProp.FILES, entry))
+            file_name = entry.get(FileStoreProp.NAME)
+            file_size = get_value_as_int(entry, FileStoreProp.SIZE)
+            if not file_name or file_size is None or file_size < 0:
+                raise ValueError(
+                    "File name and size must be specified for each file in "
+                    "batch: '{}'".format(entry))
+            file_hashes = {}
+            for param_name, param_value in entry.items():
+                if param_name.startswith(FileStoreProp.HASH_PREFIX) and \
+                        param_name != FileStoreProp.HASH_TYPES and \
+                        param_value:
+                    file_hashes[param_name[len(FileStoreProp.HASH_PREFIX):]] \
+                        = str(param_value).lower()
+            if not file_hashes:
+                raise ValueError(
+                    "File hash must be specified for file in batch: '{}'".
+                    format(file_name))
+            batch_files.append({
+                FileStoreProp.NAME: file_name,
+                FileStoreProp.SIZE: file_size,
+                FileStoreProp.HASHES: file_hashes
+            })
+
+        compression_type = params.get(FileStoreProp.COMPRESSION)
+        if compression_type:
+            compression_type = compression_type.lower()
+            check_compression_type(compression_type)
+
+        return {
+            FileStoreProp.FILES: batch_files,
+            FileStoreProp.COMPRESSION: compression_type,
+            self._SEGMENT_PAYLOAD: get_buffer_view(message.payload or b"")
+        }
+
+    def store_batch(self, message):
+        """
+        Process a message containing a batch of files to store.
+
+        This is equivalent to calling :meth:`parse_batch` followed by
+        :meth:`store_parsed_batch`.
+
+        :param dxlclient.message.Message message: The message containing the
+            batch of files to process.
+        :return: The result from the storage operation.
+        :rtype: FileStoreBatchResult
+        :raises ValueError: If any parameters associated with the batch are
+            invalid.
+        """
+        return self.store_parsed_batch(self.parse_batch(message))
+
+    def store_parsed_batch(self, batch_params):
+        """
+        Store each of the files in a batch, as returned from the
+        :meth:`parse_batch` method.
+
+        Each file is hashed, validated against its expected hashes, and
+        committed in turn, in a single call and without an entry being
+        opened for the file, so storing a small file in a batch avoids the
+        file id, journal, and per-request overhead of storing it in
+        segments. A file whose contents are already stored (see
+        :meth:`dxlfiletransferservice.store.FileStoreManager.check_parsed_file`)
+        is stored from those contents rather than written again.
+
+        A file which cannot be stored, for example, because its hash does
+        not match the contents received for it, does not prevent the other
+        files in the batch from being stored. The error is reported in the
+        result for the file.
+
+        :param dict batch_params: The parameters for the batch.
+        :return: The result for each of the files in the batch.
+        :rtype: FileStoreBatchResult
+        :raises ValueError: If the payload cannot be decompressed or its size
+            does not match the total size of the files in the batch.
+        """
+        payload = batch_params[self._SEGMENT_PAYLOAD]
+        compression_type = batch_params[FileStoreProp.COMPRESSION]
+        if compression_type and payload:
+            payload = get_buffer_view(decompress(
+                compression_type, payload,
+                self._MAX_DECOMPRESSED_SEGMENT_SIZE))
+
+        batch_files = batch_params[FileStoreProp.FILES]
+        batch_size = sum(batch_file[FileStoreProp.SIZE]
+                         for batch_file in batch_files)
+        if batch_size != len(payload):
+            raise ValueError(
+                "Unexpected batch size. Expected: '{}'. Received: '{}'.".
+                format(batch_size, len(payload)))
+
+        batch_working_dir = tempfile.mkdtemp(
+            prefix=self._BATCH_WORKING_DIR_PREFIX, dir=self._working_dir)
+        try:
+            file_results = []
+            offset = 0
+            for batch_file in batch_files:
+                file_size = batch_file[FileStoreProp.SIZE]
+                file_results.append(self._store_batch_file(
+                    batch_working_dir, batch_file,
+                    payload[offset:offset + file_size]))
+                offset += file_size
+        finally:
+            shutil.rmtree(batch_working_dir)
+        return FileStoreBatchResult(file_results)
+
+    def _store_batch_file(self, batch_working_dir, batch_file, contents):
+        """
+        Store one of the files in a batch.
+
+        :param str batch_working_dir: Directory in which to write the working
+            file for the file.
+        :param dict batch_file: The parameters for the file, as parsed from
+            the manifest for the batch.
+        :param contents: Contents of the file, as `bytes` or a
+            :class:`memoryview`.
+        :return: The result for the file.
+        :rtype: dict
+        """
+        file_name = batch_file[FileStoreProp.NAME]
+        file_size = batch_file[FileStoreProp.SIZE]
+        file_hashes = batch_file[FileStoreProp.HASHES]
+        try:
+            storage_file_name = self.get_storage_file_name(file_name)
+
+            commit_start_time = monotonic()
+            file_hasher = MultiHasher(
+                set(DEFAULT_HASH_TYPES).union(
+                    self._storage.required_hash_types,
+                    parse_hash_types(",".join(file_hashes))))
+            file_hasher.update(contents)
+            stored_file_hashes = file_hasher.hexdigests()
+            for hash_type, file_hash in sorted(file_hashes.items()):
+                stored_file_hash = stored_file_hashes.get(hash_type)
+                if not stored_file_hash:
+                    raise ValueError(
+                        "Hash type '{}' not computed for file".format(
+                            hash_type))
+                if stored_file_hash != file_hash:
+                    raise ValueError(
+                        "Unexpected file hash. Expected: '{}'. Received: "
+                        "'{}'.".format(stored_file_hash, file_hash))
+
+            content_name = self._storage.find_content(
+                stored_file_hashes[HashType.SHA256], file_size)
+            if content_name:
+                self._storage.materialize(content_name, storage_file_name)
+            else:
+                working_file_name = os.path.join(
+                    batch_working_dir, self._WORKING_BASE_FILE_NAME)
+                write_start_time = monotonic()
+                file_handle = os.open(
+                    working_file_name,
+                    os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                    getattr(os, "O_BINARY", 0))
+                try:
+                    write_at(file_handle, contents, 0)
+                    if self._durability != DurabilityMode.NONE:
+                        sync_file_data(file_handle)
+                finally:
+                    os.close(file_handle)
+                self._write_seconds.observe_since(write_start_time)
+                self._bytes_written.inc(file_size)
+                content_name = self._storage.commit(
+                    working_file_name, storage_file_name, stored_file_hashes)
+                self._notify_content_committed(stored_file_hashes, file_size,
+                                               content_name)
+            self._commit_seconds.observe_since(commit_start_time)
+        except (ValueError, OSError, IOError) as ex:
+            logger.info("Failed to store file '%s' in batch: %s", file_name,
+                        ex)
+            self._files_canceled.inc()
+            return {
+                FileStoreProp.NAME: file_name,
+                FileStoreProp.ERROR: str(ex)
+            }
+
+        logger.info("Stored file '%s' from batch", storage_file_name)
+        self._files_stored.inc()
+        return {
+            FileStoreProp.NAME: file_name,
+            FileStoreProp.RESULT: FileStoreResultProp.STORE,
+            FileStoreProp.HASHES: stored_file_hashes
+        }
@@ -0,0 +1,143 @@
+from __future__ import absolute_import
+import zlib
+
+from .constants import CompressionType
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#: Window bits used by zlib to decode data with a gzip header and trailer
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+#: Bytes with which each gzip member starts
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def _decompress_gzip(data, max_size):
+    """
+    Decompress gzip data, stopping once more than the maximum size has been
+    produced. Data made up of several gzip members is decompressed to the
+    concatenation of the members, as with :func:`gzip.decompress`.
+
+    :param data: The compressed data, as `bytes` or a :class:`memoryview`.
+    :param int max_size: Maximum number of bytes to produce.
+    :return: The decompressed data. This is longer than `max_size` if the
+        decompressed data exceeds the maximum size.
+    :rtype: bytes
+    :raises ValueError: If the last member is truncated, or the data after a
+        member is not another gzip member.
+    """
+    decompressed = []
+    decompressed_size = 0
+    while True:
+        decompressor = zlib.decompressobj(_GZIP_WBITS)
+        member = decompressor.decompress(data,
+                                         max_size + 1 - decompressed_size)
+        decompressed.append(member)
+        decompressed_size += len(member)
+        if decompressed_size > max_size:
+            break
+        if not decompressor.eof:
+            raise ValueError("Truncated gzip data")
+        data = decompressor.unused_data
+        if not data:
+            break
+        if data[:len(_GZIP_MAGIC)] != _GZIP_MAGIC:
+            raise ValueError("Unexpected data after gzip member")
+    return b"".join(decompressed)
+
+
+def _decompress_zstd(data, max_size):
+    """
+    Decompress Zstandard data, stopping once more than the maximum size has
+    been produced.
+
+    :param data: The compressed data, as `bytes` or a :class:`memoryview`.
+    :param int max_size: Maximum number of bytes to produce.
+    :return: The decompressed data. This is longer than `max_size` if the
+        decompressed data exceeds the maximum size.
+    :rtype: bytes
+    """
+    reader = zstandard.ZstdDecompressor().stream_reader(data)
+    try:
+        return reader.read(max_size + 1)
+    finally:
+        reader.close()
+
+
+def _get_decompressors():
+    """
+    Get the decompression functions for the compression types which are
+    available in the running environment.
+
+    :return: Dictionary of decompression functions, keyed by
+        :class:`dxlfiletransferservice.constants.CompressionType` value.
+    :rtype: dict
+    """
+    decompressors = {CompressionType.GZIP: _decompress_gzip}
+    if zstandard:
+        decompressors[CompressionType.ZSTD] = _decompress_zstd
+    return decompressors
+
+
+_DECOMPRESSORS = _get_decompressors()
+
+
+def get_supported_compression_types():
+    """
+    Get the compression types which the service is able to decompress.
+
+    :return: The supported compression types, as
+        :class:`dxlfiletransferservice.constants.CompressionType` values.
+    :rtype: list
+    """
+    return sorted(_DECOMPRESSORS)
+
+
+def check_compression_type(compression_type):
+    """
+    Check that a compression type is supported.
+
+    :param str compression_type: The compression type.
+    :raises ValueError: If the compression type is not supported.
+    """
+    if compression_type not in _DECOMPRESSORS:
+        raise ValueError(
+            "Unsupported compression type: '{}'. Supported: '{}'".format(
+                compression_type, ",".join(get_supported_compression_types())))
+
+
+def decompress(compression_type, data, max_size):
+    """
+    Decompress data. The data is decompressed incrementally so that no more
+    than the maximum size (plus one byte) is ever produced, protecting
+    against data which expands to far more than any legitimate segment.
+
+    :param str compression_type: The compression type of the data, a member
+        of the :class:`dxlfiletransferservice.constants.CompressionType`
+        class.
+    :param data: The compressed data, as `bytes` or a :class:`memoryview`.
+    :param int max_size: Maximum number of bytes which the data may
+        decompress to.
+    :return: The decompressed data.
+    :rtype: bytes
+    :raises ValueError: If the compression type is not supported, the data
+        is not valid for the compression type, or the data decompresses to
+        more than the maximum size.
+    """
+    check_compression_type(compression_type)
+    try:
+        decompressed = _DECOMPRESSORS[compression_type](data, max_size)
+    except ValueError:
+        raise
+    except Exception as ex:
+        raise ValueError(
+            "Unable to decompress '{}' data: {}".format(compression_type,
+                                                        ex))
+    if len(decompressed) > max_size:
+        raise ValueError(
+            "Decompressed data exceeds the maximum size of '{}' bytes".format(
+                max_size))
+    return decompressed
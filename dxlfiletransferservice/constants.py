@@ -0,0 +1,131 @@
+from __future__ import absolute_import
+
+from dxlfiletransferclient.constants import \
+    FileStoreProp as _ClientFileStoreProp, HashType as _ClientHashType
+
+
+class FileStoreProp(_ClientFileStoreProp):
+    """
+    Attributes associated with the parameters for a file store operation.
+
+    This extends the attributes defined in
+    :class:`dxlfiletransferclient.constants.FileStoreProp` with attributes
+    which are only understood by this service.
+    """
+    #: Byte offset in the file at which the segment contained in the request
+    #: payload should be written. Required for a segment which arrives ahead
+    #: of a segment with a lower segment number.
+    SEGMENT_OFFSET = "segment_offset"
+
+    #: Number of bytes of a file requested in a retrieve request, starting at
+    #: the segment offset. In the response, the number of bytes contained in
+    #: the response payload.
+    SEGMENT_LENGTH = "segment_length"
+
+    #: Total number of segments in a file which is stored in parallel. When
+    #: declared, along with the size of the file, with the first segment of a
+    #: file, the segments of the file may be received in any order, for
+    #: example, from several concurrent workers each sending a disjoint range
+    #: of the file. Every segment other than the first must then include its
+    #: segment offset.
+    SEGMENT_COUNT = "segment_count"
+
+    #: Maximum number of segments which the client intends to keep in flight
+    #: for a file. The service responds with the window size that it grants,
+    #: which may be smaller than the size requested by the client.
+    WINDOW_SIZE = "window_size"
+
+    #: Comma-separated list of hash types (see :class:`HashType`) which the
+    #: client would like the service to compute for the file. The service
+    #: responds with the list of hash types that it will compute, omitting
+    #: any which it does not support. If not specified, only a SHA-256 hash
+    #: is computed.
+    HASH_TYPES = "hash_types"
+
+    #: Prefix for the name of the parameter containing the expected hash, of
+    #: a specific hash type, for the contents of the file. For example,
+    #: ``hash_sha256``.
+    HASH_PREFIX = "hash_"
+
+    #: Compression type (see :class:`CompressionType`) of the segment
+    #: contained in the request payload. The segment is decompressed before
+    #: it is hashed and written, so the segment offset, file size, and file
+    #: hashes all refer to the original, uncompressed contents. Each segment
+    #: is compressed independently, so a client may compress only the
+    #: segments for which compression helps.
+    COMPRESSION = "compression"
+
+    #: JSON list describing each of the files in a batch store request, in
+    #: the order in which the contents of the files are concatenated in the
+    #: request payload. Each entry is an object with the ``name`` and
+    #: ``size`` of the file and its expected hashes, for example,
+    #: ``hash_sha256``. In the response, a list with the result for each of
+    #: the files, including either the ``result`` and ``hashes`` for the
+    #: file or an ``error``.
+    FILES = "files"
+
+    #: Description of the error which prevented a file in a batch store
+    #: request from being stored
+    ERROR = "error"
+
+    HASH_MD5 = HASH_PREFIX + "md5"
+    HASH_SHA1 = HASH_PREFIX + "sha1"
+    HASH_BLAKE2B = HASH_PREFIX + "blake2b"
+    HASH_XXH64 = HASH_PREFIX + "xxh64"
+
+
+class HashType(_ClientHashType):
+    """
+    Constants used to indicate `hash type`.
+
+    This extends the hash types defined in
+    :class:`dxlfiletransferclient.constants.HashType` with hash types which
+    are only understood by this service.
+    """
+    MD5 = "md5"
+    SHA1 = "sha1"
+    BLAKE2B = "blake2b"
+
+    #: 64-bit xxHash. This is only supported if the optional ``xxhash``
+    #: package is installed.
+    XXH64 = "xxh64"
+
+
+class CompressionType(object):
+    """
+    Constants used to indicate the `compression type` of a segment.
+    """
+    #: gzip (RFC 1952) compressed data
+    GZIP = "gzip"
+
+    #: Zstandard compressed data. This is only supported if the optional
+    #: ``zstandard`` package is installed.
+    ZSTD = "zstd"
+
+
+class FileStoreErrorCode(object):
+    """
+    Constants used to indicate the `error code` of an error response sent by
+    the service.
+    """
+    #: The request could not be processed, for example, because it was
+    #: invalid. Sending the same request again will not succeed.
+    GENERAL = 0
+
+    #: The service has reached a limit on the transfers or requests that it
+    #: accepts at a time. The request was not processed and may be sent again
+    #: later, preferably after a backoff which increases with each attempt.
+    BUSY = 503
+
+
+class ProfileProp(object):
+    """
+    Attributes associated with the parameters for a profile request.
+    """
+    #: Action requested of the profiler (see
+    #: :class:`dxlfiletransferservice.profiler.ProfileAction`). If not
+    #: specified, profiling is started.
+    ACTION = "action"
+
+    #: Number of seconds to profile for when profiling is started
+    DURATION = "duration"
@@ -0,0 +1,222 @@
+from __future__ import absolute_import
+import logging
+import os
+import threading
+import time
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class DurabilityMode(object):
+    """
+    Constants used to indicate when data written for stored files is forced
+    to stable storage.
+    """
+    #: Never force data to stable storage. Data reaches the disk whenever the
+    #: operating system flushes it.
+    NONE = "none"
+
+    #: Force the contents of a file to stable storage when the file is
+    #: committed to the storage directory.
+    COMMIT = "commit"
+
+    #: Force each segment to stable storage before responding to the request
+    #: for the segment.
+    SEGMENT = "segment"
+
+    #: Like :const:`SEGMENT`, but batch the syncs for segments written
+    #: concurrently (across all files) into a single group, so that one sync
+    #: of the file system covers every segment in the group.
+    GROUP = "group"
+
+    #: All of the supported modes
+    ALL = (NONE, COMMIT, SEGMENT, GROUP)
+
+
+def sync_file_data(file_handle):
+    """
+    Force the data written to a file to stable storage.
+
+    :param int file_handle: Operating system level handle for the file.
+    """
+    if hasattr(os, "fdatasync"):
+        os.fdatasync(file_handle)
+    else:
+        os.fsync(file_handle)
+
+
+def sync_dir(dir_name):
+    """
+    Force an update to a directory, for example, the addition of a new file
+    entry, to stable storage. This is a no-op on platforms which do not
+    support opening a directory for syncing.
+
+    :param str dir_name: Name of the directory.
+    """
+    if hasattr(os, "O_DIRECTORY"):
+        dir_handle = os.open(dir_name, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_handle)
+        finally:
+            os.close(dir_handle)
+
+
+def _load_syncfs():
+    """
+    Look up the ``syncfs`` function of the C library, which forces all of the
+    data written to the file system containing a file handle to stable
+    storage in a single call.
+
+    :return: The function, or `None` if the platform does not provide it.
+    """
+    try:
+        import ctypes
+        import ctypes.util
+        library_name = ctypes.util.find_library("c")
+        if not library_name:
+            return None
+        return ctypes.CDLL(library_name, use_errno=True).syncfs
+    except (AttributeError, ImportError, OSError):
+        return None
+
+
+#: The ``syncfs`` function of the C library, or `None` if not available
+_SYNCFS = _load_syncfs()
+
+
+def sync_file_system(file_handle):
+    """
+    Force all of the data written to the file system which contains a file to
+    stable storage.
+
+    :param int file_handle: Operating system level handle for a file on the
+        file system.
+    :raises OSError: If the platform does not support syncing a single file
+        system, or an error occurred syncing it.
+    """
+    if not _SYNCFS:
+        raise OSError("Syncing a single file system is not supported")
+    if _SYNCFS(file_handle) != 0:
+        import ctypes
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+class _GroupCommitBatch(object):
+    """
+    Set of file handles to be synced together in a group commit.
+    """
+    def __init__(self):
+        self.file_handles = set()
+        self.done = False
+        self.errors = {}
+
+
+class GroupCommitter(object):
+    """
+    Batches syncs for file handles requested from multiple threads.
+
+    The first caller of :meth:`sync` to find no sync in progress becomes the
+    leader of the current batch. The leader closes the batch and syncs it on
+    behalf of every caller in it. Callers which arrive while the batch is
+    being synced are gathered into the next batch, one of whose callers
+    becomes its leader once the sync completes. The file handles in a batch
+    which are on the same file system are synced with a single ``syncfs``
+    call, so that the cost of the sync is shared by every writer in the
+    batch.
+
+    On platforms without ``syncfs``, each caller of :meth:`sync` syncs its own
+    file handle immediately, concurrently with the other callers.
+    """
+
+    def __init__(self, interval=0):
+        """
+        Constructor parameters:
+
+        :param float interval: Number of seconds for the leader of a batch to
+            wait for more writers to join the batch before syncing it. If 0,
+            the batch holds the writers which arrived while the previous
+            batch was being synced.
+        """
+        self._interval = interval
+        self._condition = threading.Condition()
+        self._batch = _GroupCommitBatch()
+        self._syncing = False
+        self._running = True
+
+    def sync(self, file_handle):
+        """
+        Add a file handle to the current batch and wait for the batch to be
+        synced. The file handle must not be closed until this method returns.
+
+        :param int file_handle: Operating system level handle for the file.
+        :raises OSError: If an error occurred syncing the file handle.
+        """
+        with self._condition:
+            if not self._running:
+                raise OSError("Group committer has been stopped")
+        if not _SYNCFS:
+            sync_file_data(file_handle)
+            return
+        with self._condition:
+            batch = self._batch
+            batch.file_handles.add(file_handle)
+            # Only the current batch can need a leader. A batch which has
+            # been replaced is being synced by its own leader.
+            while not batch.done and self._syncing:
+                self._condition.wait()
+            leader = not batch.done
+            if leader:
+                self._syncing = True
+        if leader:
+            self._sync_batch(batch)
+        error = batch.errors.get(file_handle)
+        if error:
+            raise error
+
+    def _sync_batch(self, batch):
+        """
+        Close a batch and sync its file handles, with one sync for each file
+        system on which the file handles reside. Any error is recorded for
+        each of the file handles which the failed sync covered.
+
+        :param _GroupCommitBatch batch: The batch to sync.
+        """
+        try:
+            if self._interval:
+                time.sleep(self._interval)
+            with self._condition:
+                self._batch = _GroupCommitBatch()
+            logger.debug("Group commit for %d file(s)",
+                         len(batch.file_handles))
+            file_handles_by_device = {}
+            for file_handle in batch.file_handles:
+                try:
+                    file_handles_by_device.setdefault(
+                        os.fstat(file_handle).st_dev, []).append(file_handle)
+                except OSError as ex:
+                    batch.errors[file_handle] = ex
+            for file_handles in file_handles_by_device.values():
+                try:
+                    if len(file_handles) == 1:
+                        sync_file_data(file_handles[0])
+                    else:
+                        sync_file_system(file_handles[0])
+                except OSError as ex:
+                    logger.exception("Error syncing files in group commit")
+                    for file_handle in file_handles:
+                        batch.errors[file_handle] = ex
+        finally:
+            with self._condition:
+                batch.done = True
+                self._syncing = False
+                self._condition.notify_all()
+
+    def stop(self):
+        """
+        Stop accepting file handles to sync. Batches already being synced
+        complete normally.
+        """
+        with self._condition:
+            self._running = False
@@ -0,0 +1,135 @@
+from __future__ import absolute_import
+import hashlib
+
+from .constants import HashType
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def _create_xxh64():
+    """
+    Create an xxHash 64-bit hash object.
+
+    :rtype: xxhash.xxh64
+    """
+    return xxhash.xxh64()
+
+
+def _get_hash_constructors():
+    """
+    Get the constructors for the hash types which are available in the
+    running environment.
+
+    :return: Dictionary of hash constructors, keyed by
+        :class:`dxlfiletransferservice.constants.HashType` value.
+    :rtype: dict
+    """
+    constructors = {}
+    for hash_type in (HashType.SHA256, HashType.SHA1, HashType.MD5,
+                      HashType.BLAKE2B):
+        try:
+            hashlib.new(hash_type)
+        except ValueError:
+            # Not available in this build of Python (or disabled, for
+            # example, MD5 in a FIPS-enabled environment)
+            continue
+        constructors[hash_type] = \
+            lambda hash_name=hash_type: hashlib.new(hash_name)
+    if xxhash:
+        constructors[HashType.XXH64] = _create_xxh64
+    return constructors
+
+
+_HASH_CONSTRUCTORS = _get_hash_constructors()
+
+#: The hash types computed for a file if the client does not request any
+DEFAULT_HASH_TYPES = (HashType.SHA256,)
+
+
+def get_supported_hash_types():
+    """
+    Get the hash types which the service is able to compute.
+
+    :return: The supported hash types, as
+        :class:`dxlfiletransferservice.constants.HashType` values.
+    :rtype: list
+    """
+    return sorted(_HASH_CONSTRUCTORS)
+
+
+def parse_hash_types(hash_types):
+    """
+    Parse a comma-separated list of requested hash types.
+
+    :param str hash_types: Comma-separated list of hash types.
+    :return: The requested hash types which are supported, in the order
+        requested, without duplicates.
+    :rtype: list
+    """
+    supported_hash_types = []
+    for hash_type in hash_types.split(","):
+        hash_type = hash_type.strip().lower()
+        if hash_type in _HASH_CONSTRUCTORS and \
+                hash_type not in supported_hash_types:
+            supported_hash_types.append(hash_type)
+    return supported_hash_types
+
+
+class MultiHasher(object):
+    """
+    Computes hashes of multiple types over the same data in a single pass.
+    Each block of data passed to :meth:`update` is fed to the hash object
+    for every hash type, so the data never needs to be read more than once.
+    """
+
+    def __init__(self, hash_types=DEFAULT_HASH_TYPES):
+        """
+        Constructor parameters:
+
+        :param list hash_types: The
+            :class:`dxlfiletransferservice.constants.HashType` values for
+            the hashes to compute.
+        :raises ValueError: If no hash types are specified or any of the
+            hash types is not supported.
+        """
+        if not hash_types:
+            raise ValueError("At least one hash type must be specified")
+        self._hashers = {}
+        for hash_type in hash_types:
+            constructor = _HASH_CONSTRUCTORS.get(hash_type)
+            if not constructor:
+                raise ValueError(
+                    "Unsupported hash type: '{}'".format(hash_type))
+            self._hashers[hash_type] = constructor()
+
+    @property
+    def hash_types(self):
+        """
+        The types of hashes computed
+
+        :rtype: list
+        """
+        return sorted(self._hashers)
+
+    def update(self, data):
+        """
+        Update each of the hashes with the supplied data.
+
+        :param bytes data: The data.
+        """
+        for hasher in self._hashers.values():
+            hasher.update(data)
+
+    def hexdigests(self):
+        """
+        Get the hexstring digest for each of the hashes computed so far.
+
+        :return: Dictionary of hexstring digests, keyed by
+            :class:`dxlfiletransferservice.constants.HashType` value.
+        :rtype: dict
+        """
+        return {hash_type: hasher.hexdigest()
+                for hash_type, hasher in self._hashers.items()}
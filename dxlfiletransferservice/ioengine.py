@@ -0,0 +1,262 @@
+from __future__ import absolute_import
+import functools
+import itertools
+import logging
+import threading
+from collections import deque
+
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # Python 2
+    asyncio = None
+
+try:
+    from queue import Queue
+except ImportError:  # Python 2
+    from Queue import Queue
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class IoEngine(object):
+    """
+    Constants used to indicate how file store requests are dispatched for
+    processing after they have been validated on the DXL message callback
+    thread.
+    """
+    #: Requests are queued to a pool of threads. Each request occupies a
+    #: thread from the pool until its segment has been stored and its
+    #: response sent. Requests for the same file are always queued to the
+    #: same thread.
+    THREADS = "threads"
+
+    #: Requests are held by an asyncio event loop, which runs the blocking
+    #: work for each request on a small executor. Requests for a file whose
+    #: previous request is still being processed wait on the event loop
+    #: rather than on a thread. This is only supported on Python 3.
+    ASYNCIO = "asyncio"
+
+    #: All of the supported engines
+    ALL = (THREADS, ASYNCIO)
+
+
+class ThreadPoolIoEngine(object):
+    """
+    Dispatches blocking tasks to a fixed set of threads, each of which
+    consumes tasks from its own queue.
+
+    Tasks submitted with the same key are always queued to the same thread,
+    so they run one at a time, in the order in which they were submitted.
+    For file store requests keyed by file id, the segments of a file which
+    a client sends in sequence are then stored in sequence, however many
+    threads are in the pool, rather than being raced against each other by
+    different threads and rejected for falling outside of a small reorder
+    window. Tasks without a key are queued to each of the threads in turn.
+    """
+
+    def __init__(self, thread_count, queue_size, thread_name_prefix):
+        """
+        Constructor parameters:
+
+        :param int thread_count: Number of threads on which tasks are run.
+        :param int queue_size: Maximum number of tasks which may be queued
+            for each thread. Once reached, :meth:`submit` blocks until the
+            thread takes the next task from its queue.
+        :param str thread_name_prefix: Prefix for the name of each thread.
+            The name of each thread is the prefix followed by the number of
+            the thread, for example, ``FileStoreIoPool-1``.
+        :raises ValueError: If the `thread_count` or `queue_size` is less
+            than 1.
+        """
+        if thread_count < 1:
+            raise ValueError(
+                "Thread count must be at least 1: '{}'".format(thread_count))
+        if queue_size < 1:
+            raise ValueError(
+                "Queue size must be at least 1: '{}'".format(queue_size))
+        self._queues = []
+        self._threads = []
+        self._next_queue_index = itertools.count()
+        for thread_index in range(thread_count):
+            task_queue = Queue(queue_size)
+            thread = threading.Thread(
+                target=self._run, args=(task_queue,),
+                name="{}-{}".format(thread_name_prefix, thread_index + 1))
+            thread.daemon = True
+            thread.start()
+            self._queues.append(task_queue)
+            self._threads.append(thread)
+
+    @staticmethod
+    def _run(task_queue):
+        """
+        Run the tasks from a queue until a task without a function is taken
+        from it.
+
+        :param Queue task_queue: The queue.
+        """
+        while True:
+            function, args = task_queue.get()
+            if function is None:
+                return
+            try:
+                function(*args)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error running I/O task")
+
+    def submit(self, key, function, *args):
+        """
+        Submit a task to be run on one of the threads.
+
+        :param key: Key of the task. Tasks with the same key run one at a
+            time, in the order in which they were submitted. If `None`, the
+            task may run concurrently with any other task.
+        :param function: The function to run.
+        :param args: The arguments to pass to the function.
+        """
+        if key is None:
+            queue_index = next(self._next_queue_index)
+        else:
+            queue_index = hash(key)
+        self._queues[queue_index % len(self._queues)].put((function, args))
+
+    def shutdown(self):
+        """
+        Wait for the tasks already submitted to complete and then stop the
+        threads.
+        """
+        for task_queue in self._queues:
+            task_queue.put((None, None))
+        for thread in self._threads:
+            thread.join()
+
+
+class AsyncioIoEngine(object):
+    """
+    Dispatches blocking tasks from an asyncio event loop, running on its own
+    thread, to a fixed-size executor.
+
+    Tasks submitted with the same key run one at a time, in the order in
+    which they were submitted. A task waiting on an earlier task for the
+    same key is held on the event loop and does not occupy an executor
+    thread. For file store requests keyed by file id, the executor threads
+    are then never blocked on the lock for a file held by another thread,
+    so a small number of threads can serve a large number of concurrent
+    transfers.
+
+    The event loop is driven through future callbacks rather than
+    coroutines so that this module can still be imported on Python 2, where
+    the engine is reported as unsupported.
+    """
+
+    def __init__(self, thread_count):
+        """
+        Constructor parameters:
+
+        :param int thread_count: Number of threads in the executor on which
+            tasks are run.
+        :raises ValueError: If asyncio is not available or the
+            `thread_count` is less than 1.
+        """
+        if asyncio is None:
+            raise ValueError(
+                "The '{}' I/O engine requires Python 3".format(
+                    IoEngine.ASYNCIO))
+        if thread_count < 1:
+            raise ValueError(
+                "Thread count must be at least 1: '{}'".format(thread_count))
+        self._executor = ThreadPoolExecutor(thread_count)
+        self._loop = asyncio.new_event_loop()
+        # Tasks waiting on an earlier task with the same key, keyed by key.
+        # Only accessed from the event loop thread.
+        self._waiting_tasks = {}
+        self._pending_count = 0
+        self._pending_condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run_loop,
+                                        name="FileStoreIoEngine")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def pending_count(self):
+        """
+        Number of tasks submitted which have not yet completed
+
+        :rtype: int
+        """
+        return self._pending_count
+
+    def _run_loop(self):
+        """
+        Run the event loop until stopped.
+        """
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def submit(self, key, function, *args):
+        """
+        Submit a task to be run on the executor. This does not block.
+
+        :param key: Key of the task. Tasks with the same key run one at a
+            time. If `None`, the task may run concurrently with any other
+            task.
+        :param function: The function to run.
+        :param args: The arguments to pass to the function.
+        """
+        with self._pending_condition:
+            self._pending_count += 1
+        self._loop.call_soon_threadsafe(self._enqueue, key, function, args)
+
+    def _enqueue(self, key, function, args):
+        """
+        Start a task, or hold it until the running task with the same key
+        completes. Invoked on the event loop thread.
+        """
+        if key is not None:
+            waiting_tasks = self._waiting_tasks.get(key)
+            if waiting_tasks is not None:
+                waiting_tasks.append((function, args))
+                return
+            self._waiting_tasks[key] = deque()
+        self._start(key, function, args)
+
+    def _start(self, key, function, args):
+        """
+        Run a task on the executor. Invoked on the event loop thread.
+        """
+        future = self._loop.run_in_executor(self._executor, function, *args)
+        future.add_done_callback(functools.partial(self._on_done, key))
+
+    def _on_done(self, key, future):
+        """
+        Start the next task waiting on a completed task. Invoked on the
+        event loop thread.
+        """
+        if not future.cancelled() and future.exception():
+            logger.error("Error running I/O task",
+                         exc_info=future.exception())
+        if key is not None:
+            waiting_tasks = self._waiting_tasks[key]
+            if waiting_tasks:
+                self._start(key, *waiting_tasks.popleft())
+            else:
+                del self._waiting_tasks[key]
+        with self._pending_condition:
+            self._pending_count -= 1
+            if not self._pending_count:
+                self._pending_condition.notify_all()
+
+    def shutdown(self):
+        """
+        Wait for the tasks already submitted to complete and then stop the
+        event loop and the executor.
+        """
+        with self._pending_condition:
+            while self._pending_count:
+                self._pending_condition.wait()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown()
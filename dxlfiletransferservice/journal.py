@@ -0,0 +1,207 @@
+from __future__ import absolute_import
+import json
+import logging
+import os
+import shutil
+
+from .constants import FileStoreProp
+from .hashing import MultiHasher
+from .util import contains_path_name_separators, write_at
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class FileJournalMixin(object):
+    """
+    Mixin for the :class:`dxlfiletransferservice.store.FileStoreManager`
+    which records the state of each file being stored in a journal in the
+    working directory of the file, and recovers the files left incomplete by
+    an earlier run of the store manager from their journals, so that their
+    transfers can be resumed.
+    """
+
+    #: Name of the journal, in a file's working directory, which records the
+    #: state needed to resume the transfer of the file after a restart
+    _JOURNAL_FILE_NAME = "journal"
+
+    def _get_journal_file_name(self, file_id):
+        """
+        Get the journal file name for the supplied file_id.
+
+        :param str file_id: Id to get the journal file name for.
+        :return: The journal file name.
+        :rtype: str
+        """
+        return os.path.join(self._get_working_file_dir(file_id),
+                            self._JOURNAL_FILE_NAME)
+
+    def _write_journal(self, file_entry):
+        """
+        Record the state of a file in its journal. The record is rewritten in
+        place at the start of the journal, so the journal stays a single
+        small record however many segments are received.
+
+        :param dict file_entry: The entry of the file.
+        """
+        file_hasher = file_entry[self._FILE_HASHER]
+        journal = {
+            FileStoreProp.ID: file_entry[FileStoreProp.ID],
+            FileStoreProp.SEGMENTS_RECEIVED:
+                file_entry[FileStoreProp.SEGMENTS_RECEIVED],
+            FileStoreProp.SEGMENT_OFFSET:
+                file_entry[self._FILE_CONTIGUOUS_SIZE],
+            FileStoreProp.WINDOW_SIZE: file_entry[self._FILE_WINDOW_SIZE],
+            FileStoreProp.HASH_TYPES: file_hasher.hash_types if file_hasher
+                                      else file_entry[self._FILE_HASH_TYPES]
+        }
+        expected_content = file_entry[self._FILE_EXPECTED_CONTENT]
+        if expected_content:
+            (file_hash, file_size), file_name = expected_content
+            journal[FileStoreProp.HASH_SHA256] = file_hash
+            journal[FileStoreProp.SIZE] = file_size
+            journal[FileStoreProp.NAME] = file_name
+        record = json.dumps(journal).encode("utf-8") + b"\n"
+
+        journal_handle = file_entry[self._FILE_JOURNAL_HANDLE]
+        if journal_handle is None:
+            journal_handle = os.open(
+                self._get_journal_file_name(file_entry[FileStoreProp.ID]),
+                os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0))
+            file_entry[self._FILE_JOURNAL_HANDLE] = journal_handle
+        # Pad a record shorter than the last one rather than truncating the
+        # journal. Trailing whitespace is ignored when the record is read.
+        record += b" " * (file_entry[self._FILE_JOURNAL_LENGTH] - len(record))
+        write_at(journal_handle, record, 0)
+        file_entry[self._FILE_JOURNAL_LENGTH] = len(record)
+
+    def _read_journal(self, file_id):
+        """
+        Read the journal for a file left over from an earlier run.
+
+        :param str file_id: Id of the file.
+        :return: The journal, or `None` if the journal is missing or is not
+            consistent with the working file.
+        :rtype: dict
+        """
+        try:
+            with open(self._get_journal_file_name(file_id), "rb") as journal:
+                journal = json.loads(journal.read().decode("utf-8"))
+            if journal[FileStoreProp.ID] != file_id or \
+                    os.path.getsize(self._get_working_file_name(file_id)) < \
+                    journal[FileStoreProp.SEGMENT_OFFSET]:
+                return None
+            MultiHasher(journal[FileStoreProp.HASH_TYPES])
+            return journal
+        except (OSError, IOError, ValueError, KeyError, TypeError):
+            return None
+
+    def _get_shard_subdirs(self):
+        """
+        Get the names of the subdirectories of the shared working directory
+        which hold the files being transferred for a shard of file ids (see
+        the `working_subdir` parameter of the constructor), as opposed to the
+        working directory of a single file.
+
+        :return: The names of the subdirectories.
+        :rtype: list
+        """
+        return [name for name in os.listdir(self._working_root_dir)
+                if name.isdigit() and os.path.isdir(
+                    os.path.join(self._working_root_dir, name)) and
+                not os.path.exists(os.path.join(
+                    self._working_root_dir, name,
+                    self._WORKING_BASE_FILE_NAME))]
+
+    def _rehome_orphaned_files(self):
+        """
+        Move the working directories of incomplete files in the shard of file
+        ids handled by the store manager which were left under the working
+        directory for another shard, for example, by an earlier run with a
+        different number of shards, into the working directory of the store
+        manager, so that they are recovered along with the files already
+        there. The subdirectories of shards which are no longer configured
+        are removed once every file has been moved out of them.
+        """
+        shard_subdirs = self._get_shard_subdirs()
+        source_dirs = [os.path.join(self._working_root_dir, name)
+                       for name in shard_subdirs]
+        if self._working_dir != self._working_root_dir:
+            source_dirs.remove(self._working_dir)
+            source_dirs.append(self._working_root_dir)
+            stale_subdirs = [name for name in shard_subdirs
+                             if int(name) >= self._file_id_shard_count]
+        else:
+            stale_subdirs = shard_subdirs
+
+        for source_dir in source_dirs:
+            for file_id in os.listdir(source_dir):
+                # Skip the temporary directories for batches, whose names
+                # cannot be mistaken for a file id
+                if contains_path_name_separators(file_id) or \
+                        source_dir == self._working_root_dir and \
+                        file_id in shard_subdirs:
+                    continue
+                if not self._is_file_id_in_shard(file_id) or \
+                        os.path.exists(self._get_working_file_dir(file_id)):
+                    continue
+                logger.info("Moving incomplete file id '%s' from '%s'",
+                            file_id, source_dir)
+                try:
+                    os.rename(os.path.join(source_dir, file_id),
+                              self._get_working_file_dir(file_id))
+                except OSError:
+                    # Moved concurrently by another store manager
+                    pass
+
+        for name in stale_subdirs:
+            try:
+                os.rmdir(os.path.join(self._working_root_dir, name))
+                logger.info("Removed working dir for unconfigured shard: %s",
+                            name)
+            except OSError:
+                # Still holds files for shards handled by store managers
+                # which have not started yet
+                pass
+
+    def _recover_incomplete_files(self):
+        """
+        Recover entries for file storage operations which did not complete
+        before the store manager was last stopped, so that their transfers
+        can be resumed. The working files for operations which cannot be
+        resumed are purged.
+        """
+        shard_subdirs = self._get_shard_subdirs() \
+            if self._working_dir == self._working_root_dir else []
+        for incomplete_file_id in os.listdir(self._working_dir):
+            if incomplete_file_id in shard_subdirs or \
+                    not self._is_file_id_in_shard(incomplete_file_id):
+                continue
+            file_work_dir = self._get_working_file_dir(incomplete_file_id)
+            journal = None if contains_path_name_separators(
+                incomplete_file_id) else self._read_journal(incomplete_file_id)
+            if not journal:
+                logger.info("Purging content for incomplete file id: '%s'",
+                            incomplete_file_id)
+                shutil.rmtree(file_work_dir)
+                continue
+
+            logger.info(
+                "Recovering incomplete file id '%s' at segment '%d'",
+                incomplete_file_id, journal[FileStoreProp.SEGMENTS_RECEIVED])
+            file_entry = self._create_file_entry(incomplete_file_id)
+            file_entry[FileStoreProp.SEGMENTS_RECEIVED] = \
+                journal[FileStoreProp.SEGMENTS_RECEIVED]
+            file_entry[self._FILE_CONTIGUOUS_SIZE] = \
+                journal[FileStoreProp.SEGMENT_OFFSET]
+            file_entry[self._FILE_WINDOW_SIZE] = \
+                journal[FileStoreProp.WINDOW_SIZE]
+            file_entry[self._FILE_HASH_TYPES] = \
+                journal[FileStoreProp.HASH_TYPES]
+            self._get_shard(incomplete_file_id).files[incomplete_file_id] = \
+                file_entry
+            self._active_file_count += 1
+            if FileStoreProp.HASH_SHA256 in journal:
+                self._set_expected_content(
+                    file_entry, journal[FileStoreProp.HASH_SHA256],
+                    journal[FileStoreProp.SIZE], journal[FileStoreProp.NAME])
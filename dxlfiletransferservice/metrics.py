@@ -0,0 +1,366 @@
+from __future__ import absolute_import
+import bisect
+import logging
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+#: Clock used to measure latencies. The monotonic clock is not available on
+#: Python 2.
+monotonic = getattr(time, "monotonic", time.time)
+
+#: Default upper bounds, in seconds, of the buckets of a latency histogram
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Metric(object):
+    """
+    Base class for a metric held in a :class:`MetricsRegistry`.
+    """
+    #: Type of the metric in the Prometheus exposition format
+    TYPE = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+
+    def to_value(self):
+        """
+        Get a snapshot of the value of the metric.
+        """
+        raise NotImplementedError()
+
+    def to_prometheus_lines(self):
+        """
+        Get the samples for the metric in the Prometheus exposition format.
+
+        :rtype: list
+        """
+        return ["{} {}".format(self.name, _format_number(self.to_value()))]
+
+
+class Counter(_Metric):
+    """
+    Metric whose value only increases, for example, a count of requests.
+    """
+    TYPE = "counter"
+
+    def __init__(self, name, description):
+        super(Counter, self).__init__(name, description)
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """
+        Increase the value of the counter.
+
+        :param amount: Amount by which to increase the value.
+        """
+        with self._lock:
+            self._value += amount
+
+    def to_value(self):
+        return self._value
+
+
+class Gauge(_Metric):
+    """
+    Metric whose value is read, when the metrics are collected, from a
+    function. This is used to expose state which is already tracked
+    elsewhere, for example, the depth of a queue, without any cost on the
+    path which updates the state. The value of a gauge with several
+    functions, for example, one for each of several store managers, is the
+    sum of their values.
+    """
+
+    def __init__(self, name, description, function, metric_type="gauge"):
+        super(Gauge, self).__init__(name, description)
+        self._functions = [function]
+        self.TYPE = metric_type  # pylint: disable=invalid-name
+
+    def add_function(self, function):
+        """
+        Add a function whose value is included in the value of the gauge.
+
+        :param function: Function, taking no arguments, which returns a
+            value.
+        """
+        self._functions.append(function)
+
+    def to_value(self):
+        return sum(function() for function in self._functions)
+
+
+class Histogram(_Metric):
+    """
+    Metric which counts observed values, for example, latencies, into
+    buckets with fixed upper bounds, along with the count and sum of all of
+    the observed values.
+    """
+    TYPE = "histogram"
+
+    def __init__(self, name, description, buckets=DEFAULT_LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, description)
+        self._buckets = tuple(sorted(buckets))
+        # The last count is for values above the largest bucket bound
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Record an observed value.
+
+        :param value: The value.
+        """
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def observe_since(self, start_time):
+        """
+        Record the time elapsed since a start time as an observed value.
+
+        :param float start_time: Start time, as read from :func:`monotonic`.
+        """
+        self.observe(monotonic() - start_time)
+
+    def _snapshot(self):
+        """
+        Get a consistent snapshot of the counts and sum.
+
+        :return: The cumulative count for each bucket, including the final
+            unbounded bucket, and the sum of the observed values.
+        :rtype: tuple
+        """
+        with self._lock:
+            counts = list(self._counts)
+            value_sum = self._sum
+        cumulative_counts = []
+        total = 0
+        for count in counts:
+            total += count
+            cumulative_counts.append(total)
+        return cumulative_counts, value_sum
+
+    def to_value(self):
+        cumulative_counts, value_sum = self._snapshot()
+        bounds = [_format_number(bound) for bound in self._buckets] + ["+Inf"]
+        return {
+            "count": cumulative_counts[-1],
+            "sum": value_sum,
+            "buckets": dict(zip(bounds, cumulative_counts))
+        }
+
+    def to_prometheus_lines(self):
+        cumulative_counts, value_sum = self._snapshot()
+        bounds = [_format_number(bound) for bound in self._buckets] + ["+Inf"]
+        lines = ['{}_bucket{{le="{}"}} {}'.format(self.name, bound, count)
+                 for bound, count in zip(bounds, cumulative_counts)]
+        lines.append("{}_sum {}".format(self.name, _format_number(value_sum)))
+        lines.append("{}_count {}".format(self.name, cumulative_counts[-1]))
+        return lines
+
+
+def _format_number(value):
+    """
+    Format a number for the Prometheus exposition format.
+
+    :param value: The number.
+    :rtype: str
+    """
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MetricsRegistry(object):
+    """
+    Registry of the metrics collected by the service.
+
+    Updating a metric takes a single uncontended lock, so metrics can be
+    updated on every request without a noticeable cost. Metrics whose values
+    are already tracked elsewhere are registered as functions which are only
+    invoked when the metrics are collected.
+    """
+
+    #: Prefix for the names of all of the metrics
+    PREFIX = "dxlfiletransfer_"
+
+    def __init__(self):
+        self._metrics = []
+        self._metrics_by_name = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        """
+        Register a metric, or return the metric already registered with the
+        same name.
+
+        :param _Metric metric: The metric.
+        :return: The registered metric.
+        """
+        with self._lock:
+            registered_metric = self._metrics_by_name.get(metric.name)
+            if registered_metric:
+                return registered_metric
+            self._metrics.append(metric)
+            self._metrics_by_name[metric.name] = metric
+            return metric
+
+    def counter(self, name, description):
+        """
+        Get the counter with the supplied name, registering it if needed.
+
+        :param str name: Name of the counter, without the registry prefix.
+        :param str description: Description of the counter.
+        :rtype: Counter
+        """
+        return self._register(Counter(self.PREFIX + name, description))
+
+    def gauge(self, name, description, function, metric_type="gauge"):
+        """
+        Register a metric whose value is read from a function when the
+        metrics are collected. If a gauge with the same name is already
+        registered, the function is added to it, so that its value is the
+        sum of the values of its functions.
+
+        :param str name: Name of the metric, without the registry prefix.
+        :param str description: Description of the metric.
+        :param function: Function, taking no arguments, which returns the
+            current value of the metric.
+        :param str metric_type: Type of the metric in the Prometheus
+            exposition format. This may be "counter" for a function which
+            returns a value which only increases.
+        :rtype: Gauge
+        """
+        gauge = Gauge(self.PREFIX + name, description, function,
+                      metric_type)
+        registered_gauge = self._register(gauge)
+        if registered_gauge is not gauge:
+            registered_gauge.add_function(function)
+        return registered_gauge
+
+    def histogram(self, name, description, buckets=DEFAULT_LATENCY_BUCKETS):
+        """
+        Get the histogram with the supplied name, registering it if needed.
+
+        :param str name: Name of the histogram, without the registry prefix.
+        :param str description: Description of the histogram.
+        :param tuple buckets: Upper bounds of the buckets of the histogram.
+            If not specified, bounds suitable for latencies, in seconds, are
+            used.
+        :rtype: Histogram
+        """
+        return self._register(Histogram(self.PREFIX + name, description,
+                                        buckets))
+
+    def to_dict(self):
+        """
+        Get a snapshot of the values of all of the metrics.
+
+        :return: The values, keyed by metric name. The value of a histogram
+            is a dictionary with its `count`, `sum`, and cumulative
+            `buckets`.
+        :rtype: dict
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        return {metric.name: metric.to_value() for metric in metrics}
+
+    def to_prometheus_text(self):
+        """
+        Get a snapshot of the values of all of the metrics in the Prometheus
+        text exposition format.
+
+        :rtype: str
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append("# HELP {} {}".format(metric.name,
+                                               metric.description))
+            lines.append("# TYPE {} {}".format(metric.name, metric.TYPE))
+            lines.extend(metric.to_prometheus_lines())
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsHttpServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server which serves each request on its own thread.
+    """
+    daemon_threads = True
+
+
+class MetricsHttpEndpoint(object):
+    """
+    Local HTTP endpoint which serves the metrics in a registry, in the
+    Prometheus text exposition format, from a background thread.
+    """
+
+    #: Path from which the metrics are served
+    PATH = "/metrics"
+
+    def __init__(self, registry, port, host="127.0.0.1"):
+        """
+        Constructor parameters:
+
+        :param MetricsRegistry registry: The registry whose metrics to serve.
+        :param int port: Port to listen on. If 0, a free port is chosen.
+        :param str host: Address of the interface to listen on.
+        """
+        endpoint_path = self.PATH
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                if self.path.split("?")[0] != endpoint_path:
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # pylint: disable=redefined-builtin
+            def log_message(self, format, *args):
+                logger.debug("Metrics endpoint: " + format, *args)
+
+        self._server = _MetricsHttpServer((host, port), _Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="MetricsHttpEndpoint")
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("Serving metrics at http://%s:%d%s", host, self.port,
+                    self.PATH)
+
+    @property
+    def port(self):
+        """
+        Port on which the endpoint is listening
+
+        :rtype: int
+        """
+        return self._server.server_address[1]
+
+    def stop(self):
+        """
+        Stop serving the metrics.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -0,0 +1,249 @@
+from __future__ import absolute_import
+import logging
+
+from dxlfiletransferclient.constants import FileStoreResultProp
+from .admission import ServiceBusyError
+from .constants import FileStoreProp
+from .metrics import monotonic
+from .storeresult import FileStoreSegmentResult
+from .util import preallocate, supports_positional_writes
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class ParallelStoreMixin(object):
+    """
+    Mixin for the :class:`dxlfiletransferservice.store.FileStoreManager`
+    which stores the segments of a file whose size and segment count are
+    declared up front. The segments may be received in any order and are
+    written concurrently into a working file preallocated to the declared
+    size. The hashes for the file are computed in a single pass over the
+    working file once all of its segments have been received.
+    """
+
+    def _claim_parallel_segment(self, file_entry, segment_params, segment):
+        """
+        Validate a segment of a file stored in parallel and reserve its
+        segment number and range of the working file, declaring the segment
+        count and size for the file if this is the first segment processed
+        for it. The lock for the file must be held.
+
+        :param dict file_entry: The entry of the file.
+        :param dict segment_params: The parameters for the segment.
+        :param segment: Bytes of the segment, as `bytes` or a
+            :class:`memoryview`.
+        :return: Offset in the file at which to write the segment.
+        :rtype: int
+        :raises ValueError: If the segment is not valid for the file.
+        :raises ServiceBusyError: If there is not enough room left under the
+            maximum working size to allocate the space for the size declared
+            for the file.
+        """
+        file_id = file_entry[FileStoreProp.ID]
+        segment_count = segment_params[FileStoreProp.SEGMENT_COUNT]
+        file_size = segment_params[FileStoreProp.SIZE]
+        if file_entry[self._FILE_SEGMENT_COUNT] is None:
+            if segment_count is None or file_size is None:
+                raise ValueError(
+                    "Segment count and file size must be declared with the "
+                    "first segment for file id '{}'".format(file_id))
+            if file_entry[FileStoreProp.SEGMENTS_RECEIVED] or \
+                    file_entry[self._FILE_PENDING_SEGMENTS]:
+                raise ValueError(
+                    "Segment count must be declared before any segments are "
+                    "received for file id '{}'".format(file_id))
+            self._check_parallel_file_size(file_entry, file_size)
+            preallocate(file_entry[self._FILE_HANDLE], file_size)
+            file_entry[self._FILE_SEGMENT_COUNT] = segment_count
+            file_entry[self._FILE_SIZE] = file_size
+            logger.debug("Storing '%d' segments in parallel for file id: '%s'",
+                         segment_count, file_id)
+        elif segment_count not in (None,
+                                   file_entry[self._FILE_SEGMENT_COUNT]) or \
+                file_size not in (None, file_entry[self._FILE_SIZE]):
+            raise ValueError(
+                "Segment count and size do not match those declared for "
+                "file id '{}'".format(file_id))
+
+        segment_count = file_entry[self._FILE_SEGMENT_COUNT]
+        segment_number = segment_params[FileStoreProp.SEGMENT_NUMBER]
+        if segment_number is None or segment_number < 1 or \
+                segment_number > segment_count:
+            raise ValueError(
+                "Unexpected segment. Expected: '{}'. Received: '{}'".format(
+                    "1-{}".format(segment_count), segment_number))
+        pending_segments = file_entry[self._FILE_PENDING_SEGMENTS]
+        if segment_number in pending_segments:
+            raise ValueError(
+                "Segment '{}' already received for file id '{}'".format(
+                    segment_number, file_id))
+
+        segment_offset = segment_params[FileStoreProp.SEGMENT_OFFSET]
+        if segment_offset is None:
+            if segment_number != 1:
+                raise ValueError(
+                    "Offset must be specified for segment '{}'".format(
+                        segment_number))
+            segment_offset = 0
+        segment_length = len(segment) if segment else 0
+        if segment_offset + segment_length > file_entry[self._FILE_SIZE]:
+            raise ValueError(
+                "Segment '{}' extends beyond the end of file id '{}'".format(
+                    segment_number, file_id))
+
+        pending_segments[segment_number] = (segment_offset, segment_length)
+        file_entry[self._FILE_WRITES_IN_FLIGHT] += 1
+        return segment_offset
+
+    def _check_parallel_file_size(self, file_entry, file_size):
+        """
+        Check that the space for the size declared for a file stored in
+        parallel may be allocated in the working directory, canceling the
+        store request for the file if not. The lock for the file must be
+        held.
+
+        :param dict file_entry: The entry of the file.
+        :param int file_size: The size declared for the file.
+        :raises ValueError: If the size is negative or larger than the
+            maximum parallel file size.
+        :raises ServiceBusyError: If there is not enough room left under the
+            maximum working size for the file.
+        """
+        file_id = file_entry[FileStoreProp.ID]
+        if not 0 <= file_size <= self._max_parallel_file_size:
+            self._complete_file(file_entry, FileStoreResultProp.CANCEL)
+            raise ValueError(
+                "Size '{}' declared for file id '{}' must be from 0 to "
+                "{}".format(file_size, file_id,
+                            self._max_parallel_file_size))
+        if self._max_working_size:
+            working_size = sum(self._get_working_sizes(
+                self._get_file_entries()).values())
+            if working_size + file_size > self._max_working_size:
+                self._complete_file(file_entry, FileStoreResultProp.CANCEL)
+                raise ServiceBusyError(
+                    "Service busy: '{}' bytes already in the working "
+                    "directory, no room for '{}' bytes declared for file id "
+                    "'{}'".format(working_size, file_size, file_id))
+
+    def _complete_parallel_file_if_ready(self, file_entry):
+        """
+        Complete a store request for a file stored in parallel if all of the
+        segments for the file have now been received. The segments must
+        cover the declared size of the file exactly, with no gaps or
+        overlaps. The hashes for the file are then computed in a single pass
+        over the working file. The lock for the file must be held.
+
+        :param dict file_entry: The entry of the file to complete.
+        :return: The result of the store operation,
+            :const:`dxlfiletransferclient.constants.FileStoreResultProp.NONE`
+            if the file is not ready to be completed yet.
+        :rtype: str
+        :raises ValueError: If the segments do not cover the file or the
+            stored size/hash does not match the expected size/hash for the
+            file.
+        """
+        pending_store = file_entry[self._FILE_PENDING_STORE]
+        if not pending_store or file_entry[FileStoreProp.SEGMENTS_RECEIVED] \
+                != file_entry[self._FILE_SEGMENT_COUNT]:
+            return FileStoreResultProp.NONE
+
+        covered_size = 0
+        for segment_offset, segment_length in sorted(
+                file_entry[self._FILE_PENDING_SEGMENTS].values()):
+            if segment_offset != covered_size:
+                break
+            covered_size += segment_length
+        if covered_size != file_entry[self._FILE_SIZE]:
+            self._complete_file(file_entry, FileStoreResultProp.CANCEL)
+            raise ValueError(
+                "File storage error for file '{}': Segments do not cover the "
+                "file. First gap or overlap at offset: '{}'.".format(
+                    file_entry[FileStoreProp.ID], covered_size))
+
+        hash_start_time = monotonic()
+        self._hash_file_range(file_entry[self._FILE_HANDLE],
+                              file_entry[self._FILE_HASHER], 0, covered_size)
+        self._hash_seconds.observe_since(hash_start_time)
+        file_entry[self._FILE_CONTIGUOUS_SIZE] = covered_size
+        return self._complete_file(file_entry, FileStoreResultProp.STORE,
+                                   *pending_store[1:])
+
+    def _store_parallel_segment(self, file_entry, segment_params, segment):
+        """
+        Store a segment of a file stored in parallel. The segment is written
+        to the working file without holding the lock for the file, so that
+        segments of the same file received concurrently are written
+        concurrently. Where the platform does not support positional writes
+        (see :func:`dxlfiletransferservice.util.supports_positional_writes`),
+        the lock for the file is held for the write instead, since each write
+        moves the position of the file handle shared by the threads.
+
+        :param dict file_entry: The entry of the file.
+        :param dict segment_params: The parameters for the segment.
+        :param segment: Bytes of the segment, as `bytes` or a
+            :class:`memoryview`.
+        :return: The result from the storage operation.
+        :rtype: FileStoreSegmentResult
+        :raises ValueError: If the segment is not valid for the file.
+        """
+        file_id = file_entry[FileStoreProp.ID]
+        segment_number = segment_params[FileStoreProp.SEGMENT_NUMBER]
+        requested_file_result = segment_params[FileStoreProp.RESULT]
+        hash_types = segment_params[FileStoreProp.HASH_TYPES]
+
+        with file_entry[self._FILE_LOCK]:
+            if file_entry[self._FILE_CLOSED]:
+                raise ValueError(
+                    "File id '{}' is no longer active".format(file_id))
+            early_result = self._complete_file_early(file_entry,
+                                                     requested_file_result)
+            if early_result:
+                return early_result
+            segment_offset = self._claim_parallel_segment(
+                file_entry, segment_params, segment)
+            # The hashes are computed when the file is completed, but the
+            # hash types for the file are fixed by the first segment.
+            file_hasher = self._get_file_hasher(file_entry, hash_types)
+            if requested_file_result:
+                file_entry[self._FILE_PENDING_STORE] = (
+                    file_entry[self._FILE_SEGMENT_COUNT],
+                    segment_params[FileStoreProp.NAME],
+                    segment_params[FileStoreProp.SIZE],
+                    segment_params[FileStoreProp.HASHES])
+
+        logger.debug("Storing segment '%d' at offset '%d' for file id: '%s'",
+                     segment_number, segment_offset, file_id)
+        write_error = True
+        try:
+            file_handle = file_entry[self._FILE_HANDLE]
+            if segment and supports_positional_writes():
+                self._write_segment(file_handle, segment, segment_offset)
+            elif segment:
+                with file_entry[self._FILE_LOCK]:
+                    self._write_segment(file_handle, segment, segment_offset)
+            write_error = False
+        finally:
+            with file_entry[self._FILE_LOCK]:
+                file_entry[self._FILE_WRITES_IN_FLIGHT] -= 1
+                file_entry[self._FILE_WRITES_DONE].notify_all()
+                if write_error:
+                    # Allow the segment to be sent again
+                    file_entry[self._FILE_PENDING_SEGMENTS].pop(
+                        segment_number, None)
+
+        with file_entry[self._FILE_LOCK]:
+            if file_entry[self._FILE_CLOSED]:
+                raise ValueError(
+                    "File id '{}' is no longer active".format(file_id))
+            file_entry[FileStoreProp.SEGMENTS_RECEIVED] += 1
+            file_result = self._complete_parallel_file_if_ready(file_entry)
+            return FileStoreSegmentResult(
+                file_id,
+                file_entry[FileStoreProp.SEGMENTS_RECEIVED],
+                file_result,
+                hashes=file_hasher.hexdigests()
+                if file_result == FileStoreResultProp.STORE else None,
+                hash_types=file_hasher.hash_types if hash_types else None
+            )
@@ -0,0 +1,245 @@
+from __future__ import absolute_import
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from .metrics import monotonic
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class ProfileAction(object):
+    """
+    Constants used to indicate the `action` requested of the profiler.
+    """
+    #: Start profiling for a number of seconds
+    START = "start"
+
+    #: Stop profiling early and write the profile gathered so far
+    STOP = "stop"
+
+    #: Report whether profiling is running, without changing it
+    STATUS = "status"
+
+    #: All of the supported actions
+    ALL = (START, STOP, STATUS)
+
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler which can be started and stopped while the service
+    is running.
+
+    While running, a background thread samples the stack of every other
+    thread in the process (including the DXL message callback threads and
+    the I/O thread pool) at a fixed interval. No hooks are installed in the
+    sampled threads, so the overhead is confined to the sampling thread and
+    nothing is traced while the profiler is idle.
+
+    When profiling stops, the samples are written to a file in the profile
+    directory in the "folded" stack format, one line per distinct stack
+    with the number of samples in which it was seen, for example::
+
+        FileStoreIoPool-1;_run (ioengine.py:105);_store (...) 42
+
+    The format is accepted by common flame graph tools, for example,
+    ``flamegraph.pl`` and speedscope.
+    """
+
+    #: Default number of seconds to profile for
+    DEFAULT_DURATION = 30
+
+    #: Maximum number of seconds to profile for
+    MAX_DURATION = 3600
+
+    #: Default number of seconds between samples
+    DEFAULT_SAMPLE_INTERVAL = 0.01
+
+    def __init__(self, profile_dir, sample_interval=None):
+        """
+        Constructor parameters:
+
+        :param str profile_dir: Directory in which to write profile files. If
+            the directory does not already exist, it is created when the
+            first profile file is written.
+        :param float sample_interval: Number of seconds between samples. If
+            not specified, this defaults to 0.01.
+        :raises ValueError: If the `sample_interval` is not positive.
+        """
+        if sample_interval is None:
+            sample_interval = self.DEFAULT_SAMPLE_INTERVAL
+        if sample_interval <= 0:
+            raise ValueError(
+                "Sample interval must be positive: '{}'".format(
+                    sample_interval))
+        self._profile_dir = os.path.abspath(profile_dir)
+        self._sample_interval = sample_interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = None
+        self._profile_file_name = None
+
+    @property
+    def profile_dir(self):
+        """
+        Directory in which profile files are written
+
+        :rtype: str
+        """
+        return self._profile_dir
+
+    @property
+    def is_running(self):
+        """
+        Whether profiling is running
+
+        :rtype: bool
+        """
+        return self._thread is not None
+
+    def get_status(self):
+        """
+        Get the status of the profiler.
+
+        :return: A dictionary with whether profiling is ``running`` and the
+            name of the ``profile_file`` being gathered, or most recently
+            written.
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "running": self._thread is not None,
+                "profile_file": self._profile_file_name
+            }
+
+    def start(self, duration=None):
+        """
+        Start profiling on a background thread.
+
+        :param float duration: Number of seconds after which to stop
+            profiling and write the profile file. If not specified, this
+            defaults to 30.
+        :return: The name of the profile file which will be written.
+        :rtype: str
+        :raises ValueError: If profiling is already running or the
+            `duration` is not positive or exceeds the maximum.
+        """
+        if duration is None:
+            duration = self.DEFAULT_DURATION
+        if duration <= 0 or duration > self.MAX_DURATION:
+            raise ValueError(
+                "Profile duration must be greater than 0 and at most {} "
+                "seconds: '{}'".format(self.MAX_DURATION, duration))
+        with self._lock:
+            if self._thread:
+                raise ValueError(
+                    "Profiling is already running, writing to: '{}'".format(
+                        self._profile_file_name))
+            self._profile_file_name = os.path.join(
+                self._profile_dir,
+                "profile-{}-{}.folded".format(
+                    time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(duration, self._stopped, self._profile_file_name),
+                name="SamplingProfiler")
+            self._thread.daemon = True
+            self._thread.start()
+        logger.info("Profiling for %s seconds to: '%s'", duration,
+                    self._profile_file_name)
+        return self._profile_file_name
+
+    def stop(self):
+        """
+        Stop profiling, if it is running, waiting for the profile file to be
+        written.
+
+        :return: The name of the profile file written, or `None` if
+            profiling was not running.
+        :rtype: str
+        """
+        with self._lock:
+            thread = self._thread
+            if not thread:
+                return None
+            self._stopped.set()
+            profile_file_name = self._profile_file_name
+        thread.join()
+        return profile_file_name
+
+    def _run(self, duration, stopped, profile_file_name):
+        """
+        Sample the stacks of the threads in the process until stopped or
+        until the duration has elapsed, and then write the profile file.
+
+        :param float duration: Number of seconds to profile for.
+        :param threading.Event stopped: Event set to stop profiling early.
+        :param str profile_file_name: Name of the profile file to write.
+        """
+        stacks = Counter()
+        sample_count = 0
+        own_thread_id = threading.current_thread().ident
+        end_time = monotonic() + duration
+        try:
+            while not stopped.wait(self._sample_interval) and \
+                    monotonic() < end_time:
+                self._sample(stacks, own_thread_id)
+                sample_count += 1
+            self._write_profile(profile_file_name, stacks)
+            logger.info("Wrote profile with %d samples to: '%s'",
+                        sample_count, profile_file_name)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Error profiling to: '%s'", profile_file_name)
+        finally:
+            with self._lock:
+                if self._stopped is stopped:
+                    self._thread = None
+
+    @staticmethod
+    def _sample(stacks, own_thread_id):
+        """
+        Add the current stack of each thread, other than the sampling
+        thread, to the counts of stacks.
+
+        :param collections.Counter stacks: Number of samples for each
+            stack, keyed by the stack in the folded format.
+        :param int own_thread_id: Identifier of the sampling thread.
+        """
+        thread_names = {thread.ident: thread.name
+                        for thread in threading.enumerate()}
+        # pylint: disable=protected-access
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread_id:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append("{} ({}:{})".format(
+                    code.co_name, os.path.basename(code.co_filename),
+                    code.co_firstlineno))
+                frame = frame.f_back
+            frames.append(thread_names.get(thread_id, str(thread_id)))
+            frames.reverse()
+            stacks[";".join(frames)] += 1
+
+    def _write_profile(self, profile_file_name, stacks):
+        """
+        Write the counts of stacks to a profile file. The file is written
+        under a temporary name and then renamed, so that a partially
+        written profile is never visible.
+
+        :param str profile_file_name: Name of the profile file.
+        :param collections.Counter stacks: Number of samples for each stack.
+        """
+        if not os.path.exists(self._profile_dir):
+            os.makedirs(self._profile_dir)
+        temp_file_name = profile_file_name + ".tmp"
+        with open(temp_file_name, "w") as profile_file:
+            for stack, count in stacks.most_common():
+                profile_file.write("{} {}\n".format(stack, count))
+        os.rename(temp_file_name, profile_file_name)
@@ -0,0 +1,87 @@
+from __future__ import absolute_import
+import logging
+import threading
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class FileReapResult(object):
+    """
+    Class which holds the result of a pass over the files being stored to
+    evict abandoned transfers.
+    """
+    def __init__(self, files_reaped=0, bytes_reclaimed=0):
+        self._files_reaped = files_reaped
+        self._bytes_reclaimed = bytes_reclaimed
+
+    @property
+    def files_reaped(self):
+        """
+        Number of transfers evicted
+
+        :rtype: int
+        """
+        return self._files_reaped
+
+    @property
+    def bytes_reclaimed(self):
+        """
+        Number of bytes of working files removed for the evicted transfers
+
+        :rtype: int
+        """
+        return self._bytes_reclaimed
+
+    def to_dict(self):
+        """
+        Returns a dictionary representation of the result.
+
+        :rtype: dict
+        """
+        return {
+            "files_reaped": self._files_reaped,
+            "bytes_reclaimed": self._bytes_reclaimed
+        }
+
+
+class WorkingDirReaper(object):
+    """
+    Periodically invokes a function which evicts abandoned transfers from
+    the working directory, on a background thread, until stopped.
+    """
+
+    def __init__(self, reap_function, interval):
+        """
+        Constructor parameters:
+
+        :param reap_function: Function, taking no arguments and returning a
+            :class:`FileReapResult`, which evicts abandoned transfers.
+        :param float interval: Number of seconds to wait between invocations
+            of the `reap_function`.
+        """
+        self._reap_function = reap_function
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name="FileStoreReaper")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        """
+        Invoke the reap function every interval until stopped.
+        """
+        while not self._stopped.wait(self._interval):
+            try:
+                self._reap_function()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error reaping working directory")
+
+    def stop(self):
+        """
+        Stop the background thread, waiting for any pass in progress to
+        finish.
+        """
+        self._stopped.set()
+        self._thread.join()
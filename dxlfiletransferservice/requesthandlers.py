@@ -1,21 +1,80 @@
 from __future__ import absolute_import
+import itertools
 import logging
 
 from dxlclient.callbacks import RequestCallback
 from dxlclient.message import Response, ErrorResponse
 from dxlbootstrap.util import MessageUtils
-from dxlfiletransferclient.store import FileStoreManager
+from .admission import AdmissionController, ServiceBusyError
+from .constants import FileStoreErrorCode, FileStoreProp, ProfileProp
+from .ioengine import AsyncioIoEngine, IoEngine, ThreadPoolIoEngine
+from .metrics import MetricsRegistry, monotonic
+from .profiler import ProfileAction
+from .settings import FileStoreSettings
+from .sharding import get_file_id_shard, get_shard_topic
+from .store import FileStoreManager
 
 # Configure local logger
 logger = logging.getLogger(__name__)
 
 
+def _create_error_response(request, ex):
+    """
+    Create an error response for a request which could not be processed.
+
+    :param dxlclient.message.Request request: The request message
+    :param Exception ex: The error which occurred
+    :return: The error response. The error code is
+        :const:`dxlfiletransferservice.constants.FileStoreErrorCode.BUSY` if
+        the request was rejected because the service is busy.
+    :rtype: dxlclient.message.ErrorResponse
+    """
+    return ErrorResponse(
+        request,
+        error_code=FileStoreErrorCode.BUSY
+        if isinstance(ex, ServiceBusyError) else FileStoreErrorCode.GENERAL,
+        error_message=MessageUtils.encode(str(ex)))
+
+
 class FileStoreRequestCallback(RequestCallback):
     """
     Request callback used to process file storage requests.
+
+    If an I/O thread count is specified, the DXL message callback thread
+    only validates each request. Writing and hashing the segment contained in
+    the request, and sending the response, are then performed on a dedicated
+    I/O thread pool so that the threads which receive messages from the DXL
+    fabric never block on disk access or hashing. The requests for a file
+    are always queued to the same thread of the pool, so segments which a
+    client sends in sequence are stored in sequence. With the
+    :const:`dxlfiletransferservice.ioengine.IoEngine.ASYNCIO` I/O engine,
+    requests are instead held by an asyncio event loop which runs them on a
+    small executor, one request at a time for each file, so that requests
+    waiting on an earlier request for the same file do not occupy a thread.
+
+    Instead of a segment of a file, a request may contain a batch of small
+    files, along with a manifest listing the name, size, and hashes of each
+    file. All of the files in the batch are stored, each with its own
+    result, in a single invocation of the store manager (see
+    :meth:`dxlfiletransferservice.store.FileStoreManager.store_parsed_batch`).
+
+    Requests are subject to admission control. A request which arrives while
+    the limit on pending requests or on bytes in flight has been reached, or
+    which would start storing a new file while the limit on active files has
+    been reached, is rejected with an error response whose code is
+    :const:`dxlfiletransferservice.constants.FileStoreErrorCode.BUSY`. The
+    client may send the request again after a backoff. Transfers already in
+    progress are unaffected by the limit on active files.
+
+    The throughput of the service, the latency of each stage of processing a
+    request (waiting for an I/O thread, storing the segment, and sending the
+    response), and the depth of the queue of pending requests are recorded in
+    a :class:`dxlfiletransferservice.metrics.MetricsRegistry`.
     """
 
-    def __init__(self, dxl_client, storage_dir, working_dir=None):
+    def __init__(self, dxl_client, storage_dir, working_dir=None,
+                 settings=None, metrics_registry=None, file_id_shard=None,
+                 file_id_shard_count=None, working_subdir=None):
         """
         Constructor parameters:
 
@@ -29,12 +88,145 @@ class FileStoreRequestCallback(RequestCallback):
             transferred to the `storage_dir`. If not specified, this defaults
             to ".workdir" under the value specified for the `storage_dir`
             parameter.
+        :param dxlfiletransferservice.settings.FileStoreSettings settings:
+            The settings for storing files, including the I/O threads on
+            which requests are processed and the limits for admitting
+            requests. If not specified, the default settings are used, with
+            which requests are processed entirely on the thread which invokes
+            the callback.
+        :param dxlfiletransferservice.metrics.MetricsRegistry
+            metrics_registry: The registry in which to record the metrics for
+            store requests. If not specified, a new registry is created.
+        :param int file_id_shard: The shard of file ids handled by the
+            callback, when several callbacks share the `working_dir`. If not
+            specified, every file id is handled.
+        :param int file_id_shard_count: Number of shards of file ids.
+            Required if the `file_id_shard` is specified.
+        :param str working_subdir: Subdirectory of the `working_dir` under
+            which files are kept while being transferred, when several
+            callbacks share the `working_dir`.
         :raises PermissionError: If the `storage_dir` does not exist and cannot
             be created due to insufficient permissions.
+        :raises ValueError: If the `io_engine` in the `settings` is not
+            supported, or any of the other `settings` is out of range.
         """
         super(FileStoreRequestCallback, self).__init__()
-        self._store_manager = FileStoreManager(storage_dir, working_dir)
+        if settings is None:
+            settings = FileStoreSettings()
+        io_engine = settings.io_engine
+        if io_engine not in IoEngine.ALL:
+            raise ValueError(
+                "Unsupported I/O engine: '{}'".format(io_engine))
+        self._metrics_registry = metrics_registry or MetricsRegistry()
+        self._store_manager = FileStoreManager(
+            storage_dir, working_dir, settings,
+            metrics_registry=self._metrics_registry,
+            file_id_shard=file_id_shard,
+            file_id_shard_count=file_id_shard_count,
+            working_subdir=working_subdir)
         self._dxl_client = dxl_client
+        io_thread_count = settings.io_thread_count
+        self._io_pool = ThreadPoolIoEngine(io_thread_count,
+                                           settings.io_queue_size,
+                                           "FileStoreIoPool") \
+            if io_thread_count and io_engine == IoEngine.THREADS else None
+        self._io_engine = AsyncioIoEngine(io_thread_count) \
+            if io_thread_count and io_engine == IoEngine.ASYNCIO else None
+        max_pending_requests = settings.max_pending_requests
+        if max_pending_requests is None and io_thread_count:
+            max_pending_requests = settings.io_queue_size
+        self._admission_controller = AdmissionController(
+            max_pending_requests, settings.max_bytes_in_flight)
+        self._register_metrics(self._metrics_registry)
+
+    def _register_metrics(self, registry):
+        """
+        Register the metrics recorded for store requests.
+
+        :param dxlfiletransferservice.metrics.MetricsRegistry registry: The
+            registry in which to record the metrics.
+        """
+        self._requests = registry.counter(
+            "store_requests_total", "Store requests received")
+        self._request_errors = registry.counter(
+            "store_request_errors_total",
+            "Store requests which failed with an error other than busy")
+        self._requests_rejected = registry.counter(
+            "store_requests_rejected_total",
+            "Store requests rejected because the service was busy")
+        self._segments_stored = registry.counter(
+            "segments_stored_total", "Segments stored")
+        self._batches_stored = registry.counter(
+            "batches_stored_total", "Batches of files stored")
+        self._segment_bytes_received = registry.counter(
+            "segment_bytes_received_total",
+            "Bytes of request payloads for segments and batches stored")
+        self._queue_wait_seconds = registry.histogram(
+            "store_queue_wait_seconds",
+            "Time from the receipt of a store request until an I/O thread "
+            "starts processing it")
+        self._store_seconds = registry.histogram(
+            "store_segment_seconds",
+            "Time taken to store the segment, or batch of files, in a store "
+            "request")
+        self._send_response_seconds = registry.histogram(
+            "store_send_response_seconds",
+            "Time taken to send the response to a store request")
+        self._request_seconds = registry.histogram(
+            "store_request_seconds",
+            "Time from the receipt of a store request until its response is "
+            "sent")
+        admission_controller = self._admission_controller
+        registry.gauge(
+            "store_pending_requests",
+            "Store requests received but not yet processed",
+            lambda: admission_controller.pending_requests)
+        registry.gauge(
+            "store_bytes_in_flight",
+            "Bytes of payloads in store requests received but not yet "
+            "processed",
+            lambda: admission_controller.bytes_in_flight)
+
+    @property
+    def io_pool(self):
+        """
+        The I/O thread pool on which segments are written, or `None` if
+        segments are written on the DXL message callback thread or through
+        the asyncio I/O engine
+
+        :rtype: dxlfiletransferservice.ioengine.ThreadPoolIoEngine
+        """
+        return self._io_pool
+
+    @property
+    def io_engine(self):
+        """
+        The I/O thread pool or asyncio I/O engine on which segments are
+        written, or `None` if segments are written on the DXL message
+        callback thread
+
+        :rtype: dxlfiletransferservice.ioengine.ThreadPoolIoEngine or
+            dxlfiletransferservice.ioengine.AsyncioIoEngine
+        """
+        return self._io_pool or self._io_engine
+
+    @property
+    def store_manager(self):
+        """
+        The store manager which processes the file segments
+
+        :rtype: dxlfiletransferservice.store.FileStoreManager
+        """
+        return self._store_manager
+
+    @property
+    def metrics_registry(self):
+        """
+        The registry in which the metrics for store requests are recorded
+
+        :rtype: dxlfiletransferservice.metrics.MetricsRegistry
+        """
+        return self._metrics_registry
 
     def on_request(self, request):
         """
@@ -46,21 +238,448 @@ class FileStoreRequestCallback(RequestCallback):
         logger.debug("Request received on topic: '%s'",
                      request.destination_topic)
 
+        received_time = monotonic()
+        self._requests.inc()
+        request_size = len(request.payload) if request.payload else 0
+        try:
+            if FileStoreProp.FILES in request.other_fields:
+                store_params = self._store_manager.parse_batch(request)
+            else:
+                store_params = self._store_manager.parse_segment(request)
+            self._admission_controller.admit(request_size)
+        except ServiceBusyError as ex:
+            logger.info("Rejecting request: %s", ex)
+            self._requests_rejected.inc()
+            self._send_error_response(request, ex)
+            return
+        except Exception as ex:
+            logger.exception("Error handling request")
+            self._request_errors.inc()
+            self._send_error_response(request, ex)
+            return
+
+        io_engine = self.io_engine
+        if io_engine:
+            # Segments of a file stored in parallel, and batches of files,
+            # may be written concurrently, so only serialize segments of
+            # other files.
+            io_engine.submit(
+                None if store_params.get(FileStoreProp.SEGMENT_COUNT)
+                else store_params.get(FileStoreProp.ID),
+                self._store, request, store_params, request_size,
+                received_time)
+        else:
+            self._store(request, store_params, request_size, received_time)
+
+    def _store(self, request, store_params, request_size, received_time):
+        """
+        Store the segment, or batch of files, for a request and send the
+        response.
+
+        :param dxlclient.message.Request request: The request message
+        :param dict store_params: The parameters parsed from the request
+        :param int request_size: Number of bytes of payload in the request,
+            as admitted by the admission controller
+        :param float received_time: Time at which the request was received,
+            as read from :func:`dxlfiletransferservice.metrics.monotonic`
+        """
+        start_time = monotonic()
+        self._queue_wait_seconds.observe(start_time - received_time)
         try:
             # Create response
             res = Response(request)
 
-            # Store the next segment.
-            result = self._store_manager.store_segment(request)
+            # Store the next segment, or the files in the batch.
+            if FileStoreProp.FILES in store_params:
+                result = self._store_manager.store_parsed_batch(store_params)
+                self._batches_stored.inc()
+            else:
+                result = self._store_manager.store_parsed_segment(
+                    store_params)
+                self._segments_stored.inc()
+            stored_time = monotonic()
+            self._store_seconds.observe(stored_time - start_time)
+            self._segment_bytes_received.inc(request_size)
 
             # Set payload
             MessageUtils.dict_to_json_payload(res, result.to_dict())
 
             # Send response
             self._dxl_client.send_response(res)
+            self._send_response_seconds.observe_since(stored_time)
+
+        except ServiceBusyError as ex:
+            logger.info("Rejecting request: %s", ex)
+            self._requests_rejected.inc()
+            self._send_error_response(request, ex)
+        except Exception as ex:
+            logger.exception("Error handling request")
+            self._request_errors.inc()
+            self._send_error_response(request, ex)
+        finally:
+            self._admission_controller.release(request_size)
+            self._request_seconds.observe_since(received_time)
+
+    def _send_error_response(self, request, ex):
+        """
+        Send an error response for a request.
+
+        :param dxlclient.message.Request request: The request message
+        :param Exception ex: The error which occurred
+        """
+        self._dxl_client.send_response(_create_error_response(request, ex))
+
+    def shutdown(self):
+        """
+        Wait for any requests queued for the I/O thread pool (or I/O engine)
+        to be processed and then stop the threads in the pool and any
+        background work performed by the store manager.
+        """
+        if self._io_pool:
+            self._io_pool.shutdown()
+            self._io_pool = None
+        if self._io_engine:
+            self._io_engine.shutdown()
+            self._io_engine = None
+        self._store_manager.close()
+
+
+class FileShardRequestCallback(RequestCallback):
+    """
+    Request callback used to dispatch requests received on an unsharded
+    topic to the callbacks for the shards of the topic registered by the
+    service (see :mod:`dxlfiletransferservice.sharding`).
+
+    A request which includes a file id is dispatched to the callback for the
+    shard of the file id. Requests which do not yet refer to a file, for
+    example, for the first segment of a file, are spread across the shards
+    in turn. The file id then assigned by the store manager for the shard is
+    in that shard, so that the client can send the remaining requests for
+    the file directly to the shard topic.
+
+    A request whose file id is in a shard registered by another service
+    process is rejected with an error response naming the topic for the
+    shard, since only the store manager for the shard can find the file.
+    """
+
+    def __init__(self, dxl_client, topic, callbacks_by_shard, shard_count):
+        """
+        Constructor parameters:
+
+        :param dxlclient.client.DxlClient dxl_client: The DXL client through
+            which to send error responses
+        :param str topic: Name of the (unsharded) topic on which requests
+            are received.
+        :param dict callbacks_by_shard: The callbacks to dispatch requests
+            to, keyed by shard.
+        :param int shard_count: Number of shards of the topic, including
+            any shards which are registered by other service processes.
+        """
+        super(FileShardRequestCallback, self).__init__()
+        self._dxl_client = dxl_client
+        self._topic = topic
+        self._shards = sorted(callbacks_by_shard)
+        self._callbacks_by_shard = callbacks_by_shard
+        self._shard_count = shard_count
+        self._next_shard_index = itertools.count()
+
+    def on_request(self, request):
+        """
+        Invoked when a request message is received.
+
+        :param dxlclient.message.Request request: The request message
+        """
+        file_id = request.other_fields.get(FileStoreProp.ID)
+        if file_id:
+            shard = get_file_id_shard(file_id, self._shard_count)
+            if shard not in self._callbacks_by_shard:
+                logger.error(
+                    "Received request for file id '%s' in shard '%d' on "
+                    "topic '%s', which is not handled by this process",
+                    file_id, shard, self._topic)
+                self._dxl_client.send_response(_create_error_response(
+                    request, ValueError(
+                        "File id '{}' must be sent to topic '{}'".format(
+                            file_id, get_shard_topic(self._topic, shard)))))
+                return
+        else:
+            shard = self._shards[
+                next(self._next_shard_index) % len(self._shards)]
+        self._callbacks_by_shard[shard].on_request(request)
+
+
+class FileStatsRequestCallback(RequestCallback):
+    """
+    Request callback used to process stats requests. The response payload
+    contains a JSON object with a snapshot of the value of each metric in a
+    :class:`dxlfiletransferservice.metrics.MetricsRegistry`, keyed by metric
+    name.
+    """
+
+    def __init__(self, dxl_client, metrics_registry):
+        """
+        Constructor parameters:
+
+        :param dxlclient.client.DxlClient dxl_client: The DXL client through
+            which to send responses
+        :param dxlfiletransferservice.metrics.MetricsRegistry
+            metrics_registry: The registry whose metrics are returned
+        """
+        super(FileStatsRequestCallback, self).__init__()
+        self._dxl_client = dxl_client
+        self._metrics_registry = metrics_registry
+
+    def on_request(self, request):
+        """
+        Invoked when a request message is received.
+
+        :param dxlclient.message.Request request: The request message
+        """
+        # Handle request
+        logger.debug("Request received on topic: '%s'",
+                     request.destination_topic)
+
+        try:
+            # Create response
+            res = Response(request)
+
+            # Set payload
+            MessageUtils.dict_to_json_payload(
+                res, self._metrics_registry.to_dict())
+
+            # Send response
+            self._dxl_client.send_response(res)
+
+        except Exception as ex:
+            logger.exception("Error handling request")
+            self._dxl_client.send_response(
+                _create_error_response(request, ex))
+
+
+class FileProfileRequestCallback(RequestCallback):
+    """
+    Request callback used to process profile requests, which start or stop
+    a :class:`dxlfiletransferservice.profiler.SamplingProfiler` while the
+    service is running. The `other_fields` of the request may contain the
+    action to perform (defaults to starting the profiler) and the number of
+    seconds to profile for. The response payload contains a JSON object
+    with the status of the profiler.
+    """
+
+    def __init__(self, dxl_client, profiler):
+        """
+        Constructor parameters:
+
+        :param dxlclient.client.DxlClient dxl_client: The DXL client through
+            which to send responses
+        :param dxlfiletransferservice.profiler.SamplingProfiler profiler: The
+            profiler to control
+        """
+        super(FileProfileRequestCallback, self).__init__()
+        self._dxl_client = dxl_client
+        self._profiler = profiler
+
+    def _process(self, request):
+        """
+        Perform the action requested of the profiler.
+
+        :param dxlclient.message.Request request: The request message
+        :raises ValueError: If the action or duration is not valid.
+        """
+        params = request.other_fields
+        action = params.get(ProfileProp.ACTION, ProfileAction.START).lower()
+        if action == ProfileAction.START:
+            duration = params.get(ProfileProp.DURATION)
+            try:
+                duration = float(duration) if duration else None
+            except ValueError:
+                raise ValueError(
+                    "Profile duration must be a number: '{}'".format(
+                        duration))
+            self._profiler.start(duration)
+        elif action == ProfileAction.STOP:
+            self._profiler.stop()
+        elif action != ProfileAction.STATUS:
+            raise ValueError(
+                "Unsupported profile action: '{}'".format(action))
+
+    def on_request(self, request):
+        """
+        Invoked when a request message is received.
+
+        :param dxlclient.message.Request request: The request message
+        """
+        # Handle request
+        logger.debug("Request received on topic: '%s'",
+                     request.destination_topic)
+
+        try:
+            # Create response
+            res = Response(request)
+
+            # Perform the requested action
+            self._process(request)
+
+            # Set payload
+            MessageUtils.dict_to_json_payload(res,
+                                              self._profiler.get_status())
+
+            # Send response
+            self._dxl_client.send_response(res)
+
+        except Exception as ex:
+            logger.exception("Error handling request")
+            self._dxl_client.send_response(
+                _create_error_response(request, ex))
+
+
+class _StoreManagerQueryRequestCallback(RequestCallback):
+    """
+    Base class for request callbacks which answer a query against the store
+    manager shared with the file store request callback. Queries are cheap
+    enough to be processed on the DXL message callback thread.
+    """
+
+    def __init__(self, dxl_client, store_manager):
+        """
+        Constructor parameters:
+
+        :param dxlclient.client.DxlClient dxl_client: The DXL client through
+            which to send responses
+        :param dxlfiletransferservice.store.FileStoreManager store_manager:
+            The store manager shared with the file store request callback
+        """
+        super(_StoreManagerQueryRequestCallback, self).__init__()
+        self._dxl_client = dxl_client
+        self._store_manager = store_manager
+
+    def _query(self, request):
+        """
+        Process the query contained in a request.
+
+        :param dxlclient.message.Request request: The request message
+        :return: The result of the query.
+        :rtype: dxlfiletransferservice.storeresult.FileStoreSegmentResult
+        """
+        raise NotImplementedError()
+
+    def on_request(self, request):
+        """
+        Invoked when a request message is received.
+
+        :param dxlclient.message.Request request: The request message
+        """
+        # Handle request
+        logger.debug("Request received on topic: '%s'",
+                     request.destination_topic)
+
+        try:
+            # Create response
+            res = Response(request)
+
+            # Process the query
+            result = self._query(request)
+
+            # Set payload
+            MessageUtils.dict_to_json_payload(res, result.to_dict())
+
+            # Send response
+            self._dxl_client.send_response(res)
+
+        except Exception as ex:
+            logger.exception("Error handling request")
+            self._dxl_client.send_response(
+                _create_error_response(request, ex))
+
+
+class FilePrecheckRequestCallback(_StoreManagerQueryRequestCallback):
+    """
+    Request callback used to process file pre-check requests. A pre-check
+    declares the name, size, and SHA-256 hash of a file before any of its
+    segments are sent, allowing the service to store the file immediately
+    if the same contents are already stored.
+    """
+
+    def _query(self, request):
+        return self._store_manager.check_file(request)
+
+
+class FileResumeRequestCallback(_StoreManagerQueryRequestCallback):
+    """
+    Request callback used to process resume queries. A resume query returns
+    the point at which a client should resume the transfer of a file whose
+    transfer was interrupted.
+    """
+
+    def _query(self, request):
+        return self._store_manager.resume_file(request)
+
+
+class FileRetrieveRequestCallback(RequestCallback):
+    """
+    Request callback used to process file retrieve requests. The response
+    payload for each request contains the bytes of the requested segment of
+    the file. The size of the file, the offset and length of the segment,
+    and any hashes of the file are set in the `other_fields` of the response.
+
+    If an I/O engine is specified, reading the segment (and, for the first
+    segment of a file, hashing the entire file) and sending the response are
+    performed on the engine rather than on the DXL message callback thread.
+    """
+
+    def __init__(self, dxl_client, retrieve_manager, io_engine=None):
+        """
+        Constructor parameters:
+
+        :param dxlclient.client.DxlClient dxl_client: The DXL client through
+            which to send responses
+        :param dxlfiletransferservice.retrieve.FileRetrieveManager
+            retrieve_manager: The manager which reads the file segments
+        :param io_engine: The I/O thread pool or asyncio I/O engine on which
+            to read segments and send responses, as used for file store
+            requests (see :attr:`FileStoreRequestCallback.io_engine`).
+        """
+        super(FileRetrieveRequestCallback, self).__init__()
+        self._dxl_client = dxl_client
+        self._retrieve_manager = retrieve_manager
+        self._io_engine = io_engine
+
+    def on_request(self, request):
+        """
+        Invoked when a request message is received.
+
+        :param dxlclient.message.Request request: The request message
+        """
+        # Handle request
+        logger.debug("Request received on topic: '%s'",
+                     request.destination_topic)
+
+        if self._io_engine:
+            self._io_engine.submit(None, self._retrieve_segment, request)
+        else:
+            self._retrieve_segment(request)
+
+    def _retrieve_segment(self, request):
+        """
+        Retrieve the segment for a request and send the response.
+
+        :param dxlclient.message.Request request: The request message
+        """
+        try:
+            # Create response
+            res = Response(request)
+
+            # Read the requested segment
+            result = self._retrieve_manager.retrieve_segment(request)
+
+            # Set the segment as the payload and its attributes as fields
+            res.other_fields = result.to_fields()
+            res.payload = result.segment
+
+            # Send response
+            self._dxl_client.send_response(res)
 
         except Exception as ex:
             logger.exception("Error handling request")
-            err_res = ErrorResponse(request, error_code=0,
-                                    error_message=MessageUtils.encode(str(ex)))
-            self._dxl_client.send_response(err_res)
+            self._dxl_client.send_response(
+                _create_error_response(request, ex))
@@ -0,0 +1,493 @@
+from __future__ import absolute_import
+import logging
+import threading
+from collections import OrderedDict
+
+from .constants import FileStoreProp
+from .hashing import DEFAULT_HASH_TYPES, MultiHasher, parse_hash_types
+from .util import get_value_as_int, read_at, read_into_at
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class FileRetrieveSegmentResult(object):
+    """
+    Class which holds the result data from a file segment retrieval.
+    """
+    def __init__(self, file_name, file_size, segment_offset, segment,
+                 hashes=None):
+        self._file_name = file_name
+        self._file_size = file_size
+        self._segment_offset = segment_offset
+        self._segment = segment
+        self._hashes = hashes
+
+    @property
+    def file_name(self):
+        """
+        Name of the file, as requested
+
+        :rtype: str
+        """
+        return self._file_name
+
+    @property
+    def file_size(self):
+        """
+        Total size of the file
+
+        :rtype: int
+        """
+        return self._file_size
+
+    @property
+    def segment_offset(self):
+        """
+        Offset in the file of the first byte in the segment
+
+        :rtype: int
+        """
+        return self._segment_offset
+
+    @property
+    def segment(self):
+        """
+        Bytes of the file read for the segment
+
+        :rtype: bytes
+        """
+        return self._segment
+
+    @property
+    def hashes(self):
+        """
+        Hashes of the contents of the entire file, keyed by
+        :class:`dxlfiletransferservice.constants.HashType` value. This is
+        only set for the first segment of the file or if specific hash types
+        were requested.
+
+        :rtype: dict
+        """
+        return self._hashes
+
+    def to_fields(self):
+        """
+        Returns a dictionary representation of the result, other than the
+        segment itself, suitable for the `other_fields` of a response.
+
+        :rtype: dict
+        """
+        fields = {
+            FileStoreProp.NAME: self._file_name,
+            FileStoreProp.SIZE: str(self._file_size),
+            FileStoreProp.SEGMENT_OFFSET: str(self._segment_offset),
+            FileStoreProp.SEGMENT_LENGTH: str(len(self._segment))
+        }
+        if self._hashes:
+            for hash_type, file_hash in self._hashes.items():
+                fields[FileStoreProp.HASH_PREFIX + hash_type] = file_hash
+        return fields
+
+
+class SegmentCache(object):
+    """
+    Bounded, in-memory, least recently used cache of segments read from
+    files. Segments are keyed by the identity of the version of the file
+    that they were read from (its name, inode, size, and modification time)
+    and the range of bytes in the segment, so a segment cached for a
+    previous version of a file is never returned for a newer one. Segments
+    for older versions are evicted as the cache fills up.
+
+    Entries are evicted, least recently used first, once the total size of
+    the cached segments exceeds the byte budget for the cache.
+    """
+
+    def __init__(self, max_size):
+        """
+        Constructor parameters:
+
+        :param int max_size: Maximum total number of bytes of segments to
+            hold in the cache.
+        :raises ValueError: If the `max_size` is less than 1.
+        """
+        if max_size < 1:
+            raise ValueError(
+                "Maximum cache size must be at least 1: '{}'".format(
+                    max_size))
+        self._max_size = max_size
+        self._size = 0
+        self._segments = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def create_key(file_name, file_version, offset, length):
+        """
+        Create the key for a segment.
+
+        :param str file_name: Absolute name of the file.
+        :param tuple file_version: Identity of the version of the file, as
+            read when the segment was requested (see
+            :attr:`dxlfiletransferservice.storage.StoredFile.version`).
+        :param int offset: Offset of the first byte in the segment.
+        :param int length: Number of bytes in the segment.
+        :return: The key.
+        :rtype: tuple
+        """
+        return (file_name,) + tuple(file_version) + (offset, length)
+
+    @property
+    def max_size(self):
+        """
+        Maximum total number of bytes of segments held in the cache
+
+        :rtype: int
+        """
+        return self._max_size
+
+    def get(self, key):
+        """
+        Get a segment from the cache, marking it as most recently used.
+
+        :param tuple key: Key for the segment, from :meth:`create_key`.
+        :return: The bytes of the segment, or `None` if the segment is not
+            in the cache.
+        :rtype: bytes
+        """
+        with self._lock:
+            segment = self._segments.pop(key, None)
+            if segment is None:
+                self._misses += 1
+            else:
+                self._segments[key] = segment
+                self._hits += 1
+            return segment
+
+    def put(self, key, segment):
+        """
+        Add a segment to the cache, evicting least recently used segments
+        as needed to stay within the byte budget. A segment larger than the
+        entire budget is not cached.
+
+        :param tuple key: Key for the segment, from :meth:`create_key`.
+        :param bytes segment: The bytes of the segment.
+        """
+        if len(segment) > self._max_size:
+            return
+        with self._lock:
+            previous_segment = self._segments.pop(key, None)
+            if previous_segment is not None:
+                self._size -= len(previous_segment)
+            self._segments[key] = segment
+            self._size += len(segment)
+            while self._size > self._max_size:
+                _, evicted_segment = self._segments.popitem(last=False)
+                self._size -= len(evicted_segment)
+                self._evictions += 1
+
+    def get_stats(self):
+        """
+        Get counters for the use of the cache.
+
+        :return: A dictionary with the number of ``hits``, ``misses``, and
+            ``evictions`` since the cache was created, and the number of
+            ``segments`` and total ``size``, in bytes, currently held.
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "segments": len(self._segments),
+                "size": self._size
+            }
+
+
+class FileRetrieveManager(object):
+    """
+    Class which reads segments of files from the storage directory of a
+    :class:`dxlfiletransferservice.store.FileStoreManager`.
+
+    Each segment is read with a positional read on a file handle opened for
+    the request. No buffered file objects are used, so concurrent readers of
+    the same file each hold only the bytes of the segment being returned.
+    Any byte range of a file may be requested, so a client may download a
+    file in parallel ranges.
+
+    Files are opened through the storage backend of the store manager, so
+    the contents of files which the backend has appended to a pack are read
+    from their range of the pack.
+
+    The hashes of each file are computed once per version of the file (as
+    identified by its inode, size, and modification time, or its location in
+    a pack) and cached.
+    Segments which have been read are also held in a :class:`SegmentCache`,
+    so that segments of files which are downloaded repeatedly are served
+    from memory.
+    """
+
+    #: Default maximum number of bytes returned for a single segment
+    DEFAULT_MAX_SEGMENT_SIZE = 512 * (2 ** 10)
+
+    #: Default maximum total number of bytes of segments held in the segment
+    #: cache
+    DEFAULT_CACHE_SIZE = 64 * (2 ** 20)
+
+    #: Size of the buffer, per thread, used to read files in order to hash
+    #: them
+    _READ_BUFFER_SIZE = 2 ** 20
+
+    #: Maximum number of file versions for which hashes are cached
+    _HASH_CACHE_SIZE = 1024
+
+    def __init__(self, store_manager, max_segment_size=None,
+                 cache_size=None, metrics_registry=None):
+        """
+        Constructor parameters:
+
+        :param dxlfiletransferservice.store.FileStoreManager store_manager:
+            The store manager whose files are retrieved.
+        :param int max_segment_size: Maximum number of bytes returned for a
+            single segment. If not specified, this defaults to 524288.
+        :param int cache_size: Maximum total number of bytes of segments to
+            hold in the segment cache. If not specified, this defaults to
+            67108864. If 0, segments are not cached.
+        :param dxlfiletransferservice.metrics.MetricsRegistry
+            metrics_registry: The registry in which to record the metrics for
+            retrieved segments. If not specified, the metrics are recorded in
+            the registry of the `store_manager`.
+        :raises ValueError: If the `max_segment_size` is less than 1 or the
+            `cache_size` is negative.
+        """
+        if max_segment_size is None:
+            max_segment_size = self.DEFAULT_MAX_SEGMENT_SIZE
+        if max_segment_size < 1:
+            raise ValueError(
+                "Maximum segment size must be at least 1: '{}'".format(
+                    max_segment_size))
+        if cache_size is None:
+            cache_size = self.DEFAULT_CACHE_SIZE
+        if cache_size < 0:
+            raise ValueError(
+                "Cache size cannot be negative: '{}'".format(cache_size))
+        self._store_manager = store_manager
+        self._max_segment_size = max_segment_size
+        self._segment_cache = SegmentCache(cache_size) if cache_size else None
+        self._read_buffers = threading.local()
+        self._hash_cache = OrderedDict()
+        self._hash_cache_lock = threading.Lock()
+        self._register_metrics(metrics_registry or
+                               store_manager.metrics_registry)
+
+    def _register_metrics(self, registry):
+        """
+        Register the metrics recorded for retrieved segments.
+
+        :param dxlfiletransferservice.metrics.MetricsRegistry registry: The
+            registry in which to record the metrics.
+        """
+        self._segments_retrieved = registry.counter(
+            "segments_retrieved_total", "Segments retrieved")
+        self._segment_bytes_retrieved = registry.counter(
+            "segment_bytes_retrieved_total", "Bytes of segments retrieved")
+        segment_cache = self._segment_cache
+        if segment_cache:
+            for stat_name, metric_type, description in (
+                    ("hits", "counter", "Segment cache hits"),
+                    ("misses", "counter", "Segment cache misses"),
+                    ("evictions", "counter", "Segment cache evictions"),
+                    ("segments", "gauge", "Segments held in the cache"),
+                    ("size", "gauge", "Bytes of segments held in the cache")):
+                registry.gauge(
+                    "retrieve_cache_{}{}".format(
+                        stat_name,
+                        "_total" if metric_type == "counter" else ""),
+                    description,
+                    lambda stat_name=stat_name:
+                    segment_cache.get_stats()[stat_name],
+                    metric_type)
+
+    @property
+    def max_segment_size(self):
+        """
+        Maximum number of bytes returned for a single segment
+
+        :rtype: int
+        """
+        return self._max_segment_size
+
+    @property
+    def segment_cache(self):
+        """
+        Cache of segments which have been read, or `None` if segments are
+        not cached
+
+        :rtype: SegmentCache
+        """
+        return self._segment_cache
+
+    def _get_file_hashes(self, stored_file, hash_types):
+        """
+        Get the hashes of the contents of a file, from the cache if they
+        have already been computed for the same version of the file.
+
+        :param dxlfiletransferservice.storage.StoredFile stored_file: The
+            location of the contents of the file.
+        :param list hash_types: The types of hashes to get.
+        :return: The hexstring hashes, keyed by hash type.
+        :rtype: dict
+        """
+        cache_key = stored_file.version
+        with self._hash_cache_lock:
+            file_hashes = dict(self._hash_cache.get(cache_key, {}))
+            if cache_key in self._hash_cache:
+                self._hash_cache[cache_key] = self._hash_cache.pop(cache_key)
+
+        missing_hash_types = [hash_type for hash_type in hash_types
+                              if hash_type not in file_hashes]
+        if missing_hash_types:
+            file_hasher = MultiHasher(missing_hash_types)
+            read_buffer = getattr(self._read_buffers, "buffer", None)
+            if read_buffer is None:
+                read_buffer = memoryview(bytearray(self._READ_BUFFER_SIZE))
+                self._read_buffers.buffer = read_buffer
+            offset = stored_file.offset
+            end_offset = stored_file.offset + stored_file.size
+            while offset < end_offset:
+                bytes_read = read_into_at(
+                    stored_file.file_handle,
+                    read_buffer[:min(len(read_buffer), end_offset - offset)],
+                    offset)
+                if not bytes_read:
+                    break
+                file_hasher.update(read_buffer[:bytes_read])
+                offset += bytes_read
+            file_hashes.update(file_hasher.hexdigests())
+            with self._hash_cache_lock:
+                cached_hashes = self._hash_cache.pop(cache_key, {})
+                cached_hashes.update(file_hashes)
+                self._hash_cache[cache_key] = cached_hashes
+                if len(self._hash_cache) > self._HASH_CACHE_SIZE:
+                    self._hash_cache.popitem(last=False)
+
+        return {hash_type: file_hashes[hash_type] for hash_type in hash_types}
+
+    @staticmethod
+    def _read_segment(file_handle, offset, length):
+        """
+        Read a range of bytes from a file.
+
+        :param int file_handle: Operating system level handle for the file.
+        :param int offset: Offset of the first byte in the range.
+        :param int length: Number of bytes in the range.
+        :return: The bytes read. This is shorter than `length` if the file
+            was truncated while it was being read.
+        :rtype: bytes
+        """
+        segments = []
+        while length:
+            segment = read_at(file_handle, length, offset)
+            if not segment:
+                break
+            segments.append(segment)
+            offset += len(segment)
+            length -= len(segment)
+        # A single positional read normally returns the whole range, in which
+        # case the bytes it returns are used as is.
+        return segments[0] if len(segments) == 1 else b"".join(segments)
+
+    def retrieve_segment(self, message):
+        """
+        Process a message containing a request for a segment of a file.
+
+        The `other_fields` of the message must contain the name of the file,
+        relative to the storage directory. They may also contain the offset
+        of the first byte to retrieve (defaults to 0), the number of bytes to
+        retrieve (defaults to, and is limited by, the maximum segment size),
+        and a comma-separated list of hash types to return for the file.
+
+        The hashes of the entire file are returned with the segment at
+        offset 0, so that a client has the size and hashes of the file up
+        front, and with any segment for which hash types were requested.
+
+        :param dxlclient.message.Message message: The message containing the
+            retrieve request.
+        :return: The result of the retrieval.
+        :rtype: FileRetrieveSegmentResult
+        :raises ValueError: If any parameters associated with the request
+            are invalid or the file does not exist.
+        """
+        params = message.other_fields
+        file_name = params.get(FileStoreProp.NAME)
+        if not file_name:
+            raise ValueError(
+                "File name must be specified for retrieve request")
+        abs_file_name = self._store_manager.get_storage_file_name(file_name)
+
+        segment_offset = get_value_as_int(params,
+                                          FileStoreProp.SEGMENT_OFFSET) or 0
+        if segment_offset < 0:
+            raise ValueError(
+                "Segment offset cannot be negative: '{}'".format(
+                    segment_offset))
+        segment_length = get_value_as_int(params,
+                                          FileStoreProp.SEGMENT_LENGTH)
+        if segment_length is None:
+            segment_length = self._max_segment_size
+        elif segment_length < 0:
+            raise ValueError(
+                "Segment length cannot be negative: '{}'".format(
+                    segment_length))
+        segment_length = min(segment_length, self._max_segment_size)
+
+        hash_types = params.get(FileStoreProp.HASH_TYPES)
+        if hash_types is not None:
+            hash_types = parse_hash_types(hash_types) or \
+                list(DEFAULT_HASH_TYPES)
+        elif segment_offset == 0:
+            hash_types = list(DEFAULT_HASH_TYPES)
+
+        try:
+            stored_file = self._store_manager.storage.open_file(abs_file_name)
+        except (OSError, IOError):
+            raise ValueError("File not found: '{}'".format(file_name))
+        except ValueError:
+            raise ValueError("Not a file: '{}'".format(file_name))
+        try:
+            file_size = stored_file.size
+            if segment_offset > file_size:
+                raise ValueError(
+                    "Segment offset '{}' is beyond the end of the file".format(
+                        segment_offset))
+            segment_length = min(segment_length, file_size - segment_offset)
+            segment = None
+            if self._segment_cache and segment_length:
+                cache_key = SegmentCache.create_key(
+                    abs_file_name, stored_file.version, segment_offset,
+                    segment_length)
+                segment = self._segment_cache.get(cache_key)
+            if segment is None:
+                segment = self._read_segment(
+                    stored_file.file_handle,
+                    stored_file.offset + segment_offset, segment_length)
+                # Only cache complete segments. A short read means that the
+                # file was truncated after it was opened, in which case its
+                # identity no longer matches the key.
+                if self._segment_cache and segment_length and \
+                        len(segment) == segment_length:
+                    self._segment_cache.put(cache_key, segment)
+            hashes = self._get_file_hashes(stored_file, hash_types) \
+                if hash_types else None
+        finally:
+            stored_file.close()
+
+        self._segments_retrieved.inc()
+        self._segment_bytes_retrieved.inc(len(segment))
+        logger.debug("Retrieved '%d' bytes at offset '%d' of file '%s'",
+                     len(segment), segment_offset, abs_file_name)
+        return FileRetrieveSegmentResult(file_name, file_size,
+                                         segment_offset, segment, hashes)
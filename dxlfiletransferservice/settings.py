@@ -0,0 +1,129 @@
+from __future__ import absolute_import
+
+from .durability import DurabilityMode
+from .ioengine import IoEngine
+from .storage import StorageMode
+
+
+class FileStoreSettings(object):
+    """
+    Settings for storing files, shared by the
+    :class:`dxlfiletransferservice.requesthandlers.FileStoreRequestCallback`
+    and :class:`dxlfiletransferservice.store.FileStoreManager` for each shard
+    of the store topic registered by the service.
+
+    Each setting is held in an attribute with the same name as the
+    constructor parameter for it, which may also be set after the settings
+    are constructed. A setting which is `None` takes the default described
+    for it.
+    """
+
+    #: The default queue size for each thread of the I/O thread pool
+    DEFAULT_IO_QUEUE_SIZE = 1000
+
+    def __init__(self, reorder_window=None, durability=DurabilityMode.NONE,
+                 group_commit_interval=None, storage_mode=StorageMode.FILE,
+                 blob_dir=None, max_packed_file_size=None, max_pack_size=None,
+                 pack_compact_interval=None, idle_file_timeout=None,
+                 max_working_size=None, reap_interval=None,
+                 max_active_files=None, max_parallel_file_size=None,
+                 lock_shard_count=None, io_thread_count=0,
+                 io_queue_size=DEFAULT_IO_QUEUE_SIZE,
+                 io_engine=IoEngine.THREADS, max_pending_requests=None,
+                 max_bytes_in_flight=None):
+        """
+        Constructor parameters:
+
+        :param int reorder_window: Number of segments past the last
+            contiguous segment received for a file which may be accepted out
+            of order. A value of 1 requires segments to arrive strictly in
+            sequence. If not specified, this defaults to 64.
+        :param str durability: When data written for stored files is forced
+            to stable storage, a member of the
+            :class:`dxlfiletransferservice.durability.DurabilityMode` class.
+        :param float group_commit_interval: Number of seconds to wait for more
+            segments to join a batch of syncs for the
+            :const:`dxlfiletransferservice.durability.DurabilityMode.GROUP`
+            durability mode. If not specified, this defaults to 0.
+        :param str storage_mode: How committed files are laid out under the
+            storage directory, a member of the
+            :class:`dxlfiletransferservice.storage.StorageMode` class.
+        :param str blob_dir: Directory under which the contents of files are
+            stored, keyed by hash, for the
+            :const:`dxlfiletransferservice.storage.StorageMode.CONTENT_ADDRESSED`
+            storage mode. If not specified, this defaults to ".blobs" under
+            the storage directory.
+        :param int max_packed_file_size: Maximum size of a file whose
+            contents are appended to a pack for the
+            :const:`dxlfiletransferservice.storage.StorageMode.PACK` storage
+            mode. If not specified, this defaults to 1048576.
+        :param int max_pack_size: Size at which a pack is closed and a new
+            pack started for the
+            :const:`dxlfiletransferservice.storage.StorageMode.PACK` storage
+            mode. If not specified, this defaults to 268435456.
+        :param float pack_compact_interval: Number of seconds between passes
+            to compact packs for the
+            :const:`dxlfiletransferservice.storage.StorageMode.PACK` storage
+            mode. If not specified, this defaults to 3600.
+        :param float idle_file_timeout: Number of seconds after the last
+            request for a file at which the transfer of the file is
+            considered abandoned and is evicted from the working directory.
+            If not specified, transfers are not evicted for being idle.
+        :param int max_working_size: Maximum total number of bytes of working
+            files. When exceeded, the least recently active transfers are
+            evicted until the total is back under the maximum. If not
+            specified, the size of the working directory is not limited.
+        :param float reap_interval: Number of seconds between passes to
+            evict transfers for the `idle_file_timeout` and
+            `max_working_size`. If not specified, this defaults to 60.
+        :param int max_active_files: Maximum number of files which may be in
+            the process of being stored at a time. Once reached, requests
+            which would start storing a new file are rejected with a
+            :class:`dxlfiletransferservice.admission.ServiceBusyError` until
+            the transfer of another file completes. If not specified, the
+            number of files is not limited.
+        :param int max_parallel_file_size: Maximum size which may be declared
+            for a file stored in parallel. The space for the whole file is
+            allocated in the working directory when the size is declared. If
+            not specified, this defaults to 4294967296.
+        :param int lock_shard_count: Number of shards to partition the state
+            (and locks) for the files being stored by a store manager across.
+            If not specified, this defaults to 32.
+        :param int io_thread_count: Number of threads used to write file
+            segments and send responses. If 0, requests are processed
+            entirely on the thread which invokes the request callback.
+        :param int io_queue_size: Maximum number of requests which may be
+            queued for each thread of the I/O thread pool.
+        :param str io_engine: How requests are dispatched to the
+            `io_thread_count` threads, a member of the
+            :class:`dxlfiletransferservice.ioengine.IoEngine` class.
+        :param int max_pending_requests: Maximum number of requests which
+            have been received but not yet processed. If not specified, this
+            defaults to the `io_queue_size` when an I/O thread pool is used,
+            so that the DXL message callback thread never blocks on a full
+            queue (or, for the asyncio I/O engine, so that the number of
+            requests held by the event loop is bounded), and is not limited
+            otherwise.
+        :param int max_bytes_in_flight: Maximum number of bytes of segments
+            in the requests which have been received but not yet processed.
+            If not specified, the number of bytes is not limited.
+        """
+        self.reorder_window = reorder_window
+        self.durability = durability
+        self.group_commit_interval = group_commit_interval
+        self.storage_mode = storage_mode
+        self.blob_dir = blob_dir
+        self.max_packed_file_size = max_packed_file_size
+        self.max_pack_size = max_pack_size
+        self.pack_compact_interval = pack_compact_interval
+        self.idle_file_timeout = idle_file_timeout
+        self.max_working_size = max_working_size
+        self.reap_interval = reap_interval
+        self.max_active_files = max_active_files
+        self.max_parallel_file_size = max_parallel_file_size
+        self.lock_shard_count = lock_shard_count
+        self.io_thread_count = io_thread_count
+        self.io_queue_size = io_queue_size
+        self.io_engine = io_engine
+        self.max_pending_requests = max_pending_requests
+        self.max_bytes_in_flight = max_bytes_in_flight
@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+import uuid
+import zlib
+
+
+def get_file_id_shard(file_id, shard_count):
+    """
+    Get the shard to which requests for a file are routed.
+
+    The shard is derived from a CRC-32 of the file id, so the same shard is
+    chosen by every client and service process, regardless of platform or
+    Python version.
+
+    :param str file_id: Id of the file.
+    :param int shard_count: Number of shards.
+    :return: The shard, from 0 to one less than the `shard_count`.
+    :rtype: int
+    :raises ValueError: If the `shard_count` is less than 1.
+    """
+    if shard_count < 1:
+        raise ValueError(
+            "Shard count must be at least 1: '{}'".format(shard_count))
+    return (zlib.crc32(file_id.encode("utf-8")) & 0xffffffff) % shard_count
+
+
+def get_shard_topic(topic, shard):
+    """
+    Get the name of the topic for a shard of a topic registered by the
+    service, for example, ``.../file/store/3`` for shard 3 of the store
+    topic.
+
+    :param str topic: Name of the topic.
+    :param int shard: The shard.
+    :return: The name of the topic for the shard.
+    :rtype: str
+    """
+    return "{}/{}".format(topic, shard)
+
+
+def get_file_topic(topic, file_id, shard_count):
+    """
+    Get the name of the topic to which a client should send requests for a
+    file when the service is sharded, so that every request for the file
+    reaches the service process which holds the state of its transfer.
+
+    A client starting a new transfer may either send the first segment
+    without a file id to the unsharded `topic`, and send the remaining
+    segments to the topic returned for the file id in the response, or
+    create the file id itself with :func:`create_file_id` and send every
+    segment to the topic returned for it.
+
+    :param str topic: Name of the topic, for example, the store topic.
+    :param str file_id: Id of the file.
+    :param int shard_count: Number of shards registered by the service. If
+        1, the unsharded `topic` is returned.
+    :return: The name of the topic.
+    :rtype: str
+    """
+    if shard_count == 1:
+        return topic
+    return get_shard_topic(topic, get_file_id_shard(file_id, shard_count))
+
+
+def create_file_id(shard=None, shard_count=None):
+    """
+    Create a new id for a file.
+
+    :param int shard: If specified, the id created is one which is routed to
+        this shard.
+    :param int shard_count: Number of shards. Required if the `shard` is
+        specified.
+    :return: The file id.
+    :rtype: str
+    :raises ValueError: If the `shard` is not between 0 and one less than
+        the `shard_count`.
+    """
+    if shard is not None and not 0 <= shard < shard_count:
+        raise ValueError(
+            "Shard must be from 0 to {}: '{}'".format(shard_count - 1, shard))
+    while True:
+        file_id = str(uuid.uuid4()).lower()
+        if shard is None or \
+                get_file_id_shard(file_id, shard_count) == shard:
+            return file_id
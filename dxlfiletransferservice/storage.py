@@ -0,0 +1,1166 @@
+from __future__ import absolute_import
+import errno
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import uuid
+
+from .constants import FileStoreProp, HashType
+from .durability import DurabilityMode, sync_dir, sync_file_data
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class StorageMode(object):
+    """
+    Constants used to indicate how committed files are laid out under the
+    storage directory.
+    """
+    #: Each committed file is stored separately under its requested name.
+    FILE = "file"
+
+    #: The contents of each committed file are stored once in a blob store,
+    #: keyed by the SHA-256 hash of the contents. The requested name is a
+    #: hard link to the blob (or a symbolic link, where hard links cannot be
+    #: created).
+    CONTENT_ADDRESSED = "cas"
+
+    #: The contents of small committed files are appended to large pack
+    #: files, with an index recording the pack, offset, length, and SHA-256
+    #: hash of each file. Larger files are stored separately under their
+    #: requested names, as for :const:`FILE`.
+    PACK = "pack"
+
+    #: All of the supported modes
+    ALL = (FILE, CONTENT_ADDRESSED, PACK)
+
+
+def _make_dirs(dir_name):
+    """
+    Create a directory, and any missing parent directories, tolerating the
+    directory being created concurrently by another thread.
+
+    :param str dir_name: Name of the directory to create.
+    """
+    if not os.path.exists(dir_name):
+        try:
+            os.makedirs(dir_name)
+        except OSError:
+            # Another transfer may have created the directory concurrently
+            if not os.path.isdir(dir_name):
+                raise
+
+
+def _replace_file(source_name, target_name):
+    """
+    Move a file to a new name, replacing any file which already exists under
+    the new name.
+
+    :param str source_name: Name of the file to move.
+    :param str target_name: Name to move the file to.
+    """
+    if hasattr(os, "replace"):
+        os.replace(source_name, target_name)
+    else:  # Python 2
+        try:
+            os.rename(source_name, target_name)
+        except OSError:
+            # Windows does not allow renaming over an existing file
+            if not os.path.lexists(target_name):
+                raise
+            os.remove(target_name)
+            os.rename(source_name, target_name)
+
+
+class StoredFile(object):
+    """
+    Class which holds the location, in a file opened for reading, of the
+    contents of a stored file.
+    """
+    def __init__(self, file_handle, offset, size, version):
+        self._file_handle = file_handle
+        self._offset = offset
+        self._size = size
+        self._version = version
+
+    @property
+    def file_handle(self):
+        """
+        Operating system level handle for the file holding the contents
+
+        :rtype: int
+        """
+        return self._file_handle
+
+    @property
+    def offset(self):
+        """
+        Offset of the first byte of the contents in the file
+
+        :rtype: int
+        """
+        return self._offset
+
+    @property
+    def size(self):
+        """
+        Size of the contents
+
+        :rtype: int
+        """
+        return self._size
+
+    @property
+    def version(self):
+        """
+        Identity of this version of the contents. Different contents stored
+        under the same name, for example, after the file is stored again,
+        have a different version.
+
+        :rtype: tuple
+        """
+        return self._version
+
+    def close(self):
+        """
+        Close the handle for the file holding the contents.
+        """
+        os.close(self._file_handle)
+
+
+class FileStorage(object):
+    """
+    Storage backend which moves each committed file into place under its
+    requested name.
+    """
+
+    def __init__(self, storage_dir, durability=DurabilityMode.NONE):
+        """
+        Constructor parameters:
+
+        :param str storage_dir: Directory under which files are stored.
+        :param str durability: When data written for stored files is forced
+            to stable storage, a member of the
+            :class:`dxlfiletransferservice.durability.DurabilityMode` class.
+        """
+        self._storage_dir = storage_dir
+        self._durability = durability
+
+    @property
+    def storage_dir(self):
+        """
+        Directory under which files are stored
+
+        :rtype: str
+        """
+        return self._storage_dir
+
+    @property
+    def required_hash_types(self):
+        """
+        Types of hashes which must be computed for every committed file
+
+        :rtype: tuple
+        """
+        return ()
+
+    def is_reserved_name(self, file_name):
+        """
+        Determine if a file name is reserved for use by the storage backend
+        and so may not be used as the name of a stored file.
+
+        :param str file_name: Absolute name of the file.
+        :rtype: bool
+        """
+        return False
+
+    def is_immutable_content(self, content_name):
+        """
+        Determine if the contents held by a file, as returned from
+        :meth:`commit` or :meth:`find_content`, are never changed once
+        committed, so that they can be stored under another name with
+        :meth:`materialize` without being verified again. Contents which
+        this backend moves into place under the requested name of a file may
+        be overwritten or modified later, so they are never immutable.
+
+        :param str content_name: Name of the file holding the contents.
+        :rtype: bool
+        """
+        return False
+
+    def _sync_dir(self, dir_name):
+        """
+        Sync a directory if the durability mode calls for it.
+
+        :param str dir_name: Name of the directory.
+        """
+        if self._durability != DurabilityMode.NONE:
+            sync_dir(dir_name)
+
+    def open_file(self, file_name):
+        """
+        Open a stored file for reading.
+
+        :param str file_name: Absolute name of the stored file.
+        :return: The location of the contents of the file. The caller must
+            close it.
+        :rtype: StoredFile
+        :raises OSError: If the file does not exist.
+        :raises ValueError: If the name refers to something other than a
+            file, for example, a directory.
+        """
+        file_handle = os.open(file_name,
+                              os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            file_stat = os.fstat(file_handle)
+            if not stat.S_ISREG(file_stat.st_mode):
+                raise ValueError("Not a file: '{}'".format(file_name))
+        except Exception:
+            os.close(file_handle)
+            raise
+        return StoredFile(file_handle, 0, file_stat.st_size,
+                          (file_stat.st_dev, file_stat.st_ino,
+                           file_stat.st_size, file_stat.st_mtime))
+
+    def close(self):
+        """
+        Stop any background work performed by the storage backend and close
+        any files which it holds open.
+        """
+        pass
+
+    def find_content(self, file_hash, file_size):
+        """
+        Find previously stored contents with the supplied hash and size.
+
+        :param str file_hash: Hexstring SHA-256 hash of the contents.
+        :param int file_size: Size of the contents.
+        :return: The name of a file holding the contents, for use with
+            :meth:`materialize`, or `None` if the contents cannot be found.
+            This backend does not index stored files by hash, so it always
+            returns `None`.
+        :rtype: str
+        """
+        return None
+
+    def commit(self, working_file_name, file_name, file_hashes):
+        """
+        Commit a fully received and validated working file.
+
+        :param str working_file_name: Name of the working file. The working
+            file is consumed by the commit.
+        :param str file_name: Absolute name under the storage directory at
+            which to store the file.
+        :param dict file_hashes: Hexstring hashes computed for the contents
+            of the file, keyed by hash type.
+        :return: The name of the file holding the committed contents, for
+            use with :meth:`materialize`.
+        :rtype: str
+        """
+        file_dir = os.path.dirname(file_name)
+        _make_dirs(file_dir)
+        if os.path.exists(file_name):
+            os.remove(file_name)
+        os.rename(working_file_name, file_name)
+        self._sync_dir(file_dir)
+        return file_name
+
+    def materialize(self, content_name, file_name):
+        """
+        Store previously committed contents under another name, without the
+        contents having to be transferred again.
+
+        :param str content_name: Name of the file holding the contents, as
+            returned from :meth:`find_content` or :meth:`commit`.
+        :param str file_name: Absolute name under the storage directory at
+            which to store the file.
+        """
+        file_dir = os.path.dirname(file_name)
+        _make_dirs(file_dir)
+        # Copy to a temporary file first so that a partially copied file is
+        # never visible under the requested name.
+        temp_handle, temp_file_name = tempfile.mkstemp(dir=file_dir)
+        try:
+            with os.fdopen(temp_handle, "wb") as temp_file:
+                with open(content_name, "rb") as content_file:
+                    shutil.copyfileobj(content_file, temp_file)
+                shutil.copymode(content_name, temp_file_name)
+                if self._durability != DurabilityMode.NONE:
+                    temp_file.flush()
+                    os.fsync(temp_file.fileno())
+            if os.path.exists(file_name):
+                os.remove(file_name)
+            os.rename(temp_file_name, file_name)
+        except Exception:
+            if os.path.exists(temp_file_name):
+                os.remove(temp_file_name)
+            raise
+        self._sync_dir(file_dir)
+
+
+class ContentAddressedStorage(FileStorage):
+    """
+    Storage backend which deduplicates the contents of committed files.
+
+    The contents of each file are stored once under a blob directory, at a
+    path derived from the SHA-256 hash of the contents. The requested name
+    for the file is then linked to the blob. A commit for contents which are
+    already present in the blob store only has to create the link; the
+    working file is discarded without being moved.
+
+    Since every name for the same contents refers to the same blob, stored
+    files must not be modified in place. Blobs are kept when the names which
+    refer to them are stored again.
+    """
+
+    #: Default location within the storage directory to place the blob
+    #: directory
+    _DEFAULT_BLOB_SUBDIR = ".blobs"
+
+    #: Number of leading characters of the hash used to name each level of
+    #: subdirectories in which blobs are placed
+    _BLOB_PREFIX_LENGTH = 2
+
+    #: Prefix for the temporary name under which a link to a blob is created
+    #: before being moved into place
+    _TEMP_LINK_PREFIX = ".link-"
+
+    def __init__(self, storage_dir, durability=DurabilityMode.NONE,
+                 blob_dir=None):
+        """
+        Constructor parameters:
+
+        :param str storage_dir: Directory under which files are stored.
+        :param str durability: When data written for stored files is forced
+            to stable storage, a member of the
+            :class:`dxlfiletransferservice.durability.DurabilityMode` class.
+        :param str blob_dir: Directory under which the contents of files are
+            stored, keyed by hash. This must be on the same file system as
+            the `storage_dir`. If not specified, this defaults to ".blobs"
+            under the `storage_dir`.
+        """
+        super(ContentAddressedStorage, self).__init__(storage_dir, durability)
+        self._blob_dir = os.path.abspath(blob_dir) if blob_dir else \
+            os.path.join(storage_dir, self._DEFAULT_BLOB_SUBDIR)
+        _make_dirs(self._blob_dir)
+        logger.info("Using blob dir: %s", self._blob_dir)
+
+    @property
+    def blob_dir(self):
+        """
+        Directory under which the contents of files are stored, keyed by hash
+
+        :rtype: str
+        """
+        return self._blob_dir
+
+    @property
+    def required_hash_types(self):
+        return (HashType.SHA256,)
+
+    def is_reserved_name(self, file_name):
+        return file_name == self._blob_dir or \
+            file_name.startswith(self._blob_dir + os.sep)
+
+    def is_immutable_content(self, content_name):
+        return self.is_reserved_name(content_name)
+
+    def get_blob_name(self, file_hash):
+        """
+        Get the name of the blob for contents with the supplied hash.
+
+        :param str file_hash: Hexstring SHA-256 hash of the contents.
+        :return: The name of the blob.
+        :rtype: str
+        """
+        return os.path.join(self._blob_dir,
+                            file_hash[:self._BLOB_PREFIX_LENGTH],
+                            file_hash)
+
+    def find_content(self, file_hash, file_size):
+        blob_name = self.get_blob_name(file_hash)
+        try:
+            if os.path.getsize(blob_name) == file_size:
+                return blob_name
+        except OSError:
+            pass
+        return None
+
+    def commit(self, working_file_name, file_name, file_hashes):
+        blob_name = self.get_blob_name(file_hashes[HashType.SHA256])
+        if os.path.exists(blob_name):
+            logger.debug("Contents for '%s' already stored in blob '%s'",
+                         file_name, blob_name)
+            os.remove(working_file_name)
+        else:
+            blob_dir = os.path.dirname(blob_name)
+            _make_dirs(blob_dir)
+            # A concurrent commit of the same contents just replaces the
+            # blob with an identical copy.
+            os.rename(working_file_name, blob_name)
+            self._sync_dir(blob_dir)
+        self.materialize(blob_name, file_name)
+        return blob_name
+
+    def materialize(self, content_name, file_name):
+        file_dir = os.path.dirname(file_name)
+        _make_dirs(file_dir)
+        # Link under a temporary name first and move the link over any
+        # existing file, so that concurrent stores to the same name each
+        # replace the file rather than failing on the link.
+        temp_file_name = os.path.join(
+            file_dir, "{}{}".format(self._TEMP_LINK_PREFIX, uuid.uuid4().hex))
+        try:
+            try:
+                os.link(content_name, temp_file_name)
+            except (AttributeError, OSError) as ex:
+                # Fall back to a symbolic link where hard links are not
+                # supported or the link count for the blob is exhausted.
+                if isinstance(ex, OSError) and ex.errno not in (
+                        errno.EMLINK, errno.EPERM, errno.EXDEV):
+                    raise
+                os.symlink(content_name, temp_file_name)
+            _replace_file(temp_file_name, file_name)
+            # Moving a link over another link to the same blob leaves both
+            # links in place
+            if os.path.lexists(temp_file_name):
+                os.remove(temp_file_name)
+        except Exception:
+            if os.path.lexists(temp_file_name):
+                os.remove(temp_file_name)
+            raise
+        self._sync_dir(file_dir)
+
+
+class PackCompactResult(object):
+    """
+    Class which holds the result of a pass over the packs of a
+    :class:`PackStorage` to reclaim the space held by the contents of files
+    which have since been stored again.
+    """
+    def __init__(self, packs_compacted=0, bytes_reclaimed=0):
+        self._packs_compacted = packs_compacted
+        self._bytes_reclaimed = bytes_reclaimed
+
+    @property
+    def packs_compacted(self):
+        """
+        Number of packs compacted
+
+        :rtype: int
+        """
+        return self._packs_compacted
+
+    @property
+    def bytes_reclaimed(self):
+        """
+        Number of bytes of dead contents removed with the compacted packs
+
+        :rtype: int
+        """
+        return self._bytes_reclaimed
+
+    def to_dict(self):
+        """
+        Returns a dictionary representation of the result.
+
+        :rtype: dict
+        """
+        return {
+            "packs_compacted": self._packs_compacted,
+            "bytes_reclaimed": self._bytes_reclaimed
+        }
+
+
+class _PackCompactor(object):
+    """
+    Periodically invokes a function which compacts packs, on a background
+    thread, until stopped.
+    """
+
+    def __init__(self, compact_function, interval):
+        """
+        Constructor parameters:
+
+        :param compact_function: Function, taking no arguments and returning
+            a :class:`PackCompactResult`, which compacts packs.
+        :param float interval: Number of seconds to wait between invocations
+            of the `compact_function`.
+        """
+        self._compact_function = compact_function
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name="FilePackCompactor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        """
+        Invoke the compact function every interval until stopped.
+        """
+        while not self._stopped.wait(self._interval):
+            try:
+                self._compact_function()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error compacting packs")
+
+    def stop(self):
+        """
+        Stop the background thread, waiting for any pass in progress to
+        finish.
+        """
+        self._stopped.set()
+        self._thread.join()
+
+
+def _write_all(file_handle, data):
+    """
+    Write all of the supplied data at the current position in a file.
+
+    :param int file_handle: Operating system level handle for the file.
+    :param bytes data: The data to write.
+    """
+    while data:
+        data = data[os.write(file_handle, data):]
+
+
+def _read_all(file_handle, length, offset):
+    """
+    Read a range of bytes from a file.
+
+    :param int file_handle: Operating system level handle for the file.
+    :param int length: Number of bytes in the range.
+    :param int offset: Offset of the first byte in the range.
+    :return: The bytes read.
+    :rtype: bytes
+    :raises ValueError: If the file ends before the end of the range.
+    """
+    os.lseek(file_handle, offset, os.SEEK_SET)
+    chunks = []
+    while length:
+        chunk = os.read(file_handle, length)
+        if not chunk:
+            raise ValueError(
+                "Unexpected end of pack at offset '{}'".format(offset))
+        chunks.append(chunk)
+        offset += len(chunk)
+        length -= len(chunk)
+    return b"".join(chunks)
+
+
+class PackStorage(FileStorage):
+    """
+    Storage backend which appends the contents of small committed files to
+    large pack files, so that storing many small files does not create a
+    file (and inode) under the storage directory for each of them.
+
+    An index records the pack, offset, length, and SHA-256 hash of the
+    contents stored under each name. The index is held in memory and
+    persisted as a log of JSON records in the pack directory, which is
+    appended to as files are stored. The log is rewritten with one record
+    for each indexed file when the backend is created, after packs are
+    compacted, and whenever the log has grown to more than twice as many
+    records as there are indexed files. Contents which are
+    already present in a pack are not appended again; the name is indexed
+    to the existing contents instead.
+
+    Files larger than the maximum packed file size are stored separately
+    under their requested names, as for :class:`FileStorage`. Storing a
+    file replaces any contents previously stored under the same name,
+    whether packed or not. Stored files are read through :meth:`open_file`,
+    which locates the contents of a packed file within its pack.
+
+    The contents of a packed file which is stored again remain
+    in their pack as dead bytes. Once the fraction of dead bytes in a pack
+    reaches the compaction threshold, :meth:`compact` copies the live
+    contents of the pack into the current pack and deletes the old pack.
+    This is invoked periodically from a background thread.
+
+    Since the index is held in memory, only one instance of this backend
+    may use a pack directory at a time.
+    """
+
+    #: Default location within the storage directory to place the pack
+    #: directory
+    _DEFAULT_PACK_SUBDIR = ".packs"
+
+    #: Default maximum size of a file whose contents are appended to a pack
+    _DEFAULT_MAX_PACKED_FILE_SIZE = 2 ** 20
+
+    #: Default size at which a pack is closed and a new pack started
+    _DEFAULT_MAX_PACK_SIZE = 256 * (2 ** 20)
+
+    #: Default number of seconds between passes to compact packs
+    _DEFAULT_COMPACT_INTERVAL = 3600
+
+    #: Default fraction of the bytes in a pack which must be dead for the
+    #: pack to be compacted
+    _DEFAULT_COMPACT_THRESHOLD = 0.5
+
+    #: Name of the index file in the pack directory
+    _INDEX_FILE_NAME = "index"
+
+    #: Prefix for the name of the temporary file to which the index is
+    #: rewritten
+    _INDEX_TEMP_FILE_PREFIX = "index-"
+
+    #: Minimum number of records in the index file before it is rewritten
+    #: for having grown past the number of indexed files
+    _INDEX_REWRITE_MIN_RECORDS = 1024
+
+    #: Number of records in the index file, as a multiple of the number of
+    #: indexed files, past which the index file is rewritten
+    _INDEX_REWRITE_RATIO = 2
+
+    #: Prefix for the name of each pack file in the pack directory, which is
+    #: followed by the number of the pack
+    _PACK_FILE_PREFIX = "pack-"
+
+    #: Key name in an index record for the number of the pack holding the
+    #: contents of the file. A record without a pack removes the file from
+    #: the index.
+    _INDEX_PACK = "pack"
+
+    #: Key name in an index record for the offset of the contents in the pack
+    _INDEX_OFFSET = "offset"
+
+    #: Key name in an index record for the length of the contents
+    _INDEX_LENGTH = "length"
+
+    def __init__(self, storage_dir, durability=DurabilityMode.NONE,
+                 pack_dir=None, max_packed_file_size=None, max_pack_size=None,
+                 compact_interval=None, compact_threshold=None):
+        """
+        Constructor parameters:
+
+        :param str storage_dir: Directory under which files are stored.
+        :param str durability: When data written for stored files is forced
+            to stable storage, a member of the
+            :class:`dxlfiletransferservice.durability.DurabilityMode` class.
+        :param str pack_dir: Directory in which the packs and their index are
+            stored. If not specified, this defaults to ".packs" under the
+            `storage_dir`.
+        :param int max_packed_file_size: Maximum size of a file whose
+            contents are appended to a pack. Larger files are stored
+            separately. If not specified, this defaults to 1048576.
+        :param int max_pack_size: Size at which a pack is closed and a new
+            pack started. If not specified, this defaults to 268435456.
+        :param float compact_interval: Number of seconds between passes to
+            compact packs. If not specified, this defaults to 3600.
+        :param float compact_threshold: Fraction of the bytes in a pack which
+            must be dead for the pack to be compacted. If not specified, this
+            defaults to 0.5.
+        :raises ValueError: If the `max_packed_file_size` is negative, the
+            `max_pack_size` is less than 1, the `compact_interval` is not
+            positive, or the `compact_threshold` is not greater than 0 and
+            no greater than 1.
+        """
+        super(PackStorage, self).__init__(storage_dir, durability)
+        if max_packed_file_size is None:
+            max_packed_file_size = self._DEFAULT_MAX_PACKED_FILE_SIZE
+        if max_packed_file_size < 0:
+            raise ValueError(
+                "Maximum packed file size cannot be negative: '{}'".format(
+                    max_packed_file_size))
+        if max_pack_size is None:
+            max_pack_size = self._DEFAULT_MAX_PACK_SIZE
+        if max_pack_size < 1:
+            raise ValueError(
+                "Maximum pack size must be at least 1: '{}'".format(
+                    max_pack_size))
+        if compact_interval is None:
+            compact_interval = self._DEFAULT_COMPACT_INTERVAL
+        if compact_interval <= 0:
+            raise ValueError(
+                "Compact interval must be positive: '{}'".format(
+                    compact_interval))
+        if compact_threshold is None:
+            compact_threshold = self._DEFAULT_COMPACT_THRESHOLD
+        if not 0 < compact_threshold <= 1:
+            raise ValueError(
+                "Compact threshold must be greater than 0 and no greater "
+                "than 1: '{}'".format(compact_threshold))
+        self._pack_dir = os.path.abspath(pack_dir) if pack_dir else \
+            os.path.join(storage_dir, self._DEFAULT_PACK_SUBDIR)
+        _make_dirs(self._pack_dir)
+        logger.info("Using pack dir: %s", self._pack_dir)
+        self._max_packed_file_size = max_packed_file_size
+        self._max_pack_size = max_pack_size
+        self._compact_threshold = compact_threshold
+        # Guards all of the state below, and the writes to the current pack
+        # and the index
+        self._lock = threading.Lock()
+        # Location of the contents of each packed file, keyed by the name of
+        # the file relative to the storage directory, as a tuple of the pack
+        # number, offset, length, and SHA-256 hash.
+        self._files = {}
+        # SHA-256 hash, and number of files referring to each range of
+        # contents, keyed by pack number, offset, and length. An empty range
+        # may have the same offset as the range appended after it.
+        self._ranges = {}
+        # Pack number and offset of each range of contents, keyed by SHA-256
+        # hash and length
+        self._ranges_by_content = {}
+        # Size, and number of bytes referred to by packed files, keyed by pack
+        # number
+        self._pack_sizes = {}
+        self._pack_live_sizes = {}
+        self._current_pack = None
+        self._current_pack_handle = None
+        self._index_handle = None
+        # Number of records in the index file
+        self._index_record_count = 0
+        self._load_index()
+        self._compactor = _PackCompactor(self.compact, compact_interval)
+
+    @property
+    def pack_dir(self):
+        """
+        Directory in which the packs and their index are stored
+
+        :rtype: str
+        """
+        return self._pack_dir
+
+    @property
+    def required_hash_types(self):
+        return (HashType.SHA256,)
+
+    def is_reserved_name(self, file_name):
+        return file_name == self._pack_dir or \
+            file_name.startswith(self._pack_dir + os.sep)
+
+    def _get_pack_file_name(self, pack):
+        """
+        Get the name of the file for a pack.
+
+        :param int pack: Number of the pack.
+        :return: The name of the pack file.
+        :rtype: str
+        """
+        return os.path.join(self._pack_dir,
+                            "{}{:08d}".format(self._PACK_FILE_PREFIX, pack))
+
+    def _get_content_name(self, file_hash, file_size):
+        """
+        Get the name by which packed contents are referred to in
+        :meth:`materialize`. This is a name under the pack directory at which
+        no file is actually stored.
+
+        :param str file_hash: Hexstring SHA-256 hash of the contents.
+        :param int file_size: Size of the contents.
+        :return: The name of the contents.
+        :rtype: str
+        """
+        return os.path.join(self._pack_dir,
+                            "{}-{}".format(file_hash, file_size))
+
+    def _get_index_name(self, file_name):
+        """
+        Get the name under which a file is indexed.
+
+        :param str file_name: Absolute name of the file.
+        :return: The name of the file relative to the storage directory.
+        :rtype: str
+        """
+        return os.path.relpath(file_name, self._storage_dir)
+
+    def _add_file(self, index_name, pack, offset, length, file_hash):
+        """
+        Add a file to the in-memory index, replacing any contents previously
+        indexed under its name.
+
+        :param str index_name: Name under which the file is indexed.
+        :param int pack: Number of the pack holding the contents.
+        :param int offset: Offset of the contents in the pack.
+        :param int length: Length of the contents.
+        :param str file_hash: Hexstring SHA-256 hash of the contents.
+        """
+        self._remove_file(index_name)
+        self._files[index_name] = (pack, offset, length, file_hash)
+        content_range = self._ranges.get((pack, offset, length))
+        if content_range:
+            content_range[1] += 1
+        else:
+            self._ranges[(pack, offset, length)] = [file_hash, 1]
+            self._ranges_by_content[(file_hash, length)] = (pack, offset)
+            self._pack_live_sizes[pack] += length
+
+    def _remove_file(self, index_name):
+        """
+        Remove a file from the in-memory index.
+
+        :param str index_name: Name under which the file is indexed.
+        :return: `True` if the file was in the index.
+        :rtype: bool
+        """
+        file_location = self._files.pop(index_name, None)
+        if not file_location:
+            return False
+        pack, offset, length, file_hash = file_location
+        content_range = self._ranges[(pack, offset, length)]
+        content_range[1] -= 1
+        if not content_range[1]:
+            del self._ranges[(pack, offset, length)]
+            if self._ranges_by_content.get((file_hash, length)) == \
+                    (pack, offset):
+                del self._ranges_by_content[(file_hash, length)]
+            self._pack_live_sizes[pack] -= length
+        return True
+
+    def _load_index(self):
+        """
+        Load the index from the pack directory, dropping any files whose
+        contents are missing from their packs, for example, because the
+        service was stopped before the contents were written to disk. The
+        index is then rewritten without the records which have been
+        superseded, and the next file is appended to a new pack.
+        """
+        packs = []
+        for file_name in os.listdir(self._pack_dir):
+            if file_name.startswith(self._INDEX_TEMP_FILE_PREFIX):
+                os.remove(os.path.join(self._pack_dir, file_name))
+            elif file_name.startswith(self._PACK_FILE_PREFIX):
+                try:
+                    pack = int(file_name[len(self._PACK_FILE_PREFIX):])
+                except ValueError:
+                    continue
+                packs.append(pack)
+                self._pack_sizes[pack] = os.path.getsize(
+                    self._get_pack_file_name(pack))
+                self._pack_live_sizes[pack] = 0
+
+        index_file_name = os.path.join(self._pack_dir, self._INDEX_FILE_NAME)
+        if os.path.exists(index_file_name):
+            with open(index_file_name, "rb") as index_file:
+                for line in index_file:
+                    try:
+                        record = json.loads(line.decode("utf-8"))
+                        index_name = record[FileStoreProp.NAME]
+                        if self._INDEX_PACK not in record:
+                            self._remove_file(index_name)
+                            continue
+                        pack = record[self._INDEX_PACK]
+                        offset = record[self._INDEX_OFFSET]
+                        length = record[self._INDEX_LENGTH]
+                        file_hash = record[FileStoreProp.HASH_SHA256]
+                    except (ValueError, KeyError, TypeError):
+                        # A record partially written when the service was
+                        # stopped
+                        logger.warning("Skipping invalid pack index record")
+                        continue
+                    if offset + length > self._pack_sizes.get(pack, -1):
+                        logger.warning(
+                            "Dropping file '%s' missing from pack '%d'",
+                            index_name, pack)
+                        self._remove_file(index_name)
+                        continue
+                    self._add_file(index_name, pack, offset, length,
+                                   file_hash)
+
+        self._current_pack = max(packs) + 1 if packs else 1
+        self._rewrite_index()
+        logger.info("Loaded pack index with '%d' file(s) in '%d' pack(s)",
+                    len(self._files), len(packs))
+
+    def _rewrite_index(self):
+        """
+        Rewrite the index with a record for each of the files currently in
+        it, replacing the existing index file.
+        """
+        temp_handle, temp_file_name = tempfile.mkstemp(
+            prefix=self._INDEX_TEMP_FILE_PREFIX, dir=self._pack_dir)
+        try:
+            _write_all(temp_handle, b"".join(
+                self._get_index_record(index_name, file_location)
+                for index_name, file_location in sorted(self._files.items())))
+            if self._durability != DurabilityMode.NONE:
+                os.fsync(temp_handle)
+        finally:
+            os.close(temp_handle)
+        index_file_name = os.path.join(self._pack_dir, self._INDEX_FILE_NAME)
+        getattr(os, "replace", os.rename)(temp_file_name, index_file_name)
+        self._sync_dir(self._pack_dir)
+        if self._index_handle is not None:
+            os.close(self._index_handle)
+        self._index_handle = os.open(
+            index_file_name,
+            os.O_WRONLY | os.O_APPEND | getattr(os, "O_BINARY", 0))
+        self._index_record_count = len(self._files)
+
+    def _get_index_record(self, index_name, file_location=None):
+        """
+        Get the record written to the index for a file.
+
+        :param str index_name: Name under which the file is indexed.
+        :param tuple file_location: Location of the contents of the file, or
+            `None` to get a record which removes the file from the index.
+        :return: The record, as a line of JSON.
+        :rtype: bytes
+        """
+        record = {FileStoreProp.NAME: index_name}
+        if file_location:
+            pack, offset, length, file_hash = file_location
+            record[self._INDEX_PACK] = pack
+            record[self._INDEX_OFFSET] = offset
+            record[self._INDEX_LENGTH] = length
+            record[FileStoreProp.HASH_SHA256] = file_hash
+        return json.dumps(record, sort_keys=True).encode("utf-8") + b"\n"
+
+    def _append_index_record(self, index_name):
+        """
+        Append the record for the current state of a file to the index,
+        rewriting the index instead once the records superseded by later
+        ones make up most of it.
+
+        :param str index_name: Name under which the file is indexed.
+        """
+        if self._index_record_count >= self._INDEX_REWRITE_MIN_RECORDS and \
+                self._index_record_count >= \
+                self._INDEX_REWRITE_RATIO * len(self._files):
+            self._rewrite_index()
+            return
+        _write_all(self._index_handle, self._get_index_record(
+            index_name, self._files.get(index_name)))
+        if self._durability != DurabilityMode.NONE:
+            sync_file_data(self._index_handle)
+        self._index_record_count += 1
+
+    def _append_contents(self, contents):
+        """
+        Append contents to the current pack, starting a new pack first if
+        the contents would take the current pack past the maximum pack size.
+
+        :param bytes contents: The contents to append.
+        :return: The number of the pack and the offset at which the contents
+            were appended.
+        :rtype: tuple
+        """
+        pack_size = self._pack_sizes.get(self._current_pack, 0)
+        if pack_size and pack_size + len(contents) > self._max_pack_size:
+            os.close(self._current_pack_handle)
+            self._current_pack_handle = None
+            self._current_pack += 1
+            pack_size = 0
+        if self._current_pack_handle is None:
+            self._current_pack_handle = os.open(
+                self._get_pack_file_name(self._current_pack),
+                os.O_WRONLY | os.O_CREAT | os.O_APPEND |
+                getattr(os, "O_BINARY", 0))
+            self._pack_sizes[self._current_pack] = 0
+            self._pack_live_sizes[self._current_pack] = 0
+            self._sync_dir(self._pack_dir)
+        _write_all(self._current_pack_handle, contents)
+        if self._durability != DurabilityMode.NONE:
+            sync_file_data(self._current_pack_handle)
+        self._pack_sizes[self._current_pack] = pack_size + len(contents)
+        return self._current_pack, pack_size
+
+    def _index_file(self, file_name, pack, offset, length, file_hash):
+        """
+        Add a file to the index and record it in the index file. The lock
+        for the index must be held.
+
+        :param str file_name: Absolute name of the file.
+        :param int pack: Number of the pack holding the contents.
+        :param int offset: Offset of the contents in the pack.
+        :param int length: Length of the contents.
+        :param str file_hash: Hexstring SHA-256 hash of the contents.
+        """
+        index_name = self._get_index_name(file_name)
+        self._add_file(index_name, pack, offset, length, file_hash)
+        self._append_index_record(index_name)
+
+    def _unindex_file(self, file_name):
+        """
+        Remove a file from the index, recording the removal in the index
+        file. The lock for the index must be held.
+
+        :param str file_name: Absolute name of the file.
+        :return: `True` if the file was in the index.
+        :rtype: bool
+        """
+        index_name = self._get_index_name(file_name)
+        if not self._remove_file(index_name):
+            return False
+        self._append_index_record(index_name)
+        return True
+
+    def _remove_unpacked_file(self, file_name):
+        """
+        Remove a file stored separately under a name which is now indexed to
+        packed contents.
+
+        :param str file_name: Absolute name of the file.
+        """
+        if os.path.lexists(file_name) and not os.path.isdir(file_name):
+            os.remove(file_name)
+            self._sync_dir(os.path.dirname(file_name))
+
+    def is_immutable_content(self, content_name):
+        # Files too large to be packed are moved into place as for the
+        # base backend
+        return os.path.dirname(content_name) == self._pack_dir
+
+    def open_file(self, file_name):
+        with self._lock:
+            file_location = self._files.get(self._get_index_name(file_name))
+            if file_location:
+                pack, offset, length, _ = file_location
+                pack_file_name = self._get_pack_file_name(pack)
+                # Opened while holding the lock so that the pack cannot be
+                # deleted by a compaction in the meantime
+                return StoredFile(
+                    os.open(pack_file_name,
+                            os.O_RDONLY | getattr(os, "O_BINARY", 0)),
+                    offset, length, (pack_file_name, offset, length))
+        return super(PackStorage, self).open_file(file_name)
+
+    def find_content(self, file_hash, file_size):
+        with self._lock:
+            if (file_hash, file_size) in self._ranges_by_content:
+                return self._get_content_name(file_hash, file_size)
+        return None
+
+    def commit(self, working_file_name, file_name, file_hashes):
+        file_size = os.path.getsize(working_file_name)
+        if file_size > self._max_packed_file_size:
+            content_name = super(PackStorage, self).commit(
+                working_file_name, file_name, file_hashes)
+            with self._lock:
+                self._unindex_file(file_name)
+            return content_name
+
+        with open(working_file_name, "rb") as working_file:
+            contents = working_file.read()
+        os.remove(working_file_name)
+        file_hash = file_hashes[HashType.SHA256]
+        with self._lock:
+            content_location = self._ranges_by_content.get(
+                (file_hash, file_size))
+            if content_location:
+                logger.debug("Contents for '%s' already stored in pack '%d'",
+                             file_name, content_location[0])
+            else:
+                content_location = self._append_contents(contents)
+            self._index_file(file_name, content_location[0],
+                             content_location[1], file_size, file_hash)
+        self._remove_unpacked_file(file_name)
+        return self._get_content_name(file_hash, file_size)
+
+    def materialize(self, content_name, file_name):
+        if os.path.dirname(content_name) != self._pack_dir:
+            super(PackStorage, self).materialize(content_name, file_name)
+            with self._lock:
+                self._unindex_file(file_name)
+            return
+
+        file_hash, file_size = os.path.basename(content_name).rsplit("-", 1)
+        file_size = int(file_size)
+        with self._lock:
+            content_location = self._ranges_by_content.get(
+                (file_hash, file_size))
+            if not content_location:
+                raise ValueError(
+                    "Packed contents no longer stored: '{}'".format(
+                        content_name))
+            self._index_file(file_name, content_location[0],
+                             content_location[1], file_size, file_hash)
+        self._remove_unpacked_file(file_name)
+
+    def _compact_pack(self, pack):
+        """
+        Copy the live contents of a pack into the current pack, reindex the
+        files referring to them, and delete the pack. The lock for the index
+        must be held.
+
+        :param int pack: Number of the pack.
+        :return: The number of bytes of dead contents reclaimed.
+        :rtype: int
+        """
+        pack_file_name = self._get_pack_file_name(pack)
+        bytes_reclaimed = self._pack_sizes[pack] - self._pack_live_sizes[pack]
+        moved_ranges = {}
+        pack_handle = os.open(pack_file_name,
+                              os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            for (range_pack, offset, length), (file_hash, _) in sorted(
+                    self._ranges.items()):
+                if range_pack != pack:
+                    continue
+                # The same contents may also be stored in another pack
+                content_location = self._ranges_by_content.get(
+                    (file_hash, length))
+                if not content_location or content_location[0] == pack:
+                    content_location = self._append_contents(
+                        _read_all(pack_handle, length, offset))
+                moved_ranges[(offset, length)] = content_location
+        finally:
+            os.close(pack_handle)
+
+        for index_name, file_location in list(self._files.items()):
+            if file_location[0] == pack:
+                new_pack, new_offset = moved_ranges[file_location[1:3]]
+                self._add_file(index_name, new_pack, new_offset,
+                               *file_location[2:])
+                self._append_index_record(index_name)
+
+        # Every file referring to the pack has been moved out of it
+        del self._pack_sizes[pack]
+        del self._pack_live_sizes[pack]
+        os.remove(pack_file_name)
+        self._sync_dir(self._pack_dir)
+        return bytes_reclaimed
+
+    def compact(self):
+        """
+        Compact each pack, other than the current pack, in which the
+        fraction of dead bytes has reached the compaction threshold. Each
+        pack is compacted while holding the lock for the index, so files
+        are not stored or opened while a pack is being compacted, but may
+        be between packs. The index is rewritten once all of the packs have
+        been compacted.
+
+        This is called periodically from a background thread.
+
+        :return: The result of the pass.
+        :rtype: PackCompactResult
+        """
+        with self._lock:
+            packs = sorted(
+                pack for pack, pack_size in self._pack_sizes.items()
+                if pack != self._current_pack and pack_size and
+                float(pack_size - self._pack_live_sizes[pack]) / pack_size
+                >= self._compact_threshold)
+        packs_compacted = 0
+        bytes_reclaimed = 0
+        for pack in packs:
+            with self._lock:
+                if pack not in self._pack_sizes:
+                    continue
+                bytes_reclaimed += self._compact_pack(pack)
+            packs_compacted += 1
+        if packs_compacted:
+            with self._lock:
+                self._rewrite_index()
+            logger.info("Compacted '%d' pack(s), reclaiming '%d' bytes",
+                        packs_compacted, bytes_reclaimed)
+        return PackCompactResult(packs_compacted, bytes_reclaimed)
+
+    def close(self):
+        if self._compactor:
+            self._compactor.stop()
+            self._compactor = None
+        with self._lock:
+            if self._current_pack_handle is not None:
+                os.close(self._current_pack_handle)
+                self._current_pack_handle = None
+            if self._index_handle is not None:
+                os.close(self._index_handle)
+                self._index_handle = None
@@ -0,0 +1,1580 @@
+from __future__ import absolute_import
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from dxlfiletransferclient.constants import FileStoreResultProp
+from .admission import ServiceBusyError
+from .batchstore import BatchStoreMixin
+from .compression import check_compression_type, decompress
+from .constants import FileStoreProp, HashType
+from .durability import DurabilityMode, GroupCommitter, sync_file_data
+from .hashing import DEFAULT_HASH_TYPES, MultiHasher, parse_hash_types
+from .journal import FileJournalMixin
+from .metrics import MetricsRegistry, monotonic
+from .parallelstore import ParallelStoreMixin
+from .reaper import FileReapResult, WorkingDirReaper
+from .settings import FileStoreSettings
+from .sharding import create_file_id, get_file_id_shard
+from .storage import ContentAddressedStorage, FileStorage, PackStorage, \
+    StorageMode
+from .storeresult import FileStoreSegmentResult
+from .util import contains_path_name_separators, get_buffer_view, \
+    get_value_as_int, read_into_at, write_at
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class _FileShard(object):
+    """
+    Partition of the active file entries tracked by a
+    :class:`FileStoreManager`. Each shard guards its own entries with its own
+    lock so that lookups for unrelated file ids do not contend with each
+    other.
+    """
+    def __init__(self):
+        self.files = {}
+        # Ids of recently completed files, oldest first
+        self.completed_ids = OrderedDict()
+        self.lock = threading.Lock()
+
+
+class FileStoreManager(FileJournalMixin, ParallelStoreMixin,
+                       BatchStoreMixin):
+    """
+    Class which writes file segments into a backing file store.
+
+    State for the files being stored is partitioned into shards keyed by
+    file id. Each file entry also carries its own lock. Segments for
+    different files are written fully in parallel; only segments for the
+    same file are serialized.
+
+    Segments for a file may arrive out of order as long as their segment
+    numbers fall within the receive window following the last contiguous
+    segment received. Each segment is written directly at its offset in the
+    working file. The running hash for the file is advanced as gaps between
+    received segments close.
+
+    A client may instead declare the size and segment count for a file up
+    front, in which case the segments of the file may be received in any
+    order and are written concurrently, without holding the lock for the
+    file, into a working file preallocated to the declared size. The hashes
+    for such a file are computed in a single pass over the working file once
+    all of its segments have been received.
+
+    The journals for files being stored and the recovery of incomplete files
+    after a restart, the storing of files in parallel, and the storing of
+    batches of files are implemented by the
+    :class:`dxlfiletransferservice.journal.FileJournalMixin`,
+    :class:`dxlfiletransferservice.parallelstore.ParallelStoreMixin`, and
+    :class:`dxlfiletransferservice.batchstore.BatchStoreMixin` classes.
+    """
+
+    #: Default location within the storage directory to place the working
+    #: directory
+    _DEFAULT_WORKING_SUBDIR = ".workdir"
+
+    #: Base file name for temporary files written in a file's working directory
+    _WORKING_BASE_FILE_NAME = "file"
+
+    #: Size of the buffer, per thread, used to read back segments which were
+    #: received ahead of a gap in a file in order to hash them
+    _READ_BUFFER_SIZE = 2 ** 20
+
+    #: Maximum number of bytes which a compressed segment may decompress to
+    _MAX_DECOMPRESSED_SEGMENT_SIZE = 64 * (2 ** 20)
+
+    #: Default number of seconds to wait for more segments to join a batch of
+    #: syncs for the
+    #: :const:`dxlfiletransferservice.durability.DurabilityMode.GROUP`
+    #: durability mode
+    _DEFAULT_GROUP_COMMIT_INTERVAL = 0
+
+    #: Default number of seconds between passes to evict abandoned transfers
+    #: from the working directory
+    _DEFAULT_REAP_INTERVAL = 60
+
+    #: Default maximum size which may be declared for a file stored in
+    #: parallel, for which space is allocated up front in the working
+    #: directory
+    _DEFAULT_MAX_PARALLEL_FILE_SIZE = 2 ** 32
+
+    #: Default number of shards to partition active file entries across
+    _DEFAULT_SHARD_COUNT = 32
+
+    #: Default number of segments past the last contiguous segment received
+    #: for a file which may be accepted out of order
+    _DEFAULT_REORDER_WINDOW = 64
+
+    #: Number of recently completed file ids remembered per shard, so that
+    #: segment requests which were still in flight when a file was completed
+    #: are rejected rather than starting a new file under the same id
+    _COMPLETED_FILE_ID_HISTORY = 64
+
+    #: Key name for tracking the hashes computed for a file
+    _FILE_HASHER = "file_hasher"
+
+    #: Key name containing the name of the working directory under which a file
+    #: stored.
+    _FILE_WORKING_DIR = "work_dir"
+
+    #: Key name for the lock which serializes segments for a single file
+    _FILE_LOCK = "file_lock"
+
+    #: Key name for the flag set once a file entry has been completed and
+    #: removed from its shard
+    _FILE_CLOSED = "closed"
+
+    #: Key name for the operating system level handle of the working file
+    _FILE_HANDLE = "file_handle"
+
+    #: Key name for the number of bytes stored for the contiguous segments
+    #: received so far (all of which have been added to the file hash)
+    _FILE_CONTIGUOUS_SIZE = "contiguous_size"
+
+    #: Key name for the offset and length, keyed by segment number, of
+    #: segments which were received ahead of a gap in the file
+    _FILE_PENDING_SEGMENTS = "pending_segments"
+
+    #: Key name for the parameters of a store request which is deferred until
+    #: all of the segments for the file have been received
+    _FILE_PENDING_STORE = "pending_store"
+
+    #: Key name for the window size granted to the client for the file
+    _FILE_WINDOW_SIZE = "window_size"
+
+    #: Key name for the hash and size, along with the requested file name,
+    #: of the contents declared for a file in a pre-check
+    _FILE_EXPECTED_CONTENT = "expected_content"
+
+    #: Key name for the name of a file holding immutable contents, committed
+    #: by another upload, which match the contents declared for a file, along
+    #: with the hashes computed for those contents
+    _FILE_CONTENT_SOURCE = "content_source"
+
+    #: Key name for the hash types to compute for a file recovered from its
+    #: journal, before the hashes have been recomputed
+    _FILE_HASH_TYPES = "hash_types"
+
+    #: Key name for the operating system level handle of the journal file
+    _FILE_JOURNAL_HANDLE = "journal_handle"
+
+    #: Key name for the length of the last record written to the journal
+    _FILE_JOURNAL_LENGTH = "journal_length"
+
+    #: Key name for the number of segments declared for a file stored in
+    #: parallel, or `None` if the segments of the file are received in
+    #: sequence
+    _FILE_SEGMENT_COUNT = "segment_count"
+
+    #: Key name for the size declared for a file stored in parallel
+    _FILE_SIZE = "file_size"
+
+    #: Key name for the number of segments of a file stored in parallel which
+    #: are being written without holding the lock for the file
+    _FILE_WRITES_IN_FLIGHT = "writes_in_flight"
+
+    #: Key name for the condition, associated with the lock for the file,
+    #: which is notified as writes of segments of a file stored in parallel
+    #: finish
+    _FILE_WRITES_DONE = "writes_done"
+
+    #: Key name for the time, from the monotonic clock, of the last request
+    #: processed for a file
+    _FILE_LAST_ACTIVITY = "last_activity"
+
+    #: Key name for the payload in the parameters parsed for a segment
+    _SEGMENT_PAYLOAD = "segment"
+
+    def __init__(self, storage_dir, working_dir=None, settings=None,
+                 metrics_registry=None, file_id_shard=None,
+                 file_id_shard_count=None, working_subdir=None):
+        """
+        Constructor parameters:
+
+        :param str storage_dir: Directory under which files are stored. If
+            the directory does not already exist, an attempt will be made
+            to create it.
+        :param str working_dir: Working directory under which files (or
+            segments of files) may be stored in the process of being
+            transferred to the `storage_dir`. If not specified, this defaults
+            to ".workdir" under the value specified for the `storage_dir`
+            parameter.
+        :param dxlfiletransferservice.settings.FileStoreSettings settings:
+            The settings for storing files. The settings for the I/O threads
+            and admission of requests are not used by the store manager. If
+            not specified, the default settings are used.
+        :param dxlfiletransferservice.metrics.MetricsRegistry
+            metrics_registry: The registry in which to record the metrics for
+            stored files. If not specified, the metrics are recorded in a
+            registry private to the store manager.
+        :param int file_id_shard: The shard of file ids (see
+            :func:`dxlfiletransferservice.sharding.get_file_id_shard`)
+            handled by this store manager, when several store managers share
+            the `working_dir`, for example, one in each of several worker
+            processes. The ids assigned to new files are in this shard, and
+            only the incomplete files in this shard are recovered from (or
+            purged from) the `working_dir` when the store manager is
+            created. If not specified, every file id is handled.
+        :param int file_id_shard_count: Number of shards of file ids.
+            Required if the `file_id_shard` is specified.
+        :param str working_subdir: Subdirectory of the `working_dir` under
+            which this store manager keeps the files being transferred, when
+            several store managers share the `working_dir`. No file may be
+            stored anywhere under the `working_dir`. If not specified, the
+            files are kept directly under the `working_dir`. Incomplete files
+            in the shard of file ids handled by the store manager which were
+            left under another subdirectory, or directly under the
+            `working_dir`, by a run with a different number of shards are
+            moved under this subdirectory when the store manager is created.
+        :raises PermissionError: If the `storage_dir` does not exist and cannot
+            be created due to insufficient permissions.
+        :raises ValueError: If the `lock_shard_count` or `reorder_window` in
+            the `settings` is less than 1, the `durability` or
+            `storage_mode` is not supported, the `reap_interval` is not
+            positive, the `max_parallel_file_size` is less than 1, any of the
+            settings for the
+            :const:`dxlfiletransferservice.storage.StorageMode.PACK` storage
+            mode is out of range, or the `file_id_shard` is not between 0 and
+            one less than the `file_id_shard_count`.
+        """
+        super(FileStoreManager, self).__init__()
+        if settings is None:
+            settings = FileStoreSettings()
+        shard_count = self._DEFAULT_SHARD_COUNT \
+            if settings.lock_shard_count is None \
+            else settings.lock_shard_count
+        if shard_count < 1:
+            raise ValueError(
+                "Shard count must be at least 1: '{}'".format(shard_count))
+        reorder_window = self._DEFAULT_REORDER_WINDOW \
+            if settings.reorder_window is None else settings.reorder_window
+        if reorder_window < 1:
+            raise ValueError(
+                "Reorder window must be at least 1: '{}'".format(
+                    reorder_window))
+        durability = settings.durability
+        if durability not in DurabilityMode.ALL:
+            raise ValueError(
+                "Unsupported durability mode: '{}'".format(durability))
+        storage_mode = settings.storage_mode
+        if storage_mode not in StorageMode.ALL:
+            raise ValueError(
+                "Unsupported storage mode: '{}'".format(storage_mode))
+        if file_id_shard is not None and \
+                not 0 <= file_id_shard < file_id_shard_count:
+            raise ValueError(
+                "File id shard must be from 0 to {}: '{}'".format(
+                    file_id_shard_count - 1, file_id_shard))
+        max_parallel_file_size = self._DEFAULT_MAX_PARALLEL_FILE_SIZE \
+            if settings.max_parallel_file_size is None \
+            else settings.max_parallel_file_size
+        if max_parallel_file_size < 1:
+            raise ValueError(
+                "Maximum parallel file size must be at least 1: '{}'".format(
+                    max_parallel_file_size))
+        self._max_parallel_file_size = max_parallel_file_size
+        self._file_id_shard = file_id_shard
+        self._file_id_shard_count = file_id_shard_count
+        self._shards = [_FileShard() for _ in range(shard_count)]
+        self._max_active_files = settings.max_active_files
+        self._active_file_count = 0
+        self._active_file_count_lock = threading.Lock()
+        self._reorder_window = reorder_window
+        self._read_buffers = threading.local()
+        # Entries for files with declared contents, keyed by (hash, size)
+        self._files_by_content = {}
+        self._files_by_content_lock = threading.Lock()
+        self._durability = durability
+        self._group_committer = GroupCommitter(
+            self._DEFAULT_GROUP_COMMIT_INTERVAL
+            if settings.group_commit_interval is None
+            else settings.group_commit_interval) \
+            if durability == DurabilityMode.GROUP else None
+
+        self._storage_dir = os.path.abspath(storage_dir)
+        if not os.path.exists(self._storage_dir):
+            os.makedirs(self._storage_dir)
+        logger.info("Using storage dir: %s", storage_dir)
+
+        self._working_root_dir = os.path.abspath(working_dir) \
+            if working_dir else os.path.join(self._storage_dir,
+                                             self._DEFAULT_WORKING_SUBDIR)
+        self._working_dir = os.path.join(self._working_root_dir,
+                                         working_subdir) \
+            if working_subdir else self._working_root_dir
+        if not os.path.exists(self._working_dir):
+            os.makedirs(self._working_dir)
+        logger.info("Using working dir: %s", self._working_dir)
+
+        if storage_mode == StorageMode.CONTENT_ADDRESSED:
+            self._storage = ContentAddressedStorage(
+                self._storage_dir, durability, settings.blob_dir)
+        elif storage_mode == StorageMode.PACK:
+            self._storage = PackStorage(
+                self._storage_dir, durability,
+                max_packed_file_size=settings.max_packed_file_size,
+                max_pack_size=settings.max_pack_size,
+                compact_interval=settings.pack_compact_interval)
+        else:
+            self._storage = FileStorage(self._storage_dir, durability)
+
+        self._rehome_orphaned_files()
+        self._recover_incomplete_files()
+
+        reap_interval = self._DEFAULT_REAP_INTERVAL \
+            if settings.reap_interval is None else settings.reap_interval
+        if reap_interval <= 0:
+            raise ValueError(
+                "Reap interval must be positive: '{}'".format(reap_interval))
+        self._idle_file_timeout = settings.idle_file_timeout
+        self._max_working_size = settings.max_working_size
+        self._reaper = WorkingDirReaper(self.reap_files, reap_interval) \
+            if self._idle_file_timeout or self._max_working_size else None
+
+        self._metrics_registry = metrics_registry or MetricsRegistry()
+        self._register_metrics(self._metrics_registry)
+
+    def _register_metrics(self, registry):
+        """
+        Register the metrics recorded by the store manager.
+
+        :param dxlfiletransferservice.metrics.MetricsRegistry registry: The
+            registry in which to record the metrics.
+        """
+        self._write_seconds = registry.histogram(
+            "segment_write_seconds",
+            "Time taken to write (and sync) a segment to its working file")
+        self._hash_seconds = registry.histogram(
+            "segment_hash_seconds",
+            "Time taken to hash the segments which extend the contiguous "
+            "contents of a file")
+        self._commit_seconds = registry.histogram(
+            "file_commit_seconds",
+            "Time taken to validate and commit a fully received file")
+        self._bytes_written = registry.counter(
+            "segment_bytes_written_total",
+            "Bytes of (decompressed) segments written to working files")
+        self._files_stored = registry.counter(
+            "files_stored_total", "Files stored")
+        self._files_canceled = registry.counter(
+            "files_canceled_total",
+            "Files whose storage was canceled or evicted")
+        registry.gauge("active_files",
+                       "Files in the process of being stored",
+                       lambda: self._active_file_count)
+
+    @property
+    def metrics_registry(self):
+        """
+        The registry in which the metrics for stored files are recorded
+
+        :rtype: dxlfiletransferservice.metrics.MetricsRegistry
+        """
+        return self._metrics_registry
+
+    @property
+    def storage_dir(self):
+        """
+        Directory under which files are stored
+
+        :rtype: str
+        """
+        return self._storage_dir
+
+    @property
+    def storage(self):
+        """
+        The backend which lays out committed files under the storage
+        directory, through which stored files are read
+
+        :rtype: dxlfiletransferservice.storage.FileStorage
+        """
+        return self._storage
+
+    @property
+    def working_dir(self):
+        """
+        Working directory under which files are stored while in the process
+        of being transferred
+
+        :rtype: str
+        """
+        return self._working_dir
+
+    @property
+    def active_file_count(self):
+        """
+        Number of files in the process of being stored
+
+        :rtype: int
+        """
+        return self._active_file_count
+
+    def close(self):
+        """
+        Stop any background work performed by the store manager and close the
+        working files for the files still being stored. The working files and
+        journals are left in place so that the transfers can be resumed by a
+        store manager created later for the same working directory.
+        """
+        if self._reaper:
+            self._reaper.stop()
+            self._reaper = None
+        if self._group_committer:
+            self._group_committer.stop()
+            self._group_committer = None
+        self._storage.close()
+        for shard in self._shards:
+            with shard.lock:
+                file_entries = list(shard.files.values())
+                shard.files.clear()
+            with self._active_file_count_lock:
+                self._active_file_count -= len(file_entries)
+            for file_entry in file_entries:
+                with file_entry[self._FILE_LOCK]:
+                    file_entry[self._FILE_CLOSED] = True
+                    os.close(file_entry[self._FILE_HANDLE])
+                    if file_entry[self._FILE_JOURNAL_HANDLE] is not None:
+                        os.close(file_entry[self._FILE_JOURNAL_HANDLE])
+
+    def _get_shard(self, file_id):
+        """
+        Get the shard which holds the entry for the supplied file_id.
+
+        :param str file_id: Id of the file.
+        :return: The shard.
+        :rtype: _FileShard
+        """
+        return self._shards[hash(file_id) % len(self._shards)]
+
+    def _is_file_id_in_shard(self, file_id):
+        """
+        Determine whether the supplied file_id is in the shard of file ids
+        handled by the store manager.
+
+        :param str file_id: Id of the file.
+        :rtype: bool
+        """
+        return self._file_id_shard is None or get_file_id_shard(
+            file_id, self._file_id_shard_count) == self._file_id_shard
+
+    def _get_working_file_dir(self, file_id):
+        """
+        Get the working file directory for the supplied file_id.
+
+        :param str file_id: Id to get the working file directory for.
+        :return: The working file directory.
+        :rtype: str
+        """
+        return os.path.join(self._working_dir, file_id)
+
+    def _get_working_file_name(self, file_id):
+        """
+        Get the working file name for the supplied file_id.
+
+        :param str file_id: Id to get the working file name for.
+        :return: The working file name.
+        :rtype: str
+        """
+        return os.path.join(self._get_working_file_dir(file_id),
+                            self._WORKING_BASE_FILE_NAME)
+
+    def reap_files(self):
+        """
+        Evict the transfers of files which have been idle for longer than the
+        idle file timeout, and then, if the total size of the working files
+        still exceeds the maximum working size, the least recently active
+        transfers until it no longer does. The working files and in-memory
+        state for each evicted transfer are removed, as if the transfer had
+        been canceled.
+
+        This is called periodically from a background thread if an idle file
+        timeout or maximum working size was specified for the store manager.
+        A transfer whose file is locked by a thread processing a segment is
+        skipped rather than waited on, so this never stalls the threads
+        which process segments.
+
+        :return: The result of the pass.
+        :rtype: dxlfiletransferservice.reaper.FileReapResult
+        """
+        file_entries = self._get_file_entries()
+        working_sizes = self._get_working_sizes(file_entries)
+        working_size = sum(working_sizes.values())
+
+        now = monotonic()
+        files_reaped = 0
+        bytes_reclaimed = 0
+        for file_entry in sorted(
+                file_entries,
+                key=lambda file_entry: file_entry[self._FILE_LAST_ACTIVITY]):
+            file_id = file_entry[FileStoreProp.ID]
+            if file_id not in working_sizes:
+                continue
+            idle_time = now - file_entry[self._FILE_LAST_ACTIVITY]
+            idle = self._idle_file_timeout and \
+                idle_time >= self._idle_file_timeout
+            over_quota = self._max_working_size and \
+                working_size > self._max_working_size
+            if not idle and not over_quota:
+                # Entries are visited from least to most recently active, so
+                # no later entry can be idle either.
+                break
+            file_lock = file_entry[self._FILE_LOCK]
+            if not file_lock.acquire(False):
+                continue
+            try:
+                if file_entry[self._FILE_CLOSED] or \
+                        file_entry[self._FILE_WRITES_IN_FLIGHT]:
+                    continue
+                logger.info(
+                    "Evicting %s transfer for file id '%s' after '%d' "
+                    "seconds of inactivity",
+                    "idle" if idle else "least recently active", file_id,
+                    idle_time)
+                self._complete_file(file_entry, FileStoreResultProp.CANCEL)
+            finally:
+                file_lock.release()
+            files_reaped += 1
+            bytes_reclaimed += working_sizes[file_id]
+            working_size -= working_sizes[file_id]
+
+        if files_reaped:
+            logger.info("Evicted '%d' transfer(s), reclaiming '%d' bytes",
+                        files_reaped, bytes_reclaimed)
+        return FileReapResult(files_reaped, bytes_reclaimed)
+
+    def _get_file_entries(self):
+        """
+        Get the entries of all of the files being stored.
+
+        :return: The entries.
+        :rtype: list
+        """
+        file_entries = []
+        for shard in self._shards:
+            with shard.lock:
+                file_entries.extend(shard.files.values())
+        return file_entries
+
+    def _get_working_sizes(self, file_entries):
+        """
+        Get the number of bytes of the working directory taken by each of
+        the supplied files. For a file stored in parallel, this is at least
+        the size declared for the file, for which space is allocated up
+        front.
+
+        :param list file_entries: The entries of the files.
+        :return: The number of bytes, keyed by file id. Files which have
+            been completed concurrently are left out.
+        :rtype: dict
+        """
+        working_sizes = {}
+        for file_entry in file_entries:
+            try:
+                working_sizes[file_entry[FileStoreProp.ID]] = max(
+                    os.fstat(file_entry[self._FILE_HANDLE]).st_size,
+                    file_entry[self._FILE_SIZE] or 0)
+            except OSError:
+                # Completed concurrently
+                pass
+        return working_sizes
+
+    def _get_file_hasher(self, file_entry, hash_types):
+        """
+        Get the hasher for a file, creating it if needed.
+
+        :param dict file_entry: The entry of the file.
+        :param list hash_types: The types of hashes requested for the file.
+            The hash types for the file are fixed by the first segment
+            processed for it.
+        :return: The hasher.
+        :rtype: MultiHasher
+        """
+        file_hasher = file_entry[self._FILE_HASHER]
+        if not file_hasher:
+            file_hasher = MultiHasher(
+                set(file_entry[self._FILE_HASH_TYPES] or hash_types or
+                    DEFAULT_HASH_TYPES).union(
+                        self._storage.required_hash_types))
+            # The state of the hashes for a file recovered from its journal
+            # is not persisted, so the hashes are recomputed from the
+            # contents already in the working file.
+            self._hash_file_range(file_entry[self._FILE_HANDLE], file_hasher,
+                                  0, file_entry[self._FILE_CONTIGUOUS_SIZE])
+            file_entry[self._FILE_HASHER] = file_hasher
+        return file_hasher
+
+    def _hash_file_range(self, file_handle, file_hasher, offset, length):
+        """
+        Update a file hash with a range of bytes already written to a file.
+        The bytes are read into a buffer reused by the calling thread and
+        passed to the hash through a view, so no new buffers are allocated
+        per segment.
+
+        :param int file_handle: Operating system level handle for the file.
+        :param MultiHasher file_hasher: The hash to update.
+        :param int offset: Offset of the first byte in the range.
+        :param int length: Number of bytes in the range.
+        :raises ValueError: If the file ends before the end of the range.
+        """
+        read_buffer = getattr(self._read_buffers, "buffer", None)
+        if read_buffer is None:
+            read_buffer = memoryview(bytearray(self._READ_BUFFER_SIZE))
+            self._read_buffers.buffer = read_buffer
+        while length:
+            bytes_read = read_into_at(
+                file_handle, read_buffer[:min(length, len(read_buffer))],
+                offset)
+            if not bytes_read:
+                raise ValueError(
+                    "Unexpected end of working file at offset '{}'".format(
+                        offset))
+            file_hasher.update(read_buffer[:bytes_read])
+            offset += bytes_read
+            length -= bytes_read
+
+    def _check_segment_number(self, file_entry, segment_number):
+        """
+        Check that the supplied segment number is acceptable as the next
+        segment to write for a file.
+
+        :param dict file_entry: Dictionary containing file information.
+        :param int segment_number: Number of the segment.
+        :raises ValueError: If the segment number is outside of the receive
+            window for the file or if the segment has already been received.
+        """
+        first_expected = file_entry[FileStoreProp.SEGMENTS_RECEIVED] + 1
+        last_expected = first_expected + (file_entry[self._FILE_WINDOW_SIZE] or
+                                          self._reorder_window) - 1
+        pending_store = file_entry[self._FILE_PENDING_STORE]
+        if pending_store:
+            last_expected = min(last_expected, pending_store[0])
+
+        if segment_number is None or segment_number < first_expected or \
+                segment_number > last_expected:
+            raise ValueError(
+                "Unexpected segment. Expected: '{}'. Received: '{}'".format(
+                    first_expected if first_expected == last_expected
+                    else "{}-{}".format(first_expected, last_expected),
+                    segment_number))
+        if segment_number in file_entry[self._FILE_PENDING_SEGMENTS]:
+            raise ValueError(
+                "Segment '{}' already received for file id '{}'".format(
+                    segment_number, file_entry[FileStoreProp.ID]))
+
+    def _write_segment(self, file_handle, segment, segment_offset):
+        """
+        Write a segment to a working file, syncing it if the durability mode
+        calls for it.
+
+        :param int file_handle: Operating system level handle for the file.
+        :param segment: Bytes of the segment, as `bytes` or a
+            :class:`memoryview`.
+        :param int segment_offset: Offset in the file at which to write the
+            segment.
+        """
+        write_start_time = monotonic()
+        write_at(file_handle, segment, segment_offset)
+        if self._durability == DurabilityMode.SEGMENT:
+            sync_file_data(file_handle)
+        elif self._durability == DurabilityMode.GROUP:
+            self._group_committer.sync(file_handle)
+        self._write_seconds.observe_since(write_start_time)
+        self._bytes_written.inc(len(segment))
+
+    def _write_file_segment(self, file_entry, segment_number, segment_offset,
+                            segment):
+        """
+        Write the supplied segment to the file associated with the supplied
+        file_entry.
+
+        :param dict file_entry: Dictionary containing file information.
+        :param int segment_number: Number of the segment.
+        :param int segment_offset: Offset in the file at which to write the
+            segment. If 'None', the segment is written immediately after the
+            last contiguous segment received for the file.
+        :param segment: Bytes of the segment to write to a file, as `bytes` or
+            a :class:`memoryview`.
+        :raises ValueError: If the segment number or offset is not valid for
+            the file.
+        """
+        self._check_segment_number(file_entry, segment_number)
+
+        segment = segment or b""
+        segments_received = file_entry[FileStoreProp.SEGMENTS_RECEIVED]
+        contiguous_size = file_entry[self._FILE_CONTIGUOUS_SIZE]
+        in_sequence = segment_number == segments_received + 1
+
+        if segment_offset is None:
+            if not in_sequence:
+                raise ValueError(
+                    "Offset must be specified for out-of-order segment '{}'".
+                    format(segment_number))
+            segment_offset = contiguous_size
+        elif (in_sequence and segment_offset != contiguous_size) or \
+                segment_offset < contiguous_size:
+            raise ValueError(
+                "Unexpected offset for segment '{}'. Expected: '{}'. "
+                "Received: '{}'".format(segment_number, contiguous_size,
+                                        segment_offset))
+
+        logger.debug("Storing segment '%d' at offset '%d' for file id: '%s'",
+                     segment_number, segment_offset,
+                     file_entry[FileStoreProp.ID])
+        file_handle = file_entry[self._FILE_HANDLE]
+        if segment:
+            self._write_segment(file_handle, segment, segment_offset)
+
+        if not in_sequence:
+            file_entry[self._FILE_PENDING_SEGMENTS][segment_number] = \
+                (segment_offset, len(segment))
+            return
+
+        hash_start_time = monotonic()
+        file_hasher = file_entry[self._FILE_HASHER]
+        file_hasher.update(segment)
+        contiguous_size += len(segment)
+        segments_received += 1
+
+        # Advance the hash over any segments received earlier which were
+        # waiting on the gap just closed.
+        pending_segments = file_entry[self._FILE_PENDING_SEGMENTS]
+        while segments_received + 1 in pending_segments:
+            pending_offset, pending_length = pending_segments.pop(
+                segments_received + 1)
+            if pending_offset != contiguous_size:
+                raise ValueError(
+                    "Unexpected offset for segment '{}'. Expected: '{}'. "
+                    "Received: '{}'".format(segments_received + 1,
+                                            contiguous_size, pending_offset))
+            self._hash_file_range(file_handle, file_hasher, pending_offset,
+                                  pending_length)
+            contiguous_size += pending_length
+            segments_received += 1
+        self._hash_seconds.observe_since(hash_start_time)
+
+        file_entry[self._FILE_CONTIGUOUS_SIZE] = contiguous_size
+        file_entry[FileStoreProp.SEGMENTS_RECEIVED] = segments_received
+
+    @staticmethod
+    def _get_requested_file_result(params, file_name, file_size,
+                                   file_hashes):
+        """
+        Extract the value of the requested file result from the supplied
+        params dictionary.
+
+        :param dict params: The dictionary
+        :param str file_name: File name under the storage file directory
+            in which to store the file.
+        :param int file_size: A file size.
+        :param dict file_hashes: Expected hashes for the file, keyed by hash
+            type
+        :return: The requested file result. If the result is not available
+            in the dictionary, 'None' is returned.
+        :rtype: str
+        :raises ValueError: If the file id, size, and/or hash parameter
+            values are not appropriate for the requested file result
+        """
+        requested_file_result = params.get(FileStoreProp.RESULT)
+        if requested_file_result:
+            if requested_file_result == FileStoreResultProp.STORE:
+                if file_name is None:
+                    raise ValueError(
+                        "File name must be specified for store request"
+                    )
+                if file_size is None:
+                    raise ValueError(
+                        "File size must be specified for store request")
+                if file_size is not None and not file_hashes:
+                    raise ValueError(
+                        "File hash must be specified for store request")
+            elif requested_file_result != FileStoreResultProp.CANCEL:
+                raise ValueError(
+                    "Unexpected '{}' value: '{}'".
+                    format(FileStoreProp.RESULT, requested_file_result))
+        return requested_file_result
+
+    def _create_file_entry(self, file_id):
+        """
+        Create an entry for a file, opening the working file in the
+        working directory for the file, which must already exist.
+
+        :param str file_id: Id of the file associated with the entry.
+        :rtype: dict
+        """
+        file_handle = os.open(
+            self._get_working_file_name(file_id),
+            os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0))
+        file_lock = threading.Lock()
+        return {
+            FileStoreProp.ID: file_id,
+            FileStoreProp.SEGMENTS_RECEIVED: 0,
+            self._FILE_HASHER: None,
+            self._FILE_WORKING_DIR: self._get_working_file_dir(file_id),
+            self._FILE_LOCK: file_lock,
+            self._FILE_CLOSED: False,
+            self._FILE_HANDLE: file_handle,
+            self._FILE_CONTIGUOUS_SIZE: 0,
+            self._FILE_PENDING_SEGMENTS: {},
+            self._FILE_PENDING_STORE: None,
+            self._FILE_WINDOW_SIZE: None,
+            self._FILE_EXPECTED_CONTENT: None,
+            self._FILE_CONTENT_SOURCE: None,
+            self._FILE_HASH_TYPES: None,
+            self._FILE_JOURNAL_HANDLE: None,
+            self._FILE_JOURNAL_LENGTH: 0,
+            self._FILE_SEGMENT_COUNT: None,
+            self._FILE_SIZE: None,
+            self._FILE_WRITES_IN_FLIGHT: 0,
+            self._FILE_WRITES_DONE: threading.Condition(file_lock),
+            self._FILE_LAST_ACTIVITY: monotonic()
+        }
+
+    def _find_file_entry(self, file_id):
+        """
+        Get file entry information for the supplied id.
+
+        :param str file_id: Id of the file associated with the entry.
+        :rtype: dict
+        :raises ValueError: If no entry exists for the id.
+        """
+        shard = self._get_shard(file_id)
+        with shard.lock:
+            file_entry = shard.files.get(file_id)
+        if not file_entry:
+            raise ValueError(
+                "File id '{}' is not active".format(file_id))
+        file_entry[self._FILE_LAST_ACTIVITY] = monotonic()
+        return file_entry
+
+    def _add_active_file(self):
+        """
+        Count a new file being stored against the maximum number of active
+        files.
+
+        :raises ServiceBusyError: If the maximum number of files are already
+            being stored.
+        """
+        with self._active_file_count_lock:
+            if self._max_active_files is not None and \
+                    self._active_file_count >= self._max_active_files:
+                raise ServiceBusyError(
+                    "Service busy: '{}' files already being stored".format(
+                        self._active_file_count))
+            self._active_file_count += 1
+
+    def _remove_active_file(self):
+        """
+        Stop counting a file against the maximum number of active files.
+        """
+        with self._active_file_count_lock:
+            self._active_file_count -= 1
+
+    def _get_file_entry(self, file_id):
+        """
+        Get file entry information for the supplied id. If no entry exists for
+        the id, a new entry is created.
+
+        :param str file_id: Id of the file associated with the entry. If
+            empty, a new id is generated in the shard of file ids handled by
+            the store manager.
+        :rtype: dict
+        :raises ServiceBusyError: If a new entry would be created but the
+            maximum number of files are already being stored.
+        :raises ValueError: If a new entry would be created for an id which
+            is not in the shard of file ids handled by the store manager.
+        """
+        if not file_id:
+            file_id = create_file_id(self._file_id_shard,
+                                     self._file_id_shard_count)
+        shard = self._get_shard(file_id)
+        with shard.lock:
+            file_entry = shard.files.get(file_id)
+            if not file_entry:
+                if not self._is_file_id_in_shard(file_id):
+                    raise ValueError(
+                        "File id '{}' is not in shard '{}'".format(
+                            file_id, self._file_id_shard))
+                if file_id in shard.completed_ids:
+                    raise ValueError(
+                        "File id '{}' is no longer active".format(file_id))
+                file_working_dir = self._get_working_file_dir(file_id)
+                if os.path.exists(file_working_dir):
+                    raise ValueError(
+                        "Work directory for new file id '{}' already exists".
+                        format(file_id)
+                    )
+                self._add_active_file()
+                try:
+                    os.makedirs(file_working_dir)
+                    file_entry = self._create_file_entry(file_id)
+                except Exception:
+                    self._remove_active_file()
+                    raise
+                shard.files[file_id] = file_entry
+                logger.info("Assigning file id '%s' for '%s'", file_id,
+                            file_entry[self._FILE_WORKING_DIR])
+        file_entry[self._FILE_LAST_ACTIVITY] = monotonic()
+        return file_entry
+
+    def _remove_file_entry(self, file_entry):
+        """
+        Remove the supplied file entry from the shard which tracks it.
+
+        :param dict file_entry: The entry of the file to remove.
+        """
+        file_id = file_entry[FileStoreProp.ID]
+        file_entry[self._FILE_CLOSED] = True
+        shard = self._get_shard(file_id)
+        with shard.lock:
+            if shard.files.get(file_id) is file_entry:
+                del shard.files[file_id]
+                self._remove_active_file()
+                shard.completed_ids[file_id] = True
+                if len(shard.completed_ids) > \
+                        self._COMPLETED_FILE_ID_HISTORY:
+                    shard.completed_ids.popitem(last=False)
+        expected_content = file_entry[self._FILE_EXPECTED_CONTENT]
+        if expected_content:
+            with self._files_by_content_lock:
+                content_files = self._files_by_content.get(
+                    expected_content[0], {})
+                content_files.pop(file_id, None)
+                if not content_files:
+                    self._files_by_content.pop(expected_content[0], None)
+
+    def _set_expected_content(self, file_entry, file_hash, file_size,
+                              file_name):
+        """
+        Record the contents declared for a file so that the upload can be
+        completed early if another upload commits the same contents first.
+
+        :param dict file_entry: The entry of the file.
+        :param str file_hash: Hexstring SHA-256 hash of the contents.
+        :param int file_size: Size of the contents.
+        :param str file_name: File name under the storage file directory in
+            which to store the file.
+        """
+        content_key = (file_hash, file_size)
+        with self._files_by_content_lock:
+            file_entry[self._FILE_EXPECTED_CONTENT] = (content_key, file_name)
+            self._files_by_content.setdefault(content_key, {})[
+                file_entry[FileStoreProp.ID]] = file_entry
+
+    def _notify_content_committed(self, file_hashes, file_size,
+                                  content_name):
+        """
+        Notify the files waiting on the same contents as a file which was
+        just committed that the contents are now available. The files are
+        only notified if the storage backend never changes the committed
+        contents, since the contents are not verified again when the files
+        are stored from them. For example, the contents of a file stored
+        under its requested name in the
+        :const:`dxlfiletransferservice.storage.StorageMode.FILE` storage mode
+        may be overwritten by another upload.
+
+        :param dict file_hashes: Hexstring hashes computed for the committed
+            contents, keyed by hash type.
+        :param int file_size: Size of the committed contents.
+        :param str content_name: Name of the file holding the committed
+            contents.
+        """
+        file_hash = file_hashes.get(HashType.SHA256)
+        if file_hash and self._storage.is_immutable_content(content_name):
+            with self._files_by_content_lock:
+                content_files = self._files_by_content.pop(
+                    (file_hash, file_size), {})
+            for file_entry in content_files.values():
+                file_entry[self._FILE_CONTENT_SOURCE] = (content_name,
+                                                         file_hashes)
+
+    def _validate_file(self, file_entry, file_size, file_hashes):
+        """
+        Validate that a file was stored correctly.
+
+        :param dict file_entry: The entry of the file to complete.
+        :param int file_size: Expected size of the stored file.
+        :param dict file_hashes: Expected hexstring hashes of the contents of
+            the stored file, keyed by hash type. Each of the hash types must
+            be among those computed for the file.
+        """
+        file_id = file_entry[FileStoreProp.ID]
+
+        store_error = None
+        stored_file_size = file_entry[self._FILE_CONTIGUOUS_SIZE]
+        if stored_file_size != file_size:
+            store_error = "Unexpected file size. Expected: '" + \
+                          str(stored_file_size) + "'. Received: '" + \
+                          str(file_size) + "'."
+        if stored_file_size:
+            stored_file_hashes = file_entry[self._FILE_HASHER].hexdigests()
+            for hash_type, file_hash in sorted(file_hashes.items()):
+                stored_file_hash = stored_file_hashes.get(hash_type)
+                if not stored_file_hash:
+                    store_error = "Hash type '" + hash_type + \
+                                  "' not computed for file."
+                elif stored_file_hash != file_hash:
+                    store_error = "Unexpected file hash. Expected: " + \
+                                  "'" + str(stored_file_hash) + \
+                                  "'. Received: '" + \
+                                  str(file_hash) + "'."
+        if store_error:
+            raise ValueError(
+                "File storage error for file '{}': {}".format(
+                    file_id, store_error))
+
+    def _complete_file(self, file_entry, requested_file_result,
+                       file_name=None, file_size=None, file_hashes=None):
+        """
+        Complete the storage operation for a file entry.
+
+        :param dict file_entry: The entry of the file to complete.
+        :param str requested_file_result: The desired storage result. If the
+            value is
+            :const:`dxlfiletransferclient.constants.FileStoreResultProp.STORE`
+            but the expected size/hash does not match the stored size/hash or
+            if the value is
+            :const:`dxlfiletransferclient.constants.FileStoreResultProp.CANCEL`,
+             the stored file contents are removed from disk.
+        :param str file_name: File name under the storage file directory
+            in which to store the file.
+        :param int file_size: Expected size of the stored file.
+        :param dict file_hashes: Expected hexstring hashes of the contents of
+            the stored file, keyed by hash type
+        :return: The value of the requested_file_result.
+        :raises ValueError: If the stored size/hash does not match the
+            expected size/hash for the file.
+        :rtype: str
+        """
+        file_id = file_entry[FileStoreProp.ID]
+        file_working_dir = self._get_working_file_dir(file_id)
+        file_working_name = self._get_working_file_name(file_id)
+
+        # Segments of a file stored in parallel may still be being written
+        # to the working file by other threads, for example, when the file
+        # is canceled. The lock for the file is released while waiting.
+        while file_entry[self._FILE_WRITES_IN_FLIGHT]:
+            file_entry[self._FILE_WRITES_DONE].wait()
+
+        file_handle = file_entry[self._FILE_HANDLE]
+
+        try:
+            content_source = file_entry[self._FILE_CONTENT_SOURCE]
+            if requested_file_result == FileStoreResultProp.STORE and \
+                    content_source:
+                # Another upload already committed the same contents
+                content_name = content_source[0]
+                self._storage.materialize(content_name, file_name)
+                logger.info("Stored file '%s' for id '%s' from '%s'",
+                            file_name, file_id, content_name)
+                result = FileStoreResultProp.STORE
+            elif requested_file_result == FileStoreResultProp.STORE:
+                commit_start_time = monotonic()
+                self._validate_file(file_entry, file_size, file_hashes)
+                if self._durability == DurabilityMode.COMMIT:
+                    os.fsync(file_handle)
+                os.close(file_handle)
+                file_handle = None
+
+                stored_file_hashes = file_entry[self._FILE_HASHER].hexdigests()
+                content_name = self._storage.commit(
+                    file_working_name, file_name, stored_file_hashes)
+                self._notify_content_committed(stored_file_hashes, file_size,
+                                               content_name)
+                self._commit_seconds.observe_since(commit_start_time)
+
+                logger.info("Stored file '%s' for id '%s'", file_name, file_id)
+                result = FileStoreResultProp.STORE
+            else:
+                logger.info("Canceled storage of file for id '%s'", file_id)
+                result = FileStoreResultProp.CANCEL
+        except Exception:
+            self._files_canceled.inc()
+            raise
+        finally:
+            if file_handle is not None:
+                os.close(file_handle)
+            if file_entry[self._FILE_JOURNAL_HANDLE] is not None:
+                os.close(file_entry[self._FILE_JOURNAL_HANDLE])
+            shutil.rmtree(file_working_dir)
+            self._remove_file_entry(file_entry)
+
+        if result == FileStoreResultProp.STORE:
+            self._files_stored.inc()
+        else:
+            self._files_canceled.inc()
+        return result
+
+    def _complete_file_if_ready(self, file_entry):
+        """
+        Complete a deferred store request for a file entry if all of the
+        segments for the file have now been received.
+
+        :param dict file_entry: The entry of the file to complete.
+        :return: The result of the store operation,
+            :const:`dxlfiletransferclient.constants.FileStoreResultProp.NONE`
+            if the file is not ready to be completed yet.
+        :rtype: str
+        :raises ValueError: If the stored size/hash does not match the
+            expected size/hash for the file.
+        """
+        pending_store = file_entry[self._FILE_PENDING_STORE]
+        if pending_store and file_entry[FileStoreProp.SEGMENTS_RECEIVED] == \
+                pending_store[0]:
+            return self._complete_file(file_entry, FileStoreResultProp.STORE,
+                                       *pending_store[1:])
+        return FileStoreResultProp.NONE
+
+    def get_storage_file_name(self, file_name):
+        """
+        Get the absolute name of a file under the storage directory.
+
+        :param str file_name: Name of the file, relative to the storage
+            directory.
+        :return: The absolute name of the file.
+        :rtype: str
+        :raises ValueError: If the file name refers to a location outside of
+            the storage directory or one used internally by the service, for
+            example, the working directory.
+        """
+        abs_file_name = os.path.abspath(os.path.join(
+            self._storage_dir, file_name))
+        if not abs_file_name.startswith(self._storage_dir + os.sep):
+            raise ValueError(
+                "File name cannot be outside of storage directory: '{}'".
+                format(file_name))
+        if abs_file_name == self._working_root_dir or \
+                abs_file_name.startswith(self._working_root_dir + os.sep):
+            raise ValueError(
+                "File name cannot be in working directory: '{}'".format(
+                    file_name))
+        if self._storage.is_reserved_name(abs_file_name):
+            raise ValueError(
+                "File name is reserved by the storage backend: '{}'".
+                format(file_name))
+        return abs_file_name
+
+    def parse_segment(self, message):
+        """
+        Extract and validate the parameters for a file segment from a message.
+        This does not access any state for the file or write anything to
+        disk, so it can be used to reject a malformed request before handing
+        off the remaining work for the segment to another thread.
+
+        :param dxlclient.message.Message message: The message containing the
+            file segment to process.
+        :return: The parameters for the segment, for use with the
+            :meth:`store_parsed_segment` method.
+        :rtype: dict
+        :raises ValueError: If any parameters associated with the segment
+            to store are invalid.
+        """
+        # Extract parameters from the request. Parameters all appear in the
+        # 'other_fields' element in the request. The request payload, if
+        # set, represents a segment of a file to be stored.
+        params = message.other_fields
+
+        file_id = params.get(FileStoreProp.ID)
+        if contains_path_name_separators(file_id):
+            raise ValueError(
+                "File id cannot contain path name separators: '{}'".format(
+                    file_id))
+
+        file_name = params.get(FileStoreProp.NAME)
+        if file_name:
+            file_name = self.get_storage_file_name(file_name)
+
+        segment_offset = get_value_as_int(params,
+                                          FileStoreProp.SEGMENT_OFFSET)
+        if segment_offset is not None and segment_offset < 0:
+            raise ValueError(
+                "Segment offset cannot be negative: '{}'".format(
+                    segment_offset))
+
+        segment_count = get_value_as_int(params, FileStoreProp.SEGMENT_COUNT)
+        if segment_count is not None and segment_count < 1:
+            raise ValueError(
+                "Segment count must be at least 1: '{}'".format(
+                    segment_count))
+
+        window_size = get_value_as_int(params, FileStoreProp.WINDOW_SIZE)
+        if window_size is not None and window_size < 1:
+            raise ValueError(
+                "Window size must be at least 1: '{}'".format(window_size))
+
+        file_size = get_value_as_int(params, FileStoreProp.SIZE)
+        file_hashes = {}
+        for param_name, param_value in params.items():
+            if param_name.startswith(FileStoreProp.HASH_PREFIX) and \
+                    param_name != FileStoreProp.HASH_TYPES and param_value:
+                file_hashes[param_name[len(FileStoreProp.HASH_PREFIX):]] = \
+                    param_value.lower()
+
+        hash_types = params.get(FileStoreProp.HASH_TYPES)
+        if hash_types is not None:
+            hash_types = parse_hash_types(hash_types) or \
+                list(DEFAULT_HASH_TYPES)
+
+        compression_type = params.get(FileStoreProp.COMPRESSION)
+        if compression_type:
+            compression_type = compression_type.lower()
+            check_compression_type(compression_type)
+
+        return {
+            FileStoreProp.ID: file_id,
+            FileStoreProp.NAME: file_name,
+            FileStoreProp.SEGMENT_NUMBER: get_value_as_int(
+                params, FileStoreProp.SEGMENT_NUMBER),
+            FileStoreProp.SEGMENT_OFFSET: segment_offset,
+            FileStoreProp.SEGMENT_COUNT: segment_count,
+            FileStoreProp.WINDOW_SIZE: window_size,
+            FileStoreProp.SIZE: file_size,
+            FileStoreProp.HASHES: file_hashes,
+            FileStoreProp.HASH_TYPES: hash_types,
+            FileStoreProp.COMPRESSION: compression_type,
+            FileStoreProp.RESULT: self._get_requested_file_result(
+                params, file_name, file_size, file_hashes),
+            # Refer to the payload through a view so that it is not copied
+            # on the way to the hash and the working file.
+            self._SEGMENT_PAYLOAD: get_buffer_view(message.payload)
+        }
+
+    def _complete_file_early(self, file_entry, requested_file_result):
+        """
+        Complete the storage operation for a file entry before all of its
+        segments have been received, if the file was canceled or if another
+        upload has committed the contents declared for the file. The lock for
+        the file must be held.
+
+        :param dict file_entry: The entry of the file.
+        :param str requested_file_result: The storage result requested for
+            the current segment.
+        :return: The result from the storage operation, or `None` if the
+            file was not completed.
+        :rtype: FileStoreSegmentResult
+        """
+        if requested_file_result == FileStoreResultProp.CANCEL:
+            return FileStoreSegmentResult(
+                file_entry[FileStoreProp.ID],
+                file_entry[FileStoreProp.SEGMENTS_RECEIVED],
+                self._complete_file(file_entry, requested_file_result),
+                file_entry[self._FILE_WINDOW_SIZE]
+            )
+
+        content_source = file_entry[self._FILE_CONTENT_SOURCE]
+        if content_source:
+            # The hashes reported are those computed for the contents when
+            # they were committed, rather than the hash declared for the file
+            file_name = file_entry[self._FILE_EXPECTED_CONTENT][1]
+            file_result = self._complete_file(
+                file_entry, FileStoreResultProp.STORE, file_name)
+            return FileStoreSegmentResult(
+                file_entry[FileStoreProp.ID],
+                file_entry[FileStoreProp.SEGMENTS_RECEIVED],
+                file_result,
+                file_entry[self._FILE_WINDOW_SIZE],
+                dict(content_source[1])
+            )
+
+        return None
+
+    def store_segment(self, message):
+        """
+        Process a message containing information for a file to store. If the
+        request contains a file segment, the segment is written to disk.
+
+        This is equivalent to calling :meth:`parse_segment` followed by
+        :meth:`store_parsed_segment`.
+
+        :param dxlclient.message.Message message: The message containing the
+            file segment to process.
+        :return: The result from the storage operation.
+        :rtype: FileStoreSegmentResult
+        :raises ValueError: If any parameters associated with the segment
+            to store are invalid. For example: if the segment number for the
+            message is greater than 1 but no file id is associated with the
+            message.
+        """
+        return self.store_parsed_segment(self.parse_segment(message))
+
+    def store_parsed_segment(self, segment_params):
+        """
+        Process the parameters for a file segment, as returned from the
+        :meth:`parse_segment` method. If the parameters include a file
+        segment, the segment is written to disk.
+
+        This method may be called concurrently from multiple threads. Segments
+        for different files are processed in parallel while segments for the
+        same file are processed one at a time.
+
+        A client which keeps multiple segments in flight may request a window
+        size for the file. The window granted by the service, limited by the
+        reorder window for the store manager, is returned in the result along
+        with the number of contiguous segments received, which serves as a
+        cumulative acknowledgement for the segments sent so far.
+
+        A client may also request the types of hashes to compute for the file.
+        Hashes of all of the requested types are computed in a single pass
+        over each segment. Once the file is stored, the result includes each
+        of the computed hashes. The expected hashes sent with the store
+        request are verified against the computed hashes of the same type.
+
+        If the request for the last segment of a file arrives before all
+        earlier segments have been received, the store request is deferred.
+        The file is then completed, and the store result returned, when the
+        request which fills the final gap is processed.
+
+        A client may declare the segment count and size of a file with its
+        first segment in order to store the file in parallel. The segments
+        of the file may then be sent in any order, for example, by several
+        concurrent workers each sending a disjoint range of the file, with
+        each segment after the first including its offset. The store request
+        may be sent with any of the segments. The file is completed once all
+        of its segments have been received, at which point the hashes for the
+        file are computed and verified.
+
+        A segment may be compressed, in which case it is decompressed before
+        it is hashed and written. The segment offset, file size, and file
+        hashes all refer to the decompressed contents.
+
+        If the contents of the file were declared in a pre-check (see
+        :meth:`check_parsed_file`) and another upload has since committed the
+        same contents to a storage backend which never changes committed
+        contents, the file is completed from those contents as soon as the
+        next segment request for it is processed. The store result, with the
+        hashes computed for the contents when they were committed, is
+        returned to the client in the response for that segment so that it
+        can stop sending the remaining segments.
+
+        :param dict segment_params: The parameters for the segment.
+        :return: The result from the storage operation.
+        :rtype: FileStoreSegmentResult
+        :raises ValueError: If the segment is not valid for the current
+            state of the file, for example, if the segment number is outside
+            of the receive window for the file, or if a compressed segment
+            cannot be decompressed.
+        """
+        segment_number = segment_params[FileStoreProp.SEGMENT_NUMBER]
+        segment_offset = segment_params[FileStoreProp.SEGMENT_OFFSET]
+        window_size = segment_params[FileStoreProp.WINDOW_SIZE]
+        file_name = segment_params[FileStoreProp.NAME]
+        file_size = segment_params[FileStoreProp.SIZE]
+        file_hashes = segment_params[FileStoreProp.HASHES]
+        hash_types = segment_params[FileStoreProp.HASH_TYPES]
+        requested_file_result = segment_params[FileStoreProp.RESULT]
+        segment = segment_params[self._SEGMENT_PAYLOAD]
+
+        # Decompress the segment before taking the lock for the file so that
+        # segments for the same file can be decompressed in parallel.
+        compression_type = segment_params[FileStoreProp.COMPRESSION]
+        if compression_type and segment:
+            segment = get_buffer_view(decompress(
+                compression_type, segment,
+                self._MAX_DECOMPRESSED_SEGMENT_SIZE))
+
+        # Obtain or create a file entry for the file associated with the
+        # request
+        file_entry = self._get_file_entry(segment_params[FileStoreProp.ID])
+
+        if segment_params[FileStoreProp.SEGMENT_COUNT] is not None or \
+                file_entry[self._FILE_SEGMENT_COUNT]:
+            return self._store_parallel_segment(file_entry, segment_params,
+                                                segment)
+
+        # Serialize the processing of segments for the same file. The entry
+        # may have been completed by another thread while waiting on the lock.
+        with file_entry[self._FILE_LOCK]:
+            if file_entry[self._FILE_CLOSED]:
+                raise ValueError(
+                    "File id '{}' is no longer active".format(
+                        file_entry[FileStoreProp.ID]))
+
+            if window_size:
+                file_entry[self._FILE_WINDOW_SIZE] = min(window_size,
+                                                         self._reorder_window)
+
+            early_result = self._complete_file_early(file_entry,
+                                                     requested_file_result)
+            if early_result:
+                return early_result
+
+            # The segment count may have been declared by a segment which
+            # was processed concurrently
+            if file_entry[self._FILE_SEGMENT_COUNT]:
+                raise ValueError(
+                    "Unexpected segment for file id '{}' which is stored in "
+                    "parallel".format(file_entry[FileStoreProp.ID]))
+
+            # All of the hashes are computed in a single pass over each
+            # segment.
+            file_hasher = self._get_file_hasher(file_entry, hash_types)
+
+            if requested_file_result:
+                pending_segments = file_entry[self._FILE_PENDING_SEGMENTS]
+                if pending_segments and \
+                        max(pending_segments) > segment_number:
+                    raise ValueError(
+                        "Segment '{}' received beyond last segment '{}'".
+                        format(max(pending_segments), segment_number))
+            segments_received = file_entry[FileStoreProp.SEGMENTS_RECEIVED]
+            self._write_file_segment(file_entry, segment_number,
+                                     segment_offset, segment)
+            if requested_file_result:
+                file_entry[self._FILE_PENDING_STORE] = (
+                    segment_number, file_name, file_size, file_hashes)
+            file_result = self._complete_file_if_ready(file_entry)
+            if not file_result and segments_received != \
+                    file_entry[FileStoreProp.SEGMENTS_RECEIVED]:
+                self._write_journal(file_entry)
+
+            return FileStoreSegmentResult(
+                file_entry[FileStoreProp.ID],
+                file_entry[FileStoreProp.SEGMENTS_RECEIVED],
+                file_result,
+                file_entry[self._FILE_WINDOW_SIZE],
+                file_hasher.hexdigests()
+                if file_result == FileStoreResultProp.STORE else None,
+                file_hasher.hash_types if hash_types else None
+            )
+
+    def check_file(self, message):
+        """
+        Process a message containing a pre-check for a file to store.
+
+        This is equivalent to calling :meth:`parse_segment` followed by
+        :meth:`check_parsed_file`.
+
+        :param dxlclient.message.Message message: The message containing the
+            pre-check parameters for the file.
+        :return: The result from the pre-check.
+        :rtype: FileStoreSegmentResult
+        :raises ValueError: If any parameters associated with the pre-check
+            are invalid.
+        """
+        return self.check_parsed_file(self.parse_segment(message))
+
+    def check_parsed_file(self, check_params):
+        """
+        Check whether contents with the SHA-256 hash and size declared for a
+        file, before any of its segments are sent, are already stored.
+
+        If the contents are found, the file is stored under the requested
+        name immediately and the result is
+        :const:`dxlfiletransferclient.constants.FileStoreResultProp.STORE`.
+        The client does not need to send any segments for the file.
+
+        Otherwise, the result is
+        :const:`dxlfiletransferclient.constants.FileStoreResultProp.NONE`
+        and an entry is opened for the file, under the file id from the
+        parameters or a newly generated id. The client should then send the
+        segments for the file under the id returned in the result. The
+        declared contents are remembered for the file; if another upload of
+        the same contents commits first, the file is completed early (see
+        :meth:`store_parsed_segment`).
+
+        :param dict check_params: The parameters for the pre-check, as
+            returned from the :meth:`parse_segment` method. The file name,
+            size, and SHA-256 hash must be set.
+        :return: The result from the pre-check.
+        :rtype: FileStoreSegmentResult
+        :raises ValueError: If the file name, size, or SHA-256 hash is not
+            specified.
+        """
+        file_id = check_params[FileStoreProp.ID]
+        file_name = check_params[FileStoreProp.NAME]
+        file_size = check_params[FileStoreProp.SIZE]
+        file_hash = check_params[FileStoreProp.HASHES].get(HashType.SHA256)
+        if file_name is None or file_size is None or not file_hash:
+            raise ValueError(
+                "File name, size, and SHA-256 hash must be specified for "
+                "pre-check")
+
+        content_name = self._storage.find_content(file_hash, file_size)
+        if content_name:
+            self._storage.materialize(content_name, file_name)
+            logger.info("Stored file '%s' from '%s' without transfer",
+                        file_name, content_name)
+            return FileStoreSegmentResult(
+                file_id or create_file_id(self._file_id_shard,
+                                          self._file_id_shard_count), 0,
+                FileStoreResultProp.STORE, hashes={HashType.SHA256: file_hash})
+
+        file_entry = self._get_file_entry(file_id)
+        with file_entry[self._FILE_LOCK]:
+            if file_entry[self._FILE_CLOSED]:
+                raise ValueError(
+                    "File id '{}' is no longer active".format(
+                        file_entry[FileStoreProp.ID]))
+            self._set_expected_content(file_entry, file_hash, file_size,
+                                       file_name)
+            self._write_journal(file_entry)
+            return FileStoreSegmentResult(
+                file_entry[FileStoreProp.ID],
+                file_entry[FileStoreProp.SEGMENTS_RECEIVED])
+
+    def resume_file(self, message):
+        """
+        Process a message containing a query for the point at which to resume
+        the transfer of a file.
+
+        This is equivalent to calling :meth:`parse_segment` followed by
+        :meth:`resume_parsed_file`.
+
+        :param dxlclient.message.Message message: The message containing the
+            id of the file.
+        :return: The result from the query.
+        :rtype: FileStoreSegmentResult
+        :raises ValueError: If the file id is not specified or is not active.
+        """
+        return self.resume_parsed_file(self.parse_segment(message))
+
+    def resume_parsed_file(self, resume_params):
+        """
+        Get the point at which to resume the transfer of a file. This may be
+        for a file whose transfer was interrupted by a client disconnect or
+        one recovered from its journal when the store manager was started.
+
+        The result includes the number of segments received so far, counting
+        only the segments received without a gap from the first segment, and
+        the offset in the file at which the next segment should be written.
+        The client should resume by sending the segment numbered one past
+        the number of segments received. Any segments received beyond a gap
+        are discarded and must be sent again.
+
+        Files stored in parallel (see :meth:`store_parsed_segment`) are not
+        journaled, so their transfers cannot be resumed.
+
+        :param dict resume_params: The parameters for the query, as returned
+            from the :meth:`parse_segment` method. The file id must be set.
+        :return: The result from the query.
+        :rtype: FileStoreSegmentResult
+        :raises ValueError: If the file id is not specified or is not active
+            or if the file is stored in parallel.
+        """
+        file_id = resume_params[FileStoreProp.ID]
+        if not file_id:
+            raise ValueError("File id must be specified for resume query")
+        file_entry = self._find_file_entry(file_id)
+        with file_entry[self._FILE_LOCK]:
+            if file_entry[self._FILE_CLOSED]:
+                raise ValueError(
+                    "File id '{}' is no longer active".format(file_id))
+            if file_entry[self._FILE_SEGMENT_COUNT]:
+                raise ValueError(
+                    "Resume is not supported for file id '{}' which is "
+                    "stored in parallel".format(file_id))
+            file_entry[self._FILE_PENDING_SEGMENTS].clear()
+            file_entry[self._FILE_PENDING_STORE] = None
+            file_hasher = file_entry[self._FILE_HASHER]
+            return FileStoreSegmentResult(
+                file_id,
+                file_entry[FileStoreProp.SEGMENTS_RECEIVED],
+                window_size=file_entry[self._FILE_WINDOW_SIZE],
+                hash_types=file_hasher.hash_types if file_hasher
+                else file_entry[self._FILE_HASH_TYPES],
+                segment_offset=file_entry[self._FILE_CONTIGUOUS_SIZE])
+
@@ -0,0 +1,165 @@
+from __future__ import absolute_import
+
+from dxlfiletransferclient.constants import FileStoreResultProp
+from .constants import FileStoreProp
+
+
+class FileStoreSegmentResult(object):
+    """
+    Class which holds the result data from a file segment storage
+    attempt.
+    """
+    def __init__(self, file_id, segments_received,
+                 file_result=FileStoreResultProp.NONE, window_size=None,
+                 hashes=None, hash_types=None, segment_offset=None):
+        self._file_id = file_id
+        self._segments_received = segments_received
+        self._file_result = file_result
+        self._window_size = window_size
+        self._hashes = hashes
+        self._hash_types = hash_types
+        self._segment_offset = segment_offset
+
+    @property
+    def file_id(self):
+        """
+        Id of the file
+
+        :rtype: str
+        """
+        return self._file_id
+
+    @property
+    def segments_received(self):
+        """
+        Number of segments received so far for the file, counting only the
+        segments received without a gap from the first segment. Segments
+        received out of order beyond a gap are not included.
+
+        :rtype: int
+        """
+        return self._segments_received
+
+    @property
+    def file_result(self):
+        """
+        Storage result for the entire file (not just the segment), a member of
+        the :class:`dxlfiletransferclient.constants.FileStoreResultProp` class.
+        If the stored segment was not the last one for the file, the return
+        value would be
+        :const:`dxlfiletransferclient.constants.FileStoreResultProp.NONE`.
+
+        :rtype: str
+        """
+        return self._file_result
+
+    @property
+    def window_size(self):
+        """
+        Number of segments which the client may keep in flight for the file,
+        as granted by the service. This is only set if the client requested a
+        window size for the file.
+
+        :rtype: int
+        """
+        return self._window_size
+
+    @property
+    def hashes(self):
+        """
+        Hashes computed for the file, keyed by
+        :class:`dxlfiletransferservice.constants.HashType` value. This is
+        only set once the file has been stored.
+
+        :rtype: dict
+        """
+        return self._hashes
+
+    @property
+    def hash_types(self):
+        """
+        Types of hashes which the service computes for the file. This is only
+        set if the client requested specific hash types for the file.
+
+        :rtype: list
+        """
+        return self._hash_types
+
+    @property
+    def segment_offset(self):
+        """
+        Byte offset in the file at which the segment following the segments
+        received so far should be written. This is only set in the result of
+        a resume query.
+
+        :rtype: int
+        """
+        return self._segment_offset
+
+    def to_dict(self):
+        """
+        Returns a dictionary representation of the file segment results.
+
+        :rtype: dict
+        """
+        dict_value = {
+            FileStoreProp.ID: self._file_id,
+            FileStoreProp.SEGMENTS_RECEIVED: self._segments_received
+        }
+
+        if self._file_result:
+            dict_value[FileStoreProp.RESULT] = self._file_result
+
+        if self._window_size:
+            dict_value[FileStoreProp.WINDOW_SIZE] = self._window_size
+
+        if self._hashes:
+            dict_value[FileStoreProp.HASHES] = self._hashes
+
+        if self._hash_types:
+            dict_value[FileStoreProp.HASH_TYPES] = self._hash_types
+
+        if self._segment_offset is not None:
+            dict_value[FileStoreProp.SEGMENT_OFFSET] = self._segment_offset
+
+        return dict_value
+
+
+class FileStoreBatchResult(object):
+    """
+    Class which holds the result data from a batch file storage attempt.
+    """
+    def __init__(self, file_results):
+        self._file_results = file_results
+
+    @property
+    def file_results(self):
+        """
+        Result for each of the files in the batch, in the order in which the
+        files appear in the manifest for the batch. Each result is a
+        dictionary with the name of the file and either the storage result
+        and hashes for the file or the error which prevented the file from
+        being stored.
+
+        :rtype: list
+        """
+        return self._file_results
+
+    @property
+    def files_stored(self):
+        """
+        Number of files in the batch which were stored
+
+        :rtype: int
+        """
+        return sum(1 for file_result in self._file_results
+                   if file_result.get(FileStoreProp.RESULT) ==
+                   FileStoreResultProp.STORE)
+
+    def to_dict(self):
+        """
+        Returns a dictionary representation of the batch results.
+
+        :rtype: dict
+        """
+        return {FileStoreProp.FILES: self._file_results}
@@ -0,0 +1,156 @@
+from __future__ import absolute_import
+import errno
+import os
+import sys
+
+_PATH_NAME_SEPARATORS = (".", "\\", "/")
+
+
+def contains_path_name_separators(value):
+    """
+    Determine if the supplied value contains any characters which
+    could represent a path name separator.
+
+    :param str value: Value to check for path name separators
+    :return: True if the value contains possible path name separators, False if
+        not.
+    :rtype: bool
+    """
+    contains = False
+    if value:
+        for pathname_sep_chars in _PATH_NAME_SEPARATORS:
+            if pathname_sep_chars in value:
+                contains = True
+                break
+    return contains
+
+
+def get_value_as_int(dict_obj, key):
+    """
+    Return the value associated with a key in a dictionary, converted to an
+    int.
+
+    :param dict dict_obj: Dictionary to retrieve the value from
+    :param str key: Key associated with the value to return
+    :return The value, as an integer. Returns 'None' if the key cannot be found
+        in the dictionary.
+    :rtype: int
+    :raises ValueError: If the key is present in the dictionary but the value
+        cannot be converted to an int.
+    """
+    return_value = None
+    if key in dict_obj:
+        try:
+            return_value = int(dict_obj.get(key))
+        except ValueError:
+            raise ValueError(
+                "'{}' of '{}' could not be converted to an int".format(
+                    key, dict_obj.get(key)))
+    return return_value
+
+
+def get_buffer_view(data):
+    """
+    Get a view over the supplied data which can be sliced, hashed, and written
+    to a file without copying the underlying bytes.
+
+    :param bytes data: The data. This may be 'None'.
+    :return: A :class:`memoryview` over the data. On Python 2, where the
+        functions used to hash and write data do not accept a
+        :class:`memoryview`, the data is returned as is.
+    """
+    if data is None or sys.version_info[0] < 3:
+        return data
+    return memoryview(data)
+
+
+def supports_positional_writes():
+    """
+    Determine if :func:`write_at` writes without moving the current position
+    in the file. Only then may several threads write to the same file handle
+    at the same time.
+
+    :return: True if positional writes are supported, False if not.
+    :rtype: bool
+    """
+    return hasattr(os, "pwrite")
+
+
+def write_at(file_handle, data, offset):
+    """
+    Write data at a specific offset in a file, without changing the current
+    position in the file where the platform supports it.
+
+    :param int file_handle: Operating system level handle for the file.
+    :param data: Data to write, as `bytes` or a :class:`memoryview`. If a
+        partial write occurs, the remaining data is sliced without copying
+        when the data is a :class:`memoryview`.
+    :param int offset: Offset in the file at which to write the data.
+    """
+    if supports_positional_writes():
+        while data:
+            bytes_written = os.pwrite(file_handle, data, offset)
+            data = data[bytes_written:]
+            offset += bytes_written
+    else:
+        os.lseek(file_handle, offset, os.SEEK_SET)
+        while data:
+            data = data[os.write(file_handle, data):]
+
+
+def preallocate(file_handle, size):
+    """
+    Allocate the space for a file of a specific size up front, so that
+    writes at any offset in the file do not have to extend it. Where the
+    platform or file system does not support allocating space, the file is
+    just extended to the size.
+
+    :param int file_handle: Operating system level handle for the file.
+    :param int size: Size of the file.
+    """
+    if size and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(file_handle, 0, size)
+            return
+        except OSError as ex:
+            if ex.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+    os.ftruncate(file_handle, size)
+
+
+def read_at(file_handle, length, offset):
+    """
+    Read data from a specific offset in a file, without changing the current
+    position in the file where the platform supports it.
+
+    :param int file_handle: Operating system level handle for the file.
+    :param int length: Number of bytes to read.
+    :param int offset: Offset in the file from which to read the data.
+    :return: The data read. This may be shorter than `length` if the end of
+        the file is reached.
+    :rtype: bytes
+    """
+    if hasattr(os, "pread"):
+        return os.pread(file_handle, length, offset)
+    os.lseek(file_handle, offset, os.SEEK_SET)
+    return os.read(file_handle, length)
+
+
+def read_into_at(file_handle, buffer_view, offset):
+    """
+    Read data from a specific offset in a file into an existing buffer. Where
+    the platform supports it, the data is read directly into the buffer
+    without allocating an intermediate `bytes` object.
+
+    :param int file_handle: Operating system level handle for the file.
+    :param memoryview buffer_view: Writable view over the buffer to read the
+        data into. Up to the length of the view is read.
+    :param int offset: Offset in the file from which to read the data.
+    :return: Number of bytes read.
+    :rtype: int
+    """
+    if hasattr(os, "preadv"):
+        return os.preadv(file_handle, [buffer_view], offset)
+    data = read_at(file_handle, len(buffer_view), offset)
+    buffer_view[:len(data)] = data
+    return len(data)
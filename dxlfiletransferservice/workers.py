@@ -0,0 +1,142 @@
+from __future__ import absolute_import
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+from logging.config import fileConfig
+
+from .app import FileTransferService
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+def configure_logging(config_dir):
+    """
+    Configure logging for the service from the logging configuration file in
+    the configuration directory or, if there is no such file, to the
+    console.
+
+    :param str config_dir: The location of the configuration files for the
+        application
+    """
+    logging_config_path = os.path.join(
+        config_dir, FileTransferService.LOGGING_CONFIG_FILE)
+    if os.access(logging_config_path, os.R_OK):
+        # Log configuration via configuration file
+        fileConfig(logging_config_path, disable_existing_loggers=False)
+    else:
+        root_logger = logging.getLogger()
+        # A worker process forked from the supervisor inherits its handler
+        if not root_logger.handlers:
+            # Default log configuration (no configuration file)
+            log_formatter = logging.Formatter(
+                '%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
+
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(log_formatter)
+
+            root_logger.addHandler(console_handler)
+            root_logger.setLevel(logging.INFO)
+
+
+def run_worker(config_dir, worker_index, worker_count, stop_event):
+    """
+    Run the service in one of several worker processes until stopped by the
+    supervisor.
+
+    :param str config_dir: The location of the configuration files for the
+        application
+    :param int worker_index: Index of the worker.
+    :param int worker_count: Number of workers.
+    :param multiprocessing.Event stop_event: Event set by the supervisor to
+        stop the worker.
+    """
+    # Only the supervisor handles signals, so that a signal delivered to the
+    # whole process group, for example, for Ctrl-C, does not interrupt a
+    # worker while the supervisor is stopping it.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    configure_logging(config_dir)
+    supervisor_pid = os.getppid()
+    try:
+        with FileTransferService(config_dir, worker_index,
+                                 worker_count) as app:
+            app.run()
+            # Also stop if the supervisor exits without stopping the worker
+            while not stop_event.wait(1) and \
+                    os.getppid() == supervisor_pid:
+                pass
+    except Exception:
+        logger.exception("Error occurred in worker %d, exiting",
+                         worker_index + 1)
+        sys.exit(1)
+
+
+class WorkerSupervisor(object):
+    """
+    Starts and stops the worker processes for the service.
+
+    Each worker runs its own instance of the
+    :class:`dxlfiletransferservice.app.FileTransferService` application, with
+    its own DXL client, I/O threads, and store manager, so that the hashing
+    and writing of segments is spread across processes rather than limited
+    by the interpreter lock of a single process. The workers share the
+    storage and working directories. Every segment of a file reaches the
+    same worker through the shard topics which the worker registers (see
+    :mod:`dxlfiletransferservice.sharding`).
+    """
+
+    def __init__(self, config_dir, worker_count):
+        """
+        Constructor parameters:
+
+        :param str config_dir: The location of the configuration files for the
+            application
+        :param int worker_count: Number of worker processes to start.
+        """
+        self._config_dir = config_dir
+        self._worker_count = worker_count
+        self._stop_event = multiprocessing.Event()
+        self._processes = []
+
+    def start(self):
+        """
+        Start the worker processes.
+        """
+        for worker_index in range(self._worker_count):
+            process = multiprocessing.Process(
+                target=run_worker,
+                args=(self._config_dir, worker_index, self._worker_count,
+                      self._stop_event),
+                name="FileTransferServiceWorker-{}".format(worker_index + 1))
+            process.start()
+            logger.info("Started worker %d of %d, pid: %d", worker_index + 1,
+                        self._worker_count, process.pid)
+            self._processes.append(process)
+
+    def get_exited_worker(self):
+        """
+        Get a worker process which has exited without being stopped.
+
+        :return: The index of the worker, or `None` if every worker is still
+            running.
+        :rtype: int
+        """
+        for worker_index, process in enumerate(self._processes):
+            if not process.is_alive():
+                return worker_index
+        return None
+
+    def stop(self):
+        """
+        Stop the worker processes, waiting for each to finish processing the
+        requests it has already received.
+        """
+        self._stop_event.set()
+        for worker_index, process in enumerate(self._processes):
+            process.join()
+            logger.info("Worker %d exited with code: %s", worker_index + 1,
+                        process.exitcode)
+        self._processes = []
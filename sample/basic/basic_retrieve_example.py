@@ -0,0 +1,112 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import hashlib
+import os
+import sys
+import time
+
+from dxlclient.client_config import DxlClientConfig
+from dxlclient.client import DxlClient
+from dxlclient.message import Message, Request
+from dxlbootstrap.util import MessageUtils
+from dxlfiletransferservice.constants import FileStoreProp
+
+# Import common logging and configuration
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+from common import *
+
+# Configure local logger
+logging.getLogger().setLevel(logging.ERROR)
+logger = logging.getLogger(__name__)
+
+# Create DXL configuration from file
+config = DxlClientConfig.create_dxl_config_from_file(CONFIG_FILE)
+
+# Extract the name of the file to retrieve, relative to the storage directory
+# of the service, and the name of the local file to write it to from command
+# line arguments
+if len(sys.argv) > 2:
+    RETRIEVE_FILE_NAME = sys.argv[1]
+    LOCAL_FILE_NAME = sys.argv[2]
+else:
+    print("Name of file to retrieve and name of local file to write it to " +
+          "must be specified as arguments")
+    exit(1)
+
+# Request the file contents in segments of up to 256 KB. The service may
+# return fewer bytes per segment, depending on its 'retrieveSegmentSize'
+# setting.
+MAX_SEGMENT_SIZE = 256 * (2 ** 10)
+
+# Create the client
+with DxlClient(config) as client:
+    # Connect to the fabric
+    client.connect()
+
+    logger.info("Connected to DXL fabric.")
+
+    start = time.time()
+    request_topic = \
+        "/opendxl-file-transfer/service/file-transfer/file/retrieve"
+    file_hash = hashlib.sha256()
+    expected_file_hash = None
+    file_size = None
+    bytes_received = 0
+
+    # Open the local file to write the retrieved contents to
+    with open(LOCAL_FILE_NAME, 'wb') as file_handle:
+        # Loop until all file segments have been received from the service
+        # (or an error has occurred).
+        while file_size is None or bytes_received < file_size:
+            # Request the next range of bytes in the file. Any range may be
+            # requested, so a client could also request several ranges in
+            # parallel.
+            req = Request(request_topic)
+            req.other_fields = {
+                FileStoreProp.NAME: RETRIEVE_FILE_NAME,
+                FileStoreProp.SEGMENT_OFFSET: str(bytes_received),
+                FileStoreProp.SEGMENT_LENGTH: str(MAX_SEGMENT_SIZE)
+            }
+
+            # Send the retrieve request to the DXL fabric. Exit if an error
+            # response is received.
+            res = client.sync_request(req, timeout=30)
+            if res.message_type == Message.MESSAGE_TYPE_ERROR:
+                print("\nError invoking service with topic '{}': {} ({})".
+                      format(request_topic, res.error_message,
+                             res.error_code))
+                exit(1)
+
+            # The size of the file is included in every response. The hash of
+            # the file is included in the response for the first segment.
+            file_size = int(res.other_fields[FileStoreProp.SIZE])
+            if expected_file_hash is None:
+                expected_file_hash = res.other_fields[FileStoreProp.HASH_SHA256]
+
+            # The response payload contains the bytes of the segment
+            segment = res.payload
+            if not segment and bytes_received < file_size:
+                print("\nFile was truncated while being retrieved")
+                exit(1)
+            file_handle.write(segment)
+            file_hash.update(segment)
+            bytes_received += len(segment)
+
+            # Update the current percent complete on the console.
+            sys.stdout.write("\rPercent complete: {}%".format(
+                int((bytes_received / file_size) * 100)
+                if file_size else 100))
+            sys.stdout.flush()
+
+    # Display the details of the retrieved file, confirming that the hash of
+    # the bytes received matches the hash reported by the service.
+    print("\nRetrieved file: \n{}".format(MessageUtils.dict_to_json(
+        {
+            FileStoreProp.NAME: RETRIEVE_FILE_NAME,
+            FileStoreProp.SIZE: bytes_received,
+            FileStoreProp.HASH_SHA256: file_hash.hexdigest(),
+            "hash_verified": file_hash.hexdigest() == expected_file_hash
+        },
+        pretty_print=True)))
+    print("Elapsed time (ms): {}".format((time.time() - start) * 1000))
@@ -3,6 +3,7 @@ from __future__ import division
 from __future__ import print_function
 import hashlib
 import os
+import random
 import sys
 import time
 
@@ -11,6 +12,7 @@ from dxlclient.client import DxlClient
 from dxlclient.message import Message, Request
 from dxlbootstrap.util import MessageUtils
 from dxlfiletransferclient import FileStoreProp, FileStoreResultProp
+from dxlfiletransferservice.constants import FileStoreErrorCode
 
 # Import common logging and configuration
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
@@ -41,6 +43,39 @@ else:
 # for a DXL broker message is 1 MB.
 MAX_SEGMENT_SIZE = 50 * (2 ** 10)
 
+# If the service responds that it is busy, the number of times to send a
+# request again, and the initial and maximum number of seconds to wait before
+# sending it again.
+MAX_BUSY_RETRIES = 8
+INITIAL_BUSY_BACKOFF = 0.1
+MAX_BUSY_BACKOFF = 5
+
+
+def send_request(client, req):
+    """
+    Send a request to the service and wait for the response. If the service
+    responds that it is busy, the request is sent again after a backoff which
+    doubles, up to a limit, after each attempt. A random jitter is applied to
+    the backoff so that clients which were rejected at the same time do not
+    all retry at the same time.
+    """
+    backoff = INITIAL_BUSY_BACKOFF
+    res = client.sync_request(req, timeout=30)
+    for _ in range(MAX_BUSY_RETRIES):
+        if res.message_type != Message.MESSAGE_TYPE_ERROR or \
+                res.error_code != FileStoreErrorCode.BUSY:
+            break
+        logger.info("Service busy, retrying in %.2f seconds", backoff)
+        time.sleep(backoff * random.uniform(0.5, 1.5))
+        backoff = min(backoff * 2, MAX_BUSY_BACKOFF)
+        # Each attempt is sent as a new request message
+        retry_req = Request(req.destination_topic)
+        retry_req.other_fields = req.other_fields
+        retry_req.payload = req.payload
+        res = client.sync_request(retry_req, timeout=30)
+    return res
+
+
 # Create the client
 with DxlClient(config) as client:
     # Connect to the fabric
@@ -112,9 +147,10 @@ with DxlClient(config) as client:
             req.other_fields = other_fields
             req.payload = segment
 
-            # Send the file segment request to the DXL fabric. Exit if an
-            # error response is received.
-            res = client.sync_request(req, timeout=30)
+            # Send the file segment request to the DXL fabric, retrying
+            # with backoff while the service is busy. Exit if an error
+            # response is received.
+            res = send_request(client, req)
             if res.message_type == Message.MESSAGE_TYPE_ERROR:
                 print("\nError invoking service with topic '{}': {} ({})".format(
                     request_topic, res.error_message, res.error_code))
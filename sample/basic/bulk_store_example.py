@@ -0,0 +1,131 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import hashlib
+import json
+import os
+import sys
+import time
+
+from dxlclient.client_config import DxlClientConfig
+from dxlclient.client import DxlClient
+from dxlclient.message import Message, Request
+from dxlbootstrap.util import MessageUtils
+from dxlfiletransferclient import FileStoreResultProp
+from dxlfiletransferservice.constants import FileStoreProp
+
+# Import common logging and configuration
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+from common import *
+
+# Configure local logger
+logging.getLogger().setLevel(logging.ERROR)
+logger = logging.getLogger(__name__)
+
+# Create DXL configuration from file
+config = DxlClientConfig.create_dxl_config_from_file(CONFIG_FILE)
+
+# Extract the name of the target storage directory, if specified, from a
+# command line argument
+STORE_FILE_DIR = ""
+if len(sys.argv) > 2:
+    STORE_FILE_DIR = sys.argv[2]
+
+# Extract the name of the directory to upload from a command line argument
+UPLOAD_DIR = None
+if len(sys.argv) > 1:
+    UPLOAD_DIR = sys.argv[1]
+else:
+    print("Name of directory to store must be specified as an argument")
+    exit(1)
+
+# Send the files in batches of up to 512 KB. The default maximum size for a
+# DXL broker message is 1 MB.
+MAX_BATCH_SIZE = 512 * (2 ** 10)
+
+# Maximum number of files to send in a single batch
+MAX_BATCH_FILES = 1000
+
+
+def send_batch(client, request_topic, batch):
+    """
+    Send a batch of files to the service in a single request and return the
+    result for each of the files.
+    """
+    manifest = []
+    contents = []
+    for file_name, store_file_name in batch:
+        with open(file_name, 'rb') as file_handle:
+            content = file_handle.read()
+        # Each entry in the manifest describes one of the files, in the
+        # order in which the contents of the files appear in the payload.
+        manifest.append({
+            FileStoreProp.NAME: store_file_name,
+            FileStoreProp.SIZE: len(content),
+            FileStoreProp.HASH_SHA256: hashlib.sha256(content).hexdigest()
+        })
+        contents.append(content)
+
+    req = Request(request_topic)
+    req.other_fields = {FileStoreProp.FILES: json.dumps(manifest)}
+    req.payload = b"".join(contents)
+    res = client.sync_request(req, timeout=30)
+    if res.message_type == Message.MESSAGE_TYPE_ERROR:
+        print("Error invoking service with topic '{}': {} ({})".format(
+            request_topic, res.error_message, res.error_code))
+        exit(1)
+    return MessageUtils.json_payload_to_dict(res)[FileStoreProp.FILES]
+
+
+# Group the files under the directory into batches. Files too large to send
+# in a batch should instead be sent in segments, as in the basic store
+# example.
+batches = [[]]
+batch_size = 0
+skipped_files = []
+for dir_name, _, file_names in os.walk(UPLOAD_DIR):
+    for file_name in sorted(file_names):
+        file_name = os.path.join(dir_name, file_name)
+        file_size = os.path.getsize(file_name)
+        if file_size > MAX_BATCH_SIZE:
+            skipped_files.append(file_name)
+            continue
+        if batch_size + file_size > MAX_BATCH_SIZE or \
+                len(batches[-1]) == MAX_BATCH_FILES:
+            batches.append([])
+            batch_size = 0
+        store_file_name = os.path.join(
+            STORE_FILE_DIR, os.path.relpath(file_name, UPLOAD_DIR)).replace(
+                os.sep, "/")
+        batches[-1].append((file_name, store_file_name))
+        batch_size += file_size
+
+# Create the client
+with DxlClient(config) as client:
+    # Connect to the fabric
+    client.connect()
+
+    logger.info("Connected to DXL fabric.")
+
+    start = time.time()
+    request_topic = "/opendxl-file-transfer/service/file-transfer/file/store"
+    files_stored = 0
+    file_errors = []
+    for batch in batches:
+        if not batch:
+            continue
+        for file_result in send_batch(client, request_topic, batch):
+            if file_result.get(FileStoreProp.RESULT) == \
+                    FileStoreResultProp.STORE:
+                files_stored += 1
+            else:
+                file_errors.append(file_result)
+
+    for file_error in file_errors:
+        print("Error storing file: \n{}".format(
+            MessageUtils.dict_to_json(file_error, pretty_print=True)))
+    for skipped_file in skipped_files:
+        print("Skipped file too large for a batch: {}".format(skipped_file))
+    print("Files stored: {}".format(files_stored))
+    print("Batches sent: {}".format(len([batch for batch in batches
+                                         if batch])))
+    print("Elapsed time (ms): {}".format((time.time() - start) * 1000))
@@ -0,0 +1,199 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+from dxlclient.client_config import DxlClientConfig
+from dxlclient.client import DxlClient
+from dxlclient.message import Message, Request
+from dxlbootstrap.util import MessageUtils
+from dxlfiletransferclient import FileStoreResultProp
+from dxlfiletransferservice.constants import FileStoreErrorCode, \
+    FileStoreProp
+
+# Import common logging and configuration
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+from common import *
+
+# Configure local logger
+logging.getLogger().setLevel(logging.ERROR)
+logger = logging.getLogger(__name__)
+
+# Create DXL configuration from file
+config = DxlClientConfig.create_dxl_config_from_file(CONFIG_FILE)
+
+# Extract the name of the target storage directory, if specified, from a
+# command line argument
+STORE_FILE_DIR = ""
+if len(sys.argv) > 2:
+    STORE_FILE_DIR = sys.argv[2]
+
+# Extract the name of the file to upload from a command line argument
+STORE_FILE_NAME = None
+if len(sys.argv) > 1:
+    STORE_FILE_NAME = sys.argv[1]
+else:
+    print("Name of file to store must be specified as an argument")
+    exit(1)
+
+# Send the file contents in 50 KB segments. The default maximum size
+# for a DXL broker message is 1 MB.
+MAX_SEGMENT_SIZE = 50 * (2 ** 10)
+
+# The number of workers which send segments of the file concurrently
+WORKER_COUNT = 4
+
+# If the service responds that it is busy, the number of times to send a
+# request again, and the initial and maximum number of seconds to wait before
+# sending it again.
+MAX_BUSY_RETRIES = 8
+INITIAL_BUSY_BACKOFF = 0.1
+MAX_BUSY_BACKOFF = 5
+
+
+def send_request(client, req):
+    """
+    Send a request to the service and wait for the response. If the service
+    responds that it is busy, the request is sent again after a backoff which
+    doubles, up to a limit, after each attempt. A random jitter is applied to
+    the backoff so that clients which were rejected at the same time do not
+    all retry at the same time.
+    """
+    backoff = INITIAL_BUSY_BACKOFF
+    res = client.sync_request(req, timeout=30)
+    for _ in range(MAX_BUSY_RETRIES):
+        if res.message_type != Message.MESSAGE_TYPE_ERROR or \
+                res.error_code != FileStoreErrorCode.BUSY:
+            break
+        logger.info("Service busy, retrying in %.2f seconds", backoff)
+        time.sleep(backoff * random.uniform(0.5, 1.5))
+        backoff = min(backoff * 2, MAX_BUSY_BACKOFF)
+        # Each attempt is sent as a new request message
+        retry_req = Request(req.destination_topic)
+        retry_req.other_fields = req.other_fields
+        retry_req.payload = req.payload
+        res = client.sync_request(retry_req, timeout=30)
+    return res
+
+
+class SegmentWorker(threading.Thread):
+    """
+    Sends every `WORKER_COUNT`-th segment of the file, starting with the
+    segment at the supplied index, one request at a time.
+    """
+    def __init__(self, client, request_topic, worker_index, file_id,
+                 file_size, total_segments, last_segment_fields):
+        super(SegmentWorker, self).__init__()
+        self.client = client
+        self.request_topic = request_topic
+        self.worker_index = worker_index
+        self.file_id = file_id
+        self.file_size = file_size
+        self.total_segments = total_segments
+        self.last_segment_fields = last_segment_fields
+        self.error = None
+        self.last_response = None
+
+    def run(self):
+        # Each worker reads its own segments through its own file handle
+        with open(STORE_FILE_NAME, 'rb') as file_handle:
+            for segment_index in range(self.worker_index,
+                                       self.total_segments, WORKER_COUNT):
+                segment_number = segment_index + 1
+                segment_offset = segment_index * MAX_SEGMENT_SIZE
+                file_handle.seek(segment_offset)
+                segment = file_handle.read(MAX_SEGMENT_SIZE)
+
+                # Every segment includes the segment count and size of the
+                # file, so that the file can be declared by whichever
+                # segment the service receives first, and the offset at
+                # which the segment should be written.
+                other_fields = {
+                    FileStoreProp.ID: self.file_id,
+                    FileStoreProp.SEGMENT_NUMBER: str(segment_number),
+                    FileStoreProp.SEGMENT_OFFSET: str(segment_offset),
+                    FileStoreProp.SEGMENT_COUNT: str(self.total_segments),
+                    FileStoreProp.SIZE: str(self.file_size)
+                }
+                if segment_number == self.total_segments:
+                    other_fields.update(self.last_segment_fields)
+
+                req = Request(self.request_topic)
+                req.other_fields = other_fields
+                req.payload = segment
+                # Retry with backoff while the service is busy
+                res = send_request(self.client, req)
+                if res.message_type == Message.MESSAGE_TYPE_ERROR:
+                    self.error = "{} ({})".format(res.error_message,
+                                                  res.error_code)
+                    return
+
+                # The service completes the file when it has received all of
+                # the segments, so the store result may be in the response
+                # to any segment request.
+                res_dict = MessageUtils.json_payload_to_dict(res)
+                if res_dict.get(FileStoreProp.RESULT):
+                    self.last_response = res_dict
+
+
+# Create the client
+with DxlClient(config) as client:
+    # Connect to the fabric
+    client.connect()
+
+    logger.info("Connected to DXL fabric.")
+
+    start = time.time()
+    request_topic = "/opendxl-file-transfer/service/file-transfer/file/store"
+    store_file_name = os.path.join(STORE_FILE_DIR,
+                                   os.path.basename(STORE_FILE_NAME))
+    file_size = os.path.getsize(STORE_FILE_NAME)
+
+    # Determine the number of segments that the file will be sent in. An
+    # empty file is still sent as a single (empty) segment.
+    total_segments = file_size // MAX_SEGMENT_SIZE
+    if file_size % MAX_SEGMENT_SIZE or not total_segments:
+        total_segments += 1
+
+    # Compute the hash of the file contents up front. The service verifies
+    # the hash once all of the segments have been received.
+    file_hash = hashlib.sha256()
+    with open(STORE_FILE_NAME, 'rb') as file_handle:
+        for segment in iter(lambda: file_handle.read(MAX_SEGMENT_SIZE), b""):
+            file_hash.update(segment)
+
+    # The 'file_id' is chosen by the client so that all of the workers can
+    # start sending segments without waiting for a response from the
+    # service.
+    file_id = str(uuid.uuid4())
+    last_segment_fields = {
+        FileStoreProp.NAME: store_file_name,
+        FileStoreProp.RESULT: FileStoreResultProp.STORE,
+        FileStoreProp.HASH_SHA256: file_hash.hexdigest()
+    }
+    workers = [SegmentWorker(client, request_topic, worker_index, file_id,
+                             file_size, total_segments, last_segment_fields)
+               for worker_index in range(min(WORKER_COUNT, total_segments))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    errors = [worker.error for worker in workers if worker.error]
+    if errors:
+        print("Error invoking service with topic '{}': {}".format(
+            request_topic, errors[0]))
+        exit(1)
+
+    # Display the response from the service which completed the file
+    last_response = [worker.last_response for worker in workers
+                     if worker.last_response][0]
+    print("Response for the completed file: \n{}".format(
+        MessageUtils.dict_to_json(last_response, pretty_print=True)))
+    print("Elapsed time (ms): {}".format((time.time() - start) * 1000))
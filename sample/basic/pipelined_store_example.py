@@ -0,0 +1,252 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import hashlib
+import os
+import sys
+import threading
+import time
+import zlib
+
+from dxlclient.callbacks import ResponseCallback
+from dxlclient.client_config import DxlClientConfig
+from dxlclient.client import DxlClient
+from dxlclient.message import Message, Request
+from dxlbootstrap.util import MessageUtils
+from dxlfiletransferclient import FileStoreResultProp
+from dxlfiletransferservice.constants import CompressionType, FileStoreProp
+
+# Import common logging and configuration
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+from common import *
+
+# Configure local logger
+logging.getLogger().setLevel(logging.ERROR)
+logger = logging.getLogger(__name__)
+
+# Create DXL configuration from file
+config = DxlClientConfig.create_dxl_config_from_file(CONFIG_FILE)
+
+# Extract the name of the target storage directory, if specified, from a
+# command line argument
+STORE_FILE_DIR = ""
+if len(sys.argv) > 2:
+    STORE_FILE_DIR = sys.argv[2]
+
+# Extract the name of the file to upload from a command line argument
+STORE_FILE_NAME = None
+if len(sys.argv) > 1:
+    STORE_FILE_NAME = sys.argv[1]
+else:
+    print("Name of file to store must be specified as an argument")
+    exit(1)
+
+# Send the file contents in 50 KB segments. The default maximum size
+# for a DXL broker message is 1 MB.
+MAX_SEGMENT_SIZE = 50 * (2 ** 10)
+
+# The number of segment requests to keep outstanding at a time. The service
+# may grant a smaller window than the one requested.
+WINDOW_SIZE = 16
+
+# Send a segment gzip compressed only if compression shrinks it by at least
+# this fraction. Set to None to never compress segments.
+MIN_COMPRESSION_SAVINGS = 0.1
+
+# After a segment which does not compress well enough, the number of
+# segments to send without trying to compress them, to avoid spending time
+# compressing data which does not compress (for example, archives or media).
+COMPRESSION_BACKOFF_SEGMENTS = 8
+
+
+def compress_segment(segment):
+    """
+    Compress a segment in the gzip format.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(segment) + compressor.flush()
+
+
+class SegmentResponseCallback(ResponseCallback):
+    """
+    Tracks the responses received for the segment requests in flight.
+    """
+    def __init__(self):
+        super(SegmentResponseCallback, self).__init__()
+        self.condition = threading.Condition()
+        self.responses_received = 0
+        self.segments_acknowledged = 0
+        self.window_size = WINDOW_SIZE
+        self.error = None
+        self.last_response = {}
+
+    def on_response(self, response):
+        with self.condition:
+            self.responses_received += 1
+            if response.message_type == Message.MESSAGE_TYPE_ERROR:
+                # Segments still in flight when the file is completed early
+                # are rejected by the service.
+                if not self.last_response:
+                        self.error = "{} ({})".format(response.error_message,
+                                                  response.error_code)
+            else:
+                res_dict = MessageUtils.json_payload_to_dict(response)
+                # The number of segments received is a cumulative
+                # acknowledgement for all of the segments sent so far.
+                self.segments_acknowledged = max(
+                    self.segments_acknowledged,
+                    res_dict[FileStoreProp.SEGMENTS_RECEIVED])
+                self.window_size = res_dict.get(FileStoreProp.WINDOW_SIZE,
+                                                self.window_size)
+                if res_dict.get(FileStoreProp.RESULT):
+                    self.last_response = res_dict
+            self.condition.notify_all()
+
+
+# Create the client
+with DxlClient(config) as client:
+    # Connect to the fabric
+    client.connect()
+
+    logger.info("Connected to DXL fabric.")
+
+    start = time.time()
+    request_topic = "/opendxl-file-transfer/service/file-transfer/file/store"
+    precheck_topic = \
+        "/opendxl-file-transfer/service/file-transfer/file/precheck"
+    response_callback = SegmentResponseCallback()
+    store_file_name = os.path.join(STORE_FILE_DIR,
+                                   os.path.basename(STORE_FILE_NAME))
+    file_size = os.path.getsize(STORE_FILE_NAME)
+
+    # Compute the hash of the file contents up front so that the service can
+    # be asked whether it already has the contents.
+    file_hash = hashlib.sha256()
+    with open(STORE_FILE_NAME, 'rb') as file_handle:
+        for segment in iter(lambda: file_handle.read(MAX_SEGMENT_SIZE), b""):
+            file_hash.update(segment)
+    file_hash = file_hash.hexdigest()
+
+    # Send the pre-check request. If the service already has the contents,
+    # it stores the file without any segments being sent. Otherwise, the
+    # service responds with the 'file_id' to send the segments under.
+    req = Request(precheck_topic)
+    req.other_fields = {
+        FileStoreProp.NAME: store_file_name,
+        FileStoreProp.SIZE: str(file_size),
+        FileStoreProp.HASH_SHA256: file_hash
+    }
+    res = client.sync_request(req, timeout=30)
+    if res.message_type == Message.MESSAGE_TYPE_ERROR:
+        print("Error invoking service with topic '{}': {} ({})".format(
+            precheck_topic, res.error_message, res.error_code))
+        exit(1)
+    res_dict = MessageUtils.json_payload_to_dict(res)
+    if res_dict.get(FileStoreProp.RESULT) == FileStoreResultProp.STORE:
+        print("Contents already stored by the service: \n{}".format(
+            MessageUtils.dict_to_json(res_dict, pretty_print=True)))
+        print("Elapsed time (ms): {}".format((time.time() - start) * 1000))
+        exit(0)
+
+    # The 'file_id' returned by the pre-check is included in every segment
+    # request, so requests for later segments do not need to wait for the
+    # response to the first segment.
+    file_id = res_dict[FileStoreProp.ID]
+    segments_sent = 0
+    bytes_sent = 0
+    segments_to_skip_compression = 0
+
+    # Open the local file to be sent to the service
+    with open(STORE_FILE_NAME, 'rb') as file_handle:
+        # Determine the number of segments that the file will be sent in. An
+        # empty file is still sent as a single (empty) segment.
+        total_segments = file_size // MAX_SEGMENT_SIZE
+        if file_size % MAX_SEGMENT_SIZE or not total_segments:
+            total_segments += 1
+        bytes_read = 0
+
+        for segment_number in range(1, total_segments + 1):
+            # Wait until the segment falls within the window of segments
+            # which have not yet been acknowledged by the service. Stop
+            # sending if the service completed the file early because another
+            # upload of the same contents finished first.
+            with response_callback.condition:
+                while not response_callback.error and \
+                        not response_callback.last_response and \
+                        segment_number > \
+                        response_callback.segments_acknowledged + \
+                        response_callback.window_size:
+                    response_callback.condition.wait(30)
+                if response_callback.error or response_callback.last_response:
+                    break
+
+            segment = file_handle.read(MAX_SEGMENT_SIZE)
+
+            # Each segment includes the 'file_id', the window size, and the
+            # offset in the file at which the segment should be written since
+            # the service may process segments out of order.
+            other_fields = {
+                FileStoreProp.ID: file_id,
+                FileStoreProp.SEGMENT_NUMBER: str(segment_number),
+                FileStoreProp.SEGMENT_OFFSET: str(bytes_read),
+                FileStoreProp.WINDOW_SIZE: str(WINDOW_SIZE)
+            }
+
+            bytes_read += len(segment)
+            if segment_number == total_segments:
+                other_fields[FileStoreProp.NAME] = store_file_name
+                other_fields[FileStoreProp.RESULT] = FileStoreResultProp.STORE
+                other_fields[FileStoreProp.SIZE] = str(file_size)
+                other_fields[FileStoreProp.HASH_SHA256] = file_hash
+
+            # Compress the segment only when doing so actually helps. Each
+            # segment is decompressed by the service independently, so the
+            # offset, size, and hash always refer to the original contents.
+            payload = segment
+            if MIN_COMPRESSION_SAVINGS is not None and segment:
+                if segments_to_skip_compression:
+                    segments_to_skip_compression -= 1
+                else:
+                    compressed = compress_segment(segment)
+                    if len(compressed) <= \
+                            len(segment) * (1 - MIN_COMPRESSION_SAVINGS):
+                        payload = compressed
+                        other_fields[FileStoreProp.COMPRESSION] = \
+                            CompressionType.GZIP
+                    else:
+                        segments_to_skip_compression = \
+                            COMPRESSION_BACKOFF_SEGMENTS
+
+            req = Request(request_topic)
+            req.other_fields = other_fields
+            req.payload = payload
+
+            # Send the file segment request without waiting for the response.
+            client.async_request(req, response_callback)
+            segments_sent += 1
+            bytes_sent += len(payload)
+
+            # Update the current percent complete on the console.
+            sys.stdout.write("\rPercent complete: {}%".format(
+                int((segment_number / total_segments) * 100)))
+            sys.stdout.flush()
+
+    # Wait for the responses to all outstanding segment requests
+    with response_callback.condition:
+        while not response_callback.error and \
+                response_callback.responses_received < segments_sent:
+            response_callback.condition.wait(30)
+
+    if response_callback.error:
+        print("\nError invoking service with topic '{}': {}".format(
+            request_topic, response_callback.error))
+        exit(1)
+
+    # Display the response from the service which completed the file. This
+    # may be the response to any segment request if the service processed
+    # the segments out of order.
+    print("\nResponse for the completed file: \n{}".
+          format(MessageUtils.dict_to_json(response_callback.last_response,
+                                           pretty_print=True)))
+    print("Bytes sent: {} of {}".format(bytes_sent, file_size))
+    print("Elapsed time (ms): {}".format((time.time() - start) * 1000))
@@ -82,7 +82,9 @@ setup(
 
     extras_require={
         "dev": DEV_REQUIREMENTS,
-        "test": TEST_REQUIREMENTS
+        "test": TEST_REQUIREMENTS,
+        "xxhash": ["xxhash"],
+        "zstd": ["zstandard"]
     },
 
     test_suite="nose.collector",
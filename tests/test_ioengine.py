@@ -0,0 +1,209 @@
+import os
+import shutil
+import threading
+import time
+import unittest
+from tempfile import mkdtemp
+
+# pylint: disable=wrong-import-position
+from dxlclient.message import Message
+from dxlbootstrap.util import MessageUtils
+from dxlfiletransferservice.constants import FileStoreProp
+from dxlfiletransferservice.ioengine import AsyncioIoEngine, IoEngine, \
+    ThreadPoolIoEngine
+from dxlfiletransferservice.requesthandlers import \
+    FileRetrieveRequestCallback, FileStoreRequestCallback
+from dxlfiletransferservice.settings import FileStoreSettings
+from dxlfiletransferservice.retrieve import FileRetrieveManager
+from tests.test_requesthandlers import ResponseRecorder
+from tests.test_retrieve import create_retrieve_request
+from tests.test_store import create_segment_request
+
+
+class AsyncioIoEngineTest(unittest.TestCase):
+    def test_tasks_with_same_key_run_in_order_one_at_a_time(self):
+        engine = AsyncioIoEngine(4)
+        lock = threading.Lock()
+        running = []
+        overlapped = []
+        completed = []
+
+        def task(key, number):
+            with lock:
+                if key in running:
+                    overlapped.append(key)
+                running.append(key)
+            time.sleep(0.01)
+            with lock:
+                running.remove(key)
+                completed.append((key, number))
+
+        try:
+            for number in range(5):
+                engine.submit("a", task, "a", number)
+                engine.submit("b", task, "b", number)
+        finally:
+            engine.shutdown()
+        self.assertEqual([], overlapped)
+        self.assertEqual(list(range(5)),
+                         [number for key, number in completed if key == "a"])
+        self.assertEqual(list(range(5)),
+                         [number for key, number in completed if key == "b"])
+
+    def test_shutdown_waits_for_pending_tasks(self):
+        engine = AsyncioIoEngine(1)
+        completed = []
+        for number in range(3):
+            engine.submit(None, lambda n: time.sleep(0.01) or
+                          completed.append(n), number)
+        engine.shutdown()
+        self.assertEqual(0, engine.pending_count)
+        self.assertEqual([0, 1, 2], sorted(completed))
+
+    def test_error_in_task_does_not_block_later_tasks(self):
+        engine = AsyncioIoEngine(1)
+        completed = []
+
+        def fail():
+            raise RuntimeError("failed")
+
+        engine.submit("a", fail)
+        engine.submit("a", completed.append, 1)
+        engine.shutdown()
+        self.assertEqual([1], completed)
+
+    def test_invalid_thread_count_rejected(self):
+        with self.assertRaises(ValueError):
+            AsyncioIoEngine(0)
+
+
+class ThreadPoolIoEngineTest(unittest.TestCase):
+    def test_tasks_with_same_key_run_in_order_on_one_thread(self):
+        engine = ThreadPoolIoEngine(4, 100, "TestIoPool")
+        lock = threading.Lock()
+        threads_by_key = {}
+        completed = []
+
+        def task(key, number):
+            time.sleep(0.001)
+            with lock:
+                threads_by_key.setdefault(key, set()).add(
+                    threading.current_thread().name)
+                completed.append((key, number))
+
+        try:
+            for number in range(20):
+                for key in ("a", "b", "c"):
+                    engine.submit(key, task, key, number)
+        finally:
+            engine.shutdown()
+        for key in ("a", "b", "c"):
+            self.assertEqual(1, len(threads_by_key[key]))
+            self.assertEqual(list(range(20)),
+                             [number for task_key, number in completed
+                              if task_key == key])
+
+    def test_tasks_without_key_spread_across_threads(self):
+        engine = ThreadPoolIoEngine(3, 10, "TestIoPool")
+        thread_names = set()
+        try:
+            for _ in range(3):
+                engine.submit(None, lambda: thread_names.add(
+                    threading.current_thread().name))
+        finally:
+            engine.shutdown()
+        self.assertEqual({"TestIoPool-1", "TestIoPool-2", "TestIoPool-3"},
+                         thread_names)
+
+    def test_error_in_task_does_not_stop_thread(self):
+        engine = ThreadPoolIoEngine(1, 10, "TestIoPool")
+        completed = []
+
+        def fail():
+            raise RuntimeError("failed")
+
+        engine.submit("a", fail)
+        engine.submit("a", completed.append, 1)
+        engine.shutdown()
+        self.assertEqual([1], completed)
+
+    def test_invalid_thread_count_or_queue_size_rejected(self):
+        with self.assertRaises(ValueError):
+            ThreadPoolIoEngine(0, 10, "TestIoPool")
+        with self.assertRaises(ValueError):
+            ThreadPoolIoEngine(1, 0, "TestIoPool")
+
+
+class FileStoreRequestCallbackAsyncioTest(unittest.TestCase):
+    def setUp(self):
+        self.storage_dir = mkdtemp()
+        self.dxl_client = ResponseRecorder()
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir)
+
+    def test_response_sent_from_engine(self):
+        callback = FileStoreRequestCallback(
+            self.dxl_client, self.storage_dir,
+            settings=FileStoreSettings(io_thread_count=2,
+                                       io_engine=IoEngine.ASYNCIO))
+        try:
+            callback.on_request(create_segment_request(1, b"abc"))
+            response = self.dxl_client.wait_for_responses(1)[0]
+            self.assertEqual(Message.MESSAGE_TYPE_RESPONSE,
+                             response.message_type)
+            file_id = MessageUtils.json_payload_to_dict(response)[
+                FileStoreProp.ID]
+            for segment_number in range(2, 5):
+                callback.on_request(create_segment_request(
+                    segment_number, b"abc", file_id))
+            responses = self.dxl_client.wait_for_responses(4)
+            self.assertEqual(
+                [1, 2, 3, 4],
+                sorted(MessageUtils.json_payload_to_dict(response)[
+                    FileStoreProp.SEGMENTS_RECEIVED]
+                       for response in responses))
+            self.assertIsNone(callback.io_pool)
+        finally:
+            callback.shutdown()
+
+    def test_retrieve_response_sent_from_engine(self):
+        with open(os.path.join(self.storage_dir, "test.txt"), "wb") as \
+                file_handle:
+            file_handle.write(b"abcdefghij")
+        response_threads = []
+        send_response = self.dxl_client.send_response
+
+        def record_response_thread(response):
+            response_threads.append(threading.current_thread().name)
+            send_response(response)
+
+        self.dxl_client.send_response = record_response_thread
+        callback = FileStoreRequestCallback(
+            self.dxl_client, self.storage_dir,
+            settings=FileStoreSettings(io_thread_count=2,
+                                       io_engine=IoEngine.ASYNCIO))
+        try:
+            retrieve_callback = FileRetrieveRequestCallback(
+                self.dxl_client,
+                FileRetrieveManager(callback.store_manager),
+                callback.io_engine)
+            retrieve_callback.on_request(create_retrieve_request("test.txt"))
+            response = self.dxl_client.wait_for_responses(1)[0]
+            self.assertEqual(Message.MESSAGE_TYPE_RESPONSE,
+                             response.message_type)
+            self.assertNotEqual([threading.current_thread().name],
+                                response_threads)
+        finally:
+            callback.shutdown()
+
+    def test_unsupported_engine_rejected(self):
+        with self.assertRaises(ValueError):
+            FileStoreRequestCallback(
+                self.dxl_client, self.storage_dir,
+                settings=FileStoreSettings(io_thread_count=2,
+                                           io_engine="fibers"))
+
+
+if __name__ == "__main__":
+    unittest.main()
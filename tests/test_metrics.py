@@ -0,0 +1,136 @@
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+try:
+    from urllib.request import urlopen
+except ImportError:  # Python 2
+    from urllib2 import urlopen
+
+# pylint: disable=wrong-import-position
+from dxlbootstrap.util import MessageUtils
+from dxlfiletransferservice.constants import FileStoreProp
+from dxlfiletransferservice.metrics import MetricsHttpEndpoint, \
+    MetricsRegistry
+from dxlfiletransferservice.requesthandlers import \
+    FileStatsRequestCallback, FileStoreRequestCallback
+from dxlfiletransferservice.settings import FileStoreSettings
+from tests.test_requesthandlers import ResponseRecorder
+from tests.test_store import create_segment_request, store_request_fields
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def test_counter_and_gauge_values(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("requests_total", "Requests")
+        counter.inc()
+        counter.inc(2)
+        depth = [5]
+        registry.gauge("depth", "Depth", lambda: depth[0])
+        depth[0] = 7
+        self.assertEqual({"dxlfiletransfer_requests_total": 3,
+                          "dxlfiletransfer_depth": 7}, registry.to_dict())
+
+    def test_same_name_returns_registered_metric(self):
+        registry = MetricsRegistry()
+        self.assertIs(registry.counter("requests_total", "Requests"),
+                      registry.counter("requests_total", "Requests"))
+
+    def test_gauges_with_same_name_are_summed(self):
+        registry = MetricsRegistry()
+        registry.gauge("active_files", "Active files", lambda: 2)
+        registry.gauge("active_files", "Active files", lambda: 3)
+        self.assertEqual({"dxlfiletransfer_active_files": 5},
+                         registry.to_dict())
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("latency_seconds", "Latency",
+                                       buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        value = registry.to_dict()["dxlfiletransfer_latency_seconds"]
+        self.assertEqual(4, value["count"])
+        self.assertAlmostEqual(2.65, value["sum"])
+        self.assertEqual({"0.1": 2, "1": 3, "+Inf": 4}, value["buckets"])
+
+    def test_prometheus_text(self):
+        registry = MetricsRegistry()
+        registry.counter("requests_total", "Requests").inc()
+        registry.histogram("latency_seconds", "Latency",
+                           buckets=(0.5,)).observe(0.25)
+        self.assertEqual(
+            "# HELP dxlfiletransfer_requests_total Requests\n"
+            "# TYPE dxlfiletransfer_requests_total counter\n"
+            "dxlfiletransfer_requests_total 1\n"
+            "# HELP dxlfiletransfer_latency_seconds Latency\n"
+            "# TYPE dxlfiletransfer_latency_seconds histogram\n"
+            "dxlfiletransfer_latency_seconds_bucket{le=\"0.5\"} 1\n"
+            "dxlfiletransfer_latency_seconds_bucket{le=\"+Inf\"} 1\n"
+            "dxlfiletransfer_latency_seconds_sum 0.25\n"
+            "dxlfiletransfer_latency_seconds_count 1\n",
+            registry.to_prometheus_text())
+
+    def test_http_endpoint(self):
+        registry = MetricsRegistry()
+        registry.counter("requests_total", "Requests").inc()
+        endpoint = MetricsHttpEndpoint(registry, 0)
+        try:
+            response = urlopen("http://127.0.0.1:{}/metrics".format(
+                endpoint.port))
+            try:
+                body = response.read().decode("utf-8")
+            finally:
+                response.close()
+            self.assertIn("dxlfiletransfer_requests_total 1\n", body)
+        finally:
+            endpoint.stop()
+
+
+class FileStoreMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.storage_dir = mkdtemp()
+        self.dxl_client = ResponseRecorder()
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir)
+
+    def test_store_requests_recorded(self):
+        registry = MetricsRegistry()
+        callback = FileStoreRequestCallback(
+            self.dxl_client, self.storage_dir,
+            settings=FileStoreSettings(io_thread_count=2),
+            metrics_registry=registry)
+        stats_callback = FileStatsRequestCallback(self.dxl_client, registry)
+        try:
+            callback.on_request(create_segment_request(
+                1, b"abc", other_fields=store_request_fields("test.txt",
+                                                             b"abc")))
+            self.dxl_client.wait_for_responses(1)
+            callback.on_request(create_segment_request(
+                1, b"abc", other_fields={FileStoreProp.SEGMENT_OFFSET: "-1"}))
+            self.dxl_client.wait_for_responses(2)
+            stats_callback.on_request(create_segment_request(None, None))
+            stats = MessageUtils.json_payload_to_dict(
+                self.dxl_client.wait_for_responses(3)[2])
+        finally:
+            callback.shutdown()
+
+        self.assertEqual(2, stats["dxlfiletransfer_store_requests_total"])
+        self.assertEqual(
+            1, stats["dxlfiletransfer_store_request_errors_total"])
+        self.assertEqual(1, stats["dxlfiletransfer_segments_stored_total"])
+        self.assertEqual(
+            3, stats["dxlfiletransfer_segment_bytes_written_total"])
+        self.assertEqual(1, stats["dxlfiletransfer_files_stored_total"])
+        self.assertEqual(0, stats["dxlfiletransfer_store_pending_requests"])
+        self.assertEqual(0, stats["dxlfiletransfer_active_files"])
+        for histogram_name in ("store_queue_wait_seconds",
+                               "store_segment_seconds",
+                               "store_send_response_seconds",
+                               "segment_write_seconds",
+                               "segment_hash_seconds",
+                               "file_commit_seconds"):
+            self.assertEqual(
+                1, stats["dxlfiletransfer_" + histogram_name]["count"],
+                histogram_name)
@@ -0,0 +1,97 @@
+import os
+import shutil
+import threading
+import time
+import unittest
+from tempfile import mkdtemp
+
+# pylint: disable=wrong-import-position
+from dxlclient.message import Message, Request
+from dxlbootstrap.util import MessageUtils
+from dxlfiletransferservice.constants import ProfileProp
+from dxlfiletransferservice.profiler import ProfileAction, SamplingProfiler
+from dxlfiletransferservice.requesthandlers import FileProfileRequestCallback
+from tests.test_requesthandlers import ResponseRecorder
+
+
+def busy_loop(stopped):
+    while not stopped.is_set():
+        sum(range(1000))
+
+
+def create_profile_request(action, duration=None):
+    req = Request("/test/admin/profile")
+    other_fields = {ProfileProp.ACTION: action}
+    if duration is not None:
+        other_fields[ProfileProp.DURATION] = str(duration)
+    req.other_fields = other_fields
+    return req
+
+
+class SamplingProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.profile_dir = os.path.join(mkdtemp(), "profiles")
+        self.profiler = SamplingProfiler(self.profile_dir,
+                                         sample_interval=0.001)
+
+    def tearDown(self):
+        self.profiler.stop()
+        shutil.rmtree(os.path.dirname(self.profile_dir))
+
+    def test_profile_written_for_other_threads(self):
+        stopped = threading.Event()
+        thread = threading.Thread(target=busy_loop, args=(stopped,),
+                                  name="BusyThread")
+        thread.start()
+        try:
+            profile_file_name = self.profiler.start(10)
+            self.assertTrue(self.profiler.is_running)
+            time.sleep(0.1)
+            self.assertEqual(profile_file_name, self.profiler.stop())
+        finally:
+            stopped.set()
+            thread.join()
+
+        self.assertFalse(self.profiler.is_running)
+        with open(profile_file_name) as profile_file:
+            lines = profile_file.read().splitlines()
+        self.assertTrue(any(line.startswith("BusyThread;") and
+                            "busy_loop (test_profiler.py:" in line
+                            for line in lines))
+        self.assertFalse(any(line.startswith("SamplingProfiler;")
+                             for line in lines))
+
+    def test_profiling_stops_after_duration(self):
+        profile_file_name = self.profiler.start(0.05)
+        for _ in range(100):
+            if not self.profiler.is_running:
+                break
+            time.sleep(0.05)
+        self.assertFalse(self.profiler.is_running)
+        self.assertTrue(os.path.exists(profile_file_name))
+        self.assertIsNone(self.profiler.stop())
+
+    def test_start_rejected_while_running_or_with_invalid_duration(self):
+        self.profiler.start(10)
+        self.assertRaises(ValueError, self.profiler.start, 10)
+        self.profiler.stop()
+        self.assertRaises(ValueError, self.profiler.start, 0)
+        self.assertRaises(ValueError, self.profiler.start,
+                          SamplingProfiler.MAX_DURATION + 1)
+
+    def test_request_callback(self):
+        dxl_client = ResponseRecorder()
+        callback = FileProfileRequestCallback(dxl_client, self.profiler)
+        callback.on_request(create_profile_request(ProfileAction.START, 10))
+        callback.on_request(create_profile_request(ProfileAction.STATUS))
+        callback.on_request(create_profile_request(ProfileAction.STOP))
+        callback.on_request(create_profile_request("restart"))
+        responses = dxl_client.wait_for_responses(4)
+
+        status = MessageUtils.json_payload_to_dict(responses[1])
+        self.assertTrue(status["running"])
+        status = MessageUtils.json_payload_to_dict(responses[2])
+        self.assertFalse(status["running"])
+        self.assertTrue(os.path.exists(status["profile_file"]))
+        self.assertEqual(Message.MESSAGE_TYPE_ERROR,
+                         responses[3].message_type)
@@ -0,0 +1,189 @@
+import shutil
+import threading
+import unittest
+from tempfile import mkdtemp
+
+# pylint: disable=wrong-import-position
+from dxlclient.message import Message
+from dxlfiletransferclient.constants import FileStoreResultProp
+from dxlbootstrap.util import MessageUtils
+from dxlfiletransferservice.admission import AdmissionController, \
+    ServiceBusyError
+from dxlfiletransferservice.constants import FileStoreErrorCode, \
+    FileStoreProp
+from dxlfiletransferservice.requesthandlers import \
+    FilePrecheckRequestCallback, FileStoreRequestCallback
+from dxlfiletransferservice.settings import FileStoreSettings
+from dxlfiletransferservice.storage import StorageMode
+from tests.test_store import create_batch_request, create_segment_request, \
+    store_request_fields
+
+
+class ResponseRecorder(object):
+    def __init__(self):
+        self.responses = []
+        self.condition = threading.Condition()
+
+    def send_response(self, response):
+        with self.condition:
+            self.responses.append(response)
+            self.condition.notify_all()
+
+    def wait_for_responses(self, count):
+        with self.condition:
+            while len(self.responses) < count:
+                self.condition.wait(5)
+        return self.responses
+
+
+class FileStoreRequestCallbackTest(unittest.TestCase):
+    def setUp(self):
+        self.storage_dir = mkdtemp()
+        self.dxl_client = ResponseRecorder()
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir)
+
+    def test_response_sent_from_io_pool(self):
+        callback = FileStoreRequestCallback(
+            self.dxl_client, self.storage_dir,
+            settings=FileStoreSettings(io_thread_count=2))
+        try:
+            callback.on_request(create_segment_request(1, b"abc"))
+            response = self.dxl_client.wait_for_responses(1)[0]
+            self.assertEqual(Message.MESSAGE_TYPE_RESPONSE,
+                             response.message_type)
+            self.assertEqual(
+                1, MessageUtils.json_payload_to_dict(response)[
+                    FileStoreProp.SEGMENTS_RECEIVED])
+        finally:
+            callback.shutdown()
+
+    def test_segments_sent_in_sequence_stored_in_sequence(self):
+        callback = FileStoreRequestCallback(
+            self.dxl_client, self.storage_dir,
+            settings=FileStoreSettings(reorder_window=1, io_thread_count=4))
+        try:
+            callback.on_request(create_segment_request(1, b"abc"))
+            file_id = MessageUtils.json_payload_to_dict(
+                self.dxl_client.wait_for_responses(1)[0])[FileStoreProp.ID]
+            for segment_number in range(2, 51):
+                callback.on_request(create_segment_request(
+                    segment_number, b"abc", file_id))
+            responses = self.dxl_client.wait_for_responses(50)
+            self.assertEqual(
+                [Message.MESSAGE_TYPE_RESPONSE] * 50,
+                [response.message_type for response in responses])
+        finally:
+            callback.shutdown()
+
+    def test_invalid_request_rejected_on_callback_thread(self):
+        callback = FileStoreRequestCallback(
+            self.dxl_client, self.storage_dir,
+            settings=FileStoreSettings(io_thread_count=2))
+        try:
+            callback.on_request(create_segment_request(
+                1, b"abc", other_fields={FileStoreProp.SEGMENT_OFFSET: "-1"}))
+            self.assertEqual(1, len(self.dxl_client.responses))
+            self.assertEqual(Message.MESSAGE_TYPE_ERROR,
+                             self.dxl_client.responses[0].message_type)
+        finally:
+            callback.shutdown()
+
+    def test_precheck_response_for_stored_contents(self):
+        callback = FileStoreRequestCallback(
+            self.dxl_client, self.storage_dir,
+            settings=FileStoreSettings(
+                storage_mode=StorageMode.CONTENT_ADDRESSED))
+        precheck_callback = FilePrecheckRequestCallback(
+            self.dxl_client, callback.store_manager)
+        try:
+            callback.on_request(create_segment_request(
+                1, b"abc", other_fields=store_request_fields(
+                    "first.txt", b"abc")))
+            precheck_callback.on_request(create_segment_request(
+                None, None, other_fields=store_request_fields(
+                    "second.txt", b"abc")))
+            response = self.dxl_client.wait_for_responses(2)[1]
+            self.assertEqual(
+                FileStoreResultProp.STORE,
+                MessageUtils.json_payload_to_dict(response)[
+                    FileStoreProp.RESULT])
+        finally:
+            callback.shutdown()
+
+    def test_new_transfer_rejected_as_busy_at_limit(self):
+        callback = FileStoreRequestCallback(
+            self.dxl_client, self.storage_dir,
+            settings=FileStoreSettings(max_active_files=1))
+        try:
+            callback.on_request(create_segment_request(1, b"abc"))
+            callback.on_request(create_segment_request(1, b"def"))
+            responses = self.dxl_client.wait_for_responses(2)
+            self.assertEqual(Message.MESSAGE_TYPE_RESPONSE,
+                             responses[0].message_type)
+            self.assertEqual(Message.MESSAGE_TYPE_ERROR,
+                             responses[1].message_type)
+            self.assertEqual(FileStoreErrorCode.BUSY, responses[1].error_code)
+
+            # The transfer already in progress is unaffected
+            file_id = MessageUtils.json_payload_to_dict(responses[0])[
+                FileStoreProp.ID]
+            callback.on_request(create_segment_request(
+                2, b"def", file_id, store_request_fields("test.txt",
+                                                         b"abcdef")))
+            response = self.dxl_client.wait_for_responses(3)[2]
+            self.assertEqual(
+                FileStoreResultProp.STORE,
+                MessageUtils.json_payload_to_dict(response)[
+                    FileStoreProp.RESULT])
+            self.assertEqual(0, callback.store_manager.active_file_count)
+        finally:
+            callback.shutdown()
+
+
+    def test_batch_response_sent_from_io_pool(self):
+        callback = FileStoreRequestCallback(
+            self.dxl_client, self.storage_dir,
+            settings=FileStoreSettings(io_thread_count=2))
+        try:
+            callback.on_request(create_batch_request(
+                [("a.txt", b"abc"), ("b.txt", b"def")]))
+            response = self.dxl_client.wait_for_responses(1)[0]
+            self.assertEqual(Message.MESSAGE_TYPE_RESPONSE,
+                             response.message_type)
+            file_results = MessageUtils.json_payload_to_dict(response)[
+                FileStoreProp.FILES]
+            self.assertEqual(["a.txt", "b.txt"],
+                             [file_result[FileStoreProp.NAME]
+                              for file_result in file_results])
+            self.assertEqual(
+                [FileStoreResultProp.STORE] * 2,
+                [file_result[FileStoreProp.RESULT]
+                 for file_result in file_results])
+        finally:
+            callback.shutdown()
+
+class AdmissionControllerTest(unittest.TestCase):
+    def test_pending_request_limit(self):
+        controller = AdmissionController(max_pending_requests=2)
+        controller.admit(10)
+        controller.admit(10)
+        with self.assertRaises(ServiceBusyError):
+            controller.admit(10)
+        controller.release(10)
+        controller.admit(10)
+        self.assertEqual(2, controller.pending_requests)
+
+    def test_bytes_in_flight_limit(self):
+        controller = AdmissionController(max_bytes_in_flight=100)
+        # A single request is admitted however large it is
+        controller.admit(150)
+        with self.assertRaises(ServiceBusyError):
+            controller.admit(1)
+        controller.release(150)
+        controller.admit(60)
+        with self.assertRaises(ServiceBusyError):
+            controller.admit(50)
+        controller.admit(40)
+        self.assertEqual(100, controller.bytes_in_flight)
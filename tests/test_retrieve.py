@@ -0,0 +1,174 @@
+import hashlib
+import os
+import shutil
+import time
+import unittest
+from tempfile import mkdtemp
+
+# pylint: disable=wrong-import-position
+from dxlclient.message import Request
+from dxlfiletransferservice.constants import FileStoreProp, HashType
+from dxlfiletransferservice.retrieve import FileRetrieveManager, SegmentCache
+from dxlfiletransferservice.settings import FileStoreSettings
+from dxlfiletransferservice.storage import StorageMode
+from dxlfiletransferservice.store import FileStoreManager
+from tests.test_store import create_segment_request, store_request_fields
+
+
+def create_retrieve_request(name, other_fields=None):
+    req = Request("/test/file/retrieve")
+    fields = {FileStoreProp.NAME: name}
+    if other_fields:
+        fields.update(other_fields)
+    req.other_fields = fields
+    return req
+
+
+class FileRetrieveManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.storage_dir = mkdtemp()
+        self.store_manager = FileStoreManager(self.storage_dir)
+        self.manager = FileRetrieveManager(self.store_manager,
+                                           max_segment_size=4)
+
+    def tearDown(self):
+        self.store_manager.close()
+        shutil.rmtree(self.storage_dir)
+
+    def write_stored_file(self, name, content):
+        file_name = os.path.join(self.storage_dir, name)
+        if not os.path.isdir(os.path.dirname(file_name)):
+            os.makedirs(os.path.dirname(file_name))
+        with open(file_name, "wb") as file_handle:
+            file_handle.write(content)
+
+    def test_first_segment_includes_size_and_hash(self):
+        self.write_stored_file("dir/test.txt", b"abcdefghij")
+        result = self.manager.retrieve_segment(
+            create_retrieve_request("dir/test.txt"))
+        self.assertEqual(b"abcd", result.segment)
+        self.assertEqual({
+            FileStoreProp.NAME: "dir/test.txt",
+            FileStoreProp.SIZE: "10",
+            FileStoreProp.SEGMENT_OFFSET: "0",
+            FileStoreProp.SEGMENT_LENGTH: "4",
+            FileStoreProp.HASH_SHA256:
+                hashlib.sha256(b"abcdefghij").hexdigest()
+        }, result.to_fields())
+
+    def test_range_requests(self):
+        self.write_stored_file("test.txt", b"abcdefghij")
+        result = self.manager.retrieve_segment(create_retrieve_request(
+            "test.txt", {FileStoreProp.SEGMENT_OFFSET: "8",
+                         FileStoreProp.SEGMENT_LENGTH: "4"}))
+        self.assertEqual(b"ij", result.segment)
+        self.assertEqual(8, result.segment_offset)
+        self.assertIsNone(result.hashes)
+
+        result = self.manager.retrieve_segment(create_retrieve_request(
+            "test.txt", {FileStoreProp.SEGMENT_OFFSET: "3",
+                         FileStoreProp.SEGMENT_LENGTH: "2",
+                         FileStoreProp.HASH_TYPES: "md5"}))
+        self.assertEqual(b"de", result.segment)
+        self.assertEqual(
+            {HashType.MD5: hashlib.md5(b"abcdefghij").hexdigest()},
+            result.hashes)
+
+        with self.assertRaises(ValueError):
+            self.manager.retrieve_segment(create_retrieve_request(
+                "test.txt", {FileStoreProp.SEGMENT_OFFSET: "11"}))
+
+    def test_hashes_recomputed_when_file_changes(self):
+        self.write_stored_file("test.txt", b"abc")
+        self.manager.retrieve_segment(create_retrieve_request("test.txt"))
+        self.write_stored_file("test.txt", b"abcd")
+        # Ensure the modification time differs on coarse-grained file systems
+        os.utime(os.path.join(self.storage_dir, "test.txt"),
+                 (time.time() + 10, time.time() + 10))
+        result = self.manager.retrieve_segment(
+            create_retrieve_request("test.txt"))
+        self.assertEqual(
+            {HashType.SHA256: hashlib.sha256(b"abcd").hexdigest()},
+            result.hashes)
+
+    def test_invalid_names_rejected(self):
+        os.makedirs(os.path.join(self.storage_dir, "dir"))
+        for name in ("missing.txt", "dir", "../outside.txt",
+                     ".workdir/file"):
+            with self.assertRaises(ValueError):
+                self.manager.retrieve_segment(create_retrieve_request(name))
+
+
+    def test_segments_served_from_cache(self):
+        self.write_stored_file("test.txt", b"abcdefghij")
+        request_fields = {FileStoreProp.SEGMENT_OFFSET: "4"}
+        result = self.manager.retrieve_segment(
+            create_retrieve_request("test.txt", request_fields))
+        self.assertEqual(b"efgh", result.segment)
+        self.assertEqual(1, self.manager.segment_cache.get_stats()["misses"])
+
+        result = self.manager.retrieve_segment(
+            create_retrieve_request("test.txt", request_fields))
+        self.assertEqual(b"efgh", result.segment)
+        self.assertEqual(1, self.manager.segment_cache.get_stats()["hits"])
+
+        # A new version of the file is not served from the cache
+        self.write_stored_file("test.txt", b"0123456789")
+        os.utime(os.path.join(self.storage_dir, "test.txt"),
+                 (time.time() + 10, time.time() + 10))
+        result = self.manager.retrieve_segment(
+            create_retrieve_request("test.txt", request_fields))
+        self.assertEqual(b"4567", result.segment)
+        self.assertEqual(2, self.manager.segment_cache.get_stats()["misses"])
+
+    def test_cache_disabled(self):
+        manager = FileRetrieveManager(self.store_manager, cache_size=0)
+        self.assertIsNone(manager.segment_cache)
+        self.write_stored_file("test.txt", b"abc")
+        self.assertEqual(b"abc", manager.retrieve_segment(
+            create_retrieve_request("test.txt")).segment)
+
+    def test_packed_files_retrieved(self):
+        self.store_manager.close()
+        self.store_manager = FileStoreManager(
+            self.storage_dir,
+            settings=FileStoreSettings(storage_mode=StorageMode.PACK))
+        self.manager = FileRetrieveManager(self.store_manager,
+                                           max_segment_size=4)
+        for name, content in (("a.txt", b"abcdefghij"),
+                              ("dir/b.txt", b"0123456789")):
+            self.store_manager.store_segment(create_segment_request(
+                1, content, other_fields=store_request_fields(name,
+                                                              content)))
+        result = self.manager.retrieve_segment(
+            create_retrieve_request("dir/b.txt"))
+        self.assertEqual(b"0123", result.segment)
+        self.assertEqual(10, result.file_size)
+        self.assertEqual(
+            {HashType.SHA256: hashlib.sha256(b"0123456789").hexdigest()},
+            result.hashes)
+        result = self.manager.retrieve_segment(create_retrieve_request(
+            "dir/b.txt", {FileStoreProp.SEGMENT_OFFSET: "8"}))
+        self.assertEqual(b"89", result.segment)
+        with self.assertRaises(ValueError):
+            self.manager.retrieve_segment(create_retrieve_request("c.txt"))
+
+
+class SegmentCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used_over_budget(self):
+        cache = SegmentCache(10)
+        cache.put("a", b"aaaa")
+        cache.put("b", b"bbbb")
+        self.assertEqual(b"aaaa", cache.get("a"))
+        cache.put("c", b"cccc")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(b"aaaa", cache.get("a"))
+        self.assertEqual(b"cccc", cache.get("c"))
+        # Segments larger than the budget are not cached
+        cache.put("d", b"d" * 11)
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual({"hits": 3, "misses": 2, "evictions": 1,
+                          "segments": 2, "size": 8}, cache.get_stats())
+
+        with self.assertRaises(ValueError):
+            SegmentCache(0)
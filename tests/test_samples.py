@@ -170,6 +170,127 @@ class Sample(unittest.TestCase):
             os.remove(source_file)
             shutil.rmtree(storage_dir)
 
+    def test_pipelined_store_example(self):
+        storage_dir = mkdtemp()
+        source_file, source_file_hash = self.create_random_file()
+        store_subdir = "subdir1/subdir2"
+        expected_store_file = os.path.join(
+            storage_dir, store_subdir, os.path.basename(source_file)
+        )
+        try:
+            mock_print = self.run_sample_with_service(
+                "sample/basic/pipelined_store_example.py",
+                [source_file, store_subdir], storage_dir)
+            self.assertTrue(os.path.exists(expected_store_file))
+            self.assertEqual(source_file_hash,
+                             self.get_hash_for_file(expected_store_file))
+            mock_print.assert_any_call(
+                StringMatches(
+                    self.expected_print_output(
+                        "\nResponse for the completed file:",
+                        {
+                            FileStoreProp.RESULT: FileStoreResultProp.STORE
+                        }
+                    )
+                )
+            )
+            mock_print.assert_any_call(StringDoesNotMatch(
+                "Error invoking request"))
+        finally:
+            os.remove(source_file)
+            shutil.rmtree(storage_dir)
+
+    def test_parallel_store_example(self):
+        storage_dir = mkdtemp()
+        source_file, source_file_hash = self.create_random_file()
+        store_subdir = "subdir1/subdir2"
+        expected_store_file = os.path.join(
+            storage_dir, store_subdir, os.path.basename(source_file)
+        )
+        try:
+            mock_print = self.run_sample_with_service(
+                "sample/basic/parallel_store_example.py",
+                [source_file, store_subdir], storage_dir)
+            self.assertTrue(os.path.exists(expected_store_file))
+            self.assertEqual(source_file_hash,
+                             self.get_hash_for_file(expected_store_file))
+            mock_print.assert_any_call(
+                StringMatches(
+                    self.expected_print_output(
+                        "Response for the completed file:",
+                        {
+                            FileStoreProp.RESULT: FileStoreResultProp.STORE
+                        }
+                    )
+                )
+            )
+            mock_print.assert_any_call(StringDoesNotMatch(
+                "Error invoking request"))
+        finally:
+            os.remove(source_file)
+            shutil.rmtree(storage_dir)
+
+    def test_bulk_store_example(self):
+        storage_dir = mkdtemp()
+        upload_dir = mkdtemp()
+        store_subdir = "subdir1"
+        upload_files = {"a.txt": b"abc", "nested/b.txt": b"defgh",
+                        "nested/c.txt": b""}
+        try:
+            for name, content in upload_files.items():
+                file_name = os.path.join(upload_dir, name)
+                if not os.path.exists(os.path.dirname(file_name)):
+                    os.makedirs(os.path.dirname(file_name))
+                with open(file_name, "wb") as file_handle:
+                    file_handle.write(content)
+            mock_print = self.run_sample_with_service(
+                "sample/basic/bulk_store_example.py",
+                [upload_dir, store_subdir], storage_dir)
+            for name, content in upload_files.items():
+                with open(os.path.join(storage_dir, store_subdir, name),
+                          "rb") as file_handle:
+                    self.assertEqual(content, file_handle.read())
+            mock_print.assert_any_call("Files stored: 3")
+            mock_print.assert_any_call(StringDoesNotMatch(
+                "Error storing file"))
+        finally:
+            shutil.rmtree(upload_dir)
+            shutil.rmtree(storage_dir)
+
+    def test_basic_retrieve_example(self):
+        storage_dir = mkdtemp()
+        source_file, source_file_hash = self.create_random_file()
+        retrieve_subdir = "subdir1/subdir2"
+        retrieve_file = os.path.join(retrieve_subdir,
+                                     os.path.basename(source_file))
+        os.makedirs(os.path.join(storage_dir, retrieve_subdir))
+        shutil.copy(source_file, os.path.join(storage_dir, retrieve_file))
+        local_file = source_file + ".retrieved"
+        try:
+            mock_print = self.run_sample_with_service(
+                "sample/basic/basic_retrieve_example.py",
+                [retrieve_file, local_file], storage_dir)
+            self.assertEqual(source_file_hash,
+                             self.get_hash_for_file(local_file))
+            mock_print.assert_any_call(
+                StringMatches(
+                    self.expected_print_output(
+                        "\nRetrieved file:",
+                        {
+                            FileStoreProp.HASH_SHA256: source_file_hash,
+                            "hash_verified": True
+                        }
+                    )
+                )
+            )
+            mock_print.assert_any_call(StringDoesNotMatch(
+                "Error invoking request"))
+        finally:
+            os.remove(source_file)
+            if os.path.exists(local_file):
+                os.remove(local_file)
+            shutil.rmtree(storage_dir)
+
     def test_basic_service_example(self):
         storage_dir = mkdtemp()
         source_file, source_file_hash = self.create_random_file()
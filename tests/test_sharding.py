@@ -0,0 +1,238 @@
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+# pylint: disable=wrong-import-position
+from dxlclient.message import Message
+from dxlbootstrap.util import MessageUtils
+from dxlfiletransferservice.app import FileTransferService
+from dxlfiletransferservice.constants import FileStoreProp
+from dxlfiletransferservice.requesthandlers import FileShardRequestCallback
+from dxlfiletransferservice.sharding import create_file_id, \
+    get_file_id_shard, get_file_topic, get_shard_topic
+from dxlfiletransferservice.store import FileStoreManager
+from tests.test_requesthandlers import ResponseRecorder
+from tests.test_store import create_segment_request
+
+
+class ShardingTest(unittest.TestCase):
+    def test_file_id_shard_is_stable(self):
+        self.assertEqual(
+            get_file_id_shard("1c6e6c7a-0d1e-4c36-9a8e-4c8a4b2e5f01", 7),
+            get_file_id_shard("1c6e6c7a-0d1e-4c36-9a8e-4c8a4b2e5f01", 7))
+        for shard_count in range(1, 10):
+            self.assertTrue(0 <= get_file_id_shard(create_file_id(),
+                                                   shard_count) < shard_count)
+
+    def test_file_id_created_in_shard(self):
+        for shard in range(4):
+            self.assertEqual(shard,
+                             get_file_id_shard(create_file_id(shard, 4), 4))
+        with self.assertRaises(ValueError):
+            create_file_id(4, 4)
+
+    def test_file_topic(self):
+        file_id = create_file_id(2, 3)
+        self.assertEqual("/file/store/2",
+                         get_file_topic("/file/store", file_id, 3))
+        self.assertEqual("/file/store",
+                         get_file_topic("/file/store", file_id, 1))
+        self.assertEqual("/file/store/5", get_shard_topic("/file/store", 5))
+
+
+class ShardedFileStoreManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.storage_dir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir)
+
+    def test_assigned_file_ids_in_shard(self):
+        manager = FileStoreManager(self.storage_dir, file_id_shard=1,
+                                   file_id_shard_count=3)
+        try:
+            for _ in range(10):
+                file_id = manager.store_segment(
+                    create_segment_request(1, b"abc")).file_id
+                self.assertEqual(1, get_file_id_shard(file_id, 3))
+        finally:
+            manager.close()
+
+    def test_only_files_in_shard_recovered(self):
+        working_dir = os.path.join(self.storage_dir, ".workdir")
+        file_ids = [create_file_id(shard, 2) for shard in range(2)]
+        for file_id in file_ids:
+            os.makedirs(os.path.join(working_dir, file_id))
+        manager = FileStoreManager(self.storage_dir, file_id_shard=0,
+                                   file_id_shard_count=2)
+        manager.close()
+        # The incomplete file in the shard is purged, since it has no
+        # journal, but the one in the other shard is left in place
+        self.assertEqual([file_ids[1]], os.listdir(working_dir))
+
+    def test_files_kept_in_working_subdir(self):
+        manager = FileStoreManager(self.storage_dir, file_id_shard=1,
+                                   file_id_shard_count=2, working_subdir="1")
+        try:
+            self.assertEqual(
+                os.path.join(self.storage_dir, ".workdir", "1"),
+                manager.working_dir)
+            file_id = manager.store_segment(
+                create_segment_request(1, b"abc")).file_id
+            self.assertEqual([file_id], os.listdir(manager.working_dir))
+            # Nothing may be stored under the shared working directory
+            with self.assertRaises(ValueError):
+                manager.get_storage_file_name(".workdir/0/test.txt")
+        finally:
+            manager.close()
+
+    def store_incomplete_files(self, shard_count):
+        file_ids = []
+        for shard in range(shard_count):
+            manager = FileStoreManager(
+                self.storage_dir, file_id_shard=shard,
+                file_id_shard_count=shard_count, working_subdir=str(shard))
+            try:
+                for _ in range(3):
+                    file_ids.append(manager.store_segment(
+                        create_segment_request(1, b"abc")).file_id)
+            finally:
+                manager.close()
+        return file_ids
+
+    def test_incomplete_files_moved_when_shard_count_changes(self):
+        file_ids = self.store_incomplete_files(3)
+        managers = [FileStoreManager(self.storage_dir, file_id_shard=shard,
+                                     file_id_shard_count=2,
+                                     working_subdir=str(shard))
+                    for shard in range(2)]
+        try:
+            for file_id in file_ids:
+                manager = managers[get_file_id_shard(file_id, 2)]
+                self.assertIn(file_id, os.listdir(manager.working_dir))
+                self.assertEqual(2, manager.store_segment(
+                    create_segment_request(2, b"def", file_id)
+                ).segments_received)
+            # The subdirectory for the shard which is no longer configured
+            # is removed
+            self.assertEqual(["0", "1"], sorted(os.listdir(
+                os.path.join(self.storage_dir, ".workdir"))))
+        finally:
+            for manager in managers:
+                manager.close()
+
+    def test_incomplete_files_moved_when_sharding_disabled(self):
+        file_ids = self.store_incomplete_files(2)
+        manager = FileStoreManager(self.storage_dir)
+        try:
+            self.assertEqual(sorted(file_ids),
+                             sorted(os.listdir(manager.working_dir)))
+            for file_id in file_ids:
+                manager.store_segment(
+                    create_segment_request(2, b"def", file_id))
+        finally:
+            manager.close()
+
+    def test_file_id_in_other_shard_rejected(self):
+        manager = FileStoreManager(self.storage_dir, file_id_shard=0,
+                                   file_id_shard_count=2, working_subdir="0")
+        try:
+            with self.assertRaises(ValueError):
+                manager.store_segment(create_segment_request(
+                    1, b"abc", create_file_id(1, 2)))
+            self.assertEqual([], os.listdir(manager.working_dir))
+        finally:
+            manager.close()
+
+    def test_invalid_shard_rejected(self):
+        with self.assertRaises(ValueError):
+            FileStoreManager(self.storage_dir, file_id_shard=2,
+                             file_id_shard_count=2)
+
+
+class RecordingCallback(object):
+    def __init__(self):
+        self.requests = []
+
+    def on_request(self, request):
+        self.requests.append(request)
+
+
+class FileShardRequestCallbackTest(unittest.TestCase):
+    def test_requests_dispatched_by_file_id(self):
+        callbacks_by_shard = {1: RecordingCallback(), 3: RecordingCallback()}
+        callback = FileShardRequestCallback(
+            ResponseRecorder(), "/test/file/store", callbacks_by_shard, 4)
+        for shard in (1, 3, 3):
+            callback.on_request(
+                create_segment_request(2, b"abc", create_file_id(shard, 4)))
+        self.assertEqual(1, len(callbacks_by_shard[1].requests))
+        self.assertEqual(2, len(callbacks_by_shard[3].requests))
+        for request in callbacks_by_shard[3].requests:
+            self.assertEqual(3, get_file_id_shard(
+                request.other_fields[FileStoreProp.ID], 4))
+
+    def test_requests_without_file_id_spread_across_shards(self):
+        callbacks_by_shard = {0: RecordingCallback(), 1: RecordingCallback()}
+        callback = FileShardRequestCallback(
+            ResponseRecorder(), "/test/file/store", callbacks_by_shard, 2)
+        for _ in range(4):
+            callback.on_request(create_segment_request(1, b"abc"))
+        self.assertEqual([2, 2], [len(callbacks_by_shard[shard].requests)
+                                  for shard in (0, 1)])
+
+    def test_file_id_for_other_process_rejected(self):
+        dxl_client = ResponseRecorder()
+        callbacks_by_shard = {0: RecordingCallback(), 1: RecordingCallback()}
+        callback = FileShardRequestCallback(
+            dxl_client, "/test/file/store", callbacks_by_shard, 4)
+        file_id = create_file_id(3, 4)
+        callback.on_request(create_segment_request(2, b"abc", file_id))
+        self.assertEqual([0, 0], [len(callbacks_by_shard[shard].requests)
+                                  for shard in (0, 1)])
+        response = dxl_client.wait_for_responses(1)[0]
+        self.assertEqual(Message.MESSAGE_TYPE_ERROR, response.message_type)
+        self.assertIn("/test/file/store/3",
+                      MessageUtils.decode(response.error_message))
+
+
+class WorkerCountTest(unittest.TestCase):
+    def setUp(self):
+        self.config_dir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.config_dir)
+
+    def write_config(self, content):
+        with open(os.path.join(self.config_dir,
+                               "dxlfiletransferservice.config"),
+                  "w") as config_file:
+            config_file.write(content)
+
+    def test_worker_count_defaults_to_one(self):
+        self.assertEqual(
+            1, FileTransferService.get_worker_count(self.config_dir))
+        self.write_config("[General]\nstorageDir=/tmp\n;workerCount=4\n")
+        self.assertEqual(
+            1, FileTransferService.get_worker_count(self.config_dir))
+
+    def test_worker_count_from_config(self):
+        self.write_config("[General]\nworkerCount=4\n")
+        self.assertEqual(
+            4, FileTransferService.get_worker_count(self.config_dir))
+
+    def test_invalid_worker_count_rejected(self):
+        for value in ("0", "many"):
+            self.write_config("[General]\nworkerCount={}\n".format(value))
+            with self.assertRaises(ValueError):
+                FileTransferService.get_worker_count(self.config_dir)
+
+    def test_invalid_worker_index_rejected(self):
+        with self.assertRaises(ValueError):
+            FileTransferService(self.config_dir, worker_index=2,
+                                worker_count=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
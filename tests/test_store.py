@@ -0,0 +1,965 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import time
+import unittest
+from tempfile import mkdtemp
+from mock import patch
+
+# pylint: disable=wrong-import-position
+from dxlclient.message import Request
+from dxlfiletransferclient.constants import FileStoreResultProp
+from dxlfiletransferservice.admission import ServiceBusyError
+from dxlfiletransferservice.constants import CompressionType, \
+    FileStoreProp, HashType
+from dxlfiletransferservice.durability import DurabilityMode, \
+    GroupCommitter
+from dxlfiletransferservice.settings import FileStoreSettings
+from dxlfiletransferservice.storage import StorageMode
+from dxlfiletransferservice.store import FileStoreManager
+
+
+def create_segment_request(segment_number, segment, file_id=None,
+                           other_fields=None):
+    req = Request("/test/file/store")
+    fields = {}
+    if segment_number is not None:
+        fields[FileStoreProp.SEGMENT_NUMBER] = str(segment_number)
+    if file_id:
+        fields[FileStoreProp.ID] = file_id
+    if other_fields:
+        fields.update(other_fields)
+    req.other_fields = fields
+    req.payload = segment
+    return req
+
+
+def gzip_compress(data):
+    compressed = io.BytesIO()
+    with gzip.GzipFile(fileobj=compressed, mode="wb") as gzip_file:
+        gzip_file.write(data)
+    return compressed.getvalue()
+
+
+def store_request_fields(name, content):
+    return {
+        FileStoreProp.RESULT: FileStoreResultProp.STORE,
+        FileStoreProp.NAME: name,
+        FileStoreProp.SIZE: str(len(content)),
+        FileStoreProp.HASH_SHA256: hashlib.sha256(content).hexdigest()
+    }
+
+
+def create_batch_request(files, other_fields=None):
+    req = Request("/test/file/store")
+    fields = {
+        FileStoreProp.FILES: json.dumps([{
+            FileStoreProp.NAME: name,
+            FileStoreProp.SIZE: len(content),
+            FileStoreProp.HASH_SHA256: hashlib.sha256(content).hexdigest()
+        } for name, content in files])
+    }
+    if other_fields:
+        fields.update(other_fields)
+    req.other_fields = fields
+    req.payload = b"".join(content for _, content in files)
+    return req
+
+
+class FileStoreManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.storage_dir = mkdtemp()
+        self.manager = FileStoreManager(self.storage_dir)
+
+    def tearDown(self):
+        self.manager.close()
+        shutil.rmtree(self.storage_dir)
+
+    def store_file(self, name, segments, file_id=None):
+        content = b"".join(segments)
+        result = None
+        for segment_number, segment in enumerate(segments, 1):
+            other_fields = store_request_fields(name, content) \
+                if segment_number == len(segments) else None
+            result = self.manager.store_segment(create_segment_request(
+                segment_number, segment, file_id, other_fields))
+            file_id = result.file_id
+        return result
+
+    def read_stored_file(self, name):
+        with open(os.path.join(self.storage_dir, name), "rb") as file_handle:
+            return file_handle.read()
+
+    def test_store_file_in_segments(self):
+        segments = [b"abc", b"def", b"ghi"]
+        result = self.store_file("subdir/test.txt", segments)
+        self.assertEqual(FileStoreResultProp.STORE, result.file_result)
+        self.assertEqual(3, result.segments_received)
+        self.assertEqual(b"abcdefghi", self.read_stored_file("subdir/test.txt"))
+        self.assertEqual([], os.listdir(self.manager.working_dir))
+
+    def test_unexpected_segment_number_rejected(self):
+        manager = FileStoreManager(
+            self.storage_dir, settings=FileStoreSettings(reorder_window=1))
+        result = manager.store_segment(create_segment_request(1, b"abc"))
+        with self.assertRaises(ValueError):
+            manager.store_segment(create_segment_request(
+                3, b"ghi", result.file_id,
+                {FileStoreProp.SEGMENT_OFFSET: "6"}))
+
+    def test_out_of_order_segments_with_offsets(self):
+        content = b"abcdefghi"
+        result = self.manager.store_segment(create_segment_request(1, b"abc"))
+        file_id = result.file_id
+        result = self.manager.store_segment(create_segment_request(
+            4, None, file_id, dict(store_request_fields("test.txt", content),
+                                   **{FileStoreProp.SEGMENT_OFFSET: "9"})))
+        self.assertEqual(FileStoreResultProp.NONE, result.file_result)
+        result = self.manager.store_segment(create_segment_request(
+            3, b"ghi", file_id, {FileStoreProp.SEGMENT_OFFSET: "6"}))
+        self.assertEqual(1, result.segments_received)
+        result = self.manager.store_segment(create_segment_request(
+            2, b"def", file_id))
+        self.assertEqual(FileStoreResultProp.STORE, result.file_result)
+        self.assertEqual(4, result.segments_received)
+        self.assertEqual(content, self.read_stored_file("test.txt"))
+
+    def test_out_of_order_segment_requires_offset(self):
+        result = self.manager.store_segment(create_segment_request(1, b"abc"))
+        with self.assertRaises(ValueError):
+            self.manager.store_segment(
+                create_segment_request(3, b"ghi", result.file_id))
+
+    def test_segment_outside_reorder_window_rejected(self):
+        manager = FileStoreManager(
+            self.storage_dir, settings=FileStoreSettings(reorder_window=2))
+        result = manager.store_segment(create_segment_request(1, b"abc"))
+        manager.store_segment(create_segment_request(
+            3, b"ghi", result.file_id, {FileStoreProp.SEGMENT_OFFSET: "6"}))
+        with self.assertRaises(ValueError):
+            manager.store_segment(create_segment_request(
+                4, b"jkl", result.file_id,
+                {FileStoreProp.SEGMENT_OFFSET: "9"}))
+
+    def test_duplicate_out_of_order_segment_rejected(self):
+        result = self.manager.store_segment(create_segment_request(1, b"abc"))
+        self.manager.store_segment(create_segment_request(
+            3, b"ghi", result.file_id, {FileStoreProp.SEGMENT_OFFSET: "6"}))
+        with self.assertRaises(ValueError):
+            self.manager.store_segment(create_segment_request(
+                3, b"ghi", result.file_id,
+                {FileStoreProp.SEGMENT_OFFSET: "6"}))
+
+    def test_requested_window_size_limited_by_reorder_window(self):
+        manager = FileStoreManager(
+            self.storage_dir, settings=FileStoreSettings(reorder_window=4))
+        result = manager.store_segment(create_segment_request(
+            1, b"abc", other_fields={FileStoreProp.WINDOW_SIZE: "8"}))
+        self.assertEqual(4, result.window_size)
+        self.assertEqual(4, result.to_dict()[FileStoreProp.WINDOW_SIZE])
+        result = manager.store_segment(create_segment_request(
+            2, b"def", result.file_id, {FileStoreProp.WINDOW_SIZE: "2"}))
+        self.assertEqual(2, result.window_size)
+        with self.assertRaises(ValueError):
+            manager.store_segment(create_segment_request(
+                5, b"mno", result.file_id,
+                {FileStoreProp.SEGMENT_OFFSET: "12"}))
+
+    def test_multiple_hash_types_computed(self):
+        content = b"abcdef"
+        result = self.manager.store_segment(create_segment_request(
+            1, b"abc", other_fields={
+                FileStoreProp.HASH_TYPES: "sha256,md5,sha1,unknown"}))
+        self.assertEqual([HashType.MD5, HashType.SHA1, HashType.SHA256],
+                         result.hash_types)
+        other_fields = store_request_fields("test.txt", content)
+        other_fields[FileStoreProp.HASH_MD5] = hashlib.md5(content).hexdigest()
+        result = self.manager.store_segment(create_segment_request(
+            2, b"def", result.file_id, other_fields))
+        self.assertEqual({
+            HashType.MD5: hashlib.md5(content).hexdigest(),
+            HashType.SHA1: hashlib.sha1(content).hexdigest(),
+            HashType.SHA256: hashlib.sha256(content).hexdigest()
+        }, result.to_dict()[FileStoreProp.HASHES])
+
+    def test_store_with_negotiated_hash_type_only(self):
+        content = b"abcdef"
+        result = self.manager.store_segment(create_segment_request(
+            1, content, other_fields={
+                FileStoreProp.HASH_TYPES: HashType.BLAKE2B,
+                FileStoreProp.RESULT: FileStoreResultProp.STORE,
+                FileStoreProp.NAME: "test.txt",
+                FileStoreProp.SIZE: str(len(content)),
+                FileStoreProp.HASH_BLAKE2B:
+                    hashlib.blake2b(content).hexdigest()}))
+        self.assertEqual(FileStoreResultProp.STORE, result.file_result)
+        self.assertEqual([HashType.BLAKE2B], list(result.hashes))
+
+    def test_hash_type_not_computed_rejected(self):
+        content = b"abcdef"
+        other_fields = store_request_fields("test.txt", content)
+        other_fields[FileStoreProp.HASH_MD5] = hashlib.md5(content).hexdigest()
+        with self.assertRaises(ValueError):
+            self.manager.store_segment(create_segment_request(
+                1, content, other_fields=other_fields))
+
+    def test_cancel_removes_working_files(self):
+        result = self.manager.store_segment(create_segment_request(1, b"abc"))
+        result = self.manager.store_segment(create_segment_request(
+            2, None, result.file_id,
+            {FileStoreProp.RESULT: FileStoreResultProp.CANCEL}))
+        self.assertEqual(FileStoreResultProp.CANCEL, result.file_result)
+        self.assertEqual([], os.listdir(self.manager.working_dir))
+
+    def test_concurrent_stores_for_different_files(self):
+        errors = []
+
+        def store_files(thread_number):
+            try:
+                for file_number in range(5):
+                    name = "file-{}-{}".format(thread_number, file_number)
+                    self.store_file(name, [name.encode()] * 10)
+            except Exception as ex:  # pylint: disable=broad-except
+                errors.append(ex)
+
+        threads = [threading.Thread(target=store_files, args=(thread_number,))
+                   for thread_number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        for thread_number in range(8):
+            for file_number in range(5):
+                name = "file-{}-{}".format(thread_number, file_number)
+                self.assertEqual(name.encode() * 10,
+                                 self.read_stored_file(name))
+
+    def test_concurrent_segments_for_same_file_serialized(self):
+        result = self.manager.store_segment(create_segment_request(1, b"a"))
+        errors = []
+
+        def store_duplicate_segment():
+            try:
+                self.manager.store_segment(
+                    create_segment_request(2, b"b", result.file_id))
+            except ValueError as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=store_duplicate_segment)
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Exactly one of the duplicate segment requests should be accepted
+        self.assertEqual(3, len(errors))
+
+    def test_store_file_with_each_durability_mode(self):
+        for durability in DurabilityMode.ALL:
+            self.manager.close()
+            self.manager = FileStoreManager(
+                self.storage_dir,
+                settings=FileStoreSettings(durability=durability))
+            self.store_file(durability, [b"abc", b"def"])
+            self.assertEqual(b"abcdef", self.read_stored_file(durability))
+
+    def test_concurrent_stores_with_group_commit(self):
+        self.manager.close()
+        self.manager = FileStoreManager(
+            self.storage_dir,
+            settings=FileStoreSettings(durability=DurabilityMode.GROUP,
+                                       group_commit_interval=0.01))
+        self.test_concurrent_stores_for_different_files()
+
+    def test_group_commit_error_raised_only_for_failed_file(self):
+        # The interval holds the batch open for both syncs
+        committer = GroupCommitter(0.1)
+        good_handle = os.open(os.path.join(self.storage_dir, "good.txt"),
+                              os.O_RDWR | os.O_CREAT)
+        bad_handle = os.open(os.path.join(self.storage_dir, "bad.txt"),
+                             os.O_RDWR | os.O_CREAT)
+        os.close(bad_handle)
+        errors = []
+
+        def sync_bad_handle():
+            try:
+                committer.sync(bad_handle)
+            except OSError as ex:
+                errors.append(ex)
+
+        try:
+            thread = threading.Thread(target=sync_bad_handle)
+            thread.start()
+            committer.sync(good_handle)
+            thread.join()
+            self.assertEqual(1, len(errors))
+        finally:
+            os.close(good_handle)
+            committer.stop()
+
+    def test_invalid_durability_mode_rejected(self):
+        with self.assertRaises(ValueError):
+            FileStoreManager(self.storage_dir,
+                             settings=FileStoreSettings(durability="unknown"))
+
+    def test_content_addressed_storage_deduplicates_contents(self):
+        self.manager.close()
+        self.manager = FileStoreManager(
+            self.storage_dir,
+            settings=FileStoreSettings(
+                storage_mode=StorageMode.CONTENT_ADDRESSED,
+                durability=DurabilityMode.COMMIT))
+        self.store_file("first.txt", [b"abc", b"def"])
+        self.store_file("dir/second.txt", [b"abcdef"])
+        self.store_file("third.txt", [b"ghi"])
+
+        self.assertEqual(b"abcdef", self.read_stored_file("first.txt"))
+        self.assertEqual(b"abcdef", self.read_stored_file("dir/second.txt"))
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.storage_dir, "first.txt"),
+            os.path.join(self.storage_dir, "dir/second.txt")))
+        file_hash = hashlib.sha256(b"abcdef").hexdigest()
+        blob_name = os.path.join(self.storage_dir, ".blobs", file_hash[:2],
+                                 file_hash)
+        self.assertEqual(3, os.stat(blob_name).st_nlink)
+        self.assertEqual([], os.listdir(self.manager.working_dir))
+
+    def test_content_addressed_storage_computes_sha256(self):
+        self.manager.close()
+        self.manager = FileStoreManager(
+            self.storage_dir,
+            settings=FileStoreSettings(
+                storage_mode=StorageMode.CONTENT_ADDRESSED))
+        content = b"abcdef"
+        result = self.manager.store_segment(create_segment_request(
+            1, content, other_fields={
+                FileStoreProp.HASH_TYPES: HashType.MD5,
+                FileStoreProp.RESULT: FileStoreResultProp.STORE,
+                FileStoreProp.NAME: "test.txt",
+                FileStoreProp.SIZE: str(len(content)),
+                FileStoreProp.HASH_MD5: hashlib.md5(content).hexdigest()}))
+        self.assertEqual(FileStoreResultProp.STORE, result.file_result)
+        self.assertEqual([HashType.MD5, HashType.SHA256], result.hash_types)
+        self.assertEqual(content, self.read_stored_file("test.txt"))
+
+    def test_content_addressed_storage_rejects_blob_dir_names(self):
+        self.manager.close()
+        self.manager = FileStoreManager(
+            self.storage_dir,
+            settings=FileStoreSettings(
+                storage_mode=StorageMode.CONTENT_ADDRESSED))
+        with self.assertRaises(ValueError):
+            self.manager.store_segment(create_segment_request(
+                1, b"abc", other_fields=store_request_fields(
+                    ".blobs/test.txt", b"abc")))
+
+    def precheck_file(self, name, content, file_id=None):
+        return self.manager.check_file(create_segment_request(
+            None, None, file_id, store_request_fields(name, content)))
+
+    def test_precheck_stores_existing_contents(self):
+        self.manager.close()
+        self.manager = FileStoreManager(
+            self.storage_dir,
+            settings=FileStoreSettings(
+                storage_mode=StorageMode.CONTENT_ADDRESSED))
+        result = self.precheck_file("first.txt", b"abcdef")
+        self.assertIsNone(result.file_result)
+        self.store_file("first.txt", [b"abc", b"def"], result.file_id)
+
+        result = self.precheck_file("second.txt", b"abcdef")
+        self.assertEqual(FileStoreResultProp.STORE, result.file_result)
+        self.assertEqual(
+            {HashType.SHA256: hashlib.sha256(b"abcdef").hexdigest()},
+            result.hashes)
+        self.assertEqual(b"abcdef", self.read_stored_file("second.txt"))
+        self.assertEqual([], os.listdir(self.manager.working_dir))
+
+    def test_precheck_completes_duplicate_upload_early(self):
+        self.manager.close()
+        self.manager = FileStoreManager(
+            self.storage_dir,
+            settings=FileStoreSettings(
+                storage_mode=StorageMode.CONTENT_ADDRESSED))
+        first_id = self.precheck_file("first.txt", b"abcdef").file_id
+        second_id = self.precheck_file("second.txt", b"abcdef").file_id
+        self.assertNotEqual(first_id, second_id)
+        result = self.manager.store_segment(
+            create_segment_request(1, b"abc", second_id))
+        self.assertIsNone(result.file_result)
+
+        first_result = self.store_file("first.txt", [b"abc", b"def"],
+                                       first_id)
+        result = self.manager.store_segment(
+            create_segment_request(2, b"def", second_id))
+        self.assertEqual(FileStoreResultProp.STORE, result.file_result)
+        self.assertEqual(first_result.hashes, result.hashes)
+        self.assertEqual(b"abcdef", self.read_stored_file("second.txt"))
+        self.assertEqual([], os.listdir(self.manager.working_dir))
+
+        # A segment which was still in flight is rejected
+        with self.assertRaises(ValueError):
+            self.manager.store_segment(create_segment_request(
+                3, b"ghi", second_id, {FileStoreProp.SEGMENT_OFFSET: "6"}))
+        self.assertEqual([], os.listdir(self.manager.working_dir))
+
+
+    def test_concurrent_links_to_same_name_replace_file(self):
+        self.manager.close()
+        self.manager = FileStoreManager(
+            self.storage_dir,
+            settings=FileStoreSettings(
+                storage_mode=StorageMode.CONTENT_ADDRESSED))
+        self.store_file("first.txt", [b"abc"])
+        self.store_file("second.txt", [b"def"])
+        storage = self.manager.storage
+        file_name = os.path.join(self.storage_dir, "same.txt")
+        errors = []
+        link = os.link
+
+        def slow_link(source, target):
+            time.sleep(0.001)
+            link(source, target)
+
+        def link_contents(content):
+            blob_name = storage.get_blob_name(
+                hashlib.sha256(content).hexdigest())
+            try:
+                for _ in range(50):
+                    storage.materialize(blob_name, file_name)
+            except OSError as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=link_contents, args=(content,))
+                   for content in (b"abc", b"abc", b"def")]
+        with patch.object(os, "link", side_effect=slow_link):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual([], errors)
+        self.assertIn(self.read_stored_file("same.txt"), (b"abc", b"def"))
+        self.assertEqual(
+            sorted([".blobs", ".workdir", "first.txt", "same.txt",
+                    "second.txt"]),
+            sorted(os.listdir(self.storage_dir)))
+    def test_mutable_contents_not_used_to_complete_upload_early(self):
+        content = b"abcdef"
+        first_id = self.precheck_file("first.txt", content).file_id
+        second_id = self.precheck_file("second.txt", content).file_id
+        self.store_file("first.txt", [b"abc", b"def"], first_id)
+        # The file stored under its requested name may be changed after it
+        # is committed
+        with open(os.path.join(self.storage_dir, "first.txt"), "wb") as \
+                first_file:
+            first_file.write(b"ghijkl")
+
+        result = self.manager.store_segment(
+            create_segment_request(1, b"abc", second_id))
+        self.assertIsNone(result.file_result)
+        result = self.manager.store_segment(create_segment_request(
+            2, b"def", second_id, store_request_fields("second.txt",
+                                                       content)))
+        self.assertEqual(FileStoreResultProp.STORE, result.file_result)
+        self.assertEqual(hashlib.sha256(content).hexdigest(),
+                         result.hashes[HashType.SHA256])
+        self.assertEqual(content, self.read_stored_file("second.txt"))
+
+    def test_precheck_requires_hash(self):
+        other_fields = store_request_fields("test.txt", b"abc")
+        del other_fields[FileStoreProp.HASH_SHA256]
+        with self.assertRaises(ValueError):
+            self.manager.check_file(create_segment_request(
+                None, None, other_fields=other_fields))
+
+    def resume_file(self, file_id):
+        return self.manager.resume_file(create_segment_request(
+            None, None, file_id))
+
+    def test_transfer_resumed_after_restart(self):
+        content = b"abcdefghi"
+        result = self.manager.store_segment(create_segment_request(
+            1, b"abc", other_fields={FileStoreProp.HASH_TYPES: "md5"}))
+        file_id = result.file_id
+        self.manager.store_segment(create_segment_request(
+            2, b"def", file_id))
+        self.manager.close()
+
+        self.manager = FileStoreManager(self.storage_dir)
+        result = self.resume_file(file_id)
+        self.assertEqual(2, result.segments_received)
+        self.assertEqual(6, result.segment_offset)
+        self.assertEqual([HashType.MD5], result.hash_types)
+
+        other_fields = store_request_fields("test.txt", content)
+        del other_fields[FileStoreProp.HASH_SHA256]
+        other_fields[FileStoreProp.HASH_MD5] = hashlib.md5(content).hexdigest()
+        result = self.manager.store_segment(create_segment_request(
+            3, b"ghi", file_id, other_fields))
+        self.assertEqual(FileStoreResultProp.STORE, result.file_result)
+        self.assertEqual(content, self.read_stored_file("test.txt"))
+        self.assertEqual([], os.listdir(self.manager.working_dir))
+
+    def test_resume_discards_segments_beyond_gap(self):
+        file_id = self.manager.store_segment(
+            create_segment_request(1, b"abc")).file_id
+        self.manager.store_segment(create_segment_request(
+            3, b"ghi", file_id, {FileStoreProp.SEGMENT_OFFSET: "6"}))
+        result = self.resume_file(file_id)
+        self.assertEqual(1, result.segments_received)
+        self.assertEqual(3, result.segment_offset)
+
+        self.manager.store_segment(create_segment_request(2, b"def", file_id))
+        result = self.manager.store_segment(create_segment_request(
+            3, b"ghi", file_id, store_request_fields("test.txt",
+                                                     b"abcdefghi")))
+        self.assertEqual(FileStoreResultProp.STORE, result.file_result)
+        self.assertEqual(b"abcdefghi", self.read_stored_file("test.txt"))
+
+    def test_incomplete_file_without_journal_purged(self):
+        os.makedirs(os.path.join(self.manager.working_dir, "incomplete"))
+        self.manager.close()
+        self.manager = FileStoreManager(self.storage_dir)
+        self.assertEqual([], os.listdir(self.manager.working_dir))
+        with self.assertRaises(ValueError):
+            self.resume_file("incomplete")
+
+    def test_compressed_segments_decompressed_before_write(self):
+        content = b"abc" * 1000 + b"def" * 1000
+        result = self.manager.store_segment(create_segment_request(
+            1, gzip_compress(b"abc" * 1000), other_fields={
+                FileStoreProp.COMPRESSION: CompressionType.GZIP}))
+        self.assertEqual(1, result.segments_received)
+        other_fields = store_request_fields("test.txt", content)
+        other_fields[FileStoreProp.COMPRESSION] = CompressionType.GZIP
+        other_fields[FileStoreProp.SEGMENT_OFFSET] = "3000"
+        result = self.manager.store_segment(create_segment_request(
+            2, gzip_compress(b"def" * 1000), result.file_id, other_fields))
+        self.assertEqual(FileStoreResultProp.STORE, result.file_result)
+        self.assertEqual(content, self.read_stored_file("test.txt"))
+
+    def test_multiple_gzip_members_decompressed(self):
+        content = b"abc" * 1000 + b"def" * 1000
+        other_fields = store_request_fields("test.txt", content)
+        other_fields[FileStoreProp.COMPRESSION] = CompressionType.GZIP
+        result = self.manager.store_segment(create_segment_request(
+            1, gzip_compress(b"abc" * 1000) + gzip_compress(b"def" * 1000),
+            other_fields=other_fields))
+        self.assertEqual(FileStoreResultProp.STORE, result.file_result)
+        self.assertEqual(content, self.read_stored_file("test.txt"))
+
+    def test_trailing_data_after_gzip_member_rejected(self):
+        with self.assertRaises(ValueError):
+            self.manager.store_segment(create_segment_request(
+                1, gzip_compress(b"abc") + b"junk", other_fields={
+                    FileStoreProp.COMPRESSION: CompressionType.GZIP}))
+        self.assertEqual([], os.listdir(self.manager.working_dir))
+
+    def test_oversized_gzip_members_rejected(self):
+        # pylint: disable=protected-access
+        self.manager._MAX_DECOMPRESSED_SEGMENT_SIZE = 100
+        with self.assertRaises(ValueError):
+            self.manager.store_segment(create_segment_request(
+                1, gzip_compress(b"a" * 60) + gzip_compress(b"b" * 60),
+                other_fields={
+                    FileStoreProp.COMPRESSION: CompressionType.GZIP}))
+
+    def test_unsupported_compression_type_rejected(self):
+        with self.assertRaises(ValueError):
+            self.manager.store_segment(create_segment_request(
+                1, b"abc", other_fields={FileStoreProp.COMPRESSION: "lzma"}))
+
+    def test_oversized_decompressed_segment_rejected(self):
+        # pylint: disable=protected-access
+        self.manager._MAX_DECOMPRESSED_SEGMENT_SIZE = 100
+        with self.assertRaises(ValueError):
+            self.manager.store_segment(create_segment_request(
+                1, gzip_compress(b"a" * 101), other_fields={
+                    FileStoreProp.COMPRESSION: CompressionType.GZIP}))
+
+    def parallel_segment_request(self, segment_number, segment, offset,
+                                 file_id, content, segment_count):
+        other_fields = {
+            FileStoreProp.SEGMENT_OFFSET: str(offset),
+            FileStoreProp.SEGMENT_COUNT: str(segment_count),
+            FileStoreProp.SIZE: str(len(content))
+        }
+        if segment_number == segment_count:
+            other_fields.update(store_request_fields("test.txt", content))
+        return create_segment_request(segment_number, segment, file_id,
+                                      other_fields)
+
+    def test_parallel_segments_stored_concurrently(self):
+        content = os.urandom(64 * 1024)
+        segment_size = 1024
+        segment_count = len(content) // segment_size
+        file_id = "parallel-file"
+        results = []
+        errors = []
+
+        def store_segments(worker_number):
+            try:
+                for index in range(worker_number, segment_count, 4):
+                    offset = index * segment_size
+                    results.append(self.manager.store_segment(
+                        self.parallel_segment_request(
+                            index + 1, content[offset:offset + segment_size],
+                            offset, file_id, content, segment_count)))
+            except Exception as ex:  # pylint: disable=broad-except
+                errors.append(ex)
+
+        threads = [threading.Thread(target=store_segments,
+                                    args=(worker_number,))
+                   for worker_number in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        stored = [result for result in results
+                  if result.file_result == FileStoreResultProp.STORE]
+        self.assertEqual(1, len(stored))
+        self.assertEqual(hashlib.sha256(content).hexdigest(),
+                         stored[0].hashes[HashType.SHA256])
+        self.assertEqual(content, self.read_stored_file("test.txt"))
+        self.assertEqual([], os.listdir(self.manager.working_dir))
+
+    def test_parallel_segments_stored_concurrently_without_pwrite(self):
+        seek = os.lseek
+
+        def slow_seek(file_handle, offset, whence):
+            position = seek(file_handle, offset, whence)
+            # Give other threads a chance to seek the same file handle
+            # before this thread writes at the position
+            time.sleep(0.001)
+            return position
+
+        with patch.object(os, "pwrite"), \
+                patch.object(os, "lseek", side_effect=slow_seek):
+            del os.pwrite
+            self.test_parallel_segments_stored_concurrently()
+
+    def test_parallel_segments_must_cover_file(self):
+        content = b"abcdefghi"
+        self.manager.store_segment(self.parallel_segment_request(
+            3, b"ghi", 6, "parallel-file", content, 3))
+        with self.assertRaises(ValueError):
+            self.manager.store_segment(self.parallel_segment_request(
+                3, b"ghi", 6, "parallel-file", content, 3))
+        with self.assertRaises(ValueError):
+            self.manager.store_segment(self.parallel_segment_request(
+                4, b"jkl", 9, "parallel-file", content, 3))
+        with self.assertRaises(ValueError):
+            self.manager.store_segment(self.parallel_segment_request(
+                2, b"defghij", 3, "parallel-file", content, 3))
+        self.manager.store_segment(self.parallel_segment_request(
+            1, b"abc", 0, "parallel-file", content, 3))
+        # Overlaps the first segment, leaving a gap before the last one
+        with self.assertRaises(ValueError):
+            self.manager.store_segment(self.parallel_segment_request(
+                2, b"cde", 2, "parallel-file", content, 3))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.storage_dir, "test.txt")))
+        self.assertEqual([], os.listdir(self.manager.working_dir))
+
+    def test_parallel_segment_count_cannot_change(self):
+        content = b"abcdef"
+        self.manager.store_segment(self.parallel_segment_request(
+            1, b"abc", 0, "parallel-file", content, 2))
+        with self.assertRaises(ValueError):
+            self.manager.store_segment(self.parallel_segment_request(
+                2, b"def", 3, "parallel-file", content, 3))
+        with self.assertRaises(ValueError):
+            self.resume_file("parallel-file")
+        result = self.manager.store_segment(self.parallel_segment_request(
+            2, b"def", 3, "parallel-file", content, 2))
+        self.assertEqual(FileStoreResultProp.STORE, result.file_result)
+        self.assertEqual(content, self.read_stored_file("test.txt"))
+
+    def test_parallel_file_size_limited(self):
+        manager = FileStoreManager(
+            self.storage_dir,
+            settings=FileStoreSettings(max_parallel_file_size=8))
+        try:
+            with self.assertRaises(ValueError):
+                manager.store_segment(self.parallel_segment_request(
+                    1, b"abc", 0, "parallel-file", b"abcdefghi", 3))
+            self.assertEqual([], os.listdir(manager.working_dir))
+            result = manager.store_segment(self.parallel_segment_request(
+                1, b"abcdefgh", 0, "parallel-file-2", b"abcdefgh", 1))
+            self.assertEqual(FileStoreResultProp.STORE, result.file_result)
+        finally:
+            manager.close()
+
+    def test_parallel_file_size_limited_by_working_size(self):
+        manager = FileStoreManager(
+            self.storage_dir, settings=FileStoreSettings(max_working_size=10))
+        try:
+            manager.store_segment(create_segment_request(1, b"abcd"))
+            with self.assertRaises(ServiceBusyError):
+                manager.store_segment(self.parallel_segment_request(
+                    1, b"abc", 0, "parallel-file", b"abcdefg", 3))
+            manager.store_segment(self.parallel_segment_request(
+                1, b"abc", 0, "parallel-file-2", b"abcdef", 2))
+            self.assertEqual(2, len(os.listdir(manager.working_dir)))
+        finally:
+            manager.close()
+
+    def test_declared_parallel_file_size_counted_over_quota(self):
+        manager = FileStoreManager(
+            self.storage_dir, settings=FileStoreSettings(max_working_size=100))
+        try:
+            manager.store_segment(self.parallel_segment_request(
+                2, b"def", 3, "parallel-file", b"abcdef", 2))
+            # pylint: disable=protected-access
+            file_entry = manager._find_file_entry("parallel-file")
+            os.ftruncate(file_entry[manager._FILE_HANDLE], 0)
+            manager._max_working_size = 5
+            result = manager.reap_files()
+            self.assertEqual({"files_reaped": 1, "bytes_reclaimed": 6},
+                             result.to_dict())
+        finally:
+            manager.close()
+
+    def test_idle_transfers_reaped(self):
+        manager = FileStoreManager(
+            self.storage_dir, settings=FileStoreSettings(idle_file_timeout=60))
+        try:
+            idle_id = manager.store_segment(
+                create_segment_request(1, b"abc")).file_id
+            active_id = manager.store_segment(
+                create_segment_request(1, b"defg")).file_id
+            # pylint: disable=protected-access
+            idle_entry = manager._find_file_entry(idle_id)
+            idle_entry[manager._FILE_LAST_ACTIVITY] -= 120
+
+            result = manager.reap_files()
+            self.assertEqual({"files_reaped": 1, "bytes_reclaimed": 3},
+                             result.to_dict())
+            self.assertEqual([active_id], os.listdir(manager.working_dir))
+            with self.assertRaises(ValueError):
+                manager.store_segment(create_segment_request(2, b"d", idle_id))
+            manager.store_segment(create_segment_request(2, b"h", active_id))
+        finally:
+            manager.close()
+
+    def test_least_recently_active_transfers_reaped_over_quota(self):
+        manager = FileStoreManager(
+            self.storage_dir, settings=FileStoreSettings(max_working_size=9))
+        try:
+            file_ids = [manager.store_segment(
+                create_segment_request(1, b"abcd")).file_id
+                        for _ in range(3)]
+            # pylint: disable=protected-access
+            for age, file_id in enumerate(reversed(file_ids)):
+                manager._find_file_entry(file_id)[
+                    manager._FILE_LAST_ACTIVITY] -= age
+            # The first file is the least recently active until it receives
+            # another segment
+            manager.store_segment(create_segment_request(2, b"e",
+                                                         file_ids[0]))
+            result = manager.reap_files()
+            self.assertEqual(1, result.files_reaped)
+            self.assertEqual(sorted([file_ids[0], file_ids[2]]),
+                             sorted(os.listdir(manager.working_dir)))
+        finally:
+            manager.close()
+
+    def test_locked_transfer_not_reaped(self):
+        manager = FileStoreManager(
+            self.storage_dir, settings=FileStoreSettings(idle_file_timeout=60))
+        try:
+            file_id = manager.store_segment(
+                create_segment_request(1, b"abc")).file_id
+            # pylint: disable=protected-access
+            file_entry = manager._find_file_entry(file_id)
+            file_entry[manager._FILE_LAST_ACTIVITY] -= 120
+            with file_entry[manager._FILE_LOCK]:
+                self.assertEqual(0, manager.reap_files().files_reaped)
+            self.assertEqual(1, manager.reap_files().files_reaped)
+        finally:
+            manager.close()
+
+    def test_batch_files_stored(self):
+        files = [("a.txt", b"abc"), ("dir/b.txt", b"defgh"), ("c.txt", b"")]
+        result = self.manager.store_batch(create_batch_request(files))
+        self.assertEqual(3, result.files_stored)
+        for (name, content), file_result in zip(files, result.file_results):
+            self.assertEqual(name, file_result[FileStoreProp.NAME])
+            self.assertEqual(FileStoreResultProp.STORE,
+                             file_result[FileStoreProp.RESULT])
+            self.assertEqual(hashlib.sha256(content).hexdigest(),
+                             file_result[FileStoreProp.HASHES][
+                                 HashType.SHA256])
+            self.assertEqual(content, self.read_stored_file(name))
+        self.assertEqual([], os.listdir(self.manager.working_dir))
+
+    def test_batch_file_errors_reported_per_file(self):
+        req = create_batch_request([("a.txt", b"abc"), ("../b.txt", b"def"),
+                                    ("c.txt", b"ghi")])
+        manifest = json.loads(req.other_fields[FileStoreProp.FILES])
+        manifest[2][FileStoreProp.HASH_SHA256] = \
+            hashlib.sha256(b"xyz").hexdigest()
+        req.other_fields[FileStoreProp.FILES] = json.dumps(manifest)
+        result = self.manager.store_batch(req)
+        self.assertEqual(1, result.files_stored)
+        self.assertEqual(FileStoreResultProp.STORE,
+                         result.file_results[0][FileStoreProp.RESULT])
+        self.assertIn(FileStoreProp.ERROR, result.file_results[1])
+        self.assertIn(FileStoreProp.ERROR, result.file_results[2])
+        self.assertEqual(b"abc", self.read_stored_file("a.txt"))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.storage_dir, "c.txt")))
+
+    def test_batch_size_must_match_payload(self):
+        req = create_batch_request([("a.txt", b"abc")])
+        req.payload = b"abcd"
+        with self.assertRaises(ValueError):
+            self.manager.store_batch(req)
+
+    def test_batch_manifest_validated(self):
+        for manifest in ("", "{}", "[]", '[{"name": "a.txt"}]',
+                         '[{"name": "a.txt", "size": 3}]'):
+            req = create_batch_request([("a.txt", b"abc")])
+            req.other_fields[FileStoreProp.FILES] = manifest
+            with self.assertRaises(ValueError):
+                self.manager.parse_batch(req)
+
+    def test_compressed_batch_decompressed_before_write(self):
+        files = [("a.txt", b"abc" * 100), ("b.txt", b"def" * 100)]
+        req = create_batch_request(files, {
+            FileStoreProp.COMPRESSION: CompressionType.GZIP})
+        req.payload = gzip_compress(req.payload)
+        result = self.manager.store_batch(req)
+        self.assertEqual(2, result.files_stored)
+        self.assertEqual(b"def" * 100, self.read_stored_file("b.txt"))
+
+    def test_batch_file_stored_from_existing_contents(self):
+        self.manager.close()
+        self.manager = FileStoreManager(
+            self.storage_dir,
+            settings=FileStoreSettings(
+                storage_mode=StorageMode.CONTENT_ADDRESSED))
+        result = self.manager.store_batch(create_batch_request(
+            [("a.txt", b"abc"), ("b.txt", b"abc")]))
+        self.assertEqual(2, result.files_stored)
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.storage_dir, "a.txt"),
+            os.path.join(self.storage_dir, "b.txt")))
+
+    def create_pack_manager(self, **kwargs):
+        self.manager.close()
+        self.manager = FileStoreManager(
+            self.storage_dir, settings=FileStoreSettings(
+                storage_mode=StorageMode.PACK, **kwargs))
+        return self.manager.storage
+
+    def read_packed_file(self, name):
+        stored_file = self.manager.storage.open_file(
+            os.path.join(self.storage_dir, name))
+        try:
+            os.lseek(stored_file.file_handle, stored_file.offset, os.SEEK_SET)
+            return os.read(stored_file.file_handle, stored_file.size)
+        finally:
+            stored_file.close()
+
+    def test_pack_storage_appends_small_files_to_pack(self):
+        storage = self.create_pack_manager(max_packed_file_size=4)
+        self.store_file("a.txt", [b"abc"])
+        self.store_file("dir/b.txt", [b"de", b"f"])
+        self.store_file("dir/c.txt", [b"abc"])
+        self.store_file("large.txt", [b"ghijk"])
+
+        self.assertEqual(b"abc", self.read_packed_file("a.txt"))
+        self.assertEqual(b"def", self.read_packed_file("dir/b.txt"))
+        self.assertEqual(b"abc", self.read_packed_file("dir/c.txt"))
+        # Larger files are stored separately
+        self.assertEqual(b"ghijk", self.read_stored_file("large.txt"))
+        self.assertEqual(sorted([".packs", ".workdir", "large.txt"]),
+                         sorted(os.listdir(self.storage_dir)))
+        # Identical contents are only appended once
+        self.assertEqual(6, sum(
+            os.path.getsize(os.path.join(storage.pack_dir, name))
+            for name in os.listdir(storage.pack_dir)
+            if name.startswith("pack-")))
+
+    def test_pack_index_reloaded_after_restart(self):
+        self.create_pack_manager(durability=DurabilityMode.COMMIT,
+                                 max_packed_file_size=3)
+        self.store_file("a.txt", [b"abc"])
+        self.store_file("b.txt", [b"def"])
+        self.store_file("a.txt", [b"ghi"])
+        # A larger file stored under a packed name is removed from the index
+        self.store_file("b.txt", [b"defg"])
+
+        self.create_pack_manager(max_packed_file_size=3)
+        self.assertEqual(b"ghi", self.read_packed_file("a.txt"))
+        self.assertEqual(b"defg", self.read_packed_file("b.txt"))
+        self.assertEqual(b"defg", self.read_stored_file("b.txt"))
+        # New contents are appended to a new pack
+        self.store_file("c.txt", [b"jkl"])
+        self.assertEqual(b"jkl", self.read_packed_file("c.txt"))
+
+    def test_pack_index_rewritten_once_mostly_superseded(self):
+        storage = self.create_pack_manager()
+        # pylint: disable=protected-access
+        storage._INDEX_REWRITE_MIN_RECORDS = 4
+        self.store_file("a.txt", [b"abc"])
+        for content in (b"def", b"ghi", b"jkl", b"mno", b"pqr"):
+            self.store_file("b.txt", [content])
+        with open(os.path.join(storage.pack_dir, "index"), "rb") as index:
+            self.assertLessEqual(len(index.readlines()), 4)
+
+        self.create_pack_manager()
+        self.assertEqual(b"abc", self.read_packed_file("a.txt"))
+        self.assertEqual(b"pqr", self.read_packed_file("b.txt"))
+
+    def test_pack_compaction_reclaims_dead_contents(self):
+        storage = self.create_pack_manager(max_pack_size=6)
+        self.store_file("a.txt", [b"abc"])
+        self.store_file("b.txt", [b"def"])
+        self.store_file("c.txt", [b"ghi"])
+        self.store_file("a.txt", [b"jkl"])
+        self.store_file("b.txt", [b"mno"])
+        self.assertEqual(["pack-00000001", "pack-00000002",
+                          "pack-00000003"],
+                         sorted(name for name in os.listdir(storage.pack_dir)
+                                if name.startswith("pack-")))
+
+        result = storage.compact()
+        self.assertEqual(1, result.packs_compacted)
+        self.assertEqual(6, result.bytes_reclaimed)
+        self.assertFalse(os.path.exists(
+            os.path.join(storage.pack_dir, "pack-00000001")))
+        for name, content in (("a.txt", b"jkl"), ("b.txt", b"mno"),
+                              ("c.txt", b"ghi")):
+            self.assertEqual(content, self.read_packed_file(name))
+
+        self.create_pack_manager()
+        self.assertEqual(b"jkl", self.read_packed_file("a.txt"))
+
+    def test_pack_storage_precheck_and_batch(self):
+        self.create_pack_manager()
+        self.store_file("first.txt", [b"abc", b"def"])
+        result = self.precheck_file("second.txt", b"abcdef")
+        self.assertEqual(FileStoreResultProp.STORE, result.file_result)
+        self.assertEqual(b"abcdef", self.read_packed_file("second.txt"))
+
+        result = self.manager.store_batch(create_batch_request(
+            [("third.txt", b"ghi"), ("fourth.txt", b"abcdef")]))
+        self.assertEqual(2, result.files_stored)
+        self.assertEqual(b"ghi", self.read_packed_file("third.txt"))
+        self.assertEqual(b"abcdef", self.read_packed_file("fourth.txt"))
+
+    def test_pack_storage_rejects_pack_dir_names(self):
+        self.create_pack_manager()
+        with self.assertRaises(ValueError):
+            self.store_file(".packs/index", [b"abc"])